@@ -1,62 +1,50 @@
 import os
-from flask import Flask, request, jsonify, render_template, redirect, url_for
+import sys
+import json
+import threading
+import time
+from flask import Flask, Response, request, jsonify, render_template, redirect, url_for, stream_with_context
 from werkzeug.utils import secure_filename
-from mayuan_agent import MayuanQuestionAgent
-from mayuan_kg_agent import MayuanKnowledgeGraphAgent
 import uuid
 import tempfile
-import base64
-from io import BytesIO
-from PIL import Image
-from role_agent import SocratesAgent
 from dotenv import load_dotenv
 
-# ---------- Knowledge-Graph Agent 包装 ----------
-# 为了与 QuestionAgent 保持统一的调用接口，
-# 这里包装一个 process_request 方法，对用户输入做简单的主题抽取后
-# 调用 MayuanKnowledgeGraphAgent.build_knowledge_graph 生成 Mermaid 图。
+from common_utils.image_upload import UploadError, client_config, decode_upload
+from common_utils.input_parser import is_kg_request
+from common_utils.job_queue import FINISHED, create_job_queue
+from common_utils.lazy_loader import LazyAgent, warm_up_all
+from common_utils.static_assets import LONG_CACHE, AssetFingerprints
 
+# 注意：此处不在模块级别导入 Agent / LangChain / LangGraph / Pillow 等重量级依赖，
+# 它们在首次使用时才被导入并构造，从而使 worker 冷启动时间降到亚秒级。
 
-class MayuanKGAgent(MayuanKnowledgeGraphAgent):
-    """Knowledge-Graph Agent 的薄包装，提供统一的 process_request 接口。"""
 
-    def _extract_topic(self, user_input: str) -> str:
-        """从用户输入中提取知识图谱主题。
+def _prepare_agent_environment():
+    """构造 Agent 前准备环境变量。
 
-        策略：
-        1. 去除常见触发关键词（知识图谱/思维导图/mindmap 等）。
-        2. 删除标点与前后空白。
-        3. 若为空则回退使用完整输入。
-        """
+    旧版本在导入 app.py 时会连带导入 role_agent，从而设置 DASHSCOPE_API_KEY；
+    懒加载后各 Agent 的构造顺序不再固定，因此在每个工厂函数中统一保证这一点。
+    """
+    load_dotenv()
+    import role_agent  # noqa: F401 – 导入时会配置 DASHSCOPE_API_KEY
 
-        trigger_keywords = [
-            "知识图谱",
-            "思维导图",
-            "mindmap",
-            "图谱",
-            "生成",
-            "制作",
-            "构建",
-            "画",
-            "帮我",
-            "请",
-            "关于",
-            "：",
-            ":",
-        ]
 
-        topic = user_input
-        for kw in trigger_keywords:
-            topic = topic.replace(kw, "")
+def _build_question_agent():
+    _prepare_agent_environment()
+    from mayuan_agent import MayuanQuestionAgent
+    return MayuanQuestionAgent()
 
-        # 移除多余空格和常见中文标点
-        topic = topic.strip().lstrip("，,。 、")
 
-        return topic if topic else user_input
+def _build_kg_agent():
+    _prepare_agent_environment()
+    from mayuan_kg_agent import MayuanKGAgent
+    return MayuanKGAgent()
 
-    def process_request(self, user_input: str) -> str:
-        topic = self._extract_topic(user_input)
-        return self.build_knowledge_graph(topic)
+
+def _build_socrates_agent():
+    _prepare_agent_environment()
+    from role_agent import SocratesAgent
+    return SocratesAgent()
 
 
 app = Flask(__name__)
@@ -64,6 +52,19 @@ app = Flask(__name__)
 # 配置文件上传
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
 app.config['UPLOAD_FOLDER'] = os.environ.get('UPLOAD_FOLDER', tempfile.gettempdir())
+
+# 模板通过 static_url() 引用静态文件，URL 带内容指纹；指纹匹配的请求可长期缓存
+static_assets = AssetFingerprints(app.static_folder, app.static_url_path)
+app.jinja_env.globals["static_url"] = static_assets.url
+
+
+@app.after_request
+def cache_static_assets(response):
+    if (request.endpoint == "static" and response.status_code in (200, 304)
+            and static_assets.is_current(request.view_args["filename"], request.args.get("v"))):
+        response.headers["Cache-Control"] = LONG_CACHE
+    return response
+
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'bmp', 'webp'}
 
 def allowed_file(filename):
@@ -72,46 +73,24 @@ def allowed_file(filename):
            filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
 def save_uploaded_image(image_data):
-    """保存base64编码的图片数据并返回文件路径"""
+    """保存base64编码的图片数据并返回文件路径
+
+    浏览器已按 /config 缩放并重新编码的图片原样保存；临时文件后缀与图片的实际格式一致。
+    """
     try:
-        # 解析base64数据
-        if image_data.startswith('data:image'):
-            header, data = image_data.split(',', 1)
-            image_binary = base64.b64decode(data)
-        else:
-            image_binary = base64.b64decode(image_data)
-        
-        # 验证图像大小（不超过5MB）
-        if len(image_binary) > 5 * 1024 * 1024:
-            print("图片文件过大：超过5MB限制")
-            return None
-        
-        # 使用Pillow打开并验证图像
-        try:
-            img = Image.open(BytesIO(image_binary))
-            img.verify()  # 验证图像完整性
-            
-            # 如果图片分辨率超过 2048px，则提醒但不拒绝，并交由后续流程自适应缩放
-            if img.width > 4096 or img.height > 4096:
-                print("图片分辨率过高：超过 4K 限制，拒绝处理")
-                return None
-            # 在后续步骤（LLM Wrapper）中会根据需要自动缩放到 1024px 内
-            
-        except Exception as e:
-            print(f"无效的图像文件: {e}")
-            return None
-        
-        # 创建临时文件
-        temp_file = tempfile.NamedTemporaryFile(delete=False, suffix='.jpg')
-        temp_file.write(image_binary)
-        temp_file.close()
-        
-        return temp_file.name
-        
+        image_binary, suffix = decode_upload(image_data)
+    except UploadError as e:
+        print(e)
+        return None
     except Exception as e:
         print(f"保存图片失败: {e}")
         return None
 
+    # 创建临时文件
+    with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as temp_file:
+        temp_file.write(image_binary)
+    return temp_file.name
+
 def cleanup_temp_file(file_path):
     """清理临时文件"""
     try:
@@ -121,30 +100,58 @@ def cleanup_temp_file(file_path):
         print(f"清理临时文件失败: {e}")
 
 # Load Agents
-# It's better to load these once at startup.
-try:
-    question_agent = MayuanQuestionAgent()
-    print("MayuanQuestionAgent loaded successfully.")
-except Exception as e:
-    print(f"Error loading MayuanQuestionAgent: {e}")
-    question_agent = None
-
-try:
-    kg_agent = MayuanKGAgent()
-    print("MayuanKGAgent loaded successfully.")
-except Exception as e:
-    print(f"Error loading MayuanKGAgent: {e}")
-    kg_agent = None
+# Agents are constructed lazily on first use (see common_utils.lazy_loader);
+# set AGENT_WARMUP=1 to build them in a background thread at start-up instead.
+question_agent_loader = LazyAgent("MayuanQuestionAgent", _build_question_agent)
+kg_agent_loader = LazyAgent("MayuanKGAgent", _build_kg_agent)
 
 # ----- Role Play Agent -----
+# 多线程下 dialogue_sessions 的读写都在 dialogue_sessions_lock 内进行；
+# 同一会话的多轮请求由各自的会话锁串行化，不同会话之间互不阻塞
 dialogue_sessions = {}
+dialogue_sessions_lock = threading.Lock()
+_dialogue_turn_locks = {}
+
+
+def dialogue_turn_lock(session_id):
+    """返回该会话的轮次锁（不存在时创建）。"""
+    with dialogue_sessions_lock:
+        return _dialogue_turn_locks.setdefault(session_id, threading.Lock())
 
-try:
-    socrates_agent = SocratesAgent()
-    print("SocratesAgent initialized.")
-except Exception as e:
-    print(f"Error initializing SocratesAgent: {e}")
-    socrates_agent = None
+socrates_agent_loader = LazyAgent("SocratesAgent", _build_socrates_agent)
+
+ALL_AGENTS = (question_agent_loader, kg_agent_loader, socrates_agent_loader)
+
+
+def warm_up_agents(background: bool = True):
+    """预热全部 Agent；background=True 时在后台线程中构造，不阻塞启动。"""
+    return warm_up_all(ALL_AGENTS, background=background)
+
+
+def preload_for_fork():
+    """Pre-fork 模式：在 master 进程中加载全部 Agent，供 worker 以写时复制方式共享。
+
+    FAISS 索引、紧凑文档存储与编译好的 LangGraph 图只在 master 中构造一次。
+    按 gc 模块文档的建议：加载前关闭 gc，避免在内存页中留下空洞；
+    加载后 gc.freeze() 把现存对象移入永久代，worker 中的 gc 不再遍历
+    （从而不再写入）这些对象，worker 启动后再调用 gc.enable()
+    （见 gunicorn.conf.py 中的 post_fork）。
+    """
+    import gc
+
+    gc.disable()
+    warm_up_agents(background=False)
+    # Agent 只在检索服务中登记了向量库；在 master 中加载，worker 才能共享
+    from common_utils.retrieval_service import get_retriever
+    get_retriever().preload()
+    gc.freeze()
+    print(f"Pre-fork preload complete: {gc.get_freeze_count()} objects frozen.")
+
+
+if os.environ.get("PREFORK_PRELOAD") == "1":
+    preload_for_fork()
+elif os.environ.get("AGENT_WARMUP") == "1":
+    warm_up_agents(background=True)
 
 
 @app.route('/chat_ui')
@@ -155,16 +162,119 @@ def chat_ui():
 def home():
     return render_template('home.html')
 
+def answer_chat(user_message, image_path=None, session_id=None, mindmap_format=None, raise_errors=False):
+    """把一条聊天消息路由到知识图谱或出题 Agent，返回回复文本。
+
+    mindmap_format 为 "tree" 时知识图谱以紧凑 JSON 树返回，前端无需加载 Mermaid。
+    raise_errors 为 True 时（异步任务）异常直接抛出，由任务队列把任务标记为失败；
+    否则把异常转成错误提示文本返回给同步请求。
+    """
+    try:
+        # Simple routing logic
+        if is_kg_request(user_message):
+            kg_agent = kg_agent_loader.get()
+            if kg_agent:
+                print("Routing to Knowledge Graph Agent.")
+                # 知识图谱Agent暂时不支持图片，如果有图片就提示用户
+                if image_path:
+                    return "知识图谱生成功能暂时不支持图片输入，请使用纯文本描述您需要的知识图谱主题。"
+                if mindmap_format:
+                    return kg_agent.process_request(user_message, output_format=mindmap_format)
+                return kg_agent.process_request(user_message)
+            return "知识图谱助手未成功加载，无法处理您的请求。"
+
+        question_agent = question_agent_loader.get()
+        if question_agent:
+            print("Routing to Question Generation Agent.")
+            # 使用多模态功能
+            if hasattr(question_agent, 'process_multimodal_request'):
+                return question_agent.process_multimodal_request(
+                    user_message, image_path, session_id=session_id
+                )
+            if image_path:
+                return "当前版本暂时不支持图片分析，请使用纯文本提问。"
+            return question_agent.process_request(user_message, session_id=session_id)
+        return "出题助手未成功加载，无法处理您的请求。"
+
+    except Exception as e:
+        print(f"An error occurred during processing: {e}")
+        if raise_errors:
+            raise
+        return f"处理您的请求时发生内部错误: {e}"
+
+
+def run_chat_job(payload):
+    """任务队列中 "chat" 任务的处理函数。
+
+    图片数据保存在任务记录中，每次执行（包括任务中断后重新排队的再次执行）各自写出
+    临时文件并在结束后删除。
+    """
+    image_path = None
+    if payload.get("image"):
+        image_path = save_uploaded_image(payload["image"])
+        if not image_path:
+            raise ValueError("图片处理失败")
+    try:
+        response_text = answer_chat(
+            payload["message"], image_path, payload.get("session_id"), payload.get("mindmap_format"),
+            raise_errors=True,
+        )
+    finally:
+        if image_path:
+            cleanup_temp_file(image_path)
+    return {"response": response_text, "session_id": payload.get("session_id")}
+
+
+# ----- 异步任务 -----
+# 耗时的生成（大题量试卷、知识图谱）可以作为任务提交，/chat 立即返回任务 ID，
+# 由各进程中的工作线程执行；任务保存在 SQLite 中，重启后仍会继续执行
+job_queue = create_job_queue({"chat": run_chat_job})
+# SSE 连接的最长保持时间与心跳间隔（秒）
+JOB_EVENTS_TIMEOUT = float(os.environ.get("JOB_EVENTS_TIMEOUT", "300"))
+JOB_EVENTS_HEARTBEAT = 15.0
+
+
 @app.route('/chat', methods=['POST'])
 def chat():
     # 无论 client Content-Type 如何，安全地解析 JSON，避免 request.json 为 None
     data = request.get_json(silent=True) or {}
     user_message = data.get("message")
     image_data = data.get("image")  # 获取base64编码的图片数据
+    # 会话 ID：用于按用户保存题目，便于之后索要答案；首次请求时由服务端签发
+    session_id = data.get("session_id") or uuid.uuid4().hex
     
     if not user_message:
         return jsonify({"error": "No message provided"}), 400
 
+    # "async": true 时只登记任务，客户端通过 /jobs/<id> 轮询或订阅 /jobs/<id>/events
+    if data.get("async"):
+        if image_data:
+            # 图片随任务保存（而不是临时文件路径），任务重新执行时仍可读取；先校验再入队
+            try:
+                decode_upload(image_data)
+            except UploadError as e:
+                return jsonify({"error": f"图片处理失败: {e}"}), 400
+        try:
+            job_id = job_queue.submit(
+                "chat",
+                {
+                    "message": user_message,
+                    "image": image_data,
+                    "session_id": session_id,
+                    "mindmap_format": data.get("mindmap_format"),
+                },
+            )
+        except Exception as e:
+            print(f"提交任务失败: {e}")
+            return jsonify({"error": f"提交任务失败: {e}"}), 500
+        return jsonify({
+            "job_id": job_id,
+            "session_id": session_id,
+            "status": "queued",
+            "status_url": url_for("job_status", job_id=job_id),
+            "events_url": url_for("job_events", job_id=job_id),
+        }), 202
+
     # 处理图片数据
     image_path = None
     if image_data:
@@ -172,42 +282,180 @@ def chat():
         if not image_path:
             return jsonify({"error": "图片处理失败"}), 400
 
-    response_text = ""
     try:
-        # Simple routing logic
-        if any(k in user_message for k in ["知识图谱", "思维导图", "mindmap", "图谱"]):
-            if kg_agent:
-                print("Routing to Knowledge Graph Agent.")
-                # 知识图谱Agent暂时不支持图片，如果有图片就提示用户
-                if image_path:
-                    response_text = "知识图谱生成功能暂时不支持图片输入，请使用纯文本描述您需要的知识图谱主题。"
-                else:
-                    response_text = kg_agent.process_request(user_message)
-            else:
-                response_text = "知识图谱助手未成功加载，无法处理您的请求。"
-        else:
-            if question_agent:
-                print("Routing to Question Generation Agent.")
-                # 使用多模态功能
-                if hasattr(question_agent, 'process_multimodal_request'):
-                    response_text = question_agent.process_multimodal_request(user_message, image_path)
-                else:
-                    if image_path:
-                        response_text = "当前版本暂时不支持图片分析，请使用纯文本提问。"
-                    else:
-                        response_text = question_agent.process_request(user_message)
-            else:
-                response_text = "出题助手未成功加载，无法处理您的请求。"
-
-    except Exception as e:
-        print(f"An error occurred during processing: {e}")
-        response_text = f"处理您的请求时发生内部错误: {e}"
+        response_text = answer_chat(user_message, image_path, session_id, data.get("mindmap_format"))
     finally:
         # 清理临时图片文件
         if image_path:
             cleanup_temp_file(image_path)
 
-    return jsonify({"response": response_text})
+    return jsonify({"response": response_text, "session_id": session_id})
+
+
+def _job_view(job):
+    """任务状态的对外表示：完成后展开结果（response、session_id）。"""
+    view = {key: job[key] for key in ("job_id", "status", "position", "error") if key in job}
+    view.update(job.get("result") or {})
+    return view
+
+
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({"error": "任务不存在或已过期"}), 404
+    return jsonify(_job_view(job))
+
+
+@app.route('/jobs/<job_id>/events')
+def job_events(job_id):
+    """以 Server-Sent Events 推送任务状态，任务结束（或超时）后关闭连接。"""
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({"error": "任务不存在或已过期"}), 404
+
+    def stream():
+        deadline = time.monotonic() + JOB_EVENTS_TIMEOUT
+        current = job
+        last_status = None
+        while True:
+            if current["status"] != last_status:
+                last_status = current["status"]
+                event = "done" if last_status in FINISHED else "status"
+                yield f"event: {event}\ndata: {json.dumps(_job_view(current), ensure_ascii=False)}\n\n"
+            remaining = deadline - time.monotonic()
+            if last_status in FINISHED or remaining <= 0:
+                return
+            current = job_queue.wait(job_id, min(remaining, JOB_EVENTS_HEARTBEAT)) or current
+            if current["status"] == last_status:
+                yield ": keep-alive\n\n"
+
+    return Response(
+        stream_with_context(stream()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+# 批量出题限制：单次请求的试卷总数上限、并发数与每分钟启动的生成次数
+BATCH_MAX_PAPERS = int(os.environ.get("BATCH_MAX_PAPERS", "200"))
+BATCH_MAX_CONCURRENCY = int(os.environ.get("BATCH_MAX_CONCURRENCY", "8"))
+BATCH_RATE_LIMIT_PER_MINUTE = float(os.environ.get("BATCH_RATE_LIMIT_PER_MINUTE", "0")) or None
+
+
+def _batch_spec(spec):
+    """把一条批量出题需求规范为 {"message": str, "copies": int}；格式不对时抛出 ValueError。"""
+    if isinstance(spec, str):
+        spec = {"message": spec}
+    if not isinstance(spec, dict):
+        raise ValueError(f"每条需求应为字符串或对象：{spec!r}")
+    message, copies = spec.get("message", ""), spec.get("copies", 1)
+    if not isinstance(message, str) or not message.strip():
+        raise ValueError(f"message 必须是非空字符串：{message!r}")
+    if isinstance(copies, str) and copies.strip().isdigit():
+        copies = int(copies)
+    if isinstance(copies, bool) or not isinstance(copies, int) or copies < 1:
+        raise ValueError(f"copies 必须是正整数：{copies!r}")
+    return {"message": message, "copies": copies}
+
+
+@app.route('/batch_generate', methods=['POST'])
+def batch_generate():
+    """批量出题：为整个班级生成多套试卷，按完成顺序以 NDJSON 流式返回。
+
+    请求体示例：
+        {"requests": [{"message": "10道关于唯物辩证法的选择题", "copies": 40}],
+         "max_concurrency": 4}
+    每完成一套试卷即输出一行 JSON（含 index、question_only_text、full_text 等）。
+    """
+    data = request.get_json(silent=True) or {}
+    specs = data.get("requests") or []
+    if isinstance(specs, (str, dict)):
+        specs = [specs]
+    if not isinstance(specs, list) or not specs:
+        return jsonify({"error": "No requests provided"}), 400
+
+    try:
+        specs = [_batch_spec(sp) for sp in specs]
+        max_concurrency = int(data.get("max_concurrency") or BATCH_MAX_CONCURRENCY)
+    except (TypeError, ValueError) as e:
+        return jsonify({"error": f"批量出题参数无效：{e}"}), 400
+    total = sum(sp["copies"] for sp in specs)
+    if total > BATCH_MAX_PAPERS:
+        return jsonify({"error": f"单次最多生成 {BATCH_MAX_PAPERS} 套试卷"}), 400
+
+    question_agent = question_agent_loader.get()
+    if not question_agent:
+        return jsonify({"error": "出题助手未成功加载，无法处理您的请求。"}), 500
+
+    max_concurrency = max(1, min(max_concurrency, BATCH_MAX_CONCURRENCY))
+
+    def generate():
+        papers = question_agent.process_batch(
+            specs,
+            max_concurrency=max_concurrency,
+            rate_limit_per_minute=BATCH_RATE_LIMIT_PER_MINUTE,
+        )
+        try:
+            for paper in papers:
+                yield json.dumps(paper, ensure_ascii=False) + "\n"
+        finally:
+            # 客户端断开时 WSGI 服务器会关闭本生成器，随之取消尚未开始的试卷
+            papers.close()
+
+    return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
+
+@app.route('/config')
+def client_settings():
+    """前端使用的配置（图片上传前缩放到的尺寸与编码格式）。"""
+    response = jsonify(client_config())
+    response.headers["Cache-Control"] = "public, max-age=300"
+    return response
+
+@app.route('/metrics')
+def metrics():
+    """运行指标：各模型的排队等待、限流、重试 / 对冲与上游延迟等。"""
+    payload = {}
+    # 尚未加载任何 Agent 时，不为了读取指标而导入整套模型依赖
+    llm_wrapper = sys.modules.get("common_utils.llm_wrapper")
+    if llm_wrapper is not None:
+        payload["llm_throttles"] = llm_wrapper.throttle_metrics()
+        payload["llm_calls"] = llm_wrapper.call_metrics()
+        payload["singleflight"] = sys.modules["common_utils.singleflight"].singleflight_metrics()
+    model_router = sys.modules.get("common_utils.model_router")
+    if model_router is not None:
+        payload["model_routes"] = model_router.route_metrics()
+    retrieval = sys.modules.get("common_utils.retrieval_service")
+    if retrieval is not None:
+        try:
+            payload["retrieval"] = retrieval.get_retriever().metrics()
+        except Exception as e:
+            payload["retrieval"] = {"error": str(e)}
+    reranker = sys.modules.get("common_utils.reranker")
+    if reranker is not None:
+        payload["reranker"] = reranker.get_reranker().metrics()
+    prompts = sys.modules.get("common_utils.prompts")
+    if prompts is not None:
+        payload["prompt_tokens"] = prompts.PROMPT_TOKEN_STATS.metrics()
+    quiz_utils = sys.modules.get("common_utils.quiz_utils")
+    if quiz_utils is not None:
+        payload["quiz_validation"] = quiz_utils.QUIZ_VALIDATION_STATS.metrics()
+    mermaid = sys.modules.get("common_utils.mermaid")
+    if mermaid is not None:
+        payload["mindmaps"] = mermaid.MINDMAP_STATS.metrics()
+    try:
+        payload["jobs"] = job_queue.metrics()
+    except Exception as e:
+        payload["jobs"] = {"error": str(e)}
+    dialogue_state = sys.modules.get("common_utils.dialogue_state")
+    if dialogue_state is not None:
+        payload["dialogue_chunks"] = dialogue_state.CHUNKS.metrics()
+    image_caption = sys.modules.get("common_utils.image_caption")
+    if image_caption is not None:
+        payload["image_captions"] = image_caption.CAPTIONS.metrics()
+    quiz_pool = sys.modules.get("common_utils.quiz_pool")
+    if quiz_pool is not None:
+        payload["quiz_pool"] = quiz_pool.pool_metrics()
+    return jsonify(payload)
 
 # ---------------- 角色扮演端点 ----------------
 
@@ -218,6 +466,7 @@ def role_chat_page():
 
 @app.route('/start_dialogue', methods=['POST'])
 def start_dialogue():
+    socrates_agent = socrates_agent_loader.get()
     if not socrates_agent:
         return jsonify({"error": "AI助手未正确初始化"}), 500
     data = request.get_json(silent=True) or {}
@@ -245,7 +494,8 @@ def start_dialogue():
             
         if response_data["status"] == "error":
             return jsonify({"error": response_data["response"]}), 500
-        dialogue_sessions[session_id] = response_data["state"]
+        with dialogue_sessions_lock:
+            dialogue_sessions[session_id] = response_data["state"]
         return jsonify({
             "session_id": session_id,
             "response": response_data["response"],
@@ -263,6 +513,7 @@ def start_dialogue():
 
 @app.route('/continue_dialogue', methods=['POST'])
 def continue_dialogue():
+    socrates_agent = socrates_agent_loader.get()
     if not socrates_agent:
         return jsonify({"error": "AI助手未正确初始化"}), 500
     data = request.get_json(silent=True) or {}
@@ -270,7 +521,9 @@ def continue_dialogue():
     user_message = data.get("message", "").strip()
     image_data = data.get("image")  # 获取base64编码的图片数据
     
-    if not session_id or session_id not in dialogue_sessions:
+    with dialogue_sessions_lock:
+        known_session = bool(session_id) and session_id in dialogue_sessions
+    if not known_session:
         return jsonify({"error": "会话已过期，请重新开始对话"}), 400
     if not user_message:
         return jsonify({"error": "请输入您的回应"}), 400
@@ -283,17 +536,25 @@ def continue_dialogue():
             return jsonify({"error": "图片处理失败"}), 400
     
     try:
-        current_state = dialogue_sessions[session_id]
-        
-        # 如果有图片，使用多模态对话功能
-        if image_path and hasattr(socrates_agent, 'process_multimodal_dialogue'):
-            response_data = socrates_agent.process_multimodal_dialogue(user_message, current_state, image_path)
-        else:
-            response_data = socrates_agent.process_dialogue(user_message, current_state)
-            
-        if response_data["status"] == "error":
-            return jsonify({"error": response_data["response"]}), 500
-        dialogue_sessions[session_id] = response_data["state"]
+        # 同一会话同时到达的两轮请求依次处理，后一轮基于前一轮的结果，不会丢失历史
+        with dialogue_turn_lock(session_id):
+            with dialogue_sessions_lock:
+                current_state = dialogue_sessions.get(session_id)
+            if current_state is None:
+                return jsonify({"error": "会话已过期，请重新开始对话"}), 400
+
+            # 如果有图片，使用多模态对话功能
+            if image_path and hasattr(socrates_agent, 'process_multimodal_dialogue'):
+                response_data = socrates_agent.process_multimodal_dialogue(user_message, current_state, image_path)
+            else:
+                response_data = socrates_agent.process_dialogue(user_message, current_state)
+
+            if response_data["status"] == "error":
+                return jsonify({"error": response_data["response"]}), 500
+            with dialogue_sessions_lock:
+                # 处理期间会话可能已被结束，此时不再写回
+                if session_id in dialogue_sessions:
+                    dialogue_sessions[session_id] = response_data["state"]
         return jsonify({
             "response": response_data["response"],
             "character": response_data["state"]["simulated_character"],
@@ -312,8 +573,10 @@ def continue_dialogue():
 def end_dialogue():
     data = request.get_json(silent=True) or {}
     session_id = data.get("session_id")
-    if session_id and session_id in dialogue_sessions:
-        dialogue_sessions.pop(session_id, None)
+    with dialogue_sessions_lock:
+        ended = dialogue_sessions.pop(session_id, None) if session_id else None
+        _dialogue_turn_locks.pop(session_id, None)
+    if ended is not None:
         return jsonify({"message": "对话已结束"})
     return jsonify({"message": "会话未找到或已结束"})
 
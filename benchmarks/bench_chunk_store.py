@@ -0,0 +1,80 @@
+"""
+文本块存储基准：对比 LangChain 原生 ``index.pkl``（InMemoryDocstore + UUID 映射）
+与紧凑格式 ``chunks.bin``（int32 ID、单一 UTF-8 缓冲区）的加载耗时、内存占用与对象数量。
+``chunks.bin`` 通过 mmap 映射，文本页位于操作系统页缓存中、由各 worker 共享，
+因此「Python 堆」一列只统计进程私有的分配。
+
+用法：
+    python -m common_utils.chunk_store database_agent_mayuan   # 先生成 chunks.bin
+    python benchmarks/bench_chunk_store.py
+    python benchmarks/bench_chunk_store.py --path database_agent_mayuan --repeat 20
+"""
+import argparse
+import gc
+import os
+import pickle
+import sys
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def _load_legacy(path):
+    with open(os.path.join(path, "index.pkl"), "rb") as f:
+        return pickle.load(f)
+
+
+def _load_compact(path):
+    from common_utils.chunk_store import CHUNK_STORE_FILE, CompactDocstore, RowIdMapping
+
+    docstore = CompactDocstore.load(os.path.join(path, CHUNK_STORE_FILE))
+    return docstore, RowIdMapping(len(docstore))
+
+
+def _measure(loader, path, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        loader(path)
+        timings.append(time.perf_counter() - start)
+
+    gc.collect()
+    objects_before = len(gc.get_objects())
+    tracemalloc.start()
+    result = loader(path)
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    objects = len(gc.get_objects()) - objects_before
+    del result
+    return min(timings) * 1000, sorted(timings)[len(timings) // 2] * 1000, current, objects
+
+
+def main():
+    parser = argparse.ArgumentParser(description="文本块存储加载基准")
+    parser.add_argument("--path", default=os.path.join(ROOT, "database_agent_mayuan"))
+    parser.add_argument("--repeat", type=int, default=10)
+    args = parser.parse_args()
+
+    from common_utils.chunk_store import has_chunk_store
+
+    if not has_chunk_store(args.path):
+        sys.exit(f"{args.path} 中没有 chunks.bin，请先运行 python -m common_utils.chunk_store {args.path}")
+
+    rows = [("index.pkl", _load_legacy), ("chunks.bin", _load_compact)]
+    print("=" * 72)
+    print(f"   文本块存储基准：{args.path}（重复 {args.repeat} 次）")
+    print("=" * 72)
+    print(f"{'格式':<14}{'最快ms':>10}{'中位ms':>10}{'Python堆KB':>12}{'GC对象':>10}")
+    results = {}
+    for name, loader in rows:
+        best, median, memory, objects = _measure(loader, args.path, args.repeat)
+        results[name] = (median, memory)
+        print(f"{name:<14}{best:>10.2f}{median:>10.2f}{memory / 1024:>12.1f}{objects:>10}")
+    legacy, compact = results["index.pkl"], results["chunks.bin"]
+    print(f"加载耗时 {legacy[0] / compact[0]:.1f}x，进程私有内存 {legacy[1] / max(compact[1], 1):.1f}x")
+
+
+if __name__ == "__main__":
+    main()
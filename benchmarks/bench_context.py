@@ -0,0 +1,70 @@
+"""
+上下文打包基准：对比原先直接拼接检索片段与 ContextPacker 打包后的提示词大小，
+以及与主题相关的句子被保留的比例。
+
+用法：
+    python benchmarks/bench_context.py                 # 使用真实 DashScope 向量检索（需 DASHSCOPE_API_KEY）
+    python benchmarks/bench_context.py --stub          # 使用本地桩服务（检索结果随机，仅用于离线验证）
+    python benchmarks/bench_context.py --budget 800 --k 5
+"""
+import argparse
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+TOPICS = ["唯物辩证法", "实践与认识", "矛盾的同一性和斗争性", "物质和意识", "剩余价值", "社会存在与社会意识", "商品的二因素"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="检索上下文打包基准")
+    parser.add_argument("--stub", action="store_true", help="使用本地桩服务代替 DashScope")
+    parser.add_argument("--k", type=int, default=5, help="每个主题检索的片段数")
+    parser.add_argument("--budget", type=int, default=1000, help="打包的 token 预算")
+    args = parser.parse_args()
+
+    if args.stub:
+        from stub_dashscope_server import point_dashscope_at, start_stub_server
+
+        _, url = start_stub_server()
+        point_dashscope_at(url)
+        os.environ.setdefault("DASHSCOPE_API_KEY", "sk-stub")
+
+    from common_utils.context_packer import ContextPacker, char_bigrams, _normalize, _split_sentences
+    from common_utils.prompts import estimate_tokens
+    from common_utils.vector_utils import load_vectorstore
+
+    vectorstore = load_vectorstore("database_agent_mayuan")
+    packer = ContextPacker(token_budget=args.budget)
+
+    print("=" * 78)
+    print(f"   上下文打包基准：k={args.k}，预算 {args.budget} tokens")
+    print("=" * 78)
+    print(f"{'主题':<14}{'前3段拼接':>10}{'全部拼接':>10}{'打包后':>8}{'相关句保留':>12}{'耗时ms':>8}")
+    totals = [0, 0, 0]
+    for topic in TOPICS:
+        docs = [d.page_content for d in vectorstore.similarity_search(f"{topic} 马克思主义基本原理", k=args.k)]
+        start = time.perf_counter()
+        packed = packer.pack(docs, topic)
+        elapsed = (time.perf_counter() - start) * 1000
+
+        top3 = estimate_tokens("\n\n".join(docs[:3]))
+        full = estimate_tokens("\n\n".join(docs))
+        packed_tokens = estimate_tokens(packed)
+        topic_grams = char_bigrams(topic)
+        relevant = [s for d in docs for s in _split_sentences(_normalize(d)) if char_bigrams(s) & topic_grams]
+        kept = sum(1 for s in set(relevant) if s in packed)
+        recall = kept / len(set(relevant)) if relevant else 1.0
+
+        totals[0] += top3
+        totals[1] += full
+        totals[2] += packed_tokens
+        print(f"{topic:<14}{top3:>10}{full:>10}{packed_tokens:>8}{recall:>12.0%}{elapsed:>8.1f}")
+    print(f"{'合计':<14}{totals[0]:>10}{totals[1]:>10}{totals[2]:>8}")
+
+
+if __name__ == "__main__":
+    main()
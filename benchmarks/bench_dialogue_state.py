@@ -0,0 +1,111 @@
+"""
+对话状态基准：对比旧的列表式对话状态（每轮两次 ``history + [...]`` 复制、每轮重新
+转换全部历史消息并重新估算 token、每个会话保存参考资料全文）与 ``TurnLog`` + 按块 ID
+引用参考资料的新状态。
+
+统计长会话中每轮的状态处理耗时（不含模型调用），以及多个会话常驻内存的大小。
+
+用法：
+    python benchmarks/bench_dialogue_state.py
+    python benchmarks/bench_dialogue_state.py --turns 400 --sessions 200
+"""
+import argparse
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from langchain_core.documents import Document  # noqa: E402
+from langchain_core.messages import AIMessage, HumanMessage  # noqa: E402
+
+from common_utils.dialogue_state import ChunkTable, TurnLog  # noqa: E402
+from common_utils.prompts import estimate_tokens  # noqa: E402
+
+CORPUS = [
+    Document(id=f"mayuan:{i}", page_content=f"第{i}段参考资料：" + "矛盾是事物发展的根本动力。" * 40)
+    for i in range(60)
+]
+
+
+def _retrieve(rng):
+    # 每次检索得到新的字符串对象，与从文档库解码得到的文本一样
+    return [Document(id=d.id, page_content="".join(list(d.page_content))) for d in rng.sample(CORPUS, 3)]
+
+
+def legacy_turn(state, user_text, reply_text, rng):
+    history = state["conversation_history"] + [{"role": "user", "content": user_text}]
+    docs = state["retrieved_docs"] or [d.page_content for d in _retrieve(rng)]
+    messages = []
+    for msg in history:
+        messages.append((HumanMessage if msg["role"] == "user" else AIMessage)(content=msg["content"]))
+    sum(estimate_tokens(msg["content"]) for msg in history)
+    history = history + [{"role": "assistant", "content": reply_text}]
+    return {"conversation_history": history, "retrieved_docs": docs}
+
+
+def compact_turn(state, user_text, reply_text, rng, chunks):
+    history = state["conversation_history"].append("user", user_text)
+    refs = state["chunk_refs"] or chunks.intern(_retrieve(rng))
+    history.to_messages()
+    history.tokens  # noqa: B018 - 读取缓存的 token 数
+    return {"conversation_history": history.append("assistant", reply_text), "chunk_refs": refs}
+
+
+def per_turn_cost(turn_fn, initial, turns, *extra):
+    rng = random.Random(0)
+    state = initial
+    samples = []
+    for i in range(turns):
+        start = time.perf_counter()
+        state = turn_fn(state, f"第{i}轮学生的回答" * 5, f"第{i}轮的追问" * 8, rng, *extra)
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def session_memory(turn_fn, initial, sessions, turns, *extra):
+    rng = random.Random(1)
+    tracemalloc.start()
+    kept = []
+    for _ in range(sessions):
+        state = initial()
+        for i in range(turns):
+            state = turn_fn(state, f"第{i}轮学生的回答" * 5, f"第{i}轮的追问" * 8, rng, *extra)
+        kept.append(state)
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return current / sessions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="对话状态基准")
+    parser.add_argument("--turns", type=int, default=200, help="单个长会话的轮数")
+    parser.add_argument("--sessions", type=int, default=500, help="内存统计中的会话数")
+    parser.add_argument("--session-turns", type=int, default=20, help="内存统计中每个会话的轮数")
+    args = parser.parse_args()
+
+    legacy = per_turn_cost(legacy_turn, {"conversation_history": [], "retrieved_docs": []}, args.turns)
+    compact = per_turn_cost(compact_turn, {"conversation_history": TurnLog(), "chunk_refs": ()}, args.turns, ChunkTable())
+    legacy_mem = session_memory(
+        legacy_turn, lambda: {"conversation_history": [], "retrieved_docs": []}, args.sessions, args.session_turns
+    )
+    compact_mem = session_memory(
+        compact_turn, lambda: {"conversation_history": TurnLog(), "chunk_refs": ()},
+        args.sessions, args.session_turns, ChunkTable(),
+    )
+
+    print("=" * 72)
+    print(f"   对话状态基准：单会话 {args.turns} 轮；{args.sessions} 个会话 × {args.session_turns} 轮的常驻内存")
+    print("=" * 72)
+    print(f"{'状态表示':<16}{'前10轮 µs/轮':>14}{'最后10轮 µs/轮':>16}{'KB/会话':>10}")
+    for label, samples, memory in (("列表（旧）", legacy, legacy_mem), ("TurnLog + 块引用", compact, compact_mem)):
+        head = sum(samples[:10]) / 10 * 1e6
+        tail = sum(samples[-10:]) / 10 * 1e6
+        print(f"{label:<16}{head:>14.1f}{tail:>16.1f}{memory / 1024:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+"""
+图片描述缓存基准：一个班的学生上传同一张课件图片开始苏格拉底对话，随后各自再进行
+几轮文字对话。对比旧流程（带图片的一轮直接发给视觉模型，不检索，后续轮次看不到
+图片内容）与新流程（视觉模型只把图片描述一次，描述保存在会话状态中，本轮与后续
+轮次都走检索 + 文本模型）的视觉模型调用次数、带图片一轮的平均耗时，以及后续轮次
+中提示词包含图片内容的比例。
+
+桩服务中视觉模型比文本模型慢（--vision-latency / --text-latency）。
+
+用法：
+    python benchmarks/bench_image_caption.py
+    python benchmarks/bench_image_caption.py --students 30 --turns 4 --vision-latency 2.0
+"""
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from stub_dashscope_server import StubConfig, point_dashscope_at, start_stub_server  # noqa: E402
+
+CAPTION_REPLY = (
+    '{"text": "矛盾是事物发展的根本动力", "concepts": ["矛盾", "对立统一", "唯物辩证法"], '
+    '"description": "一张讲解对立统一规律的课件，中间是太极图，两侧列出矛盾的同一性与斗争性。"}'
+)
+
+
+def _text(message) -> str:
+    content = message.get("content")
+    if isinstance(content, list):
+        return " ".join(part.get("text", "") for part in content if isinstance(part, dict))
+    return str(content)
+
+
+def make_responder(vision_latency, text_latency, calls):
+    lock = threading.Lock()
+
+    def respond(model, messages):
+        vision = model.startswith("qwen-vl")
+        with lock:
+            calls["vision" if vision else "text"] += 1
+        time.sleep(vision_latency if vision else text_latency)
+        system = " ".join(_text(m) for m in messages if m.get("role") == "system")
+        if vision:
+            return CAPTION_REPLY if "只输出一个 JSON 对象" in _text(messages[-1]) else "（结合图片的苏格拉底式提问）"
+        if "意图识别" in system:
+            return '{"topic": "对立统一规律", "character": "马克思"}'
+        return "[含图片内容] 追问" if "图片描述" in system else "[无图片内容] 追问"
+    return respond
+
+
+def _slide(path):
+    from PIL import Image
+
+    Image.new("RGB", (640, 480), (230, 230, 240)).save(path, format="PNG")
+
+
+def legacy_dialogue(agent, image_path, turns):
+    """旧流程：带图片的一轮直接交给视觉模型，会话状态只记录对话文字。"""
+    from common_utils.dialogue_state import TurnLog
+
+    start = time.perf_counter()
+    # 旧流程中这一轮由视觉模型以人物设定直接回复；这里用同样的一次视觉模型调用模拟
+    reply = agent.multimodal_agent.process_multimodal_request(
+        "老师，这张图说的是什么？", image_path, system_prompt="你现在要扮演马克思，与用户进行苏格拉底式对话。"
+    )
+    first = time.perf_counter() - start
+    state = {
+        "simulated_character": "马克思",
+        "current_topic": "马克思主义理论",
+        "turn_count": 1,
+        "conversation_history": TurnLog().extend([
+            {"role": "user", "content": "老师，这张图说的是什么？"},
+            {"role": "assistant", "content": reply},
+        ]),
+        "chunk_refs": (),
+    }
+    grounded = 0
+    for turn in range(turns):
+        result = agent.process_dialogue(f"我想再想想第{turn}个问题", state)
+        state = result["state"]
+        grounded += result["response"].startswith("[含图片内容]")
+    return first, grounded
+
+
+def caption_dialogue(agent, image_path, turns):
+    """新流程：图片只描述一次，描述随会话状态进入后续每一轮。"""
+    start = time.perf_counter()
+    result = agent.process_multimodal_dialogue("老师，这张图说的是什么？", None, image_path)
+    first = time.perf_counter() - start
+    state = result["state"]
+    grounded = 0
+    for turn in range(turns):
+        result = agent.process_dialogue(f"我想再想想第{turn}个问题", state)
+        state = result["state"]
+        grounded += result["response"].startswith("[含图片内容]")
+    return first, grounded
+
+
+def main():
+    parser = argparse.ArgumentParser(description="图片描述缓存基准")
+    parser.add_argument("--students", type=int, default=20, help="上传同一张图片的学生数")
+    parser.add_argument("--turns", type=int, default=3, help="带图片的一轮之后每人再进行的文字轮数")
+    parser.add_argument("--vision-latency", type=float, default=1.0, help="桩服务视觉模型延迟（秒）")
+    parser.add_argument("--text-latency", type=float, default=0.2, help="桩服务文本模型延迟（秒）")
+    args = parser.parse_args()
+
+    calls = Counter()
+    _, url = start_stub_server(StubConfig(latency=0.0), responder=make_responder(args.vision_latency, args.text_latency, calls))
+    point_dashscope_at(url)
+    os.environ.setdefault("DASHSCOPE_API_KEY", "sk-stub")
+
+    from role_agent import SocratesAgent
+
+    agent = SocratesAgent()
+    image_path = os.path.join(tempfile.mkdtemp(), "slide.png")
+    _slide(image_path)
+
+    print("=" * 72)
+    print(f"   图片描述缓存基准：{args.students} 名学生上传同一张图片，之后各进行 {args.turns} 轮文字对话")
+    print("=" * 72)
+    print(f"{'流程':<22}{'视觉调用':>10}{'文本调用':>10}{'图片轮平均 s':>14}{'后续轮含图片内容':>18}")
+    for label, run in (("旧：视觉模型直接回复", legacy_dialogue), ("新：描述一次 + RAG", caption_dialogue)):
+        calls.clear()
+        firsts, grounded = [], 0
+        for _ in range(args.students):
+            first, hits = run(agent, image_path, args.turns)
+            firsts.append(first)
+            grounded += hits
+        share = grounded / (args.students * args.turns) if args.turns else 0.0
+        print(f"{label:<22}{calls['vision']:>10}{calls['text']:>10}{sum(firsts) / len(firsts):>14.3f}{share:>18.0%}")
+
+    from common_utils.image_caption import CAPTIONS
+
+    print(f"图片描述缓存：{CAPTIONS.metrics()}")
+
+
+if __name__ == "__main__":
+    main()
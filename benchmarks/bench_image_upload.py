@@ -0,0 +1,101 @@
+"""
+图片上传基准：对比手机原图直接上传（base64 JSON）与浏览器按 /config 缩放并编码为
+WebP 后上传（此处用 Pillow 模拟浏览器的 canvas 编码）时的请求体大小、服务端解析
+JSON + 保存图片 + 准备视觉模型输入的耗时与内存峰值。
+
+用法：
+    python benchmarks/bench_image_upload.py
+    python benchmarks/bench_image_upload.py --width 4000 --height 3000 --repeat 10
+"""
+import argparse
+import base64
+import json
+import os
+import sys
+import time
+import tracemalloc
+from io import BytesIO
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from PIL import Image, ImageFilter  # noqa: E402
+
+from common_utils.image_upload import MAX_IMAGE_DIM, UPLOAD_QUALITY, decode_upload  # noqa: E402
+
+
+def phone_photo(width, height) -> bytes:
+    """带渐变与传感器噪声的 JPEG，体积接近手机照片。"""
+    gradient = Image.linear_gradient("L").resize((width, height)).convert("RGB")
+    noise = Image.effect_noise((width, height), 40).filter(ImageFilter.GaussianBlur(0.6)).convert("RGB")
+    photo = Image.blend(gradient, noise, 0.35)
+    buffer = BytesIO()
+    photo.save(buffer, format="JPEG", quality=92)
+    return buffer.getvalue()
+
+
+def browser_upload(photo: bytes) -> bytes:
+    """模拟 image_upload.js：缩放到 max_dim 并编码为 WebP。"""
+    with Image.open(BytesIO(photo)) as img:
+        scale = min(1.0, MAX_IMAGE_DIM / max(img.size))
+        img = img.resize((round(img.width * scale), round(img.height * scale)))
+        buffer = BytesIO()
+        img.save(buffer, format="WEBP", quality=int(UPLOAD_QUALITY * 100))
+        return buffer.getvalue()
+
+
+def handle(body: bytes):
+    """服务端处理一次带图片的请求：解析 JSON、校验保存、准备视觉模型输入。"""
+    from common_utils.llm_wrapper import CustomVisionChatDashScope
+
+    payload = json.loads(body)
+    image_binary, suffix = decode_upload(payload["image"])
+    path = os.path.join("/tmp", f"bench_upload{suffix}")
+    with open(path, "wb") as f:
+        f.write(image_binary)
+    try:
+        CustomVisionChatDashScope()._prepare_multimodal_content("这张图说的是什么？", path)
+    finally:
+        os.unlink(path)
+
+
+def measure(body: bytes, repeat: int):
+    handle(body)  # 预热
+    start = time.perf_counter()
+    for _ in range(repeat):
+        handle(body)
+    elapsed = (time.perf_counter() - start) / repeat
+    tracemalloc.start()
+    handle(body)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description="图片上传基准")
+    parser.add_argument("--width", type=int, default=4032)
+    parser.add_argument("--height", type=int, default=3024)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    os.environ.setdefault("DASHSCOPE_API_KEY", "sk-stub")
+
+    photo = phone_photo(args.width, args.height)
+    bodies = {
+        "原图直接上传": photo,
+        f"浏览器缩放到 {MAX_IMAGE_DIM}px WebP": browser_upload(photo),
+    }
+    print("=" * 72)
+    print(f"   图片上传基准：{args.width}×{args.height} 手机照片")
+    print("=" * 72)
+    print(f"{'上传方式':<26}{'请求体 KB':>12}{'服务端 ms':>12}{'内存峰值 MB':>14}")
+    for label, image in bodies.items():
+        mime = "image/webp" if image is not photo else "image/jpeg"
+        body = json.dumps({"message": "这张图说的是什么？",
+                           "image": f"data:{mime};base64,{base64.b64encode(image).decode()}"}).encode()
+        elapsed, peak = measure(body, args.repeat)
+        print(f"{label:<26}{len(body) / 1024:>12.0f}{elapsed * 1000:>12.1f}{peak / 1024 / 1024:>14.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""
+异步任务队列基准：用本地桩服务模拟较慢的生成，同时发出一波 /chat 请求，对比
+同步模式（HTTP 请求一直占用到生成结束）与异步模式（立即返回任务 ID、由任务队列
+执行）的 HTTP 响应时间，以及异步模式下任务的排队 / 完成时间。
+
+用法：
+    python benchmarks/bench_job_queue.py
+    python benchmarks/bench_job_queue.py --burst 32 --latency 2.0 --workers 4
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from stub_dashscope_server import StubConfig, point_dashscope_at, start_stub_server  # noqa: E402
+
+
+def _quantiles(samples):
+    ordered = sorted(samples)
+    return ordered[len(ordered) // 2], ordered[min(len(ordered) - 1, int(0.95 * len(ordered)))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="异步任务队列基准")
+    parser.add_argument("--burst", type=int, default=16, help="同时到达的请求数")
+    parser.add_argument("--latency", type=float, default=1.0, help="桩服务每次调用的延迟（秒）")
+    parser.add_argument("--workers", type=int, default=4, help="JOB_WORKERS")
+    args = parser.parse_args()
+
+    _, url = start_stub_server(StubConfig(latency=args.latency))
+    point_dashscope_at(url)
+    os.environ.setdefault("DASHSCOPE_API_KEY", "sk-stub")
+    os.environ["JOB_WORKERS"] = str(args.workers)
+    os.environ["JOB_QUEUE_PATH"] = os.path.join(tempfile.mkdtemp(), "bench_jobs.sqlite3")
+    os.environ["QUIZ_POOL_SIZE"] = "0"
+
+    import app as appmod
+
+    client = appmod.app.test_client()
+    messages = [f"帮我出{3 + i % 5}道关于唯物辩证法的简答题" for i in range(args.burst)]
+    client.post("/chat", json={"message": messages[0]})  # 预热 Agent
+
+    def post(message, use_async):
+        start = time.perf_counter()
+        reply = client.post("/chat", json={"message": message, "async": use_async}).get_json()
+        return time.perf_counter() - start, reply
+
+    print("=" * 72)
+    print(f"   异步任务队列基准：{args.burst} 个并发请求，桩服务延迟 {args.latency}s，{args.workers} 个工作线程")
+    print("=" * 72)
+    with ThreadPoolExecutor(max_workers=args.burst) as pool:
+        sync = [t for t, _ in pool.map(lambda m: post(m, False), messages)]
+        start = time.perf_counter()
+        submitted = list(pool.map(lambda m: post(m, True), messages))
+    done = [appmod.job_queue.wait(reply["job_id"], timeout=600) for _, reply in submitted]
+    finished_in = [job["finished_at"] - job["created_at"] for job in done if job and "finished_at" in job]
+
+    print(f"{'模式':<22}{'HTTP P50 s':>12}{'HTTP P95 s':>12}{'完成 P50 s':>12}{'完成 P95 s':>12}")
+    print(f"{'同步 /chat':<22}{_quantiles(sync)[0]:>12.3f}{_quantiles(sync)[1]:>12.3f}"
+          f"{_quantiles(sync)[0]:>12.3f}{_quantiles(sync)[1]:>12.3f}")
+    http = [t for t, _ in submitted]
+    print(f"{'异步 /chat + 任务队列':<22}{_quantiles(http)[0]:>12.3f}{_quantiles(http)[1]:>12.3f}"
+          f"{_quantiles(finished_in)[0]:>12.3f}{_quantiles(finished_in)[1]:>12.3f}")
+    print(f"整波异步任务完成用时 {time.perf_counter() - start:.2f}s；任务队列指标：{appmod.job_queue.metrics()}")
+
+
+if __name__ == "__main__":
+    main()
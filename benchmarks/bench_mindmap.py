@@ -0,0 +1,73 @@
+"""
+Mindmap 校验 / 修复基准：对一组典型的模型输出（含常见格式错误）统计本地校验耗时、
+本地可修复的比例，以及仍需重新调用模型的比例。修复前，任何一种错误都会让浏览器端
+渲染失败，学生只能重新提交（即一次完整的 qwen-max 调用）。
+
+用法：
+    python benchmarks/bench_mindmap.py
+    python benchmarks/bench_mindmap.py --repeat 2000
+"""
+import argparse
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from common_utils.mermaid import repair_mindmap, split_mermaid_response  # noqa: E402
+
+GOOD = """```mermaid
+mindmap
+  root((唯物辩证法))
+    联系
+      普遍性
+      客观性
+    发展
+      前进性
+      曲折性
+    矛盾
+      同一性
+      斗争性
+```
+唯物辩证法以联系和发展的观点看世界。"""
+
+SAMPLES = {
+    "合格": GOOD,
+    "节点含括号": GOOD.replace("同一性", "同一性(相对的)").replace("斗争性", "斗争性[绝对的]"),
+    "缩进不一致": GOOD.replace("    发展", "   发展"),
+    "缺少 mindmap 声明": GOOD.replace("mindmap\n", ""),
+    "根节点形式错误": GOOD.replace("root((唯物辩证法))", "唯物辩证法"),
+    "节点过多": GOOD.replace("      斗争性", "      斗争性\n" + "\n".join(f"    扩展{i}\n      细节{i}" for i in range(8))),
+    "层级过深": GOOD.replace("      普遍性", "      普遍性\n        表现\n          例子"),
+    "代码块未闭合": GOOD.split("```\n")[0],
+    "流程图": "```mermaid\ngraph TD\n  A[唯物辩证法] --> B[联系]\n```",
+    "只有根节点": "```mermaid\nmindmap\n  root((唯物辩证法))\n```",
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mindmap 校验 / 修复基准")
+    parser.add_argument("--repeat", type=int, default=1000)
+    args = parser.parse_args()
+
+    print("=" * 72)
+    print("   Mindmap 校验 / 修复基准")
+    print("=" * 72)
+    print(f"{'样本':<16}{'µs/次':>8}  {'结果':<10}问题")
+    regenerations = 0
+    for name, output in SAMPLES.items():
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            code, _ = split_mermaid_response(output)
+            check = repair_mindmap(code, "唯物辩证法")
+        elapsed = (time.perf_counter() - start) / args.repeat * 1e6
+        status = "合格" if check.valid else ("本地修复" if check.recoverable else "需重新生成")
+        regenerations += not check.recoverable
+        print(f"{name:<16}{elapsed:>8.1f}  {status:<10}{'；'.join(check.problems)[:60]}")
+    defective = len(SAMPLES) - 1
+    print(f"有缺陷的样本 {defective} 个：修复前全部需要重新生成，修复后 {regenerations} 个需要重新生成")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""
+模型级联基准：用本地桩服务模拟 qwen-turbo / qwen-max 的不同延迟与 turbo 的出错率，
+按实际请求的组合（对话意图识别、简单选择题、困难题目、对话回复）对比「全部使用
+qwen-max」与「级联路由」的各路由中位 / P95 延迟、升级率与最终输出的合格率。
+
+用法：
+    python benchmarks/bench_model_router.py
+    python benchmarks/bench_model_router.py --turbo-latency 0.3 --max-latency 1.2 --turbo-defect-rate 0.15
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from stub_dashscope_server import StubConfig, point_dashscope_at, start_stub_server  # noqa: E402
+
+QUIZ = [
+    {"type": "选择题", "stem": f"关于矛盾的说法，正确的是（{i}）", "options": ["甲", "乙", "丙", "丁"],
+     "answer": "C", "explanation": "略"}
+    for i in range(5)
+]
+# (路由, 是否可走快速模型, 占比)
+WORKLOAD = [("dialogue_intent", True, 0.2), ("question", True, 0.3), ("question_hard", False, 0.2), ("dialogue", False, 0.3)]
+
+
+def make_responder(args, rng):
+    def respond(model, messages):
+        prompt = messages[-1]["content"] if messages else ""
+        time.sleep(args.turbo_latency if model == "qwen-turbo" else args.max_latency)
+        broken = model == "qwen-turbo" and rng.random() < args.turbo_defect_rate
+        if "意图" in prompt:
+            return "主题是矛盾" if broken else '{"topic": "矛盾", "character": "马克思"}'
+        if "出题" in prompt:
+            quiz = [dict(q, options=q["options"][:3]) for q in QUIZ] if broken else QUIZ
+            return "```json\n" + json.dumps(quiz, ensure_ascii=False) + "\n```"
+        return "你认为矛盾的同一性体现在哪里？"
+    return respond
+
+
+def run(router_enabled, requests, workers):
+    from langchain_core.messages import HumanMessage
+
+    from common_utils import model_router
+    from common_utils.llm_wrapper import CustomChatDashScope
+    from common_utils.quiz_utils import parse_structured_questions, validate_quiz
+
+    model_router._ROUTE_STATS.clear()
+    router = model_router.ModelRouter(CustomChatDashScope(model="qwen-max", temperature=0.7), enabled=router_enabled)
+
+    def quiz_ok(text):
+        questions = parse_structured_questions(text, default_type="选择题")
+        return questions is not None and validate_quiz(questions, {"选择题": 5}).ok
+
+    def intent_ok(text):
+        return text.strip().startswith("{")
+
+    def one(item):
+        route, fast = item
+        if route.startswith("question"):
+            reply = router.invoke(route, [HumanMessage(content="请出题")], fast=fast, validate=quiz_ok)
+            return quiz_ok(reply.content)
+        if route == "dialogue_intent":
+            reply = router.invoke(route, [HumanMessage(content="识别意图")], fast=fast, validate=intent_ok)
+            return intent_ok(reply.content)
+        router.invoke(route, [HumanMessage(content="继续对话")])
+        return True
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        results = list(pool.map(one, requests))
+    return model_router.route_metrics(), sum(results) / len(results)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="模型级联基准")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--workers", type=int, default=16)
+    parser.add_argument("--turbo-latency", type=float, default=0.3)
+    parser.add_argument("--max-latency", type=float, default=1.2)
+    parser.add_argument("--turbo-defect-rate", type=float, default=0.1)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    _, url = start_stub_server(StubConfig(latency=0.0), responder=make_responder(args, rng))
+    point_dashscope_at(url)
+    os.environ.setdefault("DASHSCOPE_API_KEY", "sk-stub")
+
+    routes = [(route, fast) for route, fast, _ in WORKLOAD]
+    requests = rng.choices(routes, weights=[w for *_, w in WORKLOAD], k=args.requests)
+
+    print("=" * 78)
+    print(f"   模型级联基准：{args.requests} 个请求，turbo {args.turbo_latency}s / max {args.max_latency}s，"
+          f"turbo 出错率 {args.turbo_defect_rate:.0%}")
+    print("=" * 78)
+    print(f"{'模式':<8}{'路由':<18}{'请求':>6}{'升级率':>8}{'P50 s':>8}{'P95 s':>8}")
+    for label, enabled in (("全 max", False), ("级联", True)):
+        metrics, ok_rate = run(enabled, requests, args.workers)
+        for route, m in metrics.items():
+            print(f"{label:<8}{route:<18}{m['requests']:>6}{m['escalation_rate']:>8.0%}"
+                  f"{m['latency_p50']:>8.2f}{m['latency_p95']:>8.2f}")
+        print(f"{label:<8}最终输出合格率 {ok_rate:.1%}")
+
+
+if __name__ == "__main__":
+    main()
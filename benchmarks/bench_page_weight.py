@@ -0,0 +1,48 @@
+"""
+页面体积基准：统计聊天页面首次访问与再次访问时需要下载的字节数与请求数。
+
+- 首次访问：HTML + 页面引用的本地静态文件，以及页面加载时就请求的外部脚本个数；
+- 再次访问：带内容指纹、可长期缓存（Cache-Control: immutable）的静态文件直接取自
+  浏览器缓存，其余静态文件仍需一次条件请求（往返）。
+
+用法：
+    python benchmarks/bench_page_weight.py
+"""
+import os
+import re
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+_REF_RE = re.compile(r'<(?:script|link|img)\b[^>]*?(?:src|href)="([^"]+)"')
+
+
+def main():
+    os.environ.setdefault("DASHSCOPE_API_KEY", "sk-stub")
+    os.environ["JOB_QUEUE_PATH"] = os.path.join(tempfile.mkdtemp(), "bench_jobs.sqlite3")
+
+    import app as appmod
+
+    client = appmod.app.test_client()
+    print("=" * 72)
+    print("   页面体积基准（不含字体）")
+    print("=" * 72)
+    print(f"{'页面':<12}{'HTML KB':>10}{'静态文件 KB':>14}{'外部脚本':>10}{'再次访问请求':>14}{'再次访问 KB':>14}")
+    for page in ("/chat_ui", "/role"):
+        html = client.get(page).get_data()
+        refs = _REF_RE.findall(html.decode("utf-8"))
+        local = [ref for ref in refs if ref.startswith("/static/")]
+        external = [ref for ref in refs if ref.startswith("http") and ref.endswith(".js")]
+        static_bytes, revalidated = 0, 0
+        for ref in local:
+            response = client.get(ref)
+            static_bytes += len(response.get_data())
+            revalidated += "immutable" not in (response.headers.get("Cache-Control") or "")
+        print(f"{page:<12}{len(html) / 1024:>10.1f}{static_bytes / 1024:>14.1f}{len(external):>10}"
+              f"{1 + revalidated:>14}{len(html) / 1024:>14.1f}")
+
+
+if __name__ == "__main__":
+    main()
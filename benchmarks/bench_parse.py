@@ -0,0 +1,176 @@
+"""
+输入解析微基准：对比原先逐个关键词 / 正则扫描的解析方式与
+``common_utils.input_parser`` 中合并关键词表、预编译正则的单遍解析，
+并校验两者在同一批输入上的结果完全一致。
+
+「单次请求」模拟 /chat 的实际路径：知识图谱路由判断、答案请求判断，再由
+parse_input_node 解析参数；新实现中三者共用同一次（缓存的）解析结果。
+
+用法：
+    python benchmarks/bench_parse.py
+    python benchmarks/bench_parse.py --random 20000 --repeat 5
+"""
+import argparse
+import os
+import random
+import re
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from common_utils.input_parser import InputParser  # noqa: E402
+
+COMMON_TOPICS = [
+    "唯物辩证法", "历史唯物主义", "马克思主义哲学", "认识论",
+    "实践观", "矛盾论", "否定之否定", "质量互变", "联系",
+    "发展", "本质与现象", "内容与形式", "原因与结果",
+    "必然与偶然", "可能与现实", "社会存在", "社会意识",
+    "辩证唯物主义",
+]
+DEFAULT_TOPIC = "马克思主义基本原理"
+
+REQUESTS = [
+    "帮我出3道关于唯物辩证法的选择题",
+    "给我5道简单的判断题和2道简答题，关于实践与认识的",
+    "出10道困难的材料分析题",
+    "请生成唯物辩证法的知识图谱",
+    "画一个关于社会存在与社会意识的思维导图",
+    "给出上一次题目的答案解析",
+    "出2道选择题 3道判断题 1道简答题，主题是矛盾论和质量互变",
+    "我想练习一下否定之否定规律",
+]
+FRAGMENTS = [
+    "请", "给我", "出", "3道", "5 道", "2个", "10题", "关于", "的", "唯物辩证法", "矛盾论", "联系", "发展",
+    "社会存在", "选择题", "判断题", "简答题", "材料分析题", "材料 分析", "简单", "困难", "难", "高级", "基础",
+    "题目", "知识图谱", "图谱", "思维导图", "mindmap", "生成", "画", "帮我", "：", ":", "，", " ", "解析", "答案",
+    "剩余价值", "和", "图", "谱",
+]
+
+
+def legacy_parse(user_input):
+    """重构前 BaseAgent.parse_input_node、/chat 路由与 MayuanKGAgent._extract_topic 的逐项扫描实现。"""
+    type_count_pattern = r"(\d+)\s*(?:道|题|个)[^一-龥]*?(选择题|判断题|简答题|材料\s*分析题?)"
+    compact_input = re.sub(r"\s+", "", user_input)
+    question_type_counts = {}
+    for num_str, q_type_raw in re.findall(type_count_pattern, compact_input):
+        q_type = q_type_raw.replace("材料分析题", "简答题").replace("材料分析", "简答题")
+        question_type_counts[q_type] = question_type_counts.get(q_type, 0) + int(num_str)
+    if question_type_counts:
+        num_questions = sum(question_type_counts.values())
+    else:
+        numbers = re.findall(r"(\d+)\s*(?:道|题|个)", user_input)
+        num_questions = sum(int(n) for n in numbers) if numbers else 5
+
+    difficulty = "中等"
+    if any(kw in user_input for kw in ["简单", "容易", "基础"]):
+        difficulty = "简单"
+    elif any(kw in user_input for kw in ["困难", "难", "高级"]):
+        difficulty = "困难"
+
+    detected_types = [qt for qt in ["选择题", "判断题", "简答题"]
+                      if qt in user_input or ("简答题" == qt and "材料分析" in user_input)]
+    if not question_type_counts and detected_types:
+        avg_count = max(1, num_questions // len(detected_types))
+        for qt in detected_types:
+            question_type_counts[qt] = avg_count
+    if len(question_type_counts) > 1:
+        question_type = "混合"
+    elif len(question_type_counts) == 1:
+        question_type = next(iter(question_type_counts))
+    else:
+        question_type = "选择题"
+        question_type_counts = {"选择题": num_questions}
+
+    detected_topics = [t for t in COMMON_TOPICS if t in user_input]
+    for raw in re.findall(r"关于(.*?)的", user_input):
+        cleaned = re.sub(r"(简单|容易|基础|中等|困难|高级|选择题|判断题|简答题|材料\s*分析题?|题目|\s)", "", raw).strip()
+        if cleaned:
+            detected_topics.append(cleaned)
+    ordered_topics = list(dict.fromkeys(detected_topics))
+    if not ordered_topics:
+        fallback = re.sub(r'\d+道|\d+题|请|给我|出|关于|的|简单|中等|困难|选择题|判断题|简答题|材料\s*分析题?|题目', '',
+                          user_input).strip()
+        ordered_topics = [fallback if fallback else DEFAULT_TOPIC]
+
+    is_kg = any(k in user_input for k in ["知识图谱", "思维导图", "mindmap", "图谱"])
+    is_answer = any(kw in user_input for kw in ["解析", "答案", "讲解", "答案解析", "参考答案"])
+    kg_topic = user_input
+    for kw in ["知识图谱", "思维导图", "mindmap", "图谱", "生成", "制作", "构建", "画", "帮我", "请", "关于", "：", ":"]:
+        kg_topic = kg_topic.replace(kw, "")
+    kg_topic = kg_topic.strip().lstrip("，,。 、") or user_input
+    return ("; ".join(ordered_topics), num_questions, difficulty, question_type, question_type_counts,
+            is_kg, is_answer, kg_topic)
+
+
+def compiled_parse(parser, user_input):
+    parsed = parser.parse(user_input)
+    return (parsed.topic, parsed.num_questions, parsed.difficulty, parsed.question_type,
+            parsed.question_type_counts, parsed.is_kg_request, parsed.is_answer_request,
+            parser.extract_kg_topic(user_input))
+
+
+def legacy_request(user_input):
+    if any(k in user_input for k in ["知识图谱", "思维导图", "mindmap", "图谱"]):
+        return None
+    any(kw in user_input for kw in ["解析", "答案", "讲解", "答案解析", "参考答案"])
+    return legacy_parse(user_input)
+
+
+def compiled_request(parser, user_input):
+    if parser.is_kg_request(user_input):
+        return None
+    parser.is_answer_request(user_input)
+    return parser.parse(user_input)
+
+
+def _time(fn, inputs, repeat, reset=None):
+    best = float("inf")
+    for _ in range(repeat):
+        if reset is not None:
+            reset()
+        start = time.perf_counter()
+        for text in inputs:
+            fn(text)
+        best = min(best, time.perf_counter() - start)
+    return best / len(inputs) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description="输入解析微基准")
+    parser.add_argument("--random", type=int, default=10000, help="额外随机拼接的输入条数")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    inputs = REQUESTS * 200 + [
+        "".join(rng.choice(FRAGMENTS) for _ in range(rng.randint(1, 12))) for _ in range(args.random)
+    ]
+    input_parser = InputParser(COMMON_TOPICS, DEFAULT_TOPIC)
+
+    mismatches = [text for text in inputs if legacy_parse(text) != compiled_parse(input_parser, text)]
+    unique = list(dict.fromkeys(inputs[len(REQUESTS) * 200:]))
+    repeated = REQUESTS * 200
+    reset = input_parser.parse.cache_clear
+    rows = [
+        ("完整解析", _time(legacy_parse, unique, args.repeat),
+         _time(lambda text: compiled_parse(input_parser, text), unique, args.repeat, reset)),
+        ("单次请求", _time(legacy_request, unique, args.repeat),
+         _time(lambda text: compiled_request(input_parser, text), unique, args.repeat, reset)),
+        ("重复请求", _time(legacy_request, repeated, args.repeat),
+         _time(lambda text: compiled_request(input_parser, text), repeated, args.repeat, reset)),
+    ]
+
+    print("=" * 60)
+    print(f"   输入解析微基准：{len(unique)} 条不重复输入，取 {args.repeat} 次中最快")
+    print("=" * 60)
+    print(f"{'':<16}{'逐项扫描 µs':>14}{'单遍解析 µs':>14}{'加速':>8}")
+    for label, legacy_us, compiled_us in rows:
+        print(f"{label:<16}{legacy_us:>14.2f}{compiled_us:>14.2f}{legacy_us / compiled_us:>7.1f}x")
+    print(f"结果不一致：{len(mismatches)} 条" + (f"，例如 {mismatches[0]!r}" if mismatches else ""))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""
+预生成题库基准：用本地桩服务模拟 qwen 的生成延迟，按热门程度不均（Zipf 分布）的
+“主题 × 难度 × 题型”请求流、请求之间留有随机空闲间隔，对比关闭 / 开启预生成题库时
+出题请求的 P50 / P95 响应时间、题库命中率，以及后台预生成消耗的预估 token。
+
+用法：
+    python benchmarks/bench_quiz_pool.py
+    python benchmarks/bench_quiz_pool.py --requests 120 --latency 1.0 --mean-gap 1.5
+"""
+import argparse
+import json
+import os
+import random
+import re
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from stub_dashscope_server import StubConfig, point_dashscope_at, start_stub_server  # noqa: E402
+
+TOPICS = ["唯物辩证法", "认识论", "矛盾论", "历史唯物主义", "实践观", "质量互变", "社会存在", "联系"]
+DIFFICULTIES = ["简单", "中等", "困难"]
+TYPES = ["选择题", "判断题"]
+_REQUEST_RE = re.compile(r"(\d+)道.*?(选择题|判断题|简答题)")
+
+
+def make_responder(latency):
+    def respond(model, messages):
+        time.sleep(latency)
+        match = _REQUEST_RE.search(messages[-1]["content"] if messages else "")
+        count, q_type = (int(match.group(1)), match.group(2)) if match else (3, "选择题")
+        if q_type == "选择题":
+            quiz = [{"type": q_type, "stem": f"下列说法正确的是（{i}）", "options": ["甲", "乙", "丙", "丁"],
+                     "answer": "B", "explanation": "略"} for i in range(count)]
+        else:
+            quiz = [{"type": q_type, "stem": f"判断：第{i}个命题", "answer": "正确", "explanation": "略"}
+                    for i in range(count)]
+        return "```json\n" + json.dumps(quiz, ensure_ascii=False) + "\n```"
+    return respond
+
+
+def run(pool_size, requests, args):
+    os.environ["QUIZ_POOL_SIZE"] = str(pool_size)
+    os.environ["QUIZ_POOL_IDLE_SECONDS"] = str(args.idle)
+    from common_utils.base_agent import BaseAgent
+
+    agent = BaseAgent("马克思主义基本原理", "马克思主义基本原理", TOPICS, "database_agent_mayuan")
+    rng = random.Random(args.seed)
+    latencies = []
+    for text in requests:
+        time.sleep(rng.expovariate(1 / args.mean_gap))
+        start = time.perf_counter()
+        agent.process_request(text)
+        latencies.append(time.perf_counter() - start)
+    latencies.sort()
+    metrics = agent.quiz_pool.metrics() if agent.quiz_pool else {}
+    return latencies, metrics
+
+
+def main():
+    parser = argparse.ArgumentParser(description="预生成题库基准")
+    parser.add_argument("--requests", type=int, default=80)
+    parser.add_argument("--latency", type=float, default=0.8, help="桩服务每次生成的延迟（秒）")
+    parser.add_argument("--mean-gap", type=float, default=1.0, help="请求之间的平均空闲时间（秒）")
+    parser.add_argument("--idle", type=float, default=0.3, help="QUIZ_POOL_IDLE_SECONDS")
+    parser.add_argument("--pool-size", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    _, url = start_stub_server(StubConfig(latency=0.0), responder=make_responder(args.latency))
+    point_dashscope_at(url)
+    os.environ.setdefault("DASHSCOPE_API_KEY", "sk-stub")
+
+    rng = random.Random(args.seed)
+    combos = [(t, d, q) for t in TOPICS for d in DIFFICULTIES for q in TYPES]
+    rng.shuffle(combos)
+    weights = [1 / (rank + 1) for rank in range(len(combos))]
+    requests = [f"帮我出5道关于{t}的{d}{q}" for t, d, q in rng.choices(combos, weights=weights, k=args.requests)]
+
+    print("=" * 72)
+    print(f"   预生成题库基准：{args.requests} 个请求，{len(combos)} 种组合（Zipf），生成延迟 {args.latency}s")
+    print("=" * 72)
+    print(f"{'模式':<10}{'平均 s':>8}{'P50 s':>8}{'P95 s':>8}{'命中率':>8}{'预生成':>8}{'预估 token/小时':>16}")
+    for label, size in (("无题库", 0), ("预生成题库", args.pool_size)):
+        latencies, metrics = run(size, requests, args)
+        p50 = latencies[len(latencies) // 2]
+        p95 = latencies[min(len(latencies) - 1, int(0.95 * len(latencies)))]
+        mean = sum(latencies) / len(latencies)
+        print(f"{label:<10}{mean:>8.2f}{p50:>8.2f}{p95:>8.2f}{metrics.get('hit_rate', 0.0):>8.0%}"
+              f"{metrics.get('generated', 0):>8}{metrics.get('tokens_last_hour', 0):>16}")
+
+
+if __name__ == "__main__":
+    main()
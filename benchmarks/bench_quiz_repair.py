@@ -0,0 +1,78 @@
+"""
+试卷校验与定向修复基准：对一份含若干格式错误（选项不足、缺少答案、题量不足）的
+生成结果，测量本地校验耗时，并对比「整卷重新生成」与「只修复出错题目」两种方式
+发送的提示词 token 数与预计输出 token 数。
+
+用法：
+    python benchmarks/bench_quiz_repair.py
+    python benchmarks/bench_quiz_repair.py --questions 20 --broken 2 --missing 1
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from common_utils.prompts import build_question_prompt, build_quiz_repair_prompt, estimate_tokens  # noqa: E402
+from common_utils.quiz_utils import Question, validate_quiz  # noqa: E402
+
+CONTEXT = (
+    "唯物辩证法认为，矛盾是反映事物内部和事物之间对立统一关系的哲学范畴。矛盾的同一性和斗争性相互联结、"
+    "相辅相成，推动事物的变化发展。矛盾具有普遍性和特殊性，二者的关系是共性和个性、一般和个别的关系。"
+) * 6
+
+
+def _question(i: int) -> Question:
+    return Question(
+        type="选择题",
+        stem=f"关于矛盾的同一性和斗争性，下列说法正确的是（第{i}题）",
+        options=["同一性是绝对的", "斗争性是相对的", "二者相互联结、相辅相成", "二者互不相关"],
+        answer="C",
+        explanation="矛盾的同一性和斗争性相互联结、相辅相成，没有斗争性就没有同一性。",
+    )
+
+
+def _output_tokens(questions) -> int:
+    return estimate_tokens(json.dumps([q.to_dict() for q in questions], ensure_ascii=False))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="试卷校验与定向修复基准")
+    parser.add_argument("--questions", type=int, default=10, help="请求的题目数量")
+    parser.add_argument("--broken", type=int, default=1, help="格式错误的题目数量")
+    parser.add_argument("--missing", type=int, default=1, help="少生成的题目数量")
+    parser.add_argument("--repeat", type=int, default=10000)
+    args = parser.parse_args()
+
+    questions = [_question(i) for i in range(args.questions - args.missing)]
+    for q in questions[:args.broken]:
+        q.options = q.options[:3]
+    expected = {"选择题": args.questions}
+
+    start = time.perf_counter()
+    for _ in range(args.repeat):
+        validation = validate_quiz(questions, expected)
+    validate_us = (time.perf_counter() - start) / args.repeat * 1e6
+
+    full = build_question_prompt("马克思主义基本原理", expected, "矛盾", "中等", CONTEXT, "出10道关于矛盾的选择题")
+    broken = [(validation.questions[i].to_dict(), issues) for i, issues in sorted(validation.broken.items())]
+    repair = build_quiz_repair_prompt("马克思主义基本原理", "矛盾", "中等", broken, validation.missing, CONTEXT)
+    full_in, repair_in = full.token_counts()["total"], repair.token_counts()["total"]
+    full_out = _output_tokens([_question(i) for i in range(args.questions)])
+    repair_out = _output_tokens([_question(i) for i in range(args.broken + args.missing)])
+
+    print("=" * 60)
+    print(f"   试卷修复基准：{args.questions} 题，{args.broken} 题格式错误，缺 {args.missing} 题")
+    print("=" * 60)
+    print(f"本地校验：{validate_us:.1f} µs/次，发现 {len(validation.broken)} 题错误，缺 {validation.missing}")
+    print(f"{'':<14}{'输入token':>12}{'输出token':>12}{'合计':>10}")
+    print(f"{'整卷重新生成':<12}{full_in:>12}{full_out:>12}{full_in + full_out:>10}")
+    print(f"{'定向修复':<14}{repair_in:>12}{repair_out:>12}{repair_in + repair_out:>10}")
+    print(f"定向修复的 token 为整卷重试的 {(repair_in + repair_out) / (full_in + full_out):.0%}")
+
+
+if __name__ == "__main__":
+    main()
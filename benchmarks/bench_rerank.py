@@ -0,0 +1,93 @@
+"""
+检索重排序基准：对比 FAISS 直接取前 k 段与「宽召回 + 重排序」后的前 k 段，
+统计每次查询的重排序 CPU 耗时（冷 / 热缓存）、打包后提示词大小以及与主题相关的句子占比。
+
+用法：
+    python benchmarks/bench_rerank.py                          # 使用真实 DashScope 向量检索（需 DASHSCOPE_API_KEY）
+    python benchmarks/bench_rerank.py --stub                   # 使用本地桩服务（检索结果随机，仅用于离线验证）
+    python benchmarks/bench_rerank.py --candidates 100 --latency-ms 20 --k 3
+    RERANK_CROSS_ENCODER=BAAI/bge-reranker-base python benchmarks/bench_rerank.py   # 需安装 sentence-transformers
+"""
+import argparse
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+TOPICS = ["唯物辩证法", "实践与认识", "矛盾的同一性和斗争性", "物质和意识", "剩余价值", "社会存在与社会意识", "商品的二因素"]
+
+
+def _relevance(docs, topic):
+    """与主题有字符二元组重合的句子所占比例。"""
+    from common_utils.context_packer import _normalize, _split_sentences, char_bigrams
+
+    topic_grams = char_bigrams(topic)
+    sentences = [s for d in docs for s in _split_sentences(_normalize(d))]
+    if not sentences:
+        return 0.0
+    return sum(1 for s in sentences if char_bigrams(s) & topic_grams) / len(sentences)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="检索重排序基准")
+    parser.add_argument("--stub", action="store_true", help="使用本地桩服务代替 DashScope")
+    parser.add_argument("--k", type=int, default=3, help="最终保留的片段数")
+    parser.add_argument("--candidates", type=int, default=50, help="FAISS 召回的候选数")
+    parser.add_argument("--latency-ms", type=float, default=50.0, help="每次重排序的延迟预算（毫秒）")
+    parser.add_argument("--budget", type=int, default=1000, help="打包的 token 预算")
+    args = parser.parse_args()
+
+    if args.stub:
+        from stub_dashscope_server import point_dashscope_at, start_stub_server
+
+        _, url = start_stub_server()
+        point_dashscope_at(url)
+        os.environ.setdefault("DASHSCOPE_API_KEY", "sk-stub")
+
+    from common_utils.context_packer import ContextPacker
+    from common_utils.prompts import estimate_tokens
+    from common_utils.reranker import Reranker
+    from common_utils.vector_utils import load_vectorstore
+
+    vectorstore = load_vectorstore("database_agent_mayuan")
+    reranker = Reranker(
+        candidate_k=args.candidates,
+        latency_budget_ms=args.latency_ms,
+        cross_encoder=os.environ.get("RERANK_CROSS_ENCODER") or None,
+    )
+    packer = ContextPacker(token_budget=args.budget)
+
+    print("=" * 86)
+    print(f"   重排序基准：{args.candidates} 候选 → k={args.k}，打分器 {reranker.scorer_name}，预算 {args.latency_ms}ms")
+    print("=" * 86)
+    print(f"{'主题':<14}{'FAISS tok':>10}{'重排 tok':>10}{'FAISS 相关':>11}{'重排 相关':>11}{'冷ms':>8}{'热ms':>8}")
+    totals = [0, 0]
+    for topic in TOPICS:
+        query = f"{topic} 马克思主义基本原理"
+        candidates = vectorstore.similarity_search_with_score(query, k=max(args.k, args.candidates))
+        baseline = [doc.page_content for doc, _ in candidates[:args.k]]
+
+        start = time.perf_counter()
+        reranked = [doc.page_content for doc in reranker.rerank(topic, candidates, args.k)]
+        cold = (time.perf_counter() - start) * 1000
+        start = time.perf_counter()
+        reranker.rerank(topic, candidates, args.k)
+        warm = (time.perf_counter() - start) * 1000
+
+        base_tokens = estimate_tokens(packer.pack(baseline, topic))
+        rerank_tokens = estimate_tokens(packer.pack(reranked, topic))
+        totals[0] += base_tokens
+        totals[1] += rerank_tokens
+        print(
+            f"{topic:<14}{base_tokens:>10}{rerank_tokens:>10}{_relevance(baseline, topic):>11.0%}"
+            f"{_relevance(reranked, topic):>11.0%}{cold:>8.2f}{warm:>8.2f}"
+        )
+    print(f"{'合计':<14}{totals[0]:>10}{totals[1]:>10}")
+    print(f"重排序统计: {reranker.metrics()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+"""
+DashScope 调用韧性基准：在注入故障与长尾延迟的本地桩服务上，
+对比「不重试」「重试 + 退避」「重试 + 对冲请求」三种策略的成功率与延迟分布。
+
+用法：
+    python benchmarks/bench_resilience.py
+    python benchmarks/bench_resilience.py --requests 400 --concurrency 16 --error-rate 0.15 --slow-rate 0.05
+
+桩服务在进程内启动（见 stub_dashscope_server.py），不会访问真实的 DashScope。
+"""
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from stub_dashscope_server import StubConfig, point_dashscope_at, start_stub_server  # noqa: E402
+
+STRATEGIES = {
+    "no-retry": dict(max_attempts=1, hedge=False),
+    "retry": dict(max_attempts=4, hedge=False),
+    "retry+hedge": dict(max_attempts=4, hedge=True),
+}
+
+
+def _percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))] if ordered else float("nan")
+
+
+def run_strategy(name, policy_kwargs, args):
+    from langchain_core.messages import HumanMessage
+
+    from common_utils.llm_wrapper import CustomChatDashScope, RetryPolicy, call_metrics
+
+    # 每种策略使用独立的模型名，限流器与统计互不干扰
+    model = f"bench-{name.replace('+', '-')}"
+    env_key = model.upper().replace("-", "_")
+    os.environ[f"DASHSCOPE_QPS_{env_key}"] = "1000"
+    os.environ[f"DASHSCOPE_CONCURRENCY_{env_key}"] = str(args.concurrency * 2)
+
+    policy = RetryPolicy(base_delay=args.base_delay, deadline=args.deadline, **policy_kwargs)
+    llm = CustomChatDashScope(model=model, retry_policy=policy)
+
+    def one(i):
+        start = time.perf_counter()
+        try:
+            llm.invoke([HumanMessage(content=f"请求 {i}")])
+            ok = True
+        except Exception:
+            ok = False
+        return ok, time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        results = list(pool.map(one, range(args.requests)))
+    wall = time.perf_counter() - start
+
+    latencies = [seconds for ok, seconds in results if ok]
+    stats = call_metrics().get(model, {})
+    return {
+        "strategy": name,
+        "success": sum(ok for ok, _ in results) / len(results),
+        "p50": _percentile(latencies, 0.5),
+        "p95": _percentile(latencies, 0.95),
+        "p99": _percentile(latencies, 0.99),
+        "max": max(latencies) if latencies else float("nan"),
+        "retries": stats.get("retries", 0),
+        "hedges": stats.get("hedges", 0),
+        "hedge_wins": stats.get("hedge_wins", 0),
+        "wall": wall,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="DashScope 调用韧性基准（本地桩服务）")
+    parser.add_argument("--requests", type=int, default=300)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--latency", type=float, default=0.1, help="桩服务基础延迟（秒）")
+    parser.add_argument("--jitter", type=float, default=0.03)
+    parser.add_argument("--slow-rate", type=float, default=0.05, help="长尾请求比例")
+    parser.add_argument("--slow-latency", type=float, default=2.0, help="长尾请求延迟（秒）")
+    parser.add_argument("--error-rate", type=float, default=0.1, help="HTTP 500 比例")
+    parser.add_argument("--throttle-rate", type=float, default=0.05, help="HTTP 429 比例")
+    parser.add_argument("--base-delay", type=float, default=0.1, help="重试退避基数（秒）")
+    parser.add_argument("--deadline", type=float, default=10.0, help="单次调用截止时间（秒）")
+    args = parser.parse_args()
+
+    config = StubConfig(
+        latency=args.latency,
+        jitter=args.jitter,
+        slow_rate=args.slow_rate,
+        slow_latency=args.slow_latency,
+        error_rate=args.error_rate,
+        throttle_rate=args.throttle_rate,
+    )
+    server, url = start_stub_server(config)
+    point_dashscope_at(url)
+
+    print("=" * 78)
+    print(f"   韧性基准：{args.requests} 请求 × 并发 {args.concurrency}，桩服务 {url}")
+    print(f"   注入：500={args.error_rate:.0%} 429={args.throttle_rate:.0%} 长尾={args.slow_rate:.0%}@{args.slow_latency}s")
+    print("=" * 78)
+    print(f"{'策略':<12}{'成功率':>8}{'p50':>8}{'p95':>8}{'p99':>8}{'max':>8}{'重试':>7}{'对冲':>7}{'对冲胜':>7}{'总耗时':>8}")
+    for name, policy_kwargs in STRATEGIES.items():
+        row = run_strategy(name, policy_kwargs, args)
+        print(
+            f"{row['strategy']:<12}{row['success']:>8.1%}{row['p50']:>8.3f}{row['p95']:>8.3f}"
+            f"{row['p99']:>8.3f}{row['max']:>8.3f}{row['retries']:>7}{row['hedges']:>7}"
+            f"{row['hedge_wins']:>7}{row['wall']:>8.2f}"
+        )
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
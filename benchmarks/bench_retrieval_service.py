@@ -0,0 +1,93 @@
+"""
+多学科检索服务基准：把同一个向量库复制成 N 个学科命名空间，在内存上限下轮流检索，
+统计已加载的内存、卸载次数、冷 / 热检索延迟，以及经本地 socket 访问时的额外开销。
+
+用法：
+    python benchmarks/bench_retrieval_service.py --stub                      # 本地桩服务提供 embedding
+    python benchmarks/bench_retrieval_service.py --stub --subjects 10 --memory-mb 1
+    python benchmarks/bench_retrieval_service.py --stub --socket             # 额外测量 socket 客户端
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+TOPICS = ["唯物辩证法", "实践与认识", "剩余价值", "物质和意识"]
+
+
+def _run(label, retriever, namespaces, rounds):
+    cold, warm = [], []
+    seen = set()
+    for _ in range(rounds):
+        for namespace in namespaces:
+            for topic in TOPICS:
+                start = time.perf_counter()
+                docs = retriever.search(namespace, f"{topic} 马克思主义基本原理", 3, focus=topic)
+                elapsed = (time.perf_counter() - start) * 1000
+                (warm if (namespace, topic) in seen else cold).append(elapsed)
+                seen.add((namespace, topic))
+                assert all(doc.id.startswith(f"{namespace}:") for doc in docs), docs
+    median = lambda values: sorted(values)[len(values) // 2] if values else float("nan")  # noqa: E731
+    print(f"{label:<12}{len(cold) + len(warm):>8}{median(cold):>10.2f}{median(warm):>10.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="多学科检索服务基准")
+    parser.add_argument("--stub", action="store_true", help="使用本地桩服务代替 DashScope")
+    parser.add_argument("--subjects", type=int, default=10, help="模拟的学科数量")
+    parser.add_argument("--memory-mb", type=float, default=1.0, help="已加载索引的内存上限（MB）")
+    parser.add_argument("--rounds", type=int, default=2)
+    parser.add_argument("--socket", action="store_true", help="同时测量经 socket 访问的客户端")
+    args = parser.parse_args()
+
+    if args.stub:
+        from stub_dashscope_server import point_dashscope_at, start_stub_server
+
+        _, url = start_stub_server()
+        point_dashscope_at(url)
+        os.environ.setdefault("DASHSCOPE_API_KEY", "sk-stub")
+
+    from common_utils.retrieval_service import RetrievalClient, RetrievalService, serve
+
+    source = os.path.join(ROOT, "database_agent_mayuan")
+    workdir = tempfile.mkdtemp(prefix="retrieval-bench-")
+    paths = []
+    for i in range(args.subjects):
+        path = os.path.join(workdir, f"subject{i:02d}")
+        shutil.copytree(source, path)
+        paths.append(path)
+
+    service = RetrievalService(memory_cap_mb=args.memory_mb)
+    namespaces = [service.register(path) for path in paths]
+
+    print("=" * 60)
+    print(f"   检索服务基准：{args.subjects} 个学科，内存上限 {args.memory_mb} MB")
+    print("=" * 60)
+    print(f"{'后端':<12}{'检索数':>8}{'冷ms':>10}{'热ms':>10}")
+    _run("in-process", service, namespaces, args.rounds)
+
+    if args.socket:
+        address = f"unix:{os.path.join(workdir, 'retrieval.sock')}" if hasattr(os, "fork") else "127.0.0.1:0"
+        server = serve(service, address)
+        if address.endswith(":0"):
+            address = "%s:%d" % server.server_address
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        client = RetrievalClient(address)
+        _run("socket", client, [client.register(path) for path in paths], args.rounds)
+        server.shutdown()
+
+    metrics = service.metrics()
+    loaded = [ns for ns, m in metrics["namespaces"].items() if m["loaded"]]
+    print(f"已加载 {len(loaded)}/{args.subjects} 个学科，共 {metrics['loaded_mb']} MB，卸载 {metrics['evictions']} 次")
+    shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""
+启动耗时基准：测量 ``import app`` 的冷启动时间与导入耗时分布。
+
+用法：
+    python benchmarks/bench_startup.py            # 仅测量 import app
+    python benchmarks/bench_startup.py --first-use  # 额外测量首次构造各 Agent 的耗时
+    python benchmarks/bench_startup.py --top 30     # 显示最耗时的 30 个模块
+
+导入耗时基于 ``python -X importtime``，每次都在全新的子进程中运行，
+因此结果反映的是 worker / 自动扩容实例真实的冷启动开销。
+"""
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+_FIRST_USE_SNIPPET = """
+import time
+t0 = time.perf_counter()
+import app
+t1 = time.perf_counter()
+print(f"IMPORT {t1 - t0:.4f}")
+for loader in app.ALL_AGENTS:
+    t = time.perf_counter()
+    loader.get()
+    print(f"AGENT {loader.name} {time.perf_counter() - t:.4f}")
+"""
+
+
+def _run(code: str, importtime: bool = False) -> subprocess.CompletedProcess:
+    cmd = [sys.executable]
+    if importtime:
+        cmd += ["-X", "importtime"]
+    cmd += ["-c", code]
+    return subprocess.run(cmd, cwd=ROOT, capture_output=True, text=True)
+
+
+def parse_importtime(stderr: str):
+    """解析 ``-X importtime`` 输出，返回 [(累计微秒, 模块名)] 列表。"""
+    rows = []
+    for line in stderr.splitlines():
+        # 格式：import time:  self [us] | cumulative | imported package
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        fields = line[len("import time:"):].split("|")
+        if len(fields) != 3:
+            continue
+        try:
+            rows.append((int(fields[1]), fields[2].rstrip()[1:]))
+        except ValueError:
+            continue
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="app.py 冷启动基准")
+    parser.add_argument("--repeat", type=int, default=3, help="重复测量 import app 的次数")
+    parser.add_argument("--top", type=int, default=15, help="显示累计耗时最高的模块数")
+    parser.add_argument("--first-use", action="store_true", help="同时测量首次构造 Agent 的耗时")
+    args = parser.parse_args()
+
+    print("=" * 60)
+    print("   app.py 冷启动基准")
+    print("=" * 60)
+
+    wall_times = []
+    for _ in range(args.repeat):
+        start = time.perf_counter()
+        result = _run("import app")
+        wall_times.append(time.perf_counter() - start)
+        if result.returncode != 0:
+            print(result.stderr)
+            sys.exit(result.returncode)
+    print(f"import app（含解释器启动）: 最小 {min(wall_times):.3f}s / 平均 {sum(wall_times) / len(wall_times):.3f}s")
+
+    profile = _run("import app", importtime=True)
+    rows = parse_importtime(profile.stderr)
+    print(f"\n累计导入耗时最高的 {args.top} 个模块:")
+    for cumulative_us, name in sorted(rows, reverse=True)[: args.top]:
+        print(f"  {cumulative_us / 1000:9.1f} ms  {name.strip()}")
+
+    if args.first_use:
+        print("\n首次使用耗时:")
+        result = _run(_FIRST_USE_SNIPPET)
+        for line in result.stdout.splitlines():
+            if line.startswith("IMPORT "):
+                print(f"  import app: {float(line.split()[1]):.3f}s")
+            elif line.startswith("AGENT "):
+                _, name, seconds = line.split()
+                print(f"  {name}: {float(seconds):.3f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+"""
+并发重入压力测试：多线程同时进行多场苏格拉底对话（文字轮次与带图片的轮次交替）
+和多名学生的出题 / 索要答案请求，检查各请求之间是否串话。
+
+每场对话使用不同的人物与带编号的主题，每条消息带有会话与轮次标记；桩服务在回复中
+回显系统提示词里出现的人物 / 主题以及消息中出现的全部会话标记。任何一个回复若出现
+其他会话的人物、主题或消息，或会话历史的轮数不对，即判为串话。出题请求同样带有
+学生标记，索要答案时返回的必须是该学生自己的题目。
+
+同一组请求先用 1 个线程、再用 --threads 个线程执行，对比吞吐量。
+
+用法：
+    python benchmarks/stress_reentrancy.py
+    python benchmarks/stress_reentrancy.py --sessions 24 --turns 4 --threads 32 --latency 0.2
+"""
+import argparse
+import base64
+import os
+import re
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from stub_dashscope_server import StubConfig, point_dashscope_at, start_stub_server  # noqa: E402
+
+CHARACTERS = ["恩格斯", "列宁", "黑格尔", "费尔巴哈", "普列汉诺夫", "卢卡奇"]
+_TOPIC_RE = re.compile(r"议题#\d+")
+_SESSION_RE = re.compile(r"会话S\d+")
+_STUDENT_RE = re.compile(r"学生Q\d+")
+_OPENING_RE = re.compile(r"我想和(\S+?)讨论(议题#\d+)")
+_PERSONA_RE = re.compile(r"扮演\s*([^\s，,]+)")  # 只看人物设定，参考资料中出现的人名不算
+
+
+def _text(message) -> str:
+    content = message.get("content")
+    if isinstance(content, list):
+        return " ".join(part.get("text", "") for part in content if isinstance(part, dict))
+    return str(content)
+
+
+def make_responder(latency):
+    def respond(model, messages):
+        time.sleep(latency)
+        system = " ".join(_text(m) for m in messages if m.get("role") == "system")
+        last_user = next((_text(m) for m in reversed(messages) if m.get("role") == "user"), "")
+        if "意图识别" in system:
+            match = _OPENING_RE.search(last_user)
+            return '{"topic": "%s", "character": "%s"}' % (match.group(2), match.group(1)) if match else "{}"
+        students = sorted(set(_STUDENT_RE.findall(" ".join(_text(m) for m in messages))))
+        if students:
+            return f"1. 题目（{'、'.join(students)}）\n答案：A\n解析：略"
+        characters = sorted(set(c for c in _PERSONA_RE.findall(system) if c in CHARACTERS))
+        topics = sorted(set(_TOPIC_RE.findall(system)))
+        sessions = sorted(set(_SESSION_RE.findall(" ".join(_text(m) for m in messages))))
+        return f"人物={'、'.join(characters)} 主题={'、'.join(topics)} 会话={'、'.join(sessions)}"
+    return respond
+
+
+def _image_data_url() -> str:
+    from PIL import Image
+
+    buffer = BytesIO()
+    Image.new("RGB", (32, 32), (200, 30, 30)).save(buffer, format="PNG")
+    return "data:image/png;base64," + base64.b64encode(buffer.getvalue()).decode()
+
+
+def run_dialogue(appmod, index, turns, image):
+    """一场完整的对话；返回发现的问题列表。"""
+    client = appmod.app.test_client()
+    character, topic, tag = CHARACTERS[index % len(CHARACTERS)], f"议题#{index}", f"会话S{index}"
+    expected = f"人物={character} 主题={topic} 会话={tag}"
+    problems = []
+    reply = client.post("/start_dialogue", json={"message": f"我想和{character}讨论{topic}（{tag}-T0）"}).get_json()
+    if reply.get("response") != expected:
+        problems.append(f"{tag} 第 0 轮：{reply.get('response') or reply.get('error')}")
+    session_id = reply.get("session_id")
+    for turn in range(1, turns):
+        payload = {"session_id": session_id, "message": f"请继续（{tag}-T{turn}）"}
+        if turn % 2 == 0:
+            payload["image"] = image
+        reply = client.post("/continue_dialogue", json=payload).get_json()
+        if reply.get("response") != expected:
+            problems.append(f"{tag} 第 {turn} 轮：{reply.get('response') or reply.get('error')}")
+        if reply.get("turn_count") != turn + 1:
+            problems.append(f"{tag} 第 {turn} 轮：turn_count={reply.get('turn_count')}")
+    with appmod.dialogue_sessions_lock:
+        history = appmod.dialogue_sessions.get(session_id, {}).get("conversation_history", [])
+    if len(history) != 2 * turns:
+        problems.append(f"{tag} 历史消息数 {len(history)}，应为 {2 * turns}")
+    client.post("/end_dialogue", json={"session_id": session_id})
+    return problems
+
+
+def run_quiz(appmod, index):
+    """一名学生出题后索要答案；返回发现的问题列表。"""
+    client = appmod.app.test_client()
+    tag = f"学生Q{index}"
+    session_id = f"stress-{index}-{time.monotonic_ns()}"
+    client.post("/chat", json={"message": f"帮我出1道关于唯物辩证法的选择题（{tag}）", "session_id": session_id})
+    answers = client.post("/chat", json={"message": "请给出答案和解析", "session_id": session_id}).get_json()
+    found = _STUDENT_RE.findall(answers.get("response", ""))
+    return [] if found == [tag] else [f"{tag} 拿到的答案：{answers.get('response', '')[:60]}"]
+
+
+def run_all(appmod, args, threads, image):
+    jobs = [("dialogue", i) for i in range(args.sessions)] + [("quiz", i) for i in range(args.students)]
+    start = time.perf_counter()
+    def run_job(job):
+        kind, index = job
+        return run_dialogue(appmod, index, args.turns, image) if kind == "dialogue" else run_quiz(appmod, index)
+
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        results = list(pool.map(run_job, jobs))
+    elapsed = time.perf_counter() - start
+    requests = args.sessions * (args.turns + 1) + args.students * 2
+    return [p for problems in results for p in problems], requests, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="并发重入压力测试")
+    parser.add_argument("--sessions", type=int, default=16, help="并发对话场数")
+    parser.add_argument("--turns", type=int, default=4, help="每场对话的轮数（偶数轮带图片）")
+    parser.add_argument("--students", type=int, default=16, help="并发出题的学生数")
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--latency", type=float, default=0.1, help="桩服务每次调用的延迟（秒）")
+    args = parser.parse_args()
+
+    _, url = start_stub_server(StubConfig(latency=0.0), responder=make_responder(args.latency))
+    point_dashscope_at(url)
+    os.environ.setdefault("DASHSCOPE_API_KEY", "sk-stub")
+    os.environ["QUIZ_POOL_SIZE"] = "0"
+    os.environ["JOB_QUEUE_PATH"] = os.path.join(tempfile.mkdtemp(), "stress_jobs.sqlite3")
+
+    import app as appmod
+
+    image = _image_data_url()
+    print("=" * 72)
+    print(f"   并发重入压力测试：{args.sessions} 场对话 × {args.turns} 轮，{args.students} 名学生出题")
+    print("=" * 72)
+    failed = False
+    for threads in (1, args.threads):
+        problems, requests, elapsed = run_all(appmod, args, threads, image)
+        failed = failed or bool(problems)
+        print(f"{threads:>3} 线程：{requests} 个请求，用时 {elapsed:.2f}s，吞吐 {requests / elapsed:.1f} 请求/秒，"
+              f"串话 / 错误 {len(problems)} 处")
+        for problem in problems[:10]:
+            print(f"    {problem}")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,222 @@
+"""
+本地 DashScope 桩服务：模拟对话 / 多模态 / 向量接口，并可注入故障与延迟。
+
+用法：
+    python benchmarks/stub_dashscope_server.py --port 8089 --error-rate 0.1 --throttle-rate 0.05 \\
+        --latency 0.2 --slow-rate 0.05 --slow-latency 3
+    DASHSCOPE_HTTP_BASE_URL=http://127.0.0.1:8089/api/v1 python app.py
+
+在基准脚本中也可以直接在进程内启动::
+
+    from stub_dashscope_server import StubConfig, start_stub_server, point_dashscope_at
+    server, url = start_stub_server(StubConfig(error_rate=0.1))
+    point_dashscope_at(url)
+
+故障注入：
+- ``error_rate``：返回 HTTP 500 ``InternalError``（可重试）
+- ``throttle_rate``：返回 HTTP 429 ``Throttling.RateQuota``（可重试）
+- ``bad_request_rate``：返回 HTTP 400 ``InvalidParameter``（不可重试）
+- ``latency`` ± ``jitter``：每个请求的基础延迟；``slow_rate`` 比例的请求改用 ``slow_latency``（长尾）
+- ``max_concurrency``：同时处理的请求超过该值时返回 429，模拟服务端并发额度
+"""
+import argparse
+import hashlib
+import json
+import random
+import threading
+import time
+import uuid
+from dataclasses import asdict, dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Optional, Tuple
+
+GENERATION_PATH = "/api/v1/services/aigc/text-generation/generation"
+MULTIMODAL_PATH = "/api/v1/services/aigc/multimodal-generation/generation"
+EMBEDDING_PATH = "/api/v1/services/embeddings/text-embedding/text-embedding"
+
+
+@dataclass
+class StubConfig:
+    latency: float = 0.05
+    jitter: float = 0.0
+    slow_rate: float = 0.0
+    slow_latency: float = 2.0
+    error_rate: float = 0.0
+    throttle_rate: float = 0.0
+    bad_request_rate: float = 0.0
+    max_concurrency: int = 0
+    embedding_dim: int = 1536
+
+
+def _last_user_text(messages) -> str:
+    for message in reversed(messages or []):
+        if message.get("role") != "user":
+            continue
+        content = message.get("content")
+        if isinstance(content, list):
+            return " ".join(part.get("text", "") for part in content if isinstance(part, dict))
+        return str(content)
+    return ""
+
+
+def default_responder(model: str, messages) -> str:
+    """默认回复：回显最后一条用户消息的开头。"""
+    return f"[stub:{model}] {_last_user_text(messages)[:80]}"
+
+
+def _fake_embedding(text: str, dim: int):
+    seed = int.from_bytes(hashlib.md5(text.encode("utf-8")).digest()[:8], "little")
+    rng = random.Random(seed)
+    return [rng.uniform(-1, 1) for _ in range(dim)]
+
+
+class StubState:
+    """桩服务的共享状态：配置、并发计数与请求统计。"""
+
+    def __init__(self, config: StubConfig, responder: Callable[[str, list], str] = default_responder):
+        self.config = config
+        self.responder = responder
+        self._lock = threading.Lock()
+        self.inflight = 0
+        self.counts = {"requests": 0, "ok": 0, "error": 0, "throttled": 0, "bad_request": 0, "slow": 0}
+
+    def count(self, key: str) -> None:
+        with self._lock:
+            self.counts[key] += 1
+
+    def enter(self) -> bool:
+        with self._lock:
+            self.counts["requests"] += 1
+            self.inflight += 1
+            limit = self.config.max_concurrency
+            return not limit or self.inflight <= limit
+
+    def leave(self) -> None:
+        with self._lock:
+            self.inflight -= 1
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    state: StubState = None  # 由 start_stub_server 绑定
+
+    def log_message(self, format, *args):  # noqa: A002 - 覆盖基类签名
+        pass
+
+    def _reply(self, status: int, payload: dict) -> None:
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _error(self, status: int, code: str, message: str) -> None:
+        self._reply(status, {"code": code, "message": message, "request_id": uuid.uuid4().hex})
+
+    def do_POST(self):  # noqa: N802 - http.server 约定
+        length = int(self.headers.get("Content-Length") or 0)
+        request = json.loads(self.rfile.read(length) or b"{}")
+        state, config = self.state, self.state.config
+
+        within_quota = state.enter()
+        try:
+            delay = config.latency + random.uniform(-config.jitter, config.jitter)
+            if random.random() < config.slow_rate:
+                state.count("slow")
+                delay = config.slow_latency
+            time.sleep(max(0.0, delay))
+
+            roll = random.random()
+            if not within_quota or roll < config.throttle_rate:
+                state.count("throttled")
+                return self._error(429, "Throttling.RateQuota", "Requests rate limit exceeded, please try again later.")
+            roll -= config.throttle_rate
+            if roll < config.error_rate:
+                state.count("error")
+                return self._error(500, "InternalError", "Injected internal error.")
+            roll -= config.error_rate
+            if roll < config.bad_request_rate:
+                state.count("bad_request")
+                return self._error(400, "InvalidParameter", "Injected invalid parameter.")
+
+            payload = self._handle(request)
+            if payload is None:
+                return self._error(404, "NotFound", f"Unknown path {self.path}")
+            state.count("ok")
+            return self._reply(200, payload)
+        finally:
+            state.leave()
+
+    def _handle(self, request: dict) -> Optional[dict]:
+        model = request.get("model", "")
+        data = request.get("input", {})
+        request_id = uuid.uuid4().hex
+        if self.path.startswith(EMBEDDING_PATH):
+            texts = data.get("texts") or []
+            embeddings = [
+                {"text_index": i, "embedding": _fake_embedding(text, self.state.config.embedding_dim)}
+                for i, text in enumerate(texts)
+            ]
+            return {"output": {"embeddings": embeddings}, "usage": {"total_tokens": len(texts)}, "request_id": request_id}
+
+        if self.path.startswith(GENERATION_PATH) or self.path.startswith(MULTIMODAL_PATH):
+            messages = data.get("messages") or []
+            text = self.state.responder(model, messages)
+            content = [{"text": text}] if self.path.startswith(MULTIMODAL_PATH) else text
+            return {
+                "output": {"choices": [{"finish_reason": "stop", "message": {"role": "assistant", "content": content}}]},
+                "usage": {"input_tokens": 1, "output_tokens": len(text), "total_tokens": len(text) + 1},
+                "request_id": request_id,
+            }
+        return None
+
+
+def start_stub_server(
+    config: Optional[StubConfig] = None,
+    host: str = "127.0.0.1",
+    port: int = 0,
+    responder: Callable[[str, list], str] = default_responder,
+) -> Tuple[ThreadingHTTPServer, str]:
+    """在后台线程启动桩服务，返回 (server, base_url)。``server.state`` 可用于读取统计或修改配置。"""
+    state = StubState(config or StubConfig(), responder)
+    handler = type("StubHandler", (_Handler,), {"state": state})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    server.state = state
+    threading.Thread(target=server.serve_forever, name="stub-dashscope", daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}/api/v1"
+
+
+def point_dashscope_at(base_url: str, api_key: str = "sk-stub") -> None:
+    """让当前进程中的 DashScope SDK 调用指向桩服务。"""
+    import dashscope
+
+    dashscope.base_http_api_url = base_url
+    if not dashscope.api_key:
+        dashscope.api_key = api_key
+
+
+def main():
+    defaults = StubConfig()
+    parser = argparse.ArgumentParser(description="本地 DashScope 桩服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    for field, value in asdict(defaults).items():
+        parser.add_argument(f"--{field.replace('_', '-')}", type=type(value), default=value)
+    args = parser.parse_args()
+
+    config = StubConfig(**{field: getattr(args, field) for field in asdict(defaults)})
+    server, url = start_stub_server(config, host=args.host, port=args.port)
+    print(f"DashScope stub listening on {url}")
+    print(f"  export DASHSCOPE_HTTP_BASE_URL={url}")
+    try:
+        while True:
+            time.sleep(10)
+            print(f"  stats: {server.state.counts}")
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,29 @@
-from .llm_wrapper import CustomChatDashScope
-from .vector_utils import load_embeddings, load_vectorstore
+from importlib import import_module
+
+from .lazy_loader import LazyAgent, warm_up_all
+
+# Heavy re-exports (DashScope / LangChain / FAISS) are resolved lazily so that
+# importing a light helper such as ``common_utils.lazy_loader`` does not pull
+# the whole model stack into the process.
+_LAZY_EXPORTS = {
+    "CustomChatDashScope": ".llm_wrapper",
+    "load_embeddings": ".vector_utils",
+    "load_vectorstore": ".vector_utils",
+}
 
 __all__ = [
     "CustomChatDashScope",
+    "LazyAgent",
     "load_embeddings",
     "load_vectorstore",
-] 
\ No newline at end of file
+    "warm_up_all",
+]
+
+
+def __getattr__(name):
+    module_name = _LAZY_EXPORTS.get(name)
+    if module_name is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(import_module(module_name, __name__), name)
+    globals()[name] = value
+    return value
@@ -10,26 +10,59 @@ To create a new agent (e.g., for Mao's Thoughts), you would:
    - subject_name: The name of the course (e.g., "毛概").
    - default_topic: A fallback topic if none is detected.
    - common_topics: A list of keywords to identify topics.
-   - vectorstore_path: The path to the specialized vector database.
+   - vectorstore_path: The path to the specialized vector database (registered
+     with the shared retrieval service under its folder name).
 3. The core logic for processing requests is inherited and reused.
 """
 import os
 import re
-from typing import Dict, List, TypedDict, Optional
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import nullcontext
+from typing import Callable, Dict, Iterable, Iterator, List, Tuple, TypedDict, Optional, Union
 
-from langchain_community.vectorstores import FAISS
-from langchain_dashscope.embeddings import DashScopeEmbeddings
+from langchain_core.documents import Document
 from langgraph.graph import StateGraph, END
 from langgraph.pregel import Pregel
-from langchain_core.messages import HumanMessage, SystemMessage
 
+from .chunk_store import unique_documents
+from .context_packer import ContextPacker
+from .image_caption import ImageCaption
+from .input_parser import InputParser
 from .llm_wrapper import CustomChatDashScope
+from .model_router import ModelRouter
+from .quiz_pool import PoolKey, QuizPool, charge_tokens, current_meter, use_meter
+from .retrieval_service import get_retriever
+from .singleflight import SingleFlight
 from .prompts import (
-    SINGLE_TYPE_PROMPT_TEMPLATE,
     QUESTION_TYPE_CONFIG,
-    MIXED_TYPE_PROMPT_TEMPLATE,
-    DIFFICULTY_ADDENDUM_HARD,
+    FANOUT_BATCH_REQUEST_TEMPLATE,
+    BATCH_PAPER_VARIANT_TEMPLATE,
+    BATCH_REPLACEMENT_REQUEST_TEMPLATE,
+    POOL_REQUEST_TEMPLATE,
+    PROMPT_TOKEN_STATS,
+    AssembledPrompt,
+    estimate_tokens,
+    build_question_prompt,
+    build_quiz_repair_prompt,
 )
+from .quiz_utils import (
+    QUIZ_VALIDATION_STATS,
+    Question,
+    QuestionDeduplicator,
+    QuizRecord,
+    merge_question_batches,
+    parse_structured_questions,
+    render_questions,
+    splice_repairs,
+    validate_quiz,
+)
+
+# 出题请求中除参数关键词外的常见措辞；剩余文字超过 _POOL_MAX_EXTRA_CHARS 的请求带有额外要求，不走预生成题库
+_POOL_FILLER_RE = re.compile(r"[\s\d，。,.!！?？、：:“”\"'（）()]|请|帮我|给我|帮|出|来|生成|一下|一些|几|道|个|份|套|关于|有关|的|题目|题|吧|呢|和|一份")
+_POOL_MAX_EXTRA_CHARS = 2
+_POOL_MAX_QUESTIONS = 10
 
 class GraphState(TypedDict):
     """Defines the state structure for the LangGraph workflow."""
@@ -42,9 +75,30 @@ class GraphState(TypedDict):
     question_type_counts: Dict[str, int]
     retrieved_docs: List[str]
     generated_questions: str
+    structured_questions: List[Question]
+    image_caption: Optional[ImageCaption]  # 随请求上传的图片的结构化描述
     error_message: Optional[str]
 
 
+class _StartRateLimiter:
+    """Spaces out call start times to at most ``per_minute`` starts per minute."""
+
+    def __init__(self, per_minute: Optional[float]):
+        self._interval = 60.0 / per_minute if per_minute else 0.0
+        self._next_start = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self) -> None:
+        if not self._interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            start_at = max(now, self._next_start)
+            self._next_start = start_at + self._interval
+        if start_at > now:
+            time.sleep(start_at - now)
+
+
 class BaseAgent:
     """A base class for creating intelligent question-generation agents."""
 
@@ -56,6 +110,11 @@ class BaseAgent:
         vectorstore_path: str,
         llm_model: str = "qwen-max",
         embedding_model: str = "text-embedding-v2",
+        enable_fanout: bool = True,
+        fanout_chunk_size: int = 5,
+        max_parallel_generations: int = 8,
+        context_token_budget: int = 1000,
+        max_quiz_repairs: int = 1,
     ):
         """
         Initializes the agent with subject-specific configurations.
@@ -67,34 +126,54 @@ class BaseAgent:
             vectorstore_path: Path to the local FAISS vector store.
             llm_model: The LLM model to use for generation.
             embedding_model: The embedding model to use for retrieval.
+            enable_fanout: Split mixed or large quizzes into parallel
+                single-type LLM calls and merge the results.
+            fanout_chunk_size: Maximum number of questions per parallel call.
+            max_parallel_generations: Upper bound on concurrent LLM calls
+                for a single fan-out request.
+            context_token_budget: Estimated token budget for the retrieved
+                reference material in each generation prompt.
+            max_quiz_repairs: Maximum number of targeted repair calls for
+                questions that fail local validation (0 disables repairs).
         """
         self.subject_name = subject_name
         self.default_topic = default_topic
         self.common_topics = common_topics
         self.vectorstore_path = vectorstore_path
+        self.embedding_model = embedding_model
+        self.enable_fanout = enable_fanout
+        self.fanout_chunk_size = max(1, fanout_chunk_size)
+        self.max_parallel_generations = max(1, max_parallel_generations)
+        self.context_packer = ContextPacker(token_budget=context_token_budget)
+        self.max_quiz_repairs = max(0, max_quiz_repairs)
+        # 主题、题型、难度等关键词合并为一张表，每个请求只扫描一遍
+        self.input_parser = InputParser(common_topics, default_topic)
         
         if not os.environ.get("DASHSCOPE_API_KEY"):
             raise ValueError("DASHSCOPE_API_KEY environment variable not set.")
 
         try:
-            self.embeddings = DashScopeEmbeddings(model=embedding_model)
             self.llm = CustomChatDashScope(model=llm_model, temperature=0.7)
-            print(f"[{self.subject_name}] LLM and Embedding models initialized successfully.")
+            # 简单难度的选择题先交给更快的模型，未通过校验再升级到 llm_model
+            self.router = ModelRouter(self.llm)
+            print(f"[{self.subject_name}] LLM initialized successfully.")
         except Exception as e:
             raise RuntimeError(f"Model initialization failed: {e}")
 
-        self.vectorstore = self._load_knowledge_base()
+        # 向量库由进程级（或独立进程的）检索服务托管，多个学科共用，首次检索时才加载
+        self.retriever = get_retriever()
+        self.namespace = self._load_knowledge_base()
+        # 同一时刻多名学生检索同一知识点时，只做一次检索
+        self._retrieval_flights = SingleFlight(f"{self.subject_name}检索")
         self.graph: Pregel = self._build_graph()
+        # 热门“主题 × 难度 × 题型”的现成题目，空闲时在后台补充（QUIZ_POOL_SIZE=0 关闭）
+        self.quiz_pool: Optional[QuizPool] = QuizPool.from_env(self._pregenerate, name=self.subject_name)
 
-    def _load_knowledge_base(self) -> Optional[FAISS]:
-        """Loads the vector knowledge base from the specified path."""
+    def _load_knowledge_base(self) -> Optional[str]:
+        """Registers the knowledge base with the retrieval service; returns its namespace."""
         try:
-            print(f"[{self.subject_name}] Loading knowledge base from '{self.vectorstore_path}'...")
-            return FAISS.load_local(
-                self.vectorstore_path,
-                self.embeddings,
-                allow_dangerous_deserialization=True,
-            )
+            print(f"[{self.subject_name}] Registering knowledge base '{self.vectorstore_path}'...")
+            return self.retriever.register(self.vectorstore_path, embedding_model=self.embedding_model)
         except Exception as e:
             print(f"Warning: Failed to load knowledge base: {e}. Agent will run without retrieval.")
             return None
@@ -117,142 +196,235 @@ class BaseAgent:
     def parse_input_node(self, state: GraphState) -> Dict:
         """Parses the user's raw input to extract structured parameters."""
         print(f"[{self.subject_name}] Parsing user input...")
-        user_input = state["user_input"]
-
-        # --- Extract Number and Type of Questions ---
-        type_count_pattern = r"(\d+)\s*(?:道|题|个)[^\u4e00-\u9fa5]*?(选择题|判断题|简答题|材料\s*分析题?)"
-        compact_input = re.sub(r"\s+", "", user_input)
-        mixed_matches = re.findall(type_count_pattern, compact_input)
-        
-        question_type_counts = {}
-        for num_str, q_type_raw in mixed_matches:
-            q_type_normalized = q_type_raw.replace("材料分析题", "简答题").replace("材料分析", "简答题")
-            question_type_counts[q_type_normalized] = question_type_counts.get(q_type_normalized, 0) + int(num_str)
-
-        if question_type_counts:
-            num_questions = sum(question_type_counts.values())
-        else:
-            num_pattern_simple = r"(\d+)\s*(?:道|题|个)"
-            numbers = re.findall(num_pattern_simple, user_input)
-            num_questions = sum(int(n) for n in numbers) if numbers else 5
-
-        # --- Extract Difficulty ---
-        difficulty = "中等"
-        if any(kw in user_input for kw in ["简单", "容易", "基础"]):
-            difficulty = "简单"
-        elif any(kw in user_input for kw in ["困难", "难", "高级"]):
-            difficulty = "困难"
-
-        # --- Determine Question Type(s) ---
-        detected_types = [qt for qt in ["选择题", "判断题", "简答题"] if qt in user_input or ("简答题" == qt and "材料分析" in user_input)]
-        detected_types = list(dict.fromkeys(detected_types))
-
-        if not question_type_counts and detected_types:
-            avg_count = max(1, num_questions // len(detected_types))
-            for qt in detected_types:
-                question_type_counts[qt] = avg_count
-        
-        if len(question_type_counts) > 1:
-            question_type = "混合"
-        elif len(question_type_counts) == 1:
-            question_type = next(iter(question_type_counts))
-        else:
-            question_type = "选择题"
-            question_type_counts = {"选择题": num_questions}
-
-        # --- Extract Topic ---
-        detected_topics = [t for t in self.common_topics if t in user_input]
-        about_matches = re.findall(r"关于(.*?)的", user_input)
-        for raw in about_matches:
-            cleaned = re.sub(r"(简单|容易|基础|中等|困难|高级|选择题|判断题|简答题|材料\s*分析题?|题目|\s)", "", raw).strip()
-            if cleaned:
-                detected_topics.append(cleaned)
-        
-        ordered_topics = list(dict.fromkeys(detected_topics))
-        if not ordered_topics:
-            fallback_topic = re.sub(r'\d+道|\d+题|请|给我|出|关于|的|简单|中等|困难|选择题|判断题|简答题|材料\s*分析题?|题目', '', user_input).strip()
-            ordered_topics = [fallback_topic if fallback_topic else self.default_topic]
-
+        parsed = self.input_parser.parse(state["user_input"])
+        topic = parsed.topic
+        caption = state.get("image_caption")
+        if caption and caption.concepts and topic == self.default_topic:
+            # 文字中没有指明主题时，按图片涉及的概念检索与出题
+            topic = "、".join(caption.concepts[:3])
         return {
-            "topic": "; ".join(ordered_topics),
-            "num_questions": num_questions,
-            "difficulty": difficulty,
-            "question_type": question_type,
-            "question_type_counts": question_type_counts,
+            "topic": topic,
+            "num_questions": parsed.num_questions,
+            "difficulty": parsed.difficulty,
+            "question_type": parsed.question_type,
+            "question_type_counts": dict(parsed.question_type_counts),
             "subject_name": self.subject_name,
             "error_message": None,
         }
 
+    def _similarity_search(self, query: str, k: int, focus: Optional[str] = None) -> Tuple[Document, ...]:
+        """The best ``k`` chunks after reranking a wide FAISS candidate set.
+
+        Identical concurrent queries share one search.
+        """
+        return self._retrieval_flights.do(
+            (query, k, focus),
+            lambda: tuple(self.retriever.search(self.namespace, query, k, focus=focus)),
+        )
+
     def retrieve_node(self, state: GraphState) -> Dict:
         """Retrieves relevant documents from the knowledge base."""
         print(f"[{self.subject_name}] Retrieving documents for topic: '{state['topic']}'...")
-        if self.vectorstore is None:
+        if self.namespace is None:
             return {"retrieved_docs": [], "error_message": "Knowledge base not loaded."}
 
         try:
             topic_list = [t.strip() for t in re.split(r"[;；、，]", state["topic"]) if t.strip()]
+            caption = state.get("image_caption")
+            concepts = [c for c in caption.concepts if c not in topic_list] if caption else []
             retrieved_docs = []
             for tp in topic_list:
-                docs = self.vectorstore.similarity_search(f"{tp} {self.subject_name}", k=3)
-                retrieved_docs.extend([doc.page_content for doc in docs])
+                # 带图片时，图片涉及的概念同时用于检索与重排序
+                focus = " ".join([tp, *concepts])
+                retrieved_docs.extend(self._similarity_search(f"{focus} {self.subject_name}", k=3, focus=focus))
             
-            unique_docs = list(dict.fromkeys(retrieved_docs))[:5]
+            # 按块 ID 去重（多个主题可能检索到同一块）
+            unique_docs = [doc.page_content for doc in unique_documents(retrieved_docs)[:5]]
             print(f"[{self.subject_name}] Retrieved {len(unique_docs)} unique document snippets.")
             return {"retrieved_docs": unique_docs, "error_message": None}
         except Exception as e:
             return {"retrieved_docs": [], "error_message": f"Retrieval failed: {e}"}
 
+    def _pack_context(self, state: GraphState) -> str:
+        """Deduplicates the retrieved chunks and fits them into the context budget."""
+        return self.context_packer.pack(state["retrieved_docs"], state["topic"])
+
+    def _build_prompt(self, state: GraphState, type_counts: Dict[str, int], context: str, user_input: str) -> AssembledPrompt:
+        """Assembles the generation prompt for ``type_counts`` (one entry = single type)."""
+        caption = state.get("image_caption")
+        if caption:
+            context = f"{caption.as_context()}\n\n{context}"
+        return build_question_prompt(
+            self.subject_name, type_counts, state["topic"], state["difficulty"], context, user_input
+        )
+
+    def _invoke_generation(self, prompt: AssembledPrompt, validate: Optional[Callable[[str], bool]] = None) -> str:
+        """Sends one question-generation prompt to the LLM and returns the text.
+
+        With ``validate`` the fast model is tried first and its output is
+        escalated to ``llm_model`` if the check fails.
+        """
+        tokens = PROMPT_TOKEN_STATS.record(prompt)
+        print(f"[{self.subject_name}] Prompt ≈{tokens['total']} tokens, "
+              f"{tokens['cacheable_prefix']} in the cacheable prefix.")
+        # 先计入提示词：调用失败（如上游不可用）时也占用预生成的 token 预算
+        charge_tokens(tokens["total"])
+        response = self.router.invoke(prompt.kind, prompt.to_messages(), fast=validate is not None, validate=validate)
+        charge_tokens(estimate_tokens(response.content))
+        return response.content
+
+    @staticmethod
+    def _cascade_validator(state: GraphState, type_counts: Dict[str, int]) -> Optional[Callable[[str], bool]]:
+        """Acceptance check for batches the fast model may generate, or ``None`` if ``llm_model`` is required.
+
+        Only easy multiple-choice batches are routed to the fast model; its
+        output must parse and pass :func:`validate_quiz` as is.
+        """
+        if state["difficulty"] != "简单" or set(type_counts) != {"选择题"}:
+            return None
+
+        def is_valid(text: str) -> bool:
+            questions = parse_structured_questions(text, default_type="选择题")
+            return questions is not None and validate_quiz(questions, type_counts).ok
+
+        return is_valid
+
+    def _plan_fanout_batches(self, state: GraphState) -> List[Tuple[str, int]]:
+        """Splits the requested quiz into ``(question_type, count)`` sub-batches.
+
+        Returns an empty list when the request is small enough to be generated
+        by a single call.
+        """
+        if not self.enable_fanout:
+            return []
+        counts = state["question_type_counts"] or {state["question_type"]: state["num_questions"]}
+        if state["question_type"] != "混合" and state["num_questions"] <= self.fanout_chunk_size:
+            return []
+
+        batches: List[Tuple[str, int]] = []
+        for q_type, count in counts.items():
+            remaining = count
+            while remaining > 0:
+                size = min(self.fanout_chunk_size, remaining)
+                batches.append((q_type, size))
+                remaining -= size
+        return batches if len(batches) > 1 else []
+
+    def _generate_fanout(self, state: GraphState, batches: List[Tuple[str, int]], context: str) -> List[Tuple[str, str]]:
+        """Generates each sub-batch in parallel, returning ``(question_type, raw_output)`` pairs."""
+        print(f"[{self.subject_name}] Fan-out generation: {len(batches)} parallel batches {batches}.")
+        # 子批次在线程池中生成，其 token 需计入调用方（如题库预生成）的计量
+        meter = current_meter()
+
+        def run_batch(index: int, q_type: str, count: int) -> str:
+            batch_request = FANOUT_BATCH_REQUEST_TEMPLATE.format(
+                topic=state["topic"],
+                num_questions=count,
+                difficulty=state["difficulty"],
+                question_type=q_type,
+                total_batches=len(batches),
+                batch_index=index + 1,
+            )
+            prompt = self._build_prompt(state, {q_type: count}, context, batch_request)
+            with use_meter(meter):
+                return self._invoke_generation(prompt, self._cascade_validator(state, {q_type: count}))
+
+        workers = min(self.max_parallel_generations, len(batches))
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="quiz-fanout") as pool:
+            futures = [pool.submit(run_batch, i, q_type, count) for i, (q_type, count) in enumerate(batches)]
+            outputs = [future.result() for future in futures]
+
+        return [(q_type, text) for (q_type, _), text in zip(batches, outputs)]
+
+    @staticmethod
+    def _assemble_outputs(outputs: List[Tuple[Optional[str], str]], mixed: bool) -> Tuple[str, List[Question]]:
+        """Validates raw generations once and renders the full quiz text.
+
+        Each output is parsed as the structured JSON question list; if every
+        output parses, the quiz is rendered from the merged question objects.
+        Otherwise the raw texts are merged and renumbered as plain text and no
+        structured questions are returned.
+        """
+        questions: List[Question] = []
+        for q_type, text in outputs:
+            parsed = parse_structured_questions(text, default_type=q_type)
+            if parsed is None:
+                break
+            if q_type:
+                for q in parsed:
+                    q.type = q_type
+            questions.extend(parsed)
+        else:
+            return render_questions(questions, mixed), questions
+
+        if len(outputs) == 1:
+            return outputs[0][1], []
+        return merge_question_batches([(q_type or "题目", text) for q_type, text in outputs], mixed), []
+
+    def _repair_quiz(self, state: GraphState, questions: List[Question], context: str) -> List[Question]:
+        """Validates the quiz locally and regenerates only the broken or missing items.
+
+        Each repair call sends just the failing questions with their problems
+        (plus the reference material when new questions are needed); items
+        that are still broken after ``max_quiz_repairs`` calls are kept as is.
+        """
+        expected = (
+            state["question_type_counts"] if state["question_type"] == "混合"
+            else {state["question_type"]: state["num_questions"]}
+        )
+        first = validation = QUIZ_VALIDATION_STATS.timed_validate(questions, expected)
+        calls = fixed = added = 0
+        while not validation.ok and calls < self.max_quiz_repairs:
+            calls += 1
+            print(f"[{self.subject_name}] Repairing quiz: {len(validation.broken)} broken, "
+                  f"missing {validation.missing or 'none'}.")
+            broken = [(validation.questions[i].to_dict(), issues) for i, issues in sorted(validation.broken.items())]
+            prompt = build_quiz_repair_prompt(
+                self.subject_name, state["topic"], state["difficulty"], broken, validation.missing,
+                context if validation.missing else "",
+            )
+            try:
+                repaired = parse_structured_questions(self._invoke_generation(prompt)) or []
+            except Exception as e:
+                print(f"[{self.subject_name}] Quiz repair failed: {e}")
+                break
+            spliced, call_fixed, call_added = splice_repairs(validation, repaired)
+            fixed, added = fixed + call_fixed, added + call_added
+            validation = QUIZ_VALIDATION_STATS.timed_validate(spliced, expected)
+        QUIZ_VALIDATION_STATS.record(first, validation, calls, fixed, added)
+        return validation.questions
+
     def generate_node(self, state: GraphState) -> Dict:
         """Generates questions using the LLM based on the retrieved context."""
         print(f"[{self.subject_name}] Generating questions...")
-        context = "\n\n".join(state["retrieved_docs"][:3])
+        context = self._pack_context(state)
+        mixed = state["question_type"] == "混合"
         
         try:
-            if state["question_type"] == "混合":
-                type_details = "\n".join([f"- {qt}：{cnt}道" for qt, cnt in state["question_type_counts"].items()])
-                prompt = MIXED_TYPE_PROMPT_TEMPLATE.format(
-                    subject_name=self.subject_name,
-                    topic=state["topic"],
-                    type_details=type_details,
-                    difficulty=state["difficulty"],
-                    context=context,
-                    user_input=state["user_input"],
-                )
+            batches = self._plan_fanout_batches(state)
+            if batches:
+                outputs = self._generate_fanout(state, batches, context)
             else:
-                q_type = state["question_type"]
-                config = QUESTION_TYPE_CONFIG.get(q_type, QUESTION_TYPE_CONFIG["选择题"])
-                prompt = SINGLE_TYPE_PROMPT_TEMPLATE.format(
-                    subject_name=self.subject_name,
-                    topic=state["topic"],
-                    num_questions=state["num_questions"],
-                    difficulty=state["difficulty"],
-                    question_type_specific_name=config["question_type_specific_name"],
-                    format_requirements=config["format_requirements"],
-                    output_format_example=config["output_format_example"],
-                    context=context,
-                    user_input=state["user_input"],
+                type_counts = (
+                    state["question_type_counts"] if mixed else {state["question_type"]: state["num_questions"]}
                 )
+                prompt = self._build_prompt(state, type_counts, context, state["user_input"])
+                text = self._invoke_generation(prompt, self._cascade_validator(state, type_counts))
+                outputs = [(None if mixed else state["question_type"], text)]
 
-            if state["difficulty"] == "困难":
-                prompt += f"\n\n{DIFFICULTY_ADDENDUM_HARD}"
-            
-            messages = [
-                SystemMessage(content=f"你是一位专业的{self.subject_name}课程教师，擅长出题和教学。"),
-                HumanMessage(content=prompt)
-            ]
-            response = self.llm.invoke(messages)
-            
-            print(f"[{self.subject_name}] Question generation complete.")
-            return {"generated_questions": response.content, "error_message": None}
+            generated, questions = self._assemble_outputs(outputs, mixed)
+            if questions:
+                checked = self._repair_quiz(state, questions, context)
+                if checked != questions:
+                    questions, generated = checked, render_questions(checked, mixed)
+            print(f"[{self.subject_name}] Question generation complete ({len(questions)} structured questions).")
+            return {"generated_questions": generated, "structured_questions": questions, "error_message": None}
         except Exception as e:
-            return {"generated_questions": "", "error_message": f"Generation failed: {e}"}
+            return {"generated_questions": "", "structured_questions": [], "error_message": f"Generation failed: {e}"}
 
-    def process_request(self, user_input: str) -> str:
-        """Processes a user's request through the entire workflow."""
-        if not self.graph:
-            return "Error: Agent graph is not compiled."
-        
-        initial_state = GraphState(
+    def _initial_state(self, user_input: str, image_caption: Optional[ImageCaption] = None) -> GraphState:
+        """Builds an empty workflow state for ``user_input``."""
+        return GraphState(
             user_input=user_input,
             subject_name=self.subject_name,
             topic="",
@@ -262,13 +434,295 @@ class BaseAgent:
             question_type_counts={},
             retrieved_docs=[],
             generated_questions="",
+            structured_questions=[],
+            image_caption=image_caption,
             error_message=None,
         )
-        
+
+    def _run_workflow(self, user_input: str, image_caption: Optional[ImageCaption] = None) -> GraphState:
+        """Runs the LangGraph workflow and returns the final state."""
+        return self.graph.invoke(self._initial_state(user_input, image_caption))
+
+    @staticmethod
+    def _record_from_state(final_state: GraphState) -> QuizRecord:
+        """Builds a :class:`QuizRecord` (both renderings) from a finished workflow state."""
+        if final_state.get("structured_questions"):
+            return QuizRecord.from_questions(
+                final_state["structured_questions"], mixed=final_state["question_type"] == "混合"
+            )
+        return QuizRecord.from_text(final_state["generated_questions"])
+
+    # ------------------------------------------------------------------
+    # Pre-generated quizzes
+    # ------------------------------------------------------------------
+
+    def _pool_key(self, user_input: str) -> Optional[PoolKey]:
+        """The pool key of a plain request for one common topic and one question type, else ``None``.
+
+        Requests with other topics, mixed types, more than 10 questions or
+        extra wording (e.g. a requested style) are always generated fresh.
+        """
+        parsed = self.input_parser.parse(user_input)
+        if (parsed.topic not in self.common_topics or parsed.question_type not in QUESTION_TYPE_CONFIG
+                or not 0 < parsed.num_questions <= _POOL_MAX_QUESTIONS
+                or len(parsed.keywords.intersection(QUESTION_TYPE_CONFIG)) > 1):
+            return None
+        extra = user_input
+        for keyword in sorted(parsed.keywords | {parsed.topic}, key=len, reverse=True):
+            extra = extra.replace(keyword, "")
+        if len(_POOL_FILLER_RE.sub("", extra)) > _POOL_MAX_EXTRA_CHARS:
+            return None
+        return PoolKey(parsed.topic, parsed.difficulty, parsed.question_type, parsed.num_questions)
+
+    def _pregenerate(self, key: PoolKey) -> Optional[QuizRecord]:
+        """Generates one quiz for the pool; ``None`` unless it parses and passes validation."""
+        type_counts = {key.question_type: key.num_questions}
+        state = self._initial_state(POOL_REQUEST_TEMPLATE.format(**key._asdict()))
+        state.update(
+            topic=key.topic, difficulty=key.difficulty, question_type=key.question_type,
+            num_questions=key.num_questions, question_type_counts=type_counts,
+        )
+        state.update(self.retrieve_node(state))
+        state.update(self.generate_node(state))
+        questions = state["structured_questions"]
+        if state["error_message"] or not questions or not validate_quiz(questions, type_counts).ok:
+            return None
+        return QuizRecord.from_questions(questions, mixed=False)
+
+    def _quiz_for(
+        self, user_input: str, image_caption: Optional[ImageCaption] = None
+    ) -> Tuple[Optional[QuizRecord], Optional[str]]:
+        """Returns ``(record, None)`` for a quiz request, or ``(None, error_text)``.
+
+        Popular requests are served from the pre-generated pool; each pooled
+        quiz is handed out once. Requests about an image are always generated.
+        """
+        if not self.graph:
+            return None, "Error: Agent graph is not compiled."
+        key = self._pool_key(user_input) if self.quiz_pool and image_caption is None else None
+        if key is not None:
+            record = self.quiz_pool.take(key)
+            if record is not None:
+                print(f"[{self.subject_name}] Served a pre-generated quiz for {tuple(key)}.")
+                return record, None
         try:
-            final_state = self.graph.invoke(initial_state)
-            if final_state["error_message"]:
-                return f"An error occurred: {final_state['error_message']}"
-            return final_state["generated_questions"]
+            # 前台请求进行中时后台不补充题库，避免与学生的请求争抢模型配额
+            with self.quiz_pool.foreground() if self.quiz_pool else nullcontext():
+                final_state = self._run_workflow(user_input, image_caption)
         except Exception as e:
-            return f"A system error occurred: {e}" 
\ No newline at end of file
+            return None, f"A system error occurred: {e}"
+        if final_state["error_message"]:
+            return None, f"An error occurred: {final_state['error_message']}"
+        return self._record_from_state(final_state), None
+
+    def process_request(self, user_input: str) -> str:
+        """Processes a user's request through the entire workflow."""
+        record, error = self._quiz_for(user_input)
+        return error or record.full_text
+
+    # ------------------------------------------------------------------
+    # Batch generation
+    # ------------------------------------------------------------------
+
+    @staticmethod
+    def _expand_batch_specs(specs: Iterable[Union[str, Dict]]) -> List[str]:
+        """Expands ``"request"`` / ``{"message": ..., "copies": n}`` specs into one request per paper.
+
+        Raises:
+            ValueError: a spec is not a string or dict, or its message or
+                copies has the wrong type.
+        """
+        papers: List[str] = []
+        for spec in specs:
+            if isinstance(spec, str):
+                message, copies = spec, 1
+            elif isinstance(spec, dict):
+                message, copies = spec.get("message", ""), spec.get("copies", 1)
+            else:
+                raise ValueError(f"无效的出题需求：{spec!r}")
+            if not isinstance(message, str):
+                raise ValueError(f"出题需求的 message 必须是字符串：{message!r}")
+            if isinstance(copies, bool) or not isinstance(copies, (int, str)) or not str(copies).strip().isdigit():
+                raise ValueError(f"copies 必须是正整数：{copies!r}")
+            copies = int(copies)
+            message = message.strip()
+            if message:
+                papers.extend([message] * max(1, copies))
+        return papers
+
+    @staticmethod
+    def _replacement_type(question: Question) -> str:
+        return question.type if question.type in QUESTION_TYPE_CONFIG else "选择题"
+
+    def _top_up_duplicates(self, state: GraphState, removed: List[Question], context: str) -> List[Question]:
+        """Generates replacements for questions dropped as duplicates (one attempt).
+
+        A failed call only leaves its type without replacements; the paper is
+        still delivered, reporting the missing questions as ``short_by``.
+        """
+        removed_by_type: Dict[str, List[Question]] = {}
+        for q in removed:
+            removed_by_type.setdefault(self._replacement_type(q), []).append(q)
+
+        replacements: List[Question] = []
+        for q_type, questions in removed_by_type.items():
+            request = BATCH_REPLACEMENT_REQUEST_TEMPLATE.format(
+                topic=state["topic"], num_questions=len(questions), difficulty=state["difficulty"],
+                question_type=q_type, stems="\n".join(f"- {q.stem}" for q in questions),
+            )
+            prompt = self._build_prompt(state, {q_type: len(questions)}, context, request)
+            try:
+                parsed = parse_structured_questions(self._invoke_generation(prompt), q_type)
+            except Exception as e:
+                print(f"[{self.subject_name}] Replacement generation for {len(questions)} {q_type} failed: {e}")
+                continue
+            replacements.extend(parsed or [])
+        return replacements
+
+    def _replace_duplicates(
+        self, state: GraphState, dedupe: QuestionDeduplicator
+    ) -> Tuple[List[Question], int, int]:
+        """Swaps questions that duplicate other papers for fresh ones.
+
+        Replacements take the positions of the questions they replace (same
+        type). Returns ``(questions, replaced, short_by)``; ``short_by`` counts
+        duplicates for which no acceptable replacement was generated, so the
+        paper has that many fewer questions than requested.
+        """
+        questions = state["structured_questions"]
+        kept, removed = dedupe.filter(questions)
+        if not removed:
+            return questions, 0, 0
+
+        candidates: Dict[str, List[Question]] = {}
+        for q in self._top_up_duplicates(state, removed, self._pack_context(state)):
+            candidates.setdefault(self._replacement_type(q), []).append(q)
+
+        removed_ids = {id(q) for q in removed}
+        result: List[Question] = []
+        replaced = 0
+        for q in questions:
+            if id(q) not in removed_ids:
+                result.append(q)
+                continue
+            pending = candidates.get(self._replacement_type(q), [])
+            while pending:
+                accepted, _ = dedupe.filter([pending.pop(0)])
+                if accepted:
+                    result.extend(accepted)
+                    replaced += 1
+                    break
+        return result, replaced, len(removed) - replaced
+
+    def process_batch(
+        self,
+        specs: Iterable[Union[str, Dict]],
+        max_concurrency: int = 4,
+        rate_limit_per_minute: Optional[float] = None,
+        dedupe_threshold: Optional[float] = 0.8,
+    ) -> Iterator[Dict]:
+        """Generates many papers at once, yielding each one as soon as it is ready.
+
+        Requests are parsed once per distinct message and retrieval runs once
+        per distinct topic; only the LLM generation runs per paper. Papers are
+        generated concurrently (at most ``max_concurrency`` at a time, with
+        starts spaced by ``rate_limit_per_minute``), and questions whose stems
+        nearly duplicate a question already placed in another paper are
+        replaced with freshly generated ones.
+
+        Args:
+            specs: Request strings, or dicts ``{"message": str, "copies": int}``.
+            max_concurrency: Maximum number of papers generated in parallel.
+            rate_limit_per_minute: Optional cap on generation starts per minute.
+            dedupe_threshold: Stem similarity (0-1) above which two questions
+                count as duplicates; ``None`` disables cross-paper dedupe.
+
+        Closing the iterator early (e.g. the HTTP client disconnects) cancels
+        the papers that have not started yet.
+
+        Yields:
+            Dicts with ``index``, ``request``, ``status`` (``"ok"``/``"error"``)
+            and, on success, ``quiz_id``, ``question_only_text``, ``full_text``,
+            ``duplicates_replaced`` and ``short_by`` (questions missing from
+            the paper because a duplicate could not be replaced).
+        """
+        papers = self._expand_batch_specs(specs)
+        if not papers:
+            return
+
+        parsed: Dict[str, GraphState] = {}
+        for message in dict.fromkeys(papers):
+            state = self._initial_state(message)
+            state.update(self.parse_input_node(state))
+            parsed[message] = state
+
+        retrieved: Dict[str, Dict] = {}
+        for state in parsed.values():
+            if state["topic"] not in retrieved:
+                retrieved[state["topic"]] = self.retrieve_node(state)
+
+        copies_seen: Dict[str, int] = {}
+        jobs: List[Tuple[int, str, int]] = []
+        for index, message in enumerate(papers):
+            copies_seen[message] = copies_seen.get(message, 0) + 1
+            jobs.append((index, message, copies_seen[message]))
+        total_copies = dict(copies_seen)
+
+        dedupe = QuestionDeduplicator(dedupe_threshold) if dedupe_threshold is not None else None
+        limiter = _StartRateLimiter(rate_limit_per_minute)
+        cancelled = threading.Event()
+        print(f"[{self.subject_name}] Batch generation: {len(papers)} papers, "
+              f"{len(parsed)} distinct requests, {len(retrieved)} retrievals, concurrency {max_concurrency}.")
+
+        def run_paper(index: int, message: str, copy_no: int) -> Dict:
+            base = parsed[message]
+            # 与单次工作流一致：检索失败时不中断，仅在无参考资料的情况下生成
+            state = dict(base, retrieved_docs=retrieved[base["topic"]]["retrieved_docs"])
+            if total_copies[message] > 1:
+                state["user_input"] = BATCH_PAPER_VARIANT_TEMPLATE.format(
+                    user_input=message, paper_no=copy_no, total_papers=total_copies[message]
+                )
+
+            limiter.wait()
+            if cancelled.is_set():
+                raise RuntimeError("批量出题已取消")
+            result = self.generate_node(state)
+            if result["error_message"]:
+                raise RuntimeError(result["error_message"])
+            state.update(result)
+
+            replaced = short_by = 0
+            if dedupe is not None and state["structured_questions"]:
+                state["structured_questions"], replaced, short_by = self._replace_duplicates(state, dedupe)
+                if short_by:
+                    print(f"[{self.subject_name}] Batch paper {index}: {short_by} duplicate question(s) "
+                          f"could not be replaced.")
+
+            record = self._record_from_state(state)
+            return {
+                "index": index,
+                "request": message,
+                "status": "ok",
+                "quiz_id": record.quiz_id,
+                "question_only_text": record.question_only_text,
+                "full_text": record.full_text,
+                "duplicates_replaced": replaced,
+                "short_by": short_by,
+            }
+
+        with ThreadPoolExecutor(max_workers=max(1, max_concurrency), thread_name_prefix="quiz-batch") as pool:
+            futures = {pool.submit(run_paper, *job): job for job in jobs}
+            try:
+                for future in as_completed(futures):
+                    index, message, _ = futures[future]
+                    try:
+                        yield future.result()
+                    except Exception as e:
+                        yield {"index": index, "request": message, "status": "error", "error": str(e)}
+            except GeneratorExit:
+                # 调用方不再读取（如 NDJSON 客户端断开）：丢弃尚未开始的试卷，
+                # 只等待正在调用模型的几套结束，而不是生成完全部试卷
+                cancelled.set()
+                pool.shutdown(wait=False, cancel_futures=True)
+                print(f"[{self.subject_name}] Batch generation cancelled by the consumer.")
+                raise
@@ -10,17 +10,24 @@ This module extracts the core workflow from *role.py* so that future agents
 with only minimal configuration.
 """
 
-from typing import Any, Dict, List, Optional, TypedDict
+from typing import Any, Dict, List, Optional, Tuple, TypedDict
+import ast
+import json
 import os
 import re
 
-from langchain_community.vectorstores import FAISS
-from langchain_dashscope.embeddings import DashScopeEmbeddings
 from langchain_core.messages import HumanMessage, SystemMessage, AIMessage
 from langchain_core.prompts import PromptTemplate
 from langgraph.graph import StateGraph, END
 
+from .chunk_store import unique_documents
+from .context_packer import ContextPacker
+from .dialogue_state import CHUNKS, TurnLog
+from .image_caption import ImageCaption
 from .llm_wrapper import CustomChatDashScope
+from .model_router import ModelRouter
+from .prompts import PROMPT_TOKEN_STATS, build_dialogue_system_prompt
+from .retrieval_service import get_retriever
 
 # -----------------------------------------------------------------------------
 # Graph state definition
@@ -32,8 +39,9 @@ class DialogueGraphState(TypedDict):
     user_input: str
     current_topic: str
     simulated_character: str
-    conversation_history: List[Dict[str, str]]
-    retrieved_docs: List[str]
+    conversation_history: TurnLog  # append-only; nodes return new views instead of copies
+    chunk_refs: Tuple[str, ...]  # IDs of the retrieved chunks, texts interned in CHUNKS
+    image_caption: Optional[ImageCaption]  # latest image shared in the session, described once
     socratic_response: str
     turn_count: int
     error_message: Optional[str]
@@ -60,7 +68,7 @@ class BaseDialogueAgent:
     "character": "马克思"
 }}
 
-用户输入: {{user_input}}
+用户输入: {user_input}
         """
     )
 
@@ -74,44 +82,61 @@ class BaseDialogueAgent:
         llm_model: str = "qwen-max",
         temperature: float = 0.8,
         embedding_model: str = "text-embedding-v2",
+        context_token_budget: int = 800,
     ) -> None:
         self.subject_name = subject_name
         self.vectorstore_path = vectorstore_path
+        self.embedding_model = embedding_model
         self.default_topic = default_topic
         self.default_character = default_character
+        # 参考资料随每一轮对话发送，预算比出题更紧
+        self.context_packer = ContextPacker(token_budget=context_token_budget)
 
         if "DASHSCOPE_API_KEY" not in os.environ:
             raise EnvironmentError("Please set the DASHSCOPE_API_KEY environment variable.")
 
         # Initialise models
         try:
-            self.embeddings = DashScopeEmbeddings(model=embedding_model)
             self.llm = CustomChatDashScope(model=llm_model, temperature=temperature)
-            print(f"[{self.subject_name}] LLM & Embedding models initialised.")
+            # 意图识别（抽取 JSON）交给更快的模型；苏格拉底式回复仍使用 llm_model
+            self.router = ModelRouter(self.llm)
+            print(f"[{self.subject_name}] LLM initialised.")
         except Exception as exc:
             raise RuntimeError(f"Model initialisation failed: {exc}") from exc
 
         # Knowledge base & graph
-        self.vectorstore = self._load_knowledge_base()
+        self.retriever = get_retriever()
+        self.namespace = self._load_knowledge_base()
         self.graph = self._build_graph()
 
     # ------------------------------------------------------------------
     # Internal helpers
     # ------------------------------------------------------------------
 
-    def _load_knowledge_base(self) -> Optional[FAISS]:
-        """Attempt to load the FAISS vector store configured for the agent."""
+    def _load_knowledge_base(self) -> Optional[str]:
+        """Register the agent's vector store with the shared retrieval service."""
         try:
-            print(f"[{self.subject_name}] Loading knowledge base ...")
-            return FAISS.load_local(
-                self.vectorstore_path,
-                self.embeddings,
-                allow_dangerous_deserialization=True,
-            )
+            print(f"[{self.subject_name}] Registering knowledge base ...")
+            return self.retriever.register(self.vectorstore_path, embedding_model=self.embedding_model)
         except Exception as exc:
             print(f"[{self.subject_name}] ⚠️  Failed to load knowledge base: {exc}. Running without retrieval.")
             return None
 
+    @staticmethod
+    def _parse_intent(text: str) -> Optional[Dict[str, Any]]:
+        """The ``{"topic": ..., "character": ...}`` object in an intent reply, or ``None``."""
+        match = re.search(r"\{.*\}", text, re.DOTALL)
+        if not match:
+            return None
+        try:
+            parsed = json.loads(match.group(0))
+        except ValueError:
+            try:
+                parsed = ast.literal_eval(match.group(0))
+            except (ValueError, SyntaxError):
+                return None
+        return parsed if isinstance(parsed, dict) and ("topic" in parsed or "character" in parsed) else None
+
     # ------------------------------------------------------------------
     # LangGraph nodes
     # ------------------------------------------------------------------
@@ -137,10 +162,14 @@ class BaseDialogueAgent:
             ]
 
             try:
-                llm_response = self.llm.invoke(messages)
-                match = re.search(r"\{.*\}", llm_response.content, re.DOTALL)
-                if match:
-                    parsed = eval(match.group(0))  # noqa: S307 – controlled LLM output
+                llm_response = self.router.invoke(
+                    "dialogue_intent",
+                    messages,
+                    fast=True,
+                    validate=lambda text: self._parse_intent(text) is not None,
+                )
+                parsed = self._parse_intent(llm_response.content)
+                if parsed is not None:
                     current_topic = parsed.get("topic", self.default_topic)
                     simulated_character = parsed.get("character", self.default_character)
                 else:
@@ -150,9 +179,9 @@ class BaseDialogueAgent:
                 current_topic = self.default_topic
                 simulated_character = self.default_character
 
-            conversation_history = [{"role": "user", "content": user_input}]
+            conversation_history = TurnLog().append("user", user_input)
         else:
-            conversation_history = state["conversation_history"] + [{"role": "user", "content": user_input}]
+            conversation_history = state["conversation_history"].append("user", user_input)
 
         return {
             "current_topic": current_topic,
@@ -163,24 +192,37 @@ class BaseDialogueAgent:
         }
 
     def retrieve_knowledge_node(self, state: DialogueGraphState) -> Dict[str, Any]:
-        """Retrieve relevant document snippets using the vector store."""
+        """Retrieve relevant document snippets using the vector store.
+
+        The query depends only on the session's topic, character and shared
+        image, so the chunks found once are reused as long as they are interned
+        (a new image clears ``chunk_refs``).
+        """
+        if state["chunk_refs"] and CHUNKS.has_all(state["chunk_refs"]):
+            return {"error_message": None, "dialogue_status": "continue"}
         print(f"Retrieving docs for topic '{state['current_topic']}' ...")
 
-        if self.vectorstore is None:
+        if self.namespace is None:
             err = "Vector store not loaded."
             print(err)
-            return {"retrieved_docs": [], "error_message": err, "dialogue_status": "error"}
+            return {"chunk_refs": (), "error_message": err, "dialogue_status": "error"}
 
         try:
             query = f"{state['current_topic']} {self.subject_name} {state['simulated_character']}"
-            docs = self.vectorstore.similarity_search(query, k=5)
-            retrieved = list(dict.fromkeys([doc.page_content for doc in docs]))[:5]
-            print(f"Retrieved {len(retrieved)} document snippets.")
-            return {"retrieved_docs": retrieved, "error_message": None, "dialogue_status": "continue"}
+            focus = state["current_topic"]
+            caption = state.get("image_caption")
+            if caption and caption.concepts:
+                # 图片涉及的概念同时用于检索与重排序，否则重排序会只按主题打分
+                concepts = " ".join(caption.concepts)
+                query, focus = f"{query} {concepts}", f"{focus} {concepts}"
+            docs = self.retriever.search(self.namespace, query, k=3, focus=focus)
+            refs = CHUNKS.intern(unique_documents(docs))
+            print(f"Retrieved {len(refs)} document snippets.")
+            return {"chunk_refs": refs, "error_message": None, "dialogue_status": "continue"}
         except Exception as exc:
             err = f"Retrieval error: {exc}"
             print(err)
-            return {"retrieved_docs": [], "error_message": err, "dialogue_status": "error"}
+            return {"chunk_refs": (), "error_message": err, "dialogue_status": "error"}
 
     def generate_socratic_response_node(self, state: DialogueGraphState) -> Dict[str, Any]:
         """Generate the Socratic response embodying the specified persona."""
@@ -189,35 +231,26 @@ class BaseDialogueAgent:
         current_topic = state["current_topic"]
         simulated_character = state["simulated_character"]
         conversation_history = state["conversation_history"]
-        retrieved_docs = state["retrieved_docs"]
-
-        system_content = (
-            f"你是一个资深的{self.subject_name}教师，现在你正在扮演 {simulated_character}，与学生进行一场关于 {current_topic} 的苏格拉底式对话。\n"
-            "你的目标是：\n"
-            "1. 模仿 {simulated_character} 的说话语气、风格和常用词汇。\n"
-            "2. 保持苏格拉底式对话的核心：不直接给出答案，而是通过一系列启发性的问题引导学生思考。\n"
-            "3. 问题应基于当前对话内容和参考资料，聚焦并促进思考。\n"
-            "4. 如果学生回答偏离主题，尝试巧妙引导回主题。\n"
-            "5. 当你认为学生对某个概念已经有了足够深入的思考时，可适当总结或提出更高层次的问题。\n"
-            "6. 不要分点回答，回答不超过300字\n\n"
-            "参考资料：\n"
-            f"{'   '.join(retrieved_docs)}\n\n"
-            "当前对话历史：\n"
+
+        # 规则（静态）→ 人物与参考资料（整个会话不变）→ 对话历史（只追加），
+        # 每轮请求的前缀保持一致，便于服务端前缀缓存复用
+        references = self.context_packer.pack(CHUNKS.texts(state["chunk_refs"]), current_topic)
+        caption = state.get("image_caption")
+        prompt = build_dialogue_system_prompt(
+            self.subject_name, simulated_character, current_topic, references,
+            image_context=caption.as_context() if caption else "",
         )
-        messages: List[AIMessage | HumanMessage | SystemMessage] = [SystemMessage(content=system_content)]
-        for msg in conversation_history:
-            if msg["role"] == "user":
-                messages.append(HumanMessage(content=msg["content"]))
-            else:
-                messages.append(AIMessage(content=msg["content"]))
+        # 历史消息逐轮转换并缓存，token 数按轮累加，不再每轮重新处理整段历史
+        messages: List[AIMessage | HumanMessage | SystemMessage] = prompt.to_messages()
+        messages.extend(conversation_history.to_messages())
+        PROMPT_TOKEN_STATS.record(prompt, {"history": conversation_history.tokens})
 
         try:
-            response = self.llm.invoke(messages)
+            response = self.router.invoke("dialogue", messages)
             ai_text = response.content
-            new_history = conversation_history + [{"role": "assistant", "content": ai_text}]
             return {
                 "socratic_response": ai_text,
-                "conversation_history": new_history,
+                "conversation_history": conversation_history.append("assistant", ai_text),
                 "error_message": None,
                 "turn_count": state["turn_count"] + 1,
                 "dialogue_status": "continue",
@@ -258,8 +291,13 @@ class BaseDialogueAgent:
         self,
         user_input: str,
         current_state: Optional[DialogueGraphState] = None,
+        image_caption: Optional[ImageCaption] = None,
     ) -> Dict[str, Any]:
-        """Run one turn of dialogue and return the new state + response."""
+        """Run one turn of dialogue and return the new state + response.
+
+        ``image_caption`` describes an image sent with this turn; it replaces
+        the session's previous image and triggers a fresh retrieval.
+        """
         print(f"\n>> USER: {user_input}")
         if self.graph is None:
             return {"response": "Graph not available", "status": "error"}
@@ -269,8 +307,9 @@ class BaseDialogueAgent:
                 "user_input": user_input,
                 "current_topic": "",
                 "simulated_character": "",
-                "conversation_history": [],
-                "retrieved_docs": [],
+                "conversation_history": TurnLog(),
+                "chunk_refs": (),
+                "image_caption": image_caption,
                 "socratic_response": "",
                 "turn_count": 0,
                 "error_message": None,
@@ -281,8 +320,9 @@ class BaseDialogueAgent:
                 "user_input": user_input,
                 "current_topic": current_state["current_topic"],
                 "simulated_character": current_state["simulated_character"],
-                "conversation_history": current_state["conversation_history"],
-                "retrieved_docs": current_state["retrieved_docs"],
+                "conversation_history": TurnLog.coerce(current_state.get("conversation_history")),
+                "chunk_refs": () if image_caption else tuple(current_state.get("chunk_refs", ())),
+                "image_caption": image_caption or current_state.get("image_caption"),
                 "socratic_response": "",
                 "turn_count": current_state["turn_count"],
                 "error_message": None,
@@ -3,121 +3,145 @@ This file defines the BaseKnowledgeGraphAgent, a reusable framework for
 generating Mermaid-format knowledge graphs for any subject.
 """
 import os
-import re
-from typing import List
-
-from langchain_community.vectorstores import FAISS
-from langchain_dashscope.embeddings import DashScopeEmbeddings
-from langchain_core.prompts import PromptTemplate
-from langchain_core.messages import SystemMessage, HumanMessage
+from typing import List, Sequence, Tuple
 
+from .context_packer import ContextPacker
 from .llm_wrapper import CustomChatDashScope
+from .mermaid import MINDMAP_STATS, MindmapCheck, repair_mindmap, split_mermaid_response, tree_response
+from .model_router import ModelRouter
+from .prompts import PROMPT_TOKEN_STATS, build_kg_prompt
+from .retrieval_service import get_retriever
+from .singleflight import SingleFlight
+
+# 图谱输出格式：Mermaid 源码，或供前端轻量渲染的紧凑 JSON 树（无需加载 Mermaid）
+OUTPUT_MERMAID = "mermaid"
+OUTPUT_TREE = "tree"
 
 
 class BaseKnowledgeGraphAgent:
     """Base class for generating Mermaid-format knowledge graphs."""
 
-    def __init__(self, subject_name: str, vectorstore_path: str):
+    def __init__(
+        self,
+        subject_name: str,
+        vectorstore_path: str,
+        context_token_budget: int = 1500,
+        max_regenerations: int = 1,
+        fast_topic_chars: int = 8,
+    ):
         """
         Initializes the base knowledge graph agent.
 
         Args:
             subject_name: The name of the subject (e.g., "马克思主义基本原理").
             vectorstore_path: The path to the FAISS vector store.
+            context_token_budget: Estimated token budget for the reference
+                material in the graph prompt.
+            max_regenerations: LLM calls allowed on top of the first one when
+                the mindmap cannot be repaired locally.
+            fast_topic_chars: Single topics up to this length get a short
+                mindmap and are tried on the fast model first.
         """
         self.subject_name = subject_name
         self.vectorstore_path = vectorstore_path
+        self.context_packer = ContextPacker(token_budget=context_token_budget)
+        self.max_regenerations = max(0, max_regenerations)
+        self.fast_topic_chars = fast_topic_chars
 
         if "DASHSCOPE_API_KEY" not in os.environ:
             raise EnvironmentError("Please set the DASHSCOPE_API_KEY environment variable.")
 
         try:
-            self.embeddings = DashScopeEmbeddings(model="text-embedding-v2")
-            self.llm = CustomChatDashScope(model="qwen-max", temperature=0.5)
+            # 相同提示词的并发请求合并为一次调用（全班同时生成同一知识点的图谱）
+            self.llm = CustomChatDashScope(model="qwen-max", temperature=0.5, coalesce=True)
+            self.router = ModelRouter(self.llm)
         except Exception as e:
             raise RuntimeError(f"Model initialization failed: {e}")
 
         try:
-            self.vectorstore = FAISS.load_local(
-                self.vectorstore_path,
-                self.embeddings,
-                allow_dangerous_deserialization=True,
-            )
+            self.retriever = get_retriever()
+            self.namespace = self.retriever.register(self.vectorstore_path, embedding_model="text-embedding-v2")
         except Exception as e:
             raise RuntimeError(f"Failed to load vector store from {self.vectorstore_path}: {e}")
 
-        self.graph_prompt = PromptTemplate.from_template(
-            """
-你是一位{subject_name}知识图谱专家。请利用提供的"参考资料"，围绕知识点"{topic}"构建一个 Mermaid mindmap（思维导图）格式的知识图谱，突出关键概念及其主要关系，并保持简洁易读。
-
-输出要求：
-1. mindmap 总节点不超过 15 个，层级不超过 3 级，保证图谱信息清晰、结构美观，便于学生学习和整理思路。
-2. 先输出 Mermaid 源代码，必须使用如下代码块格式：
-```mermaid
-mindmap
-  root(({topic}))
-    概念1
-      子概念A
-    概念2
-```
-3. Mermaid 代码块结束后，换行再输出一段不超过 100 字的中文总结，对图谱内容进行简洁概括。
-4. 除以上内容外，不要输出其他文字。
-
-参考资料：
-{context}
-"""
-        )
+        self._graph_flights = SingleFlight(f"{self.subject_name}知识图谱")
 
-    def _retrieve_docs(self, topic: str, k: int = 5) -> List[str]:
-        """Retrieves relevant document snippets based on the topic."""
+    def _retrieve_docs(self, topic: str, k: int = 4) -> List[str]:
+        """Retrieves relevant document snippets based on the topic (reranked)."""
         query = f"{topic} {self.subject_name}"
-        docs = self.vectorstore.similarity_search(query, k=k)
+        docs = self.retriever.search(self.namespace, query, k, focus=topic)
         return [doc.page_content for doc in docs]
 
-    def _generate_mermaid(self, topic: str, context: str) -> str:
-        """Generates Mermaid code using the large language model."""
-        prompt_text = self.graph_prompt.format(
-            subject_name=self.subject_name, topic=topic, context=context
+    def _is_short_topic(self, topic: str) -> bool:
+        """A single concept (e.g. "矛盾") rather than several topics or a sentence."""
+        return len(topic) <= self.fast_topic_chars and not any(sep in topic for sep in "；;、，,和与及")
+
+    def _generate_mermaid(self, topic: str, context: str, retry_problems: Sequence[str] = ()) -> str:
+        """Generates Mermaid code using the large language model.
+
+        Short single-topic mindmaps go to the fast model first and are
+        escalated to qwen-max if they cannot be repaired locally; retries
+        always use qwen-max.
+        """
+        prompt = build_kg_prompt(self.subject_name, topic, context, retry_problems)
+        PROMPT_TOKEN_STATS.record(prompt)
+        response = self.router.invoke(
+            prompt.kind,
+            prompt.to_messages(),
+            fast=self._is_short_topic(topic) and not retry_problems,
+            validate=lambda text: repair_mindmap(split_mermaid_response(text)[0], topic).recoverable,
         )
-        messages = [
-            SystemMessage(content="你是一位精通知识图谱构建的学者。"),
-            HumanMessage(content=prompt_text),
-        ]
-        response = self.llm.invoke(messages)
         if hasattr(response, 'content'):
             return str(response.content).strip()
         return str(response).strip()
 
-    def _format_mermaid_response(self, raw_output: str) -> str:
+    def _format_mermaid_response(self, raw_output: str, topic: str = "") -> Tuple[str, MindmapCheck]:
         """
-        Post-processes the LLM output to ensure the Mermaid code is correctly formatted.
+        Post-processes the LLM output: validates the mindmap and repairs it locally.
+
+        Returns:
+            ``(formatted_output, check)`` where *check* is the
+            :class:`~common_utils.mermaid.MindmapCheck` of the Mermaid block.
         """
-        raw_output = raw_output.strip()
-
-        # Use regex to find the mermaid block and the summary
-        mermaid_match = re.search(r"```mermaid(.*?)```", raw_output, re.DOTALL)
-        
-        if mermaid_match:
-            mermaid_code = mermaid_match.group(1).strip()
-            # The summary is whatever is left after the mermaid block
-            summary = raw_output[mermaid_match.end():].strip()
-        else:
-            # If no mermaid block is found, assume the whole output is mermaid code
-            mermaid_code = raw_output.replace("```mermaid", "").replace("```", "")
-            summary = ""
+        mermaid_code, summary = split_mermaid_response(raw_output)
+        check = repair_mindmap(mermaid_code, topic)
 
         # Reconstruct the output in a standard format
-        formatted_output = f"```mermaid\n{mermaid_code}\n```"
+        formatted_output = f"```mermaid\n{check.code}\n```"
         if summary:
             formatted_output += f"\n\n{summary}"
             
-        return formatted_output.strip()
+        return formatted_output.strip(), check
 
-    def build_knowledge_graph(self, topic: str) -> str:
+    def build_knowledge_graph(self, topic: str, output_format: str = OUTPUT_MERMAID) -> str:
         """
         Main workflow: retrieves context -> generates Mermaid code and summary.
+
+        Concurrent requests for the same topic are coalesced into one run,
+        whatever ``output_format`` each of them asked for.
+
+        Args:
+            output_format: ``"mermaid"`` (a ```mermaid block) or ``"tree"``
+                (a ```mindmap-json block, see :func:`common_utils.mermaid.tree_response`).
         """
-        docs = self._retrieve_docs(topic, k=5)
-        context = "\n\n".join(docs)
-        raw_output = self._generate_mermaid(topic, context)
-        return self._format_mermaid_response(raw_output) 
\ No newline at end of file
+        formatted = self._graph_flights.do(topic.strip(), self._build_knowledge_graph, topic.strip())
+        if output_format == OUTPUT_TREE:
+            return tree_response(formatted) or formatted
+        return formatted
+
+    def _build_knowledge_graph(self, topic: str) -> str:
+        docs = self._retrieve_docs(topic)
+        context = self.context_packer.pack(docs, topic)
+        formatted, first = self._format_mermaid_response(self._generate_mermaid(topic, context), topic)
+        check, regenerations = first, 0
+        # 本地无法修复（不是 mindmap、没有子节点）时才重新调用模型
+        while not check.recoverable and regenerations < self.max_regenerations:
+            regenerations += 1
+            print(f"[{self.subject_name}] Regenerating mindmap: {'；'.join(check.problems)}")
+            formatted, check = self._format_mermaid_response(
+                self._generate_mermaid(topic, context, check.problems), topic
+            )
+        if first.recoverable and not first.valid:
+            print(f"[{self.subject_name}] Mindmap repaired: {'；'.join(first.problems)}")
+        MINDMAP_STATS.record(first, check, regenerations)
+        return formatted 
\ No newline at end of file
@@ -0,0 +1,372 @@
+"""
+Compact, copy-on-write friendly storage for retrieved text chunks.
+
+LangChain's ``InMemoryDocstore`` keeps one ``Document`` object (plus a metadata
+dict and several strings) per chunk, keyed by UUID strings that FAISS reaches
+through an ``index_to_docstore_id`` dict. When the vector store is loaded in a
+pre-fork master, every retrieval in a worker touches the refcounts of those
+objects and dirties the shared memory pages, so each worker slowly ends up with
+its own private copy.
+
+:class:`CompactDocstore` addresses chunks by contiguous int32 IDs equal to
+their FAISS row, stores all chunk texts in a single UTF-8 buffer addressed by
+a NumPy offsets array, and keeps each distinct metadata dict once. ``Document``
+objects are created on demand per request and discarded afterwards.
+
+On disk the store is ``chunks.bin``: a small JSON header followed by the raw
+arrays, whose rows match ``chunks.faiss`` (written when build-time
+deduplication dropped rows) or else the original ``index.faiss``. It
+is memory-mapped rather than unpickled, so loading costs a few page-table
+entries and the text pages are shared by every worker through the OS page
+cache. Existing
+``index.faiss`` / ``index.pkl`` folders are converted with::
+
+    python -m common_utils.chunk_store database_agent_mayuan
+"""
+import argparse
+import json
+import mmap
+import os
+import struct
+from collections.abc import Mapping
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+from langchain_community.docstore.base import Docstore
+from langchain_core.documents import Document
+
+from .context_packer import char_bigrams
+
+CHUNK_INDEX_FILE = "chunks.faiss"
+CHUNK_STORE_FILE = "chunks.bin"
+_MAGIC = b"CHUNKS01"
+_FORMAT_VERSION = 1
+_ALIGN = 8
+
+
+def _aligned(position: int) -> int:
+    return -(-position // _ALIGN) * _ALIGN
+
+
+class PackedStrings:
+    """An immutable sequence of strings packed into one UTF-8 buffer."""
+
+    __slots__ = ("_buffer", "_offsets")
+
+    def __init__(self, buffer: Union[bytes, memoryview], offsets: np.ndarray):
+        self._buffer = buffer
+        self._offsets = offsets
+
+    @classmethod
+    def from_strings(cls, strings: Iterable[str]) -> "PackedStrings":
+        encoded = [s.encode("utf-8") for s in strings]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        if encoded:
+            np.cumsum([len(b) for b in encoded], out=offsets[1:])
+        return cls(b"".join(encoded), offsets)
+
+    def to_arrays(self) -> Tuple[np.ndarray, np.ndarray]:
+        """The packed UTF-8 buffer (as ``uint8``) and the offsets array."""
+        return np.frombuffer(self._buffer, dtype=np.uint8), self._offsets
+
+    def __len__(self) -> int:
+        return len(self._offsets) - 1
+
+    def __getitem__(self, i: int) -> str:
+        start, end = self._offsets[i], self._offsets[i + 1]
+        return str(self._buffer[start:end], "utf-8")
+
+    @property
+    def nbytes(self) -> int:
+        """Approximate memory footprint of the packed data in bytes."""
+        return len(self._buffer) + self._offsets.nbytes
+
+
+class RowIdMapping(Mapping):
+    """Identity ``FAISS row -> docstore ID`` mapping, without a per-row dict."""
+
+    __slots__ = ("_size",)
+
+    def __init__(self, size: int):
+        self._size = size
+
+    def __getitem__(self, row) -> int:
+        row = int(row)
+        if not 0 <= row < self._size:
+            raise KeyError(row)
+        return row
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(range(self._size))
+
+    def __len__(self) -> int:
+        return self._size
+
+
+class CompactDocstore(Docstore):
+    """Read-only docstore keyed by int32 chunk IDs (the chunk's FAISS row).
+
+    Chunk texts live in one packed buffer; distinct metadata dicts are stored
+    once as JSON and referenced from an int32 array. ``search`` returns a
+    ``Document`` whose ``id`` is the row number as a string (prefixed with
+    ``namespace:`` when the store belongs to a subject namespace), so callers
+    can deduplicate retrieved chunks by ID instead of by text.
+    """
+
+    def __init__(
+        self,
+        texts: PackedStrings,
+        metadatas: PackedStrings,
+        metadata_ids: np.ndarray,
+        namespace: Optional[str] = None,
+    ):
+        if len(metadata_ids) != len(texts):
+            raise ValueError(f"{len(texts)} chunk texts but {len(metadata_ids)} metadata references")
+        self._texts = texts
+        self._metadatas = metadatas
+        self._metadata_ids = np.ascontiguousarray(metadata_ids, dtype=np.int32)
+        self.namespace = namespace
+
+    @classmethod
+    def from_documents(cls, docs: Sequence[Document]) -> "CompactDocstore":
+        """Packs ``docs``; the i-th document gets chunk ID ``i``."""
+        distinct: Dict[str, int] = {}
+        metadata_ids = np.empty(len(docs), dtype=np.int32)
+        for row, doc in enumerate(docs):
+            encoded = json.dumps(doc.metadata or {}, ensure_ascii=False, sort_keys=True)
+            metadata_ids[row] = distinct.setdefault(encoded, len(distinct))
+        return cls(
+            PackedStrings.from_strings(doc.page_content for doc in docs),
+            PackedStrings.from_strings(distinct),
+            metadata_ids,
+        )
+
+    @classmethod
+    def from_docstore(cls, docstore: Docstore, doc_ids: Iterable) -> "CompactDocstore":
+        """Converts an existing docstore (e.g. ``InMemoryDocstore``); IDs follow ``doc_ids`` order."""
+        docs = []
+        for doc_id in doc_ids:
+            doc = docstore.search(doc_id)
+            if not isinstance(doc, Document):
+                raise ValueError(f"Could not find document for id {doc_id}, got {doc}")
+            docs.append(doc)
+        return cls.from_documents(docs)
+
+    @classmethod
+    def load(cls, path: str) -> "CompactDocstore":
+        """Memory-maps a store written by :meth:`save` (the texts are not copied)."""
+        with open(path, "rb") as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if mapped[:len(_MAGIC)] != _MAGIC:
+            raise ValueError(f"{path} is not a chunk store file")
+        (header_len,) = struct.unpack_from("<Q", mapped, len(_MAGIC))
+        header_start = len(_MAGIC) + 8
+        header = json.loads(mapped[header_start:header_start + header_len])
+        if header.get("version") != _FORMAT_VERSION:
+            raise ValueError(f"Unsupported chunk store version {header.get('version')} in {path}")
+
+        data_start = _aligned(header_start + header_len)
+        view = memoryview(mapped)
+        arrays = {}
+        for name, spec in header["arrays"].items():
+            start = data_start + spec["offset"]
+            arrays[name] = view[start:start + spec["nbytes"]]
+        return cls(
+            PackedStrings(arrays["text_buffer"], np.frombuffer(arrays["text_offsets"], dtype="<i8")),
+            PackedStrings(arrays["metadata_buffer"], np.frombuffer(arrays["metadata_offsets"], dtype="<i8")),
+            np.frombuffer(arrays["metadata_ids"], dtype="<i4"),
+        )
+
+    def save(self, path: str) -> None:
+        """Writes the store as ``magic | header length | JSON header | 8-byte aligned arrays``."""
+        text_buffer, text_offsets = self._texts.to_arrays()
+        metadata_buffer, metadata_offsets = self._metadatas.to_arrays()
+        arrays = {
+            "text_buffer": text_buffer,
+            "text_offsets": text_offsets.astype("<i8"),
+            "metadata_buffer": metadata_buffer,
+            "metadata_offsets": metadata_offsets.astype("<i8"),
+            "metadata_ids": self._metadata_ids.astype("<i4"),
+        }
+        specs, position = {}, 0
+        for name, array in arrays.items():
+            specs[name] = {"offset": position, "nbytes": int(array.nbytes)}
+            position = _aligned(position + array.nbytes)
+        header = json.dumps({"version": _FORMAT_VERSION, "arrays": specs}).encode("utf-8")
+        data_start = _aligned(len(_MAGIC) + 8 + len(header))
+
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(_MAGIC)
+            f.write(struct.pack("<Q", len(header)))
+            f.write(header)
+            for name, array in arrays.items():
+                f.write(b"\0" * (data_start + specs[name]["offset"] - f.tell()))
+                f.write(array.tobytes())
+        os.replace(tmp_path, path)
+
+    def __len__(self) -> int:
+        return len(self._texts)
+
+    @property
+    def nbytes(self) -> int:
+        return self._texts.nbytes + self._metadatas.nbytes + self._metadata_ids.nbytes
+
+    def text(self, chunk_id: int) -> str:
+        return self._texts[chunk_id]
+
+    def chunk_id(self, row: int) -> str:
+        return f"{self.namespace}:{row}" if self.namespace else str(row)
+
+    def search(self, search: Union[int, str]) -> Union[str, Document]:
+        if isinstance(search, str) and self.namespace and search.startswith(f"{self.namespace}:"):
+            search = search[len(self.namespace) + 1:]
+        try:
+            row = int(search)
+        except (TypeError, ValueError):
+            return f"ID {search} not found."
+        if not 0 <= row < len(self._texts):
+            return f"ID {search} not found."
+        return Document(
+            id=self.chunk_id(row),
+            page_content=self._texts[row],
+            metadata=json.loads(self._metadatas[int(self._metadata_ids[row])]),
+        )
+
+
+def unique_documents(docs: Iterable[Document]) -> List[Document]:
+    """Drops repeated chunks, by chunk ID when available and by text otherwise."""
+    seen = set()
+    unique = []
+    for doc in docs:
+        key = doc.id or doc.page_content
+        if key not in seen:
+            seen.add(key)
+            unique.append(doc)
+    return unique
+
+
+def near_duplicate_rows(texts: Sequence[str], containment: float = 0.9) -> List[int]:
+    """Rows whose text is (almost) entirely contained in an earlier kept chunk.
+
+    With ``chunk_overlap`` the splitter emits short tail chunks that consist
+    mostly of the previous chunk's overlap, and repeated passages (headers,
+    the same paragraph in two PDFs) become identical chunks. A chunk is a near
+    duplicate when at least ``containment`` of its character bigrams appear in
+    a single earlier chunk.
+    """
+    kept: List[set] = []
+    duplicates = []
+    for row, text in enumerate(texts):
+        grams = char_bigrams(text)
+        if any(len(grams & other) >= containment * len(grams) for other in kept):
+            duplicates.append(row)
+        else:
+            kept.append(grams)
+    return duplicates
+
+
+def dedupe_documents(docs: Sequence[Document], containment: float = 0.9) -> List[Document]:
+    """``docs`` without near-duplicate chunks (see :func:`near_duplicate_rows`)."""
+    dropped = set(near_duplicate_rows([doc.page_content for doc in docs], containment))
+    return [doc for row, doc in enumerate(docs) if row not in dropped]
+
+
+def has_chunk_store(folder: str) -> bool:
+    return os.path.exists(os.path.join(folder, CHUNK_STORE_FILE))
+
+
+def _index_path(folder: str) -> str:
+    path = os.path.join(folder, CHUNK_INDEX_FILE)
+    return path if os.path.exists(path) else os.path.join(folder, "index.faiss")
+
+
+def save_chunk_store(vectorstore, folder: str) -> None:
+    """Writes ``vectorstore`` as ``index.faiss`` + ``chunks.bin``.
+
+    Any ``index.pkl`` in ``folder`` should come from the same vector store
+    (``save_local``), so that both loaders see the same rows.
+    """
+    import faiss
+
+    docstore = vectorstore.docstore
+    if not isinstance(docstore, CompactDocstore):
+        docstore = CompactDocstore.from_docstore(
+            docstore, [vectorstore.index_to_docstore_id[row] for row in range(vectorstore.index.ntotal)]
+        )
+    os.makedirs(folder, exist_ok=True)
+    faiss.write_index(vectorstore.index, os.path.join(folder, "index.faiss"))
+    if os.path.exists(os.path.join(folder, CHUNK_INDEX_FILE)):
+        os.remove(os.path.join(folder, CHUNK_INDEX_FILE))
+    docstore.save(os.path.join(folder, CHUNK_STORE_FILE))
+
+
+def load_chunk_store(folder: str, embeddings, **kwargs):
+    """Loads a compact store written by :func:`save_chunk_store` as a LangChain ``FAISS``."""
+    import faiss
+    from langchain_community.vectorstores import FAISS
+
+    index = faiss.read_index(_index_path(folder))
+    docstore = CompactDocstore.load(os.path.join(folder, CHUNK_STORE_FILE))
+    if index.ntotal != len(docstore):
+        raise ValueError(f"{folder}: FAISS index has {index.ntotal} rows but the chunk store has {len(docstore)}")
+    return FAISS(embeddings, index, docstore, RowIdMapping(len(docstore)), **kwargs)
+
+
+def migrate(folder: str, dedupe: bool = True, containment: float = 0.9) -> Tuple[int, int]:
+    """Converts ``index.faiss`` / ``index.pkl`` in ``folder`` to the compact format.
+
+    The legacy files are left in place. Near-duplicate chunks are dropped
+    together with their FAISS rows (written to ``chunks.faiss``) when the index
+    supports ``reconstruct``; otherwise ``chunks.bin`` follows ``index.faiss``.
+    Returns ``(rows_before, rows_after)``.
+    """
+    import pickle
+
+    import faiss
+
+    index = faiss.read_index(os.path.join(folder, "index.faiss"))
+    with open(os.path.join(folder, "index.pkl"), "rb") as f:
+        legacy_docstore, index_to_docstore_id = pickle.load(f)
+    docs = []
+    for row in range(index.ntotal):
+        doc = legacy_docstore.search(index_to_docstore_id[row])
+        if not isinstance(doc, Document):
+            raise ValueError(f"Could not find document for row {row}, got {doc}")
+        docs.append(doc)
+
+    rows = list(range(len(docs)))
+    if dedupe:
+        dropped = set(near_duplicate_rows([doc.page_content for doc in docs], containment))
+        if dropped:
+            try:
+                vectors = index.reconstruct_n(0, index.ntotal)
+            except RuntimeError as e:
+                print(f"[chunk_store] 索引不支持 reconstruct（{e}），跳过去重。")
+            else:
+                rows = [row for row in rows if row not in dropped]
+                index = faiss.IndexFlat(index.d, index.metric_type)
+                index.add(vectors[rows])
+
+    index_path = os.path.join(folder, CHUNK_INDEX_FILE)
+    if len(rows) < len(docs):
+        faiss.write_index(index, index_path)
+    elif os.path.exists(index_path):
+        os.remove(index_path)  # 旧的去重索引已与 chunks.bin 不一致
+    CompactDocstore.from_documents([docs[row] for row in rows]).save(os.path.join(folder, CHUNK_STORE_FILE))
+    return len(docs), len(rows)
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="将 index.faiss / index.pkl 转换为紧凑的 chunks.bin（去重后另写 chunks.faiss）")
+    parser.add_argument("folder", nargs="+", help="向量库目录，如 database_agent_mayuan")
+    parser.add_argument("--no-dedupe", action="store_true", help="保留近似重复的文本块")
+    parser.add_argument("--containment", type=float, default=0.9, help="判定近似重复的字符二元组包含比例")
+    args = parser.parse_args(argv)
+    for folder in args.folder:
+        before, after = migrate(folder, dedupe=not args.no_dedupe, containment=args.containment)
+        print(f"{folder}: {before} 个文本块 -> {after} 个（去除 {before - after} 个近似重复）")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+"""
+Token-budgeted packing of retrieved chunks into prompt context.
+
+The knowledge base is split into ~1000-character chunks with 100 characters of
+overlap, so the top-k chunks for a topic often repeat each other's edges and
+carry long tails unrelated to the topic. :class:`ContextPacker` removes spans
+shared between chunks, and, when the chunks still exceed the agent's token
+budget, keeps the sentences most relevant to the query (in their original
+order) until the budget is filled.
+"""
+import math
+import re
+from typing import List, Optional, Sequence, Set, Tuple
+
+from .prompts import estimate_tokens
+
+# 句末标点（保留在句子内）或空行处断句
+_SENTENCE_END_RE = re.compile(r"(?<=[。！？!?；;])|\n{2,}")
+# PDF 抽取文本中句子内部的硬换行
+_CJK = r"\u3000-\u303f\u3400-\u4dbf\u4e00-\u9fff\uff00-\uffef"
+_CJK_LINEBREAK_RE = re.compile(rf"(?<=[{_CJK}])\n(?=[{_CJK}])")
+_SOFT_LINEBREAK_RE = re.compile(r"(?<!\n)\n(?!\n)")
+_NON_WORD_RE = re.compile(r"[\W_]+")
+_GAP_MARKER = "……"
+
+
+def char_bigrams(text: str) -> Set[str]:
+    """Character bigrams of ``text`` with whitespace and punctuation removed."""
+    text = _NON_WORD_RE.sub("", text)
+    return {text[i:i + 2] for i in range(len(text) - 1)} if len(text) > 1 else {text}
+
+
+def _normalize(text: str) -> str:
+    text = _CJK_LINEBREAK_RE.sub("", text)
+    return _SOFT_LINEBREAK_RE.sub(" ", text).strip()
+
+
+def _split_sentences(text: str) -> List[str]:
+    return [s.strip() for s in _SENTENCE_END_RE.split(text) if s and s.strip()]
+
+
+class ContextPacker:
+    """Deduplicates retrieved chunks and fits them into a token budget.
+
+    Args:
+        token_budget: Maximum estimated tokens of the packed context.
+        min_overlap: Shortest shared prefix/suffix (in characters) treated as
+            chunk overlap rather than coincidence.
+        max_overlap: Longest overlap searched for; should be at least the
+            splitter's ``chunk_overlap``.
+        rank_weight: Weight of the retrieval rank relative to lexical
+            relevance when scoring sentences.
+    """
+
+    def __init__(
+        self,
+        token_budget: int = 1500,
+        min_overlap: int = 20,
+        max_overlap: int = 300,
+        rank_weight: float = 0.15,
+        separator: str = "\n\n",
+    ):
+        self.token_budget = token_budget
+        self.min_overlap = min_overlap
+        self.max_overlap = max_overlap
+        self.rank_weight = rank_weight
+        self.separator = separator
+
+    def _overlap(self, left: str, right: str) -> int:
+        """Length of the longest suffix of ``left`` that is a prefix of ``right``."""
+        for k in range(min(len(left), len(right), self.max_overlap), self.min_overlap - 1, -1):
+            if left.endswith(right[:k]):
+                return k
+        return 0
+
+    def dedupe(self, docs: Sequence[str]) -> List[str]:
+        """Drops repeated chunks and trims text a chunk shares with an earlier one."""
+        kept: List[str] = []
+        for doc in docs:
+            text = _normalize(doc)
+            if not text or any(text in other for other in kept):
+                continue
+            for other in kept:
+                head = self._overlap(other, text)
+                if head:
+                    text = text[head:]
+                tail = self._overlap(text, other)
+                if tail:
+                    text = text[:-tail]
+            text = text.strip()
+            if len(text) >= self.min_overlap:
+                kept.append(text)
+        return kept
+
+    def _score(self, sentence: str, query_grams: Set[str], doc_rank: int) -> float:
+        grams = char_bigrams(sentence)
+        lexical = len(grams & query_grams) / math.sqrt(len(grams)) if grams and query_grams else 0.0
+        return lexical + self.rank_weight / (1 + doc_rank)
+
+    def pack(self, docs: Sequence[str], query: str, token_budget: Optional[int] = None) -> str:
+        """Returns the context string for ``docs`` retrieved for ``query``."""
+        budget = self.token_budget if token_budget is None else token_budget
+        chunks = self.dedupe(docs)
+        if not chunks:
+            return ""
+        whole = self.separator.join(chunks)
+        if estimate_tokens(whole) <= budget:
+            return whole
+
+        query_grams = char_bigrams(query)
+        candidates: List[Tuple[float, int, int, str]] = []
+        for doc_rank, chunk in enumerate(chunks):
+            for pos, sentence in enumerate(_split_sentences(chunk)):
+                candidates.append((self._score(sentence, query_grams, doc_rank), doc_rank, pos, sentence))
+
+        chosen: List[Tuple[int, int, str]] = []
+        used = 0
+        for _, doc_rank, pos, sentence in sorted(candidates, key=lambda c: (-c[0], c[1], c[2])):
+            tokens = estimate_tokens(sentence)
+            if used + tokens > budget:
+                continue
+            chosen.append((doc_rank, pos, sentence))
+            used += tokens
+
+        # 按原文顺序还原；同一片段内不连续的句子之间用省略号标出
+        parts: List[str] = []
+        current_doc, last_pos, buffer = None, -1, ""
+        for doc_rank, pos, sentence in sorted(chosen):
+            if doc_rank != current_doc:
+                if buffer:
+                    parts.append(buffer)
+                current_doc, buffer = doc_rank, ("" if pos == 0 else _GAP_MARKER)
+            elif pos != last_pos + 1:
+                buffer += _GAP_MARKER
+            buffer += sentence
+            last_pos = pos
+        if buffer:
+            parts.append(buffer)
+        return self.separator.join(parts)
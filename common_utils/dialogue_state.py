@@ -0,0 +1,193 @@
+"""
+Compact, append-only state for Socratic dialogues.
+
+A dialogue turn used to rebuild the whole history twice (``history + [...]``
+in the intent and the response node), convert every past turn to a LangChain
+message again, re-estimate the tokens of the whole history, and store the
+text of the retrieved chunks in every session.
+
+* :class:`TurnLog` is an immutable *view* of an append-only turn list.
+  Appending returns a new view in O(1) that shares the list with the old one,
+  so LangGraph can pass states around without copying the history. Token
+  counts are computed once per turn; converted LangChain messages are cached
+  for the most recently active sessions only (:data:`MAX_CACHED_SESSIONS`),
+  so idle sessions keep nothing but their turn tuples.
+* :data:`CHUNKS` interns retrieved chunk texts by chunk ID, process-wide.
+  Sessions keep a tuple of chunk IDs; a chunk retrieved by many sessions is
+  stored once.
+"""
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, Iterator, List, NamedTuple, Optional, Sequence, Tuple, Union
+
+from langchain_core.documents import Document
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage
+
+from .prompts import estimate_tokens
+
+DEFAULT_MAX_CHUNKS = 20000
+MAX_CACHED_SESSIONS = 32
+
+
+class Turn(NamedTuple):
+    role: str  # "user" | "assistant"
+    content: str
+
+
+class _TurnStore:
+    """Shared storage behind one or more :class:`TurnLog` views."""
+
+    __slots__ = ("lock", "turns", "messages", "token_sums")
+
+    def __init__(self, turns: Sequence[Turn] = ()):
+        self.lock = threading.Lock()
+        self.turns: List[Turn] = list(turns)
+        self.messages: List[BaseMessage] = []  # 按需转换，长度 <= len(turns)
+        self.token_sums: List[int] = [0]  # token_sums[i] = 前 i 轮的估算 token 数
+        for turn in self.turns:
+            self.token_sums.append(self.token_sums[-1] + estimate_tokens(turn.content))
+
+
+# 最近活跃的会话保留已转换的消息；超出上限时清空最久未用会话的缓存
+_ACTIVE_STORES: "OrderedDict[int, _TurnStore]" = OrderedDict()
+_ACTIVE_LOCK = threading.Lock()
+
+
+def _touch(store: _TurnStore) -> None:
+    with _ACTIVE_LOCK:
+        _ACTIVE_STORES[id(store)] = store
+        _ACTIVE_STORES.move_to_end(id(store))
+        evicted = []
+        while len(_ACTIVE_STORES) > MAX_CACHED_SESSIONS:
+            evicted.append(_ACTIVE_STORES.popitem(last=False)[1])
+    for old in evicted:
+        with old.lock:
+            old.messages = []
+
+
+class TurnLog:
+    """An immutable view of the first ``len(self)`` turns of an append-only log.
+
+    Views are cheap to hold in graph states and session stores. When a view
+    that is not the newest is appended to (e.g. a turn is retried after a
+    failed attempt), the log is forked and only that branch pays for a copy.
+    """
+
+    __slots__ = ("_store", "_length")
+
+    def __init__(self, turns: Iterable[Union[Turn, Dict[str, str]]] = (), *, _store: Optional[_TurnStore] = None,
+                 _length: int = 0):
+        if _store is None:
+            _store = _TurnStore([_as_turn(t) for t in turns])
+            _length = len(_store.turns)
+        self._store = _store
+        self._length = _length
+
+    @classmethod
+    def coerce(cls, history: Union["TurnLog", Iterable[Union[Turn, Dict[str, str]]], None]) -> "TurnLog":
+        """``history`` as a log (a list of ``{"role", "content"}`` dicts is converted once)."""
+        return history if isinstance(history, TurnLog) else cls(history or ())
+
+    def append(self, role: str, content: str) -> "TurnLog":
+        """A view with one more turn; ``self`` is unchanged."""
+        return self.extend([Turn(role, content)])
+
+    def extend(self, turns: Iterable[Union[Turn, Dict[str, str]]]) -> "TurnLog":
+        new_turns = [_as_turn(t) for t in turns]
+        store = self._store
+        with store.lock:
+            if len(store.turns) == self._length:
+                for turn in new_turns:
+                    store.turns.append(turn)
+                    store.token_sums.append(store.token_sums[-1] + estimate_tokens(turn.content))
+                return TurnLog(_store=store, _length=self._length + len(new_turns))
+            prefix = store.turns[:self._length]
+        return TurnLog(prefix + new_turns)
+
+    def __len__(self) -> int:
+        return self._length
+
+    def __iter__(self) -> Iterator[Turn]:
+        turns = self._store.turns
+        return (turns[i] for i in range(self._length))
+
+    def __getitem__(self, index: int) -> Turn:
+        if not -self._length <= index < self._length:
+            raise IndexError("turn index out of range")
+        return self._store.turns[index % self._length]
+
+    def __repr__(self) -> str:
+        return f"TurnLog({self._length} turns)"
+
+    @property
+    def tokens(self) -> int:
+        """Estimated tokens of all turns in this view (cached per turn)."""
+        return self._store.token_sums[self._length]
+
+    def to_messages(self) -> List[BaseMessage]:
+        """LangChain messages for this view; while the session is active each turn is converted once."""
+        store = self._store
+        with store.lock:
+            for turn in store.turns[len(store.messages):self._length]:
+                cls = HumanMessage if turn.role == "user" else AIMessage
+                store.messages.append(cls(content=turn.content))
+            messages = store.messages[:self._length]
+        _touch(store)
+        return messages
+
+    def as_dicts(self) -> List[Dict[str, str]]:
+        """The turns as ``{"role", "content"}`` dicts (for JSON responses)."""
+        return [turn._asdict() for turn in self]
+
+
+def _as_turn(turn: Union[Turn, Dict[str, str]]) -> Turn:
+    return turn if isinstance(turn, Turn) else Turn(turn["role"], turn["content"])
+
+
+class ChunkTable:
+    """Process-wide interned chunk texts, keyed by chunk ID (LRU-bounded).
+
+    Chunks without an ID (remote services that do not send one) are keyed by
+    their text, which is still stored only once.
+    """
+
+    def __init__(self, max_entries: int = DEFAULT_MAX_CHUNKS):
+        self.max_entries = max_entries
+        self._texts: "OrderedDict[str, str]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._interned = 0
+        self._reused = 0
+
+    def intern(self, docs: Iterable[Document]) -> Tuple[str, ...]:
+        """Stores the documents' texts once; returns their references."""
+        refs = []
+        with self._lock:
+            for doc in docs:
+                ref = doc.id or doc.page_content
+                if ref in self._texts:
+                    self._texts.move_to_end(ref)
+                    self._reused += 1
+                else:
+                    self._texts[ref] = doc.page_content
+                    self._interned += 1
+                refs.append(ref)
+            while len(self._texts) > self.max_entries:
+                self._texts.popitem(last=False)
+        return tuple(refs)
+
+    def has_all(self, refs: Sequence[str]) -> bool:
+        with self._lock:
+            return all(ref in self._texts for ref in refs)
+
+    def texts(self, refs: Sequence[str]) -> List[str]:
+        """Texts of ``refs``, skipping any that were evicted."""
+        with self._lock:
+            return [self._texts[ref] for ref in refs if ref in self._texts]
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            chars = sum(len(text) for text in self._texts.values())
+            return {"chunks": len(self._texts), "chars": chars, "interned": self._interned, "reused": self._reused}
+
+
+CHUNKS = ChunkTable()
@@ -0,0 +1,128 @@
+"""
+Structured image descriptions, computed once per image.
+
+An uploaded image used to go straight to ``qwen-vl-max`` together with the
+student's question: no retrieval, and nothing about the image survived the
+request. Now the vision model is asked once for an :class:`ImageCaption`
+(text in the image, concepts it illustrates, a short description); the
+caption feeds the normal retrieval + text-model workflow and is kept in the
+dialogue state, so later turns never call the vision model again.
+
+Captions are cached process-wide by the SHA-256 of the image bytes
+(:data:`CAPTIONS`), so the same slide uploaded by a whole class is described
+once.
+"""
+import ast
+import hashlib
+import json
+import os
+import re
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, NamedTuple, Optional, Tuple
+
+from .singleflight import SingleFlight
+
+DEFAULT_MAX_CAPTIONS = 512
+_MAX_CONCEPTS = 5
+
+
+class ImageCaption(NamedTuple):
+    text: str  # 图片中的文字（OCR）
+    concepts: Tuple[str, ...]  # 图片涉及的理论概念，用作检索词
+    description: str
+
+    def as_context(self) -> str:
+        """The caption as a prompt section."""
+        lines = [f"图片描述：{self.description}"]
+        if self.text:
+            lines.append(f"图片中的文字：{self.text}")
+        if self.concepts:
+            lines.append(f"图片涉及的概念：{'、'.join(self.concepts)}")
+        return "\n".join(lines)
+
+
+def parse_caption(reply: str) -> Optional[ImageCaption]:
+    """The caption in a vision-model reply, or ``None`` if it has no usable JSON object."""
+    match = re.search(r"\{.*\}", reply, re.DOTALL)
+    if not match:
+        return None
+    try:
+        parsed = json.loads(match.group(0))
+    except ValueError:
+        try:
+            parsed = ast.literal_eval(match.group(0))
+        except (ValueError, SyntaxError):
+            return None
+    if not isinstance(parsed, dict):
+        return None
+    concepts = parsed.get("concepts") or ()
+    if isinstance(concepts, str):
+        concepts = re.split(r"[、，,；;\s]+", concepts)
+    concepts = tuple(dict.fromkeys(str(c).strip() for c in concepts if str(c).strip()))[:_MAX_CONCEPTS]
+    description = str(parsed.get("description") or "").strip()
+    text = str(parsed.get("text") or "").strip()
+    if not description and not text:
+        return None
+    return ImageCaption(text=text, concepts=concepts, description=description or text)
+
+
+def image_digest(image_path: str) -> str:
+    """SHA-256 of the image file's bytes."""
+    digest = hashlib.sha256()
+    with open(image_path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 16), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class CaptionCache:
+    """LRU cache of image captions keyed by image digest.
+
+    Concurrent requests for the same uncached image share one vision call.
+    Failed descriptions (``None``) are not cached.
+    """
+
+    def __init__(self, max_entries: int = DEFAULT_MAX_CAPTIONS):
+        self.max_entries = max_entries
+        self._captions: "OrderedDict[str, ImageCaption]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._flights = SingleFlight("image_caption")
+        self.hits = 0
+        self.misses = 0
+        self.failures = 0
+
+    def get_or_describe(self, image_path: str, describe: Callable[[str], Optional[ImageCaption]]) -> Optional[ImageCaption]:
+        """The cached caption of the image at ``image_path``, computing it with ``describe`` on a miss."""
+        key = image_digest(image_path)
+        with self._lock:
+            caption = self._captions.get(key)
+            if caption is not None:
+                self._captions.move_to_end(key)
+                self.hits += 1
+                return caption
+            self.misses += 1
+        caption = self._flights.do(key, describe, image_path)
+        with self._lock:
+            if caption is None:
+                self.failures += 1
+                return None
+            self._captions[key] = caption
+            self._captions.move_to_end(key)
+            while len(self._captions) > self.max_entries:
+                self._captions.popitem(last=False)
+        return caption
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "captions": len(self._captions),
+                "hits": self.hits,
+                "misses": self.misses,
+                "failures": self.failures,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            }
+
+
+CAPTIONS = CaptionCache(int(os.environ.get("IMAGE_CAPTION_CACHE_SIZE", DEFAULT_MAX_CAPTIONS)))
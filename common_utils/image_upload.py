@@ -0,0 +1,70 @@
+"""
+Upload format for images sent by the browser.
+
+The vision wrapper never sends more than :data:`MAX_IMAGE_DIM` pixels on the
+long side, so uploading a full-resolution phone photo only wastes bandwidth,
+JSON parsing and memory. ``GET /config`` publishes :func:`client_config`;
+the pages downscale to that size and re-encode to WebP (JPEG where the
+browser cannot encode WebP) before upload. :func:`decode_upload` then keeps
+a compact upload as-is, with a file suffix that matches its real format.
+Uploads from older clients are still accepted and downscaled later by the
+vision wrapper.
+"""
+import base64
+import os
+from io import BytesIO
+from typing import Any, Dict, Tuple
+
+MAX_IMAGE_DIM = int(os.environ.get("IMAGE_MAX_DIM", "1024"))
+UPLOAD_QUALITY = float(os.environ.get("IMAGE_UPLOAD_QUALITY", "0.85"))
+MAX_UPLOAD_BYTES = 5 * 1024 * 1024
+UPLOAD_FORMATS = ("image/webp", "image/jpeg")
+
+# Pillow 格式名 -> 临时文件后缀（后缀决定发给视觉模型的 MIME 类型）
+_SUFFIXES = {"JPEG": ".jpg", "PNG": ".png", "WEBP": ".webp", "GIF": ".gif", "BMP": ".bmp"}
+
+
+class UploadError(ValueError):
+    """The upload is not an acceptable image; the message is shown to the user."""
+
+
+def client_config() -> Dict[str, Any]:
+    """Image upload settings for the browser (``GET /config``)."""
+    return {
+        "image": {
+            "max_dim": MAX_IMAGE_DIM,
+            "formats": list(UPLOAD_FORMATS),
+            "quality": UPLOAD_QUALITY,
+            "max_bytes": MAX_UPLOAD_BYTES,
+        }
+    }
+
+
+def decode_upload(image_data: str) -> Tuple[bytes, str]:
+    """``(image bytes, file suffix)`` of a base64 (data URL) upload.
+
+    Raises:
+        UploadError: the data is too large, not an image, or over 4096 px.
+    """
+    if image_data.startswith("data:"):
+        image_data = image_data.split(",", 1)[-1]
+    try:
+        image_binary = base64.b64decode(image_data)
+    except ValueError as exc:
+        raise UploadError(f"图片数据无法解码: {exc}") from exc
+    if len(image_binary) > MAX_UPLOAD_BYTES:
+        raise UploadError("图片文件过大：超过5MB限制")
+
+    # Pillow 在首次上传图片时才导入
+    from PIL import Image
+
+    try:
+        img = Image.open(BytesIO(image_binary))
+        size, image_format = img.size, img.format
+        img.verify()  # 验证图像完整性
+    except Exception as exc:
+        raise UploadError(f"无效的图像文件: {exc}") from exc
+    if max(size) > 4096:
+        raise UploadError("图片分辨率过高：超过 4K 限制，拒绝处理")
+    return image_binary, _SUFFIXES.get(image_format, ".jpg")
+
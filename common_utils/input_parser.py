@@ -0,0 +1,232 @@
+"""
+Compiled, single-pass parsing of chat requests.
+
+Every ``/chat`` request used to be scanned keyword list by keyword list: the
+KG routing check, the "give me the answers" check, the difficulty keywords,
+the question types, one ``in`` test per common topic and, for mind maps, 13
+sequential ``str.replace`` calls. :class:`KeywordMatcher` merges all of those
+keyword groups into one table scanned once per request; the regexes that
+remain (counts such as "3道选择题", "关于…的") are compiled once at import time
+and skipped when the text cannot match them.
+
+:class:`InputParser` turns the matches into the same parameters that
+``BaseAgent.parse_input_node`` used to compute with individual scans, and
+keeps recent results so the routing checks and the graph's parse node share
+one parse per request.
+"""
+import re
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Dict, FrozenSet, Iterable, Mapping, Sequence
+
+# 关键词分组
+KG_TRIGGERS = ("知识图谱", "思维导图", "mindmap", "图谱")
+KG_STRIP_KEYWORDS = ("知识图谱", "思维导图", "mindmap", "图谱", "生成", "制作", "构建", "画", "帮我", "请", "关于", "：", ":")
+ANSWER_KEYWORDS = ("解析", "答案", "讲解", "答案解析", "参考答案")
+QUIZ_KEYWORDS = ("出题", "生成题目", "题目", "选择题", "判断题", "简答题", "试题", "练习")
+EASY_KEYWORDS = ("简单", "容易", "基础")
+HARD_KEYWORDS = ("困难", "难", "高级")
+QUESTION_TYPES = ("选择题", "判断题", "简答题")
+MATERIAL_ANALYSIS = "材料分析"
+
+_DIGIT_RE = re.compile(r"\d")
+_WHITESPACE_RE = re.compile(r"\s+")
+_TYPE_COUNT_RE = re.compile(r"(\d+)\s*(?:道|题|个)[^\u4e00-\u9fa5]*?(选择题|判断题|简答题|材料\s*分析题?)")
+_COUNT_RE = re.compile(r"(\d+)\s*(?:道|题|个)")
+_ABOUT_RE = re.compile(r"关于(.*?)的")
+_ABOUT_CLEANUP_RE = re.compile(r"(简单|容易|基础|中等|困难|高级|选择题|判断题|简答题|材料\s*分析题?|题目|\s)")
+_FALLBACK_CLEANUP_RE = re.compile(r"\d+道|\d+题|请|给我|出|关于|的|简单|中等|困难|选择题|判断题|简答题|材料\s*分析题?|题目")
+
+
+def _alternation(keywords: Iterable[str]) -> str:
+    # 同一起点上较长的关键词排在前面，正则引擎取第一个命中的分支即为最长匹配
+    return "|".join(re.escape(k) for k in sorted(set(keywords), key=lambda k: (-len(k), k)))
+
+
+# 知识图谱主题抽取时删除的词；不参与关键词扫描
+_KG_STRIP_RE = re.compile(_alternation(KG_STRIP_KEYWORDS))
+
+
+class KeywordMatcher:
+    """Finds every keyword of several groups in one scan of the text.
+
+    All groups are merged into one de-duplicated keyword tuple, so a keyword
+    shared by several groups (e.g. "选择题") is tested once; each test is a C
+    substring search. The per-group alternations are compiled once and used
+    where only one group matters (routing).
+
+    Args:
+        groups: Mapping of group name to keywords. A keyword may belong to
+            several groups.
+    """
+
+    def __init__(self, groups: Mapping[str, Iterable[str]]):
+        self.groups: Dict[str, FrozenSet[str]] = {name: frozenset(k for k in kws if k) for name, kws in groups.items()}
+        self._keywords = tuple(sorted(frozenset().union(*self.groups.values())))
+        self._group_res = {name: re.compile(_alternation(kws)) for name, kws in self.groups.items() if kws}
+
+    def keywords_in(self, text: str) -> FrozenSet[str]:
+        """All keywords occurring in ``text``."""
+        return frozenset([k for k in self._keywords if k in text])
+
+    def search(self, text: str, group: str) -> bool:
+        """Whether any keyword of ``group`` occurs in ``text``."""
+        pattern = self._group_res.get(group)
+        return pattern is not None and pattern.search(text) is not None
+
+
+@dataclass
+class ParsedInput:
+    """Everything the front door needs to know about one request."""
+
+    text: str
+    keywords: FrozenSet[str]
+    is_kg_request: bool
+    is_answer_request: bool
+    is_quiz_request: bool
+    topic: str
+    num_questions: int
+    difficulty: str
+    question_type: str
+    question_type_counts: Dict[str, int]
+
+
+class InputParser:
+    """Parses chat requests for one subject.
+
+    Args:
+        common_topics: The subject's common topics; detected topics keep the
+            order of this list.
+        default_topic: Topic used when nothing can be extracted.
+        cache_size: Number of recent texts whose parse results are kept; the
+            routing check, the answer check and ``parse_input_node`` all look
+            at the same request text.
+    """
+
+    def __init__(self, common_topics: Sequence[str] = (), default_topic: str = "", cache_size: int = 1024):
+        self.common_topics = tuple(common_topics)
+        self.default_topic = default_topic
+        self.parse = lru_cache(maxsize=cache_size)(self._parse)
+        self.matcher = KeywordMatcher({
+            "topic": self.common_topics,
+            "kg": KG_TRIGGERS,
+            "answer": ANSWER_KEYWORDS,
+            "quiz": QUIZ_KEYWORDS,
+            "easy": EASY_KEYWORDS,
+            "hard": HARD_KEYWORDS,
+            "type": QUESTION_TYPES + (MATERIAL_ANALYSIS,),
+        })
+        self._groups = self.matcher.groups
+
+    # 路由判断只关心一组关键词：一次预编译的正则搜索比完整解析便宜得多
+    def is_kg_request(self, text: str) -> bool:
+        return self.matcher.search(text, "kg")
+
+    def is_answer_request(self, text: str) -> bool:
+        return self.matcher.search(text, "answer")
+
+    def is_quiz_request(self, text: str) -> bool:
+        return self.matcher.search(text, "quiz")
+
+    def extract_kg_topic(self, text: str) -> str:
+        """The mind-map topic: ``text`` without trigger words and leading punctuation."""
+        topic = _KG_STRIP_RE.sub("", text)
+        if _KG_STRIP_RE.search(topic):
+            # 删除后拼出了新的关键词（如“图mindmap谱”）：按原先逐个 replace 的语义处理
+            topic = text
+            for keyword in KG_STRIP_KEYWORDS:
+                topic = topic.replace(keyword, "")
+        topic = topic.strip().lstrip("，,。 、")
+        return topic if topic else text
+
+    def _parse(self, text: str) -> ParsedInput:
+        """Parses ``text``; called through the cached :attr:`parse`.
+
+        The result is shared between callers: treat it, including
+        ``question_type_counts``, as read-only.
+        """
+        keywords = self.matcher.keywords_in(text)
+        has_digit = _DIGIT_RE.search(text) is not None
+
+        # --- 题型与数量 ---
+        question_type_counts: Dict[str, int] = {}
+        if has_digit and ("题" in text or "材料" in text):
+            for num_str, q_type_raw in _TYPE_COUNT_RE.findall(_WHITESPACE_RE.sub("", text)):
+                q_type = q_type_raw.replace("材料分析题", "简答题").replace("材料分析", "简答题")
+                question_type_counts[q_type] = question_type_counts.get(q_type, 0) + int(num_str)
+
+        if question_type_counts:
+            num_questions = sum(question_type_counts.values())
+        else:
+            numbers = _COUNT_RE.findall(text) if has_digit else None
+            num_questions = sum(int(n) for n in numbers) if numbers else 5
+
+        # --- 难度 ---
+        groups = self._groups
+        if not keywords.isdisjoint(groups["easy"]):
+            difficulty = "简单"
+        elif not keywords.isdisjoint(groups["hard"]):
+            difficulty = "困难"
+        else:
+            difficulty = "中等"
+
+        detected_types = [
+            qt for qt in QUESTION_TYPES
+            if qt in keywords or (qt == "简答题" and MATERIAL_ANALYSIS in keywords)
+        ] if not question_type_counts else ()
+        if detected_types:
+            avg_count = max(1, num_questions // len(detected_types))
+            for qt in detected_types:
+                question_type_counts[qt] = avg_count
+
+        if len(question_type_counts) > 1:
+            question_type = "混合"
+        elif len(question_type_counts) == 1:
+            question_type = next(iter(question_type_counts))
+        else:
+            question_type = "选择题"
+            question_type_counts = {"选择题": num_questions}
+
+        # --- 主题 ---
+        detected_topics = [t for t in self.common_topics if t in keywords]
+        for raw in (_ABOUT_RE.findall(text) if "关于" in text else ()):
+            cleaned = _ABOUT_CLEANUP_RE.sub("", raw).strip()
+            if cleaned:
+                detected_topics.append(cleaned)
+        ordered_topics = list(dict.fromkeys(detected_topics)) if detected_topics else None
+        if not ordered_topics:
+            fallback_topic = _FALLBACK_CLEANUP_RE.sub("", text).strip()
+            ordered_topics = [fallback_topic if fallback_topic else self.default_topic]
+
+        return ParsedInput(
+            text=text,
+            keywords=keywords,
+            is_kg_request=not keywords.isdisjoint(groups["kg"]),
+            is_answer_request=not keywords.isdisjoint(groups["answer"]),
+            is_quiz_request=not keywords.isdisjoint(groups["quiz"]),
+            topic="; ".join(ordered_topics),
+            num_questions=num_questions,
+            difficulty=difficulty,
+            question_type=question_type,
+            question_type_counts=question_type_counts,
+        )
+
+
+# 不依赖学科主题的路由判断（/chat 入口、知识图谱主题抽取）共用此实例
+DEFAULT_PARSER = InputParser()
+
+
+def is_kg_request(text: str) -> bool:
+    return DEFAULT_PARSER.is_kg_request(text)
+
+
+def is_answer_request(text: str) -> bool:
+    return DEFAULT_PARSER.is_answer_request(text)
+
+
+def is_quiz_request(text: str) -> bool:
+    return DEFAULT_PARSER.is_quiz_request(text)
+
+
+def extract_kg_topic(text: str) -> str:
+    return DEFAULT_PARSER.extract_kg_topic(text)
@@ -0,0 +1,367 @@
+"""
+SQLite-backed job queue for long generations.
+
+``/chat`` normally holds the HTTP request open for the whole workflow; a
+20-question paper or a mindmap can outlast proxy timeouts and ties up a web
+thread per request during bursts. With a :class:`JobQueue` the request is
+stored as a job and answered at once with its ID; a bounded pool of worker
+threads per process runs the jobs in submission order, and clients poll
+``/jobs/<id>`` (or subscribe to ``/jobs/<id>/events``) for the result.
+
+Jobs live in SQLite, so every worker process on the host shares one queue
+and queued jobs survive restarts. While a job runs, its process refreshes
+the job's heartbeat; a job whose worker process died (or whose heartbeat is
+older than ``lease_seconds``) is requeued once, then marked failed. Results
+are only stored by the process that still owns the job.
+
+:func:`create_job_queue` reads the configuration from environment variables.
+"""
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from collections import deque
+from typing import Any, Callable, Dict, List, Optional
+
+QUEUED, RUNNING, DONE, ERROR = "queued", "running", "done", "error"
+FINISHED = (DONE, ERROR)
+
+DEFAULT_WORKERS = 2
+DEFAULT_RETENTION_SECONDS = 24 * 60 * 60
+DEFAULT_LEASE_SECONDS = 15 * 60
+
+Handler = Callable[[Dict[str, Any]], Dict[str, Any]]
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class JobQueue:
+    """Persistent FIFO of jobs, executed by worker threads in every process.
+
+    Args:
+        path: SQLite database file shared by the worker processes.
+        handlers: Job kind -> function ``payload -> result``; results must be
+            JSON-serialisable. An exception marks the job failed.
+        workers: Worker threads per process.
+        retention_seconds: Finished jobs older than this are purged.
+        lease_seconds: A running job whose last heartbeat is older than this
+            is assumed lost; heartbeats are sent every third of it.
+        max_attempts: Runs a job gets before an interrupted job is failed.
+        poll_interval: Seconds between checks for jobs submitted or finished
+            by other processes.
+    """
+
+    _PURGE_EVERY = 200
+
+    def __init__(
+        self,
+        path: str,
+        handlers: Dict[str, Handler],
+        workers: int = DEFAULT_WORKERS,
+        retention_seconds: float = DEFAULT_RETENTION_SECONDS,
+        lease_seconds: float = DEFAULT_LEASE_SECONDS,
+        max_attempts: int = 2,
+        poll_interval: float = 1.0,
+    ):
+        self.path = path
+        self.handlers = dict(handlers)
+        self.workers = max(1, workers)
+        self.retention_seconds = retention_seconds
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max(1, max_attempts)
+        self.poll_interval = poll_interval
+
+        self._lock = threading.Lock()
+        self._work = threading.Condition()
+        self._finished = threading.Condition()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._conn_pid: Optional[int] = None
+        self._threads_pid: Optional[int] = None
+        self._submits = 0
+        self._last_recovery = 0.0
+        self._waits: deque = deque(maxlen=500)
+        self._runs: deque = deque(maxlen=500)
+        self._counts = {"submitted": 0, "completed": 0, "failed": 0, "requeued": 0}
+
+    # ------------------------------------------------------------------
+    # Storage
+    # ------------------------------------------------------------------
+
+    def _connection(self) -> sqlite3.Connection:
+        """Returns this process's connection (callers must hold ``_lock``).
+
+        The queue may be created in a pre-fork master; SQLite connections must
+        not cross ``fork()``, so each process opens its own lazily.
+        """
+        if self._conn is None or self._conn_pid != os.getpid():
+            conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+            with conn:
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS jobs ("
+                    " id TEXT PRIMARY KEY,"
+                    " kind TEXT NOT NULL,"
+                    " payload TEXT NOT NULL,"
+                    " status TEXT NOT NULL,"
+                    " result TEXT,"
+                    " error TEXT,"
+                    " owner TEXT,"
+                    " attempts INTEGER NOT NULL DEFAULT 0,"
+                    " created_at REAL NOT NULL,"
+                    " started_at REAL,"
+                    " heartbeat_at REAL,"
+                    " finished_at REAL)"
+                )
+                columns = {row[1] for row in conn.execute("PRAGMA table_info(jobs)")}
+                if "heartbeat_at" not in columns:  # 旧版本创建的队列文件
+                    conn.execute("ALTER TABLE jobs ADD COLUMN heartbeat_at REAL")
+                conn.execute("CREATE INDEX IF NOT EXISTS jobs_status_created ON jobs (status, created_at)")
+            self._conn, self._conn_pid = conn, os.getpid()
+        return self._conn
+
+    @staticmethod
+    def _owner() -> str:
+        return f"{socket.gethostname()}:{os.getpid()}"
+
+    def submit(self, kind: str, payload: Dict[str, Any]) -> str:
+        """Stores a job and wakes a worker; returns the job ID."""
+        if kind not in self.handlers:
+            raise ValueError(f"Unknown job kind: {kind}")
+        self.start()
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._lock:
+            conn = self._connection()
+            with conn:
+                conn.execute(
+                    "INSERT INTO jobs (id, kind, payload, status, created_at) VALUES (?, ?, ?, ?, ?)",
+                    (job_id, kind, json.dumps(payload, ensure_ascii=False), QUEUED, now),
+                )
+                self._submits += 1
+                self._counts["submitted"] += 1
+                if self._submits % self._PURGE_EVERY == 0:
+                    conn.execute(
+                        "DELETE FROM jobs WHERE status IN (?, ?) AND finished_at < ?",
+                        (DONE, ERROR, now - self.retention_seconds),
+                    )
+        with self._work:
+            self._work.notify()
+        return job_id
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """The job's status and, once finished, its result or error; ``None`` if unknown."""
+        with self._lock:
+            conn = self._connection()
+            row = conn.execute(
+                "SELECT kind, status, result, error, created_at, started_at, finished_at FROM jobs WHERE id = ?",
+                (job_id,),
+            ).fetchone()
+            if row is None:
+                return None
+            kind, status, result, error, created_at, started_at, finished_at = row
+            job: Dict[str, Any] = {"job_id": job_id, "kind": kind, "status": status, "created_at": created_at}
+            if status == QUEUED:
+                job["position"] = conn.execute(
+                    "SELECT COUNT(*) FROM jobs WHERE status = ? AND created_at < ?", (QUEUED, created_at)
+                ).fetchone()[0]
+        if started_at is not None:
+            job["started_at"] = started_at
+        if status in FINISHED:
+            job["finished_at"] = finished_at
+            if result is not None:
+                job["result"] = json.loads(result)
+            if error is not None:
+                job["error"] = error
+        return job
+
+    def wait(self, job_id: str, timeout: float) -> Optional[Dict[str, Any]]:
+        """Blocks until the job finishes or ``timeout`` elapses; returns its latest state."""
+        deadline = time.monotonic() + timeout
+        while True:
+            job = self.get(job_id)
+            remaining = deadline - time.monotonic()
+            if job is None or job["status"] in FINISHED or remaining <= 0:
+                return job
+            # 本进程完成的任务会立即唤醒；其他进程完成的任务靠轮询发现
+            with self._finished:
+                self._finished.wait(min(remaining, self.poll_interval))
+
+    # ------------------------------------------------------------------
+    # Workers
+    # ------------------------------------------------------------------
+
+    def start(self) -> None:
+        """Starts this process's worker threads (idempotent; safe after ``fork()``)."""
+        if self._threads_pid == os.getpid():
+            return
+        with self._work:
+            if self._threads_pid == os.getpid():
+                return
+            self._threads_pid = os.getpid()
+            self._recover()
+            for i in range(self.workers):
+                threading.Thread(target=self._run, name=f"job-worker-{i}", daemon=True).start()
+            threading.Thread(target=self._heartbeat, name="job-heartbeat", daemon=True).start()
+        print(f"[JobQueue] {self.workers} workers started (pid {os.getpid()}).")
+
+    def _recover(self) -> None:
+        """Requeues jobs whose worker process died or whose lease expired."""
+        now = time.time()
+        self._last_recovery = now
+        host = socket.gethostname()
+        with self._lock:
+            conn = self._connection()
+            rows = conn.execute(
+                "SELECT id, owner, attempts, COALESCE(heartbeat_at, started_at) FROM jobs WHERE status = ?",
+                (RUNNING,),
+            ).fetchall()
+            lost: List[tuple] = []
+            for job_id, owner, attempts, heartbeat_at in rows:
+                owner_host, _, owner_pid = (owner or "").rpartition(":")
+                dead = owner_host == host and owner_pid.isdigit() and not _pid_alive(int(owner_pid))
+                if dead or now - (heartbeat_at or now) > self.lease_seconds:
+                    lost.append((job_id, attempts))
+            with conn:
+                for job_id, attempts in lost:
+                    if attempts < self.max_attempts:
+                        conn.execute(
+                            "UPDATE jobs SET status = ?, owner = NULL, started_at = NULL, heartbeat_at = NULL"
+                            " WHERE id = ? AND status = ?",
+                            (QUEUED, job_id, RUNNING),
+                        )
+                        self._counts["requeued"] += 1
+                    else:
+                        conn.execute(
+                            "UPDATE jobs SET status = ?, error = ?, finished_at = ? WHERE id = ? AND status = ?",
+                            (ERROR, "任务执行中断", now, job_id, RUNNING),
+                        )
+        if lost:
+            print(f"[JobQueue] Recovered {len(lost)} interrupted jobs.")
+
+    def _claim(self) -> Optional[tuple]:
+        """Atomically marks the oldest queued job as running by this process."""
+        with self._lock:
+            conn = self._connection()
+            with conn:
+                return conn.execute(
+                    "UPDATE jobs SET status = ?, owner = ?, started_at = ?, heartbeat_at = started_at,"
+                    " attempts = attempts + 1"
+                    " WHERE id = (SELECT id FROM jobs WHERE status = ? ORDER BY created_at LIMIT 1)"
+                    " RETURNING id, kind, payload, created_at, started_at, attempts",
+                    (RUNNING, self._owner(), time.time(), QUEUED),
+                ).fetchone()
+
+    def _heartbeat(self) -> None:
+        """Keeps the lease of every job this process is running from expiring."""
+        while True:
+            time.sleep(self.lease_seconds / 3)
+            try:
+                with self._lock:
+                    conn = self._connection()
+                    with conn:
+                        conn.execute(
+                            "UPDATE jobs SET heartbeat_at = ? WHERE status = ? AND owner = ?",
+                            (time.time(), RUNNING, self._owner()),
+                        )
+            except sqlite3.Error as e:
+                print(f"[JobQueue] Failed to refresh job heartbeats: {e}")
+
+    def _finish(self, job_id: str, attempt: int, result: Optional[Dict[str, Any]], error: Optional[str]) -> None:
+        with self._lock:
+            conn = self._connection()
+            with conn:
+                stored = conn.execute(
+                    "UPDATE jobs SET status = ?, result = ?, error = ?, finished_at = ?"
+                    " WHERE id = ? AND status = ? AND owner = ? AND attempts = ?",
+                    (
+                        ERROR if error is not None else DONE,
+                        None if result is None else json.dumps(result, ensure_ascii=False),
+                        error,
+                        time.time(),
+                        job_id,
+                        RUNNING,
+                        self._owner(),
+                        attempt,
+                    ),
+                ).rowcount
+            if not stored:
+                # 任务已被判定中断并重新排队（可能已由其他进程或本进程的另一线程重跑），不覆盖其状态
+                print(f"[JobQueue] Job {job_id} was requeued while running; result discarded.")
+                return
+            self._counts["failed" if error is not None else "completed"] += 1
+        with self._finished:
+            self._finished.notify_all()
+
+    def _run(self) -> None:
+        while True:
+            try:
+                if time.time() - self._last_recovery > self.lease_seconds / 2:
+                    self._recover()
+                job = self._claim()
+            except sqlite3.Error as e:
+                print(f"[JobQueue] Failed to read the queue: {e}")
+                job = None
+            if job is None:
+                with self._work:
+                    self._work.wait(self.poll_interval)
+                continue
+
+            job_id, kind, payload, created_at, started_at, attempt = job
+            self._waits.append(started_at - created_at)
+            start = time.perf_counter()
+            try:
+                result, error = self.handlers[kind](json.loads(payload)), None
+            except Exception as e:
+                print(f"[JobQueue] Job {job_id} ({kind}) failed: {e}")
+                result, error = None, str(e)
+            self._runs.append(time.perf_counter() - start)
+            try:
+                self._finish(job_id, attempt, result, error)
+            except sqlite3.Error as e:
+                print(f"[JobQueue] Failed to store the result of job {job_id}: {e}")
+
+    def metrics(self) -> Dict[str, Any]:
+        """Queue depth from the database plus this process's counters and timings."""
+        with self._lock:
+            by_status = dict(self._connection().execute(
+                "SELECT status, COUNT(*) FROM jobs GROUP BY status"
+            ).fetchall())
+            result: Dict[str, Any] = dict(self._counts)
+        result["queued"] = by_status.get(QUEUED, 0)
+        result["running"] = by_status.get(RUNNING, 0)
+        waits, runs = sorted(self._waits), sorted(self._runs)
+        quantile = lambda xs, q: round(xs[min(len(xs) - 1, int(q * len(xs)))], 3) if xs else None  # noqa: E731
+        result["queue_wait_p50"] = quantile(waits, 0.5)
+        result["queue_wait_p95"] = quantile(waits, 0.95)
+        result["run_p50"] = quantile(runs, 0.5)
+        result["run_p95"] = quantile(runs, 0.95)
+        return result
+
+
+def create_job_queue(handlers: Dict[str, Handler]) -> JobQueue:
+    """Creates the job queue configured by environment variables.
+
+    - ``JOB_QUEUE_PATH``: SQLite database file (default ``job_queue.sqlite3``).
+    - ``JOB_WORKERS``: worker threads per process (default 2).
+    - ``JOB_RETENTION``: seconds finished jobs stay retrievable.
+    - ``JOB_LEASE``: seconds without a heartbeat after which a running job
+      is considered lost.
+    """
+    return JobQueue(
+        os.environ.get("JOB_QUEUE_PATH", "job_queue.sqlite3"),
+        handlers,
+        workers=int(os.environ.get("JOB_WORKERS", DEFAULT_WORKERS)),
+        retention_seconds=float(os.environ.get("JOB_RETENTION", DEFAULT_RETENTION_SECONDS)),
+        lease_seconds=float(os.environ.get("JOB_LEASE", DEFAULT_LEASE_SECONDS)),
+    )
@@ -0,0 +1,93 @@
+"""
+Lazy, thread-safe construction of heavy agents.
+
+Agents load FAISS indexes, create LLM clients and compile LangGraph workflows
+in their constructors. Building all of them when ``app.py`` is imported makes
+every worker pay several seconds of start-up before it can serve a request.
+:class:`LazyAgent` defers construction until the first time an agent is
+actually needed and can optionally warm agents up in a background thread.
+"""
+import threading
+import time
+from typing import Callable, Generic, Optional, TypeVar
+
+T = TypeVar("T")
+
+
+class LazyAgent(Generic[T]):
+    """Builds an agent on first use and caches the instance (or the failure).
+
+    Args:
+        name: Display name used in log messages (e.g. "MayuanQuestionAgent").
+        factory: Zero-argument callable that imports and constructs the agent.
+            Heavy imports should live inside the factory so that merely
+            importing the module holding the ``LazyAgent`` stays cheap.
+    """
+
+    def __init__(self, name: str, factory: Callable[[], T]):
+        self.name = name
+        self._factory = factory
+        self._lock = threading.Lock()
+        self._instance: Optional[T] = None
+        self._error: Optional[Exception] = None
+        self._loaded = False
+        self.load_seconds: Optional[float] = None
+
+    @property
+    def loaded(self) -> bool:
+        """Whether construction has been attempted (successfully or not)."""
+        return self._loaded
+
+    @property
+    def error(self) -> Optional[Exception]:
+        """The exception raised by the factory, if construction failed."""
+        return self._error
+
+    def get(self) -> Optional[T]:
+        """Returns the agent, constructing it on first call.
+
+        Construction failures are logged and cached so that a broken agent
+        does not retry (and re-pay the start-up cost) on every request.
+        ``None`` is returned in that case, mirroring the previous behaviour
+        of ``app.py`` where a failed agent was stored as ``None``.
+        """
+        if self._loaded:
+            return self._instance
+
+        with self._lock:
+            if not self._loaded:
+                start = time.perf_counter()
+                try:
+                    self._instance = self._factory()
+                    print(f"{self.name} loaded successfully.")
+                except Exception as e:
+                    self._error = e
+                    self._instance = None
+                    print(f"Error loading {self.name}: {e}")
+                self.load_seconds = time.perf_counter() - start
+                self._loaded = True
+        return self._instance
+
+    def warm_up(self, background: bool = True) -> Optional[threading.Thread]:
+        """Constructs the agent ahead of the first request.
+
+        Args:
+            background: When ``True`` the agent is built in a daemon thread and
+                the thread is returned; otherwise construction happens inline.
+        """
+        if not background:
+            self.get()
+            return None
+        thread = threading.Thread(target=self.get, name=f"warmup-{self.name}", daemon=True)
+        thread.start()
+        return thread
+
+
+def warm_up_all(agents, background: bool = True) -> list:
+    """Warms up several :class:`LazyAgent` instances, returning started threads."""
+    threads = []
+    for agent in agents:
+        thread = agent.warm_up(background=background)
+        if thread is not None:
+            threads.append(thread)
+    return threads
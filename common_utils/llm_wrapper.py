@@ -1,8 +1,17 @@
 import os
-from typing import Any, List, Optional, Union
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple, Union
 import base64
 
 import dashscope
+import requests
+from langchain_dashscope.embeddings import DashScopeEmbeddings
 from langchain_core.language_models.chat_models import BaseChatModel
 from langchain_core.messages import (
     AIMessage,
@@ -14,6 +23,9 @@ from langchain_core.outputs import ChatGeneration, ChatResult
 
 import logging
 
+from .image_upload import MAX_IMAGE_DIM
+from .singleflight import SingleFlight, request_key
+
 # Set up API key for DashScope SDK
 api_key = os.environ.get("DASHSCOPE_API_KEY")
 if api_key:
@@ -23,6 +35,488 @@ if api_key:
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
 
+# Identical concurrent requests (same model / messages / temperature, or same
+# embedding text) share one upstream call; see common_utils/singleflight.py.
+_CHAT_FLIGHTS = SingleFlight("chat")
+_EMBEDDING_FLIGHTS = SingleFlight("embeddings")
+
+
+# =============================================================================
+# Client-side rate limiting and adaptive concurrency
+# =============================================================================
+# Every outbound DashScope call (chat, vision, embedding) passes through the
+# ModelThrottle of its model. A token bucket caps the request rate and an AIMD
+# limiter adapts the number of in-flight calls: it grows by roughly one slot
+# per window of successful calls and halves whenever the provider throttles us
+# (HTTP 429 / "Throttling*" codes). Callers queue until a slot is free or their
+# deadline expires.
+
+# Default (requests per second, max concurrent calls) per model. Override with
+# e.g. DASHSCOPE_QPS_QWEN_MAX=10 and DASHSCOPE_CONCURRENCY_QWEN_MAX=16.
+_DEFAULT_MODEL_BUDGETS: Dict[str, Tuple[float, int]] = {
+    "qwen-max": (5.0, 8),
+    "qwen-vl-max": (2.0, 4),
+    "qwen-turbo": (10.0, 16),
+    "text-embedding-v2": (10.0, 8),
+}
+_FALLBACK_BUDGET: Tuple[float, int] = (5.0, 8)
+DEFAULT_QUEUE_TIMEOUT = float(os.environ.get("DASHSCOPE_QUEUE_TIMEOUT", "60"))
+
+
+class DeadlineExceeded(Exception):
+    """Raised when a call cannot finish before its deadline."""
+
+
+class ThrottleTimeout(DeadlineExceeded):
+    """Raised when a call could not obtain a slot before its deadline."""
+
+
+def is_throttling_response(response: Any) -> bool:
+    """Whether a DashScope response signals provider-side throttling."""
+    if getattr(response, "status_code", None) == 429:
+        return True
+    code = str(getattr(response, "code", "") or "")
+    return code.startswith("Throttling")
+
+
+class TokenBucket:
+    """Classic token bucket: ``rate`` tokens per second, bursts up to ``capacity``."""
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, deadline: float) -> None:
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            if now + wait > deadline:
+                raise ThrottleTimeout("rate limit queue deadline exceeded")
+            time.sleep(wait)
+
+
+class AIMDLimiter:
+    """Concurrency limit with additive increase / multiplicative decrease."""
+
+    def __init__(self, initial: int, min_limit: int = 1, max_limit: Optional[int] = None, decrease: float = 0.5):
+        self.limit = float(initial)
+        self.min_limit = min_limit
+        self.max_limit = max_limit if max_limit is not None else initial
+        self.decrease = decrease
+        self.inflight = 0
+        self._cond = threading.Condition()
+
+    def acquire(self, deadline: float) -> None:
+        with self._cond:
+            while self.inflight >= int(self.limit):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise ThrottleTimeout("concurrency queue deadline exceeded")
+                self._cond.wait(remaining)
+            self.inflight += 1
+
+    def release(self, throttled: bool) -> None:
+        with self._cond:
+            self.inflight -= 1
+            if throttled:
+                self.limit = max(self.min_limit, self.limit * self.decrease)
+            else:
+                self.limit = min(self.max_limit, self.limit + 1.0 / max(self.limit, 1.0))
+            self._cond.notify_all()
+
+
+class _Slot:
+    """Handle yielded by :meth:`ModelThrottle.slot`; callers flag throttled responses on it."""
+
+    __slots__ = ("throttled",)
+
+    def __init__(self):
+        self.throttled = False
+
+
+class ModelThrottle:
+    """Rate limit + adaptive concurrency + queue-wait metrics for one model."""
+
+    def __init__(self, model: str, rate: float, max_concurrency: int):
+        self.model = model
+        self.bucket = TokenBucket(rate)
+        self.limiter = AIMDLimiter(initial=max_concurrency, max_limit=max_concurrency)
+        self._lock = threading.Lock()
+        self._waits: deque = deque(maxlen=1000)
+        self._calls = 0
+        self._throttled = 0
+        self._timeouts = 0
+        self._total_wait = 0.0
+
+    @contextmanager
+    def slot(self, timeout: Optional[float] = None, optional: bool = False) -> Iterator[_Slot]:
+        """Waits for a rate token and a concurrency slot, then runs the body.
+
+        ``optional`` callers (e.g. hedged requests) do not queue at all: they
+        get a slot only if one is free right now.
+
+        Raises:
+            ThrottleTimeout: if no slot is available within ``timeout`` seconds.
+        """
+        start = time.monotonic()
+        if optional:
+            deadline = start
+        else:
+            deadline = start + (DEFAULT_QUEUE_TIMEOUT if timeout is None else timeout)
+        try:
+            self.bucket.acquire(deadline)
+            self.limiter.acquire(deadline)
+        except ThrottleTimeout:
+            if not optional:
+                with self._lock:
+                    self._timeouts += 1
+            raise
+        waited = time.monotonic() - start
+        with self._lock:
+            self._calls += 1
+            self._total_wait += waited
+            self._waits.append(waited)
+
+        handle = _Slot()
+        try:
+            yield handle
+        finally:
+            if handle.throttled:
+                with self._lock:
+                    self._throttled += 1
+            self.limiter.release(handle.throttled)
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            waits = sorted(self._waits)
+            calls, throttled, timeouts, total_wait = self._calls, self._throttled, self._timeouts, self._total_wait
+
+        def pct(p: float) -> float:
+            return round(waits[min(len(waits) - 1, int(p * len(waits)))], 4) if waits else 0.0
+
+        return {
+            "calls": calls,
+            "throttled": throttled,
+            "queue_timeouts": timeouts,
+            "concurrency_limit": round(self.limiter.limit, 2),
+            "inflight": self.limiter.inflight,
+            "queue_wait_avg": round(total_wait / calls, 4) if calls else 0.0,
+            "queue_wait_p50": pct(0.5),
+            "queue_wait_p95": pct(0.95),
+            "queue_wait_max": round(waits[-1], 4) if waits else 0.0,
+        }
+
+
+_THROTTLES: Dict[str, ModelThrottle] = {}
+_THROTTLES_LOCK = threading.Lock()
+
+
+def _budget_for(model: str) -> Tuple[float, int]:
+    rate, concurrency = _DEFAULT_MODEL_BUDGETS.get(model, _FALLBACK_BUDGET)
+    env_key = model.upper().replace("-", "_").replace(".", "_")
+    rate = float(os.environ.get(f"DASHSCOPE_QPS_{env_key}", rate))
+    concurrency = int(os.environ.get(f"DASHSCOPE_CONCURRENCY_{env_key}", concurrency))
+    return rate, concurrency
+
+
+def get_throttle(model: str) -> ModelThrottle:
+    """Returns the process-wide throttle shared by every caller of ``model``."""
+    throttle = _THROTTLES.get(model)
+    if throttle is None:
+        with _THROTTLES_LOCK:
+            throttle = _THROTTLES.get(model)
+            if throttle is None:
+                rate, concurrency = _budget_for(model)
+                throttle = ModelThrottle(model, rate, concurrency)
+                _THROTTLES[model] = throttle
+    return throttle
+
+
+def throttle_metrics() -> Dict[str, Dict[str, Any]]:
+    """Queue-wait / throttling metrics for every model used so far."""
+    return {model: throttle.metrics() for model, throttle in list(_THROTTLES.items())}
+
+
+# =============================================================================
+# Retries, deadlines and hedged requests
+# =============================================================================
+# resilient_call() wraps one logical DashScope request: transient failures
+# (429, 5xx, network errors) are retried with full-jitter exponential backoff
+# until the attempt budget or the per-call deadline runs out. With hedging
+# enabled, a second identical request is sent once the first one has been
+# outstanding longer than the model's observed p95 latency, and whichever
+# succeeds first wins. Every attempt (including hedges) goes through the
+# model's throttle, so retries never bypass the rate limit.
+
+RETRYABLE_STATUS_CODES = frozenset({429, 500, 502, 503, 504})
+_RETRYABLE_CODE_PREFIXES = ("Throttling", "InternalError", "ServiceUnavailable", "RequestTimeOut", "SystemError")
+
+
+class DashScopeAPIError(Exception):
+    """A non-200 DashScope response, classified as retryable or not."""
+
+    def __init__(self, status_code: Any, code: Any, message: Any, request_id: Any = None):
+        self.status_code = status_code
+        self.code = str(code or "")
+        self.message = str(message or "")
+        self.request_id = request_id
+        super().__init__(f"DashScope API Error: Status {status_code}, Code {code} , Message {message}")
+
+    @classmethod
+    def from_response(cls, response: Any) -> "DashScopeAPIError":
+        return cls(
+            getattr(response, "status_code", "unknown"),
+            getattr(response, "code", "unknown"),
+            getattr(response, "message", "unknown"),
+            getattr(response, "request_id", None),
+        )
+
+    @property
+    def retryable(self) -> bool:
+        return self.status_code in RETRYABLE_STATUS_CODES or self.code.startswith(_RETRYABLE_CODE_PREFIXES)
+
+
+def is_retryable_error(exc: BaseException) -> bool:
+    """Whether retrying the request that raised ``exc`` may succeed."""
+    if isinstance(exc, DashScopeAPIError):
+        return exc.retryable
+    if isinstance(exc, DeadlineExceeded):
+        # 已经排队 / 等待到截止时间，再重试只会更慢
+        return False
+    return isinstance(exc, (ConnectionError, TimeoutError, requests.exceptions.RequestException))
+
+
+@dataclass
+class RetryPolicy:
+    """Attempt budget, backoff and hedging settings for :func:`resilient_call`."""
+
+    max_attempts: int = 3
+    base_delay: float = 0.5
+    max_delay: float = 8.0
+    deadline: float = 90.0
+    hedge: bool = False
+    hedge_quantile: float = 0.95
+    hedge_min_samples: int = 20
+
+    @classmethod
+    def from_env(cls) -> "RetryPolicy":
+        """Reads ``DASHSCOPE_MAX_ATTEMPTS``, ``DASHSCOPE_CALL_DEADLINE`` and ``DASHSCOPE_HEDGE``."""
+        return cls(
+            max_attempts=int(os.environ.get("DASHSCOPE_MAX_ATTEMPTS", cls.max_attempts)),
+            deadline=float(os.environ.get("DASHSCOPE_CALL_DEADLINE", cls.deadline)),
+            hedge=os.environ.get("DASHSCOPE_HEDGE", "0") == "1",
+        )
+
+    def backoff(self, attempt: int) -> float:
+        """Full-jitter exponential backoff before retry number ``attempt`` (1-based)."""
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** (attempt - 1))))
+
+
+DEFAULT_RETRY_POLICY = RetryPolicy.from_env()
+
+
+class CallStats:
+    """Per-model latency samples and retry / hedge counters."""
+
+    def __init__(self, window: int = 500):
+        self._lock = threading.Lock()
+        self._latencies: deque = deque(maxlen=window)
+        self.requests = 0
+        self.retries = 0
+        self.failures = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.input_tokens = 0
+        self.cached_tokens = 0
+
+    def incr(self, counter: str) -> None:
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def record_latency(self, seconds: float) -> None:
+        with self._lock:
+            self._latencies.append(seconds)
+
+    def record_usage(self, usage: Any) -> None:
+        """Adds prompt tokens and provider-side cache hits from a response's ``usage``."""
+        if not usage:
+            return
+        try:
+            details = usage.get("prompt_tokens_details") or {}
+            input_tokens = int(usage.get("input_tokens") or 0)
+            cached_tokens = int(details.get("cached_tokens") or 0)
+        except (AttributeError, TypeError, ValueError):
+            return
+        with self._lock:
+            self.input_tokens += input_tokens
+            self.cached_tokens += cached_tokens
+
+    def latency_quantile(self, q: float, min_samples: int = 1) -> Optional[float]:
+        with self._lock:
+            if len(self._latencies) < max(1, min_samples):
+                return None
+            ordered = sorted(self._latencies)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    def metrics(self) -> Dict[str, Any]:
+        p50, p95 = self.latency_quantile(0.5), self.latency_quantile(0.95)
+        return {
+            "requests": self.requests,
+            "retries": self.retries,
+            "failures": self.failures,
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+            "input_tokens": self.input_tokens,
+            "cached_tokens": self.cached_tokens,
+            "latency_p50": round(p50, 4) if p50 is not None else None,
+            "latency_p95": round(p95, 4) if p95 is not None else None,
+        }
+
+
+_CALL_STATS: Dict[str, CallStats] = {}
+_CALL_STATS_LOCK = threading.Lock()
+_HEDGE_POOL: Optional[ThreadPoolExecutor] = None
+_HEDGE_POOL_PID: Optional[int] = None
+_HEDGE_POOL_LOCK = threading.Lock()
+
+
+def _stats_for(model: str) -> CallStats:
+    stats = _CALL_STATS.get(model)
+    if stats is None:
+        with _CALL_STATS_LOCK:
+            stats = _CALL_STATS.setdefault(model, CallStats())
+    return stats
+
+
+def call_metrics() -> Dict[str, Dict[str, Any]]:
+    """Retry / hedge counters and upstream latency for every model used so far."""
+    return {model: stats.metrics() for model, stats in list(_CALL_STATS.items())}
+
+
+def _hedge_pool() -> ThreadPoolExecutor:
+    """Executor running hedged attempts; recreated after ``fork()`` (threads do not survive it)."""
+    global _HEDGE_POOL, _HEDGE_POOL_PID
+    with _HEDGE_POOL_LOCK:
+        if _HEDGE_POOL is None or _HEDGE_POOL_PID != os.getpid():
+            workers = int(os.environ.get("DASHSCOPE_HEDGE_WORKERS", "32"))
+            _HEDGE_POOL = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="dashscope-hedge")
+            _HEDGE_POOL_PID = os.getpid()
+        return _HEDGE_POOL
+
+
+def _attempt(
+    model: str,
+    fn,
+    deadline: float,
+    kwargs: Dict[str, Any],
+    on_dispatch: Optional[Callable[[], None]] = None,
+    optional: bool = False,
+):
+    """One throttled request; returns a 200 response or raises.
+
+    ``on_dispatch`` is called once the request has a throttle slot and is
+    actually sent upstream.
+    """
+    remaining = deadline - time.monotonic()
+    if remaining <= 0:
+        raise DeadlineExceeded(f"{model}: call deadline exceeded")
+    with get_throttle(model).slot(timeout=remaining, optional=optional) as slot:
+        if on_dispatch is not None:
+            on_dispatch()
+        started = time.monotonic()
+        response = fn(**kwargs)
+        slot.throttled = is_throttling_response(response)
+    if getattr(response, "status_code", None) != 200:
+        raise DashScopeAPIError.from_response(response)
+    stats = _stats_for(model)
+    stats.record_latency(time.monotonic() - started)
+    stats.record_usage(getattr(response, "usage", None))
+    return response
+
+
+def _hedged_attempt(model: str, fn, deadline: float, kwargs: Dict[str, Any], policy: RetryPolicy):
+    """Runs :func:`_attempt`, racing a second copy once the first exceeds the p95 latency.
+
+    The hedge delay starts when the primary request is dispatched, so time
+    spent queueing in the throttle does not trigger hedges, and the hedge is
+    only sent if the throttle has spare capacity right now; under load,
+    hedging therefore backs off instead of amplifying it.
+    """
+    stats = _stats_for(model)
+    hedge_after = stats.latency_quantile(policy.hedge_quantile, policy.hedge_min_samples) if policy.hedge else None
+    if hedge_after is None:
+        return _attempt(model, fn, deadline, kwargs)
+
+    pool = _hedge_pool()
+    dispatched = threading.Event()
+    primary = pool.submit(_attempt, model, fn, deadline, kwargs, dispatched.set)
+    primary.add_done_callback(lambda _: dispatched.set())
+    dispatched.wait(max(0.0, deadline - time.monotonic()))
+    done, _ = wait([primary], timeout=min(hedge_after, max(0.0, deadline - time.monotonic())))
+    if done:
+        return primary.result()
+
+    backup = pool.submit(_attempt, model, fn, deadline, kwargs, lambda: stats.incr("hedges"), True)
+    pending = {primary, backup}
+    last_exc: Optional[BaseException] = None
+    while pending:
+        done, pending = wait(pending, timeout=max(0.0, deadline - time.monotonic()), return_when=FIRST_COMPLETED)
+        if not done:
+            raise DeadlineExceeded(f"{model}: call deadline exceeded")
+        for future in done:
+            exc = future.exception()
+            if exc is None:
+                if future is backup:
+                    stats.incr("hedge_wins")
+                return future.result()
+            last_exc = exc
+    raise last_exc
+
+
+def resilient_call(model: str, fn, policy: Optional[RetryPolicy] = None, /, **kwargs):
+    """Calls ``fn(**kwargs)`` with retries, a deadline and optional hedging.
+
+    ``model`` selects the throttle and statistics; it is positional-only so
+    that ``kwargs`` can carry the API's own ``model=`` argument.
+
+    Returns the first successful (HTTP 200) response.
+
+    Raises:
+        DashScopeAPIError: on a non-retryable error or once retries are exhausted.
+        DeadlineExceeded: if the per-call deadline passes first.
+    """
+    policy = policy or DEFAULT_RETRY_POLICY
+    stats = _stats_for(model)
+    stats.incr("requests")
+    deadline = time.monotonic() + policy.deadline
+    attempt = 1
+    while True:
+        try:
+            return _hedged_attempt(model, fn, deadline, kwargs, policy)
+        except Exception as exc:
+            delay = policy.backoff(attempt)
+            if (
+                attempt >= policy.max_attempts
+                or not is_retryable_error(exc)
+                or time.monotonic() + delay >= deadline
+            ):
+                stats.incr("failures")
+                raise
+            logging.warning(f"[{model}] 第 {attempt} 次调用失败，{delay:.2f}s 后重试: {exc}")
+            stats.incr("retries")
+            time.sleep(delay)
+            attempt += 1
+
+
 class CustomChatDashScope(BaseChatModel):
     """A stable DashScope chat model wrapper implementing LangChain's BaseChatModel.
 
@@ -32,6 +526,10 @@ class CustomChatDashScope(BaseChatModel):
 
     model: str = "qwen-turbo"
     temperature: float = 0.7
+    retry_policy: Optional[RetryPolicy] = None
+    # 合并并发的相同请求（共享同一个回复）。采样结果会被共享，
+    # 因此只适合期望相同输入得到相同输出的场景（如知识图谱）。
+    coalesce: bool = False
 
     # ---------------------------------------------------------------------
     # Internal helpers
@@ -54,7 +552,10 @@ class CustomChatDashScope(BaseChatModel):
             elif isinstance(msg, AIMessage):
                 prompt_messages.append({"role": "assistant", "content": msg.content})
 
-        response = dashscope.Generation.call(
+        # Non-streaming mode -> GenerationResponse with status_code / output;
+        # resilient_call raises DashScopeAPIError for anything but HTTP 200.
+        call_args = (self.model, dashscope.Generation.call, self.retry_policy)
+        call_kwargs = dict(
             model=self.model,
             messages=prompt_messages,
             result_format="message",
@@ -62,29 +563,13 @@ class CustomChatDashScope(BaseChatModel):
             stream=False,
             **kwargs,
         )
-
-        # Non-streaming mode -> GenerationResponse with status_code / output
-        if hasattr(response, "status_code"):
-            if response.status_code == 200:  # type: ignore[attr-defined]
-                ai_content = response.output.choices[0]["message"]["content"]  # type: ignore[attr-defined]
-                return AIMessage(content=ai_content)
-        raise Exception(
-                "DashScope API Error: Code {} , Message {}".format(  # type: ignore[attr-defined]
-                    getattr(response, "code", "unknown"), getattr(response, "message", "unknown")
-                )
-            )
-
-        # Streaming mode -> concatenate chunks
-        if hasattr(response, "__iter__"):
-            content_chunks: List[str] = []
-            for chunk in response:
-                try:
-                    content_chunks.append(chunk.choices[0].delta.content)
-                except Exception:
-                    pass  # Some chunks may not have delta.content
-            return AIMessage(content="".join(content_chunks))
-
-        raise Exception("DashScope returned an unknown response type and could not be parsed.")
+        if self.coalesce:
+            key = request_key(self.model, self.temperature, prompt_messages, kwargs)
+            response = _CHAT_FLIGHTS.do(key, resilient_call, *call_args, **call_kwargs)
+        else:
+            response = resilient_call(*call_args, **call_kwargs)
+        ai_content = response.output.choices[0]["message"]["content"]  # type: ignore[attr-defined]
+        return AIMessage(content=ai_content)
 
     def _generate(
         self,
@@ -104,6 +589,10 @@ class CustomChatDashScope(BaseChatModel):
         return "custom_chat_dashscope_wrapper"
 
 
+# 视觉接口不可用、降级为纯文本模型时加在回复开头
+VISION_FALLBACK_NOTE = "[注意：图片分析功能暂时不可用，以下是基于文本的回复]"
+
+
 class CustomVisionChatDashScope(BaseChatModel):
     """A DashScope chat model wrapper with vision capabilities for multi-modal inputs.
     
@@ -113,6 +602,7 @@ class CustomVisionChatDashScope(BaseChatModel):
 
     model: str = "qwen-vl-max"
     temperature: float = 0.7
+    retry_policy: Optional[RetryPolicy] = None
 
     def _encode_image_base64(self, image_path: str) -> str:
         """将图片文件编码为base64字符串"""
@@ -147,30 +637,26 @@ class CustomVisionChatDashScope(BaseChatModel):
 
         # 2. 本地文件路径，需要进行编码并增加 MIME 前缀
         try:
-            import mimetypes
             import io
             from PIL import Image
 
-            # 检测 MIME 类型，若失败则默认 jpeg
-            mime_type, _ = mimetypes.guess_type(image_path)
-            if mime_type is None:
-                mime_type = "image/jpeg"
-
-            # 打开图片并在必要时缩放
             with Image.open(image_path) as img:
-                max_dim = 1024  # DashScope 推荐最长边不超过 1024
-                if max(img.size) > max_dim:
-                    ratio = max_dim / float(max(img.size))
-                    new_size = (int(img.width * ratio), int(img.height * ratio))
-                    img = img.resize(new_size)
-
-                buffered = io.BytesIO()
-                # 推断保存格式（JPEG/PNG/WebP/...）
-                save_format = mime_type.split("/")[-1].upper()
-                if save_format == "JPG":
-                    save_format = "JPEG"
-                img.save(buffered, format=save_format)
-                encoded_image = base64.b64encode(buffered.getvalue()).decode("utf-8")
+                # MIME 类型按图片实际格式确定，若无法识别则默认 jpeg
+                mime_type = Image.MIME.get(img.format, "image/jpeg")
+                if max(img.size) <= MAX_IMAGE_DIM:
+                    # 浏览器已按 /config 缩放并编码，直接发送原始字节，不再解码重编码
+                    with open(image_path, "rb") as image_file:
+                        encoded_image = base64.b64encode(image_file.read()).decode("utf-8")
+                else:
+                    # 旧客户端上传的大图：等比缩放到最长边不超过 MAX_IMAGE_DIM（DashScope 推荐 1024）
+                    ratio = MAX_IMAGE_DIM / float(max(img.size))
+                    resized = img.resize((int(img.width * ratio), int(img.height * ratio)))
+                    save_format = img.format or "JPEG"
+                    if save_format == "JPEG" and resized.mode not in ("RGB", "L"):
+                        resized = resized.convert("RGB")
+                    buffered = io.BytesIO()
+                    resized.save(buffered, format=save_format)
+                    encoded_image = base64.b64encode(buffered.getvalue()).decode("utf-8")
 
             content.append({"image": f"data:{mime_type};base64,{encoded_image}"})
         except Exception as e:
@@ -207,28 +693,25 @@ class CustomVisionChatDashScope(BaseChatModel):
                 prompt_messages.append({"role": "assistant", "content": msg.content})
 
         try:
-            response = dashscope.MultiModalConversation.call(
+            # 瞬时错误（429 / 5xx / 网络）在 resilient_call 内按退避策略重试
+            response = resilient_call(
+                self.model,
+                dashscope.MultiModalConversation.call,
+                self.retry_policy,
                 model=self.model,
                 messages=prompt_messages,
                 temperature=self.temperature,
                 timeout=30,  # 添加超时（秒）
                 **kwargs,
             )
-
-            # 处理API响应
-            if hasattr(response, "status_code"):
-                if response.status_code == 200:
-                    ai_content = response.output.choices[0]["message"]["content"]
-                    return AIMessage(content=ai_content)
-                else:
-                    error_msg = f"DashScope Vision API Error: Code {response.status_code}"
-                    if hasattr(response, 'message'):
-                        error_msg += f", Message: {response.message}"
-                    raise Exception(error_msg)
-            else:
-                raise Exception("DashScope Vision API returned unexpected response format")
+            ai_content = response.output.choices[0]["message"]["content"]
+            if isinstance(ai_content, list):
+                # 多模态接口的回复是 [{"text": ...}] 形式的片段列表
+                ai_content = "".join(part.get("text", "") for part in ai_content if isinstance(part, dict))
+            return AIMessage(content=ai_content)
 
         except Exception as e:
+            # 只有不可重试的错误或重试用尽后才降级为纯文本
             logging.error(f"视觉API调用失败: {e}")
             
             # 移除图片内容，只保留文本
@@ -243,22 +726,25 @@ class CustomVisionChatDashScope(BaseChatModel):
                     text_messages.append(msg_data)
             
             # 使用普通文本API
-            response = dashscope.Generation.call(
-                model="qwen-turbo",
-                messages=text_messages,
-                result_format="message",
-                temperature=self.temperature,
-                stream=False,
-                timeout=30,  # 添加超时
-                **kwargs,
-            )
-            
-            if hasattr(response, "status_code") and response.status_code == 200:
-                ai_content = response.output.choices[0]["message"]["content"]
-                logging.info("回退到文本模式成功")
-                return AIMessage(content=f"[注意：图片分析功能暂时不可用，以下是基于文本的回复]\n\n{ai_content}")
-            else:
-                raise Exception("文本模式API调用也失败了")
+            try:
+                response = resilient_call(
+                    "qwen-turbo",
+                    dashscope.Generation.call,
+                    self.retry_policy,
+                    model="qwen-turbo",
+                    messages=text_messages,
+                    result_format="message",
+                    temperature=self.temperature,
+                    stream=False,
+                    timeout=30,  # 添加超时
+                    **kwargs,
+                )
+            except Exception as fallback_error:
+                raise Exception("文本模式API调用也失败了") from fallback_error
+
+            ai_content = response.output.choices[0]["message"]["content"]
+            logging.info("回退到文本模式成功")
+            return AIMessage(content=f"{VISION_FALLBACK_NOTE}\n\n{ai_content}")
 
     def _generate(
         self,
@@ -287,4 +773,21 @@ class CustomVisionChatDashScope(BaseChatModel):
 
     @property
     def _llm_type(self) -> str:
-        return "custom_vision_chat_dashscope_wrapper" 
\ No newline at end of file
+        return "custom_vision_chat_dashscope_wrapper" 
+
+
+class ThrottledDashScopeEmbeddings(DashScopeEmbeddings):
+    """DashScopeEmbeddings whose API calls share the per-model throttle and retry policy."""
+
+    def _embed(self, texts: Union[str, List[str]], text_type: str) -> List[List[float]]:
+        key = (self.model, text_type, texts if isinstance(texts, str) else tuple(texts))
+        response = _EMBEDDING_FLIGHTS.do(
+            key, resilient_call, self.model, self.client.call, model=self.model, input=texts, text_type=text_type
+        )
+        return [list(item["embedding"]) for item in response.output["embeddings"]]
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self._embed(texts, "document")
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._embed(text, "query")[0]
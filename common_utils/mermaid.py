@@ -0,0 +1,253 @@
+"""
+Server-side validation and repair of Mermaid mindmaps.
+
+The knowledge-graph prompt asks for a ``mindmap`` with at most 15 nodes and 3
+levels. Model output regularly breaks those rules or Mermaid's grammar:
+inconsistent indentation, brackets or quotes inside node text (parsed as node
+shapes), several roots, or a missing ``mindmap`` header. Each such reply used
+to fail in the browser and cost the student another qwen-max call.
+
+:func:`parse_mindmap` reads the indentation tree the way Mermaid does,
+:func:`repair_mindmap` re-emits it with uniform indentation, full-width
+brackets in node text and over-limit nodes pruned (breadth-first, so the top
+levels survive). Only output without a usable tree is reported as
+unrecoverable, for the caller to regenerate.
+"""
+import json
+import re
+import threading
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+MAX_NODES = 15
+MAX_DEPTH = 3  # 根节点之下的层级数
+
+_MERMAID_BLOCK_RE = re.compile(r"```\s*mermaid(.*?)```", re.DOTALL | re.IGNORECASE)
+_UNCLOSED_BLOCK_RE = re.compile(r"```\s*mermaid(.*)$", re.DOTALL | re.IGNORECASE)
+# 节点形状：id((圆)) id))云(( id)圆角( id{{六边形}} id[方形] id(圆角)；按分隔符长度优先匹配
+_SHAPES = (("((", "))"), ("))", "(("), ("{{", "}}"), ("[", "]"), ("(", ")"), (")", "("))
+_NODE_RE = re.compile(
+    r"^(?P<id>[^\s()\[\]{}]*?)\s*(?P<open>\(\(|\)\)|\{\{|\[|\(|\))(?P<text>.*?)(?P<close>\)\)|\(\(|\}\}|\]|\)|\()\s*$"
+)
+_DECORATION_RE = re.compile(r"\s*:::.*$")  # 节点后附加的样式类
+_DIAGRAM_HEADER_RE = re.compile(r"^\s*(graph|flowchart|sequenceDiagram|classDiagram|stateDiagram|erDiagram|gantt|pie)\b")
+_TEXT_ESCAPES = str.maketrans({
+    "(": "（", ")": "）", "[": "【", "]": "】", "{": "｛", "}": "｝",
+    '"': "”", "`": "'", "<": "＜", ">": "＞", ";": "；", "#": "＃",
+})
+
+
+@dataclass
+class MindmapNode:
+    """One mindmap node; ``shape`` is an ``(open, close)`` pair or ``None``."""
+
+    text: str
+    shape: Optional[Tuple[str, str]] = None
+    children: List["MindmapNode"] = field(default_factory=list)
+
+    def count(self) -> int:
+        return 1 + sum(child.count() for child in self.children)
+
+    def depth(self) -> int:
+        """Levels below this node."""
+        return 1 + max(child.depth() for child in self.children) if self.children else 0
+
+
+@dataclass
+class MindmapCheck:
+    """Result of :func:`repair_mindmap`.
+
+    Attributes:
+        code: Mermaid source to send to the browser (repaired if needed).
+        problems: What was wrong with the original source.
+        valid: The original source already satisfied every rule.
+        recoverable: ``code`` is a usable mindmap; ``False`` means the caller
+            should regenerate.
+    """
+
+    code: str
+    problems: List[str] = field(default_factory=list)
+    valid: bool = True
+    recoverable: bool = True
+
+
+def split_mermaid_response(raw_output: str) -> Tuple[str, str]:
+    """Splits an LLM reply into ``(mermaid_code, summary)``."""
+    raw_output = raw_output.strip()
+    match = _MERMAID_BLOCK_RE.search(raw_output)
+    if match:
+        return match.group(1).strip("\n"), raw_output[match.end():].strip()
+    match = _UNCLOSED_BLOCK_RE.search(raw_output)
+    if match:
+        return match.group(1).strip("\n"), ""
+    return raw_output.replace("```", "").strip("\n"), ""
+
+
+def _parse_node(line: str) -> MindmapNode:
+    line = _DECORATION_RE.sub("", line).strip()
+    match = _NODE_RE.match(line)
+    # “概念(补充)”这类中文文字后的括号是文字的一部分，而不是“节点 ID + 形状”
+    if (match and match.group("id").isascii() and match.group("text").strip()
+            and (match.group("open"), match.group("close")) in _SHAPES):
+        return MindmapNode(match.group("text").strip(), (match.group("open"), match.group("close")))
+    return MindmapNode(line)
+
+
+def parse_mindmap(code: str) -> Tuple[Optional[MindmapNode], List[str]]:
+    """Parses mindmap source into a tree.
+
+    Returns:
+        ``(root, problems)``; ``root`` is ``None`` when no node was found.
+        Problems that Mermaid would reject (or that break the prompt's
+        limits) are listed even when the tree could be built.
+    """
+    problems: List[str] = []
+    lines = [line.replace("\t", "    ").rstrip() for line in code.splitlines()]
+    lines = [line for line in lines if line.strip() and not line.strip().startswith("%%")]
+    if lines and _DIAGRAM_HEADER_RE.match(lines[0]):
+        return None, [f"不是 mindmap 图（{lines[0].strip()}）"]
+    if lines and lines[0].strip().lower() == "mindmap":
+        lines = lines[1:]
+    else:
+        problems.append("缺少 mindmap 声明")
+
+    root: Optional[MindmapNode] = None
+    stack: List[Tuple[int, MindmapNode]] = []
+    child_indents: Dict[int, int] = {}
+    misaligned = False
+    for line in lines:
+        stripped = line.strip()
+        if stripped.startswith("::icon("):
+            continue
+        indent = len(line) - len(line.lstrip(" "))
+        node = _parse_node(stripped)
+        if not node.text:
+            continue
+        if any(ch in node.text for ch in "()[]{}\"`<>;#"):
+            problems.append(f"节点文字含非法字符：{node.text[:20]}")
+        while stack and stack[-1][0] >= indent:
+            stack.pop()
+        if root is None:
+            root = node
+        elif not stack:
+            problems.append(f"存在多个根节点：{node.text[:20]}")
+            root.children.append(node)
+            indent = stack_indent = max(indent, 1)
+            stack = [(stack_indent - 1, root)]
+        else:
+            parent = stack[-1][1]
+            # 同一父节点下的子节点缩进不同，Mermaid 会把它们挂到错误的层级
+            misaligned = misaligned or child_indents.setdefault(id(parent), indent) != indent
+            parent.children.append(node)
+        stack.append((indent, node))
+
+    if root is None:
+        return None, problems + ["没有任何节点"]
+    if root.shape != ("((", "))"):
+        problems.append("根节点不是 root((…)) 形式")
+    if misaligned:
+        problems.append("缩进不一致")
+    if root.count() > MAX_NODES:
+        problems.append(f"节点数 {root.count()} 超过 {MAX_NODES}")
+    if root.depth() > MAX_DEPTH:
+        problems.append(f"层级 {root.depth()} 超过 {MAX_DEPTH}")
+    return root, problems
+
+
+def _prune(root: MindmapNode, max_nodes: int, max_depth: int) -> None:
+    """Keeps the first ``max_nodes`` nodes in breadth-first order, up to ``max_depth`` levels."""
+    kept = 1
+    level = [root]
+    for _ in range(max_depth):
+        next_level = []
+        for node in level:
+            allowed = node.children[:max(0, max_nodes - kept)]
+            kept += len(allowed)
+            node.children = allowed
+            next_level.extend(allowed)
+        level = next_level
+    for node in level:
+        node.children = []
+
+
+def render_mindmap(root: MindmapNode) -> str:
+    """Mermaid source with two-space indentation and escaped node text."""
+    lines = ["mindmap", f"  root(({root.text.translate(_TEXT_ESCAPES)}))"]
+
+    def emit(node: MindmapNode, level: int) -> None:
+        for child in node.children:
+            text = child.text.translate(_TEXT_ESCAPES)
+            if child.shape:
+                text = f"{child.shape[0]}{text}{child.shape[1]}"
+            lines.append("  " * (level + 1) + text)
+            emit(child, level + 1)
+
+    emit(root, 1)
+    return "\n".join(lines)
+
+
+def mindmap_tree(root: MindmapNode) -> Dict:
+    """Compact JSON tree of a mindmap: ``{"t": text, "c": [children]}`` (``c`` omitted for leaves)."""
+    node: Dict = {"t": root.text}
+    if root.children:
+        node["c"] = [mindmap_tree(child) for child in root.children]
+    return node
+
+
+def tree_response(formatted: str) -> Optional[str]:
+    """A formatted mindmap reply with its Mermaid block replaced by a ```mindmap-json block.
+
+    The browser renders the tree without downloading Mermaid. Returns
+    ``None`` when the reply has no parsable mindmap.
+    """
+    code, summary = split_mermaid_response(formatted)
+    root, _ = parse_mindmap(code)
+    if root is None:
+        return None
+    tree = json.dumps(mindmap_tree(root), ensure_ascii=False, separators=(",", ":"))
+    return f"```mindmap-json\n{tree}\n```" + (f"\n\n{summary}" if summary else "")
+
+
+def repair_mindmap(code: str, topic: str = "", max_nodes: int = MAX_NODES, max_depth: int = MAX_DEPTH) -> MindmapCheck:
+    """Validates mindmap source and repairs it locally where possible.
+
+    A mindmap is unrecoverable when it is another diagram type or has no
+    node below the root; everything else is rewritten by
+    :func:`render_mindmap` after pruning to the limits.
+    """
+    root, problems = parse_mindmap(code)
+    if root is None or not root.children:
+        return MindmapCheck(code=code, problems=problems or ["只有根节点"], valid=False, recoverable=False)
+    if not problems:
+        return MindmapCheck(code=code.strip("\n"))
+    if topic and root.text.strip() in ("", "知识点"):
+        root.text = topic
+    _prune(root, max_nodes, max_depth)
+    return MindmapCheck(code=render_mindmap(root), problems=problems, valid=False)
+
+
+class MindmapStats:
+    """Counters for ``/metrics``: local repairs versus LLM regenerations."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts = {"graphs": 0, "valid_first_pass": 0, "repaired_locally": 0, "regenerations": 0, "failed": 0}
+
+    def record(self, first: MindmapCheck, final: MindmapCheck, regenerations: int) -> None:
+        with self._lock:
+            counts = self._counts
+            counts["graphs"] += 1
+            counts["valid_first_pass"] += first.valid
+            counts["repaired_locally"] += final.recoverable and not final.valid
+            counts["regenerations"] += regenerations
+            counts["failed"] += not final.recoverable
+
+    def metrics(self) -> Dict:
+        with self._lock:
+            result = dict(self._counts)
+        succeeded = result["graphs"] - result["failed"]
+        result["regenerations_per_success"] = round(result["regenerations"] / succeeded, 3) if succeeded else 0.0
+        return result
+
+
+MINDMAP_STATS = MindmapStats()
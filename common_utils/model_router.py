@@ -0,0 +1,136 @@
+"""
+Model cascade: send cheap tasks to a faster model, escalate to qwen-max.
+
+Every agent used to call ``qwen-max`` for everything, including tasks a
+smaller model handles well: extracting the dialogue intent as JSON, easy
+multiple-choice batches and short mindmaps. :class:`ModelRouter` wraps an
+agent's ``qwen-max`` model and, for requests the caller marks as ``fast``,
+tries ``qwen-turbo`` first. The reply is accepted only if the caller's
+validator passes (the same checks the agents already apply: quiz validation,
+mindmap repair, intent JSON); otherwise, or if the fast call fails, the same
+messages are sent to ``qwen-max``.
+
+Per-route request counts, escalation rates and end-to-end latency are
+reported by :func:`route_metrics` (``/metrics`` -> ``model_routes``).
+
+Environment variables:
+    MODEL_CASCADE: ``0`` sends every request to the strong model.
+    CASCADE_FAST_MODEL: Fast model name (default ``qwen-turbo``).
+"""
+import logging
+import os
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Dict, List, Optional
+
+from langchain_core.messages import AIMessage, BaseMessage
+
+from .llm_wrapper import CustomChatDashScope
+
+DEFAULT_FAST_MODEL = "qwen-turbo"
+
+
+def cascade_enabled() -> bool:
+    return os.environ.get("MODEL_CASCADE", "1").strip().lower() not in ("0", "false", "no", "off")
+
+
+class RouteStats:
+    """Counters and end-to-end latency samples of one route."""
+
+    def __init__(self, window: int = 500):
+        self._lock = threading.Lock()
+        self._latencies: deque = deque(maxlen=window)
+        self._counts = {"requests": 0, "fast": 0, "strong": 0, "escalations": 0, "fast_errors": 0}
+
+    def record(self, seconds: float, fast: bool, escalated: bool, fast_error: bool) -> None:
+        with self._lock:
+            counts = self._counts
+            counts["requests"] += 1
+            counts["fast"] += fast
+            counts["strong"] += (not fast) or escalated
+            counts["escalations"] += escalated
+            counts["fast_errors"] += fast_error
+            self._latencies.append(seconds)
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            result: Dict[str, Any] = dict(self._counts)
+            ordered = sorted(self._latencies)
+        quantile = lambda q: round(ordered[min(len(ordered) - 1, int(q * len(ordered)))], 4) if ordered else None  # noqa: E731
+        result["escalation_rate"] = round(result["escalations"] / result["fast"], 3) if result["fast"] else 0.0
+        result["latency_p50"] = quantile(0.5)
+        result["latency_p95"] = quantile(0.95)
+        return result
+
+
+_ROUTE_STATS: Dict[str, RouteStats] = {}
+_ROUTE_STATS_LOCK = threading.Lock()
+
+
+def _stats_for(route: str) -> RouteStats:
+    stats = _ROUTE_STATS.get(route)
+    if stats is None:
+        with _ROUTE_STATS_LOCK:
+            stats = _ROUTE_STATS.setdefault(route, RouteStats())
+    return stats
+
+
+def route_metrics() -> Dict[str, Dict[str, Any]]:
+    """Per-route counters, escalation rate and latency for every route used so far."""
+    return {route: stats.metrics() for route, stats in sorted(_ROUTE_STATS.items())}
+
+
+class ModelRouter:
+    """Routes one agent's LLM calls between a fast and a strong model.
+
+    Args:
+        strong: The agent's strong (``qwen-max``) chat model; the fast model
+            is a copy with the same temperature and settings.
+        fast_model: Name of the fast model (default: ``CASCADE_FAST_MODEL``
+            or ``qwen-turbo``).
+        enabled: Whether ``fast`` requests may use the fast model (default:
+            ``MODEL_CASCADE``).
+    """
+
+    def __init__(self, strong: CustomChatDashScope, fast_model: Optional[str] = None, enabled: Optional[bool] = None):
+        self.strong = strong
+        self.enabled = cascade_enabled() if enabled is None else enabled
+        fast_model = fast_model or os.environ.get("CASCADE_FAST_MODEL", DEFAULT_FAST_MODEL)
+        self.fast = strong if fast_model == strong.model else strong.model_copy(update={"model": fast_model})
+
+    def invoke(
+        self,
+        route: str,
+        messages: List[BaseMessage],
+        fast: bool = False,
+        validate: Optional[Callable[[str], bool]] = None,
+    ) -> AIMessage:
+        """Sends ``messages`` for ``route``.
+
+        Args:
+            route: Name used for metrics (e.g. ``"question"``, ``"dialogue_intent"``).
+            messages: Chat messages.
+            fast: Try the fast model first.
+            validate: Check applied to the fast model's reply text; a reply
+                that fails it is escalated to the strong model.
+        """
+        start = time.perf_counter()
+        use_fast = fast and self.enabled and self.fast is not self.strong
+        escalated = fast_error = False
+        response = None
+        if use_fast:
+            try:
+                response = self.fast.invoke(messages)
+                if validate is not None and not validate(str(response.content)):
+                    logging.info(f"[{route}] {self.fast.model} 的输出未通过校验，升级到 {self.strong.model}")
+                    response, escalated = None, True
+            except Exception as e:
+                logging.warning(f"[{route}] {self.fast.model} 调用失败（{e}），升级到 {self.strong.model}")
+                response, escalated, fast_error = None, True, True
+        try:
+            if response is None:
+                response = self.strong.invoke(messages)
+            return response
+        finally:
+            _stats_for(route).record(time.perf_counter() - start, use_fast, escalated, fast_error)
@@ -3,7 +3,9 @@
 """
 import os
 from typing import Optional, Dict, Any
-from .llm_wrapper import CustomVisionChatDashScope
+from .image_caption import CAPTIONS, ImageCaption, parse_caption
+from .llm_wrapper import VISION_FALLBACK_NOTE, CustomVisionChatDashScope
+from .prompts import IMAGE_CAPTION_PROMPT
 
 class MultimodalAgent:
     """
@@ -67,6 +69,33 @@ class MultimodalAgent:
             print(f"[{self.subject_name}] {error_msg}")
             return f"抱歉，{error_msg}。请重试或检查您的输入。"
 
+    def describe_image(self, image_path: str, question: str = "") -> Optional[ImageCaption]:
+        """
+        图片的结构化描述（文字、概念、简述），同一张图片只调用一次视觉模型
+
+        Args:
+            image_path: 图片文件路径
+            question: 学生随图片提出的问题，帮助模型关注相关内容（只在首次描述时使用）
+
+        Returns:
+            图片描述；视觉模型不可用或回复无法解析时为 None
+        """
+        def describe(path: str) -> Optional[ImageCaption]:
+            prompt = IMAGE_CAPTION_PROMPT.format(subject_name=self.subject_name, question=question or "（无）")
+            try:
+                reply = self.vision_llm.call_with_image(text=prompt.strip(), image_path=path)
+            except Exception as e:
+                print(f"[{self.subject_name}] 图片描述失败: {e}")
+                return None
+            if reply.startswith(VISION_FALLBACK_NOTE):
+                return None
+            caption = parse_caption(reply)
+            if caption is None:
+                print(f"[{self.subject_name}] 图片描述无法解析，已忽略")
+            return caption
+
+        return CAPTIONS.get_or_describe(image_path, describe)
+
     def _get_default_system_prompt(self) -> str:
         """获取默认的系统提示词"""
         return f"""你是一个专业的{self.subject_name}AI助手。你能够理解和分析用户提供的文本和图片内容。
@@ -110,33 +139,12 @@ class MayuanMultimodalAgent(MultimodalAgent):
 请用中文回答用户的问题，确保回答专业、准确、有教育意义。"""
 
 class SocratesMultimodalAgent(MultimodalAgent):
-    """苏格拉底式对话多模态Agent"""
-    
-    def __init__(self, character: str = "马克思", topic: str = "马克思主义理论"):
+    """苏格拉底式对话的多模态Agent
+
+    只用于描述图片（describe_image）：对话回复由文本模型以会话的人物与主题生成，
+    图片描述作为会话状态的一部分（见 role_agent.SocratesAgent.process_multimodal_dialogue）。
+    同一实例由所有对话会话共用，不保存任何会话状态。
+    """
+
+    def __init__(self):
         super().__init__(subject_name="历史思想家对话", model="qwen-vl-max")
-        self.character = character
-        self.current_topic = topic
-    
-    def update_dialogue_context(self, character: str, topic: str):
-        """更新对话上下文"""
-        self.character = character
-        self.current_topic = topic
-    
-    def _get_default_system_prompt(self) -> str:
-        """获取苏格拉底式对话的系统提示词"""
-        return f"""你现在要扮演{self.character}，与用户进行苏格拉底式对话，探讨"{self.current_topic}"这个主题。
-
-如果用户提供了图片，请：
-1. 仔细分析图片内容，包括文字、图表、人物等
-2. 以{self.character}的身份和观点来理解和解读图片
-3. 结合图片内容，用苏格拉底式的方法引导用户思考
-4. 如果图片与讨论主题相关，深入分析其理论意义
-5. 如果图片与主题无关，请礼貌地重定向到当前话题
-
-苏格拉底式对话的特点：
-- 通过提问引导用户思考，而不是直接给出答案
-- 挖掘用户观点中的假设和逻辑问题
-- 循序渐进地引导用户发现真理
-- 保持{self.character}的语言风格和理论背景
-
-请用中文进行对话，体现{self.character}的思想特色和对话风格。"""
\ No newline at end of file
@@ -1,41 +1,49 @@
 """
-This file stores all prompt templates for the question generation agent.
+This file stores all prompt templates for the question generation agent, the
+knowledge-graph agent and the Socratic dialogue agent.
 Centralizing prompts here makes them easier to manage, version, and adapt
 for different agents (e.g., Mao's Thoughts, Xi's Thoughts).
+
+Prompts are assembled with static sections first and per-request values last
+(see "Prompt Assembly" at the end of this file).
 """
-from langchain_core.prompts import PromptTemplate
+import json
+import math
+import re
+import threading
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
 
-# --- Generic Prompt for Single Question Type ---
-# This template is used when the user requests a single type of question.
-# It's dynamically formatted with the specific type's requirements.
-SINGLE_TYPE_PROMPT_TEMPLATE = PromptTemplate.from_template("""
-你是一位资深的{subject_name}课程教师，具有丰富的出题经验。请根据以下要求生成高质量的题目。
+from langchain_core.messages import BaseMessage, HumanMessage, SystemMessage
+from langchain_core.prompts import PromptTemplate
 
-**任务要求：**
-- 主题：{topic}
-- 题目数量：{num_questions}道
-- 难度等级：{difficulty}
-- 题目类型：{question_type_specific_name}
+# --- Prompt Layout ---
+# Question prompts are assembled from ordered sections (see "Prompt Assembly"
+# below): everything that is the same across requests comes first and the
+# per-request values (topic, counts, difficulty, retrieved context, the user's
+# own words) come last. Provider-side prefix caching can then reuse the
+# instruction prefix across requests.
 
-**参考资料：**
-{context}
+# Static per subject: teacher persona and general rules.
+QUESTION_INSTRUCTIONS_TEMPLATE = PromptTemplate.from_template("""
+你是一位资深的{subject_name}课程教师，具有丰富的出题经验。请根据本提示末尾的“任务要求”“参考资料”和“原始用户需求”生成高质量的题目。
 
 **出题要求：**
 1. 题目必须严格基于提供的参考资料内容。
-2. {difficulty}难度的题目特点：
+2. 按任务要求中的难度等级出题，各难度的题目特点：
    - 简单：考查基本概念和定义的理解。
    - 中等：考查概念间的关系和应用。
    - 困难：考查深层理解、分析和综合运用能力。
-3. {format_requirements}
-4. 语言表达要准确、严谨。
-
-**原始用户需求：** 
-{user_input}
-
-**输出格式：**
-{output_format_example}
+3. 语言表达要准确、严谨。
+""")
 
-请严格按照上述需求生成题目。
+# Static per question type: format requirements. The output layout itself is
+# given by STRUCTURED_OUTPUT_ADDENDUM; the text layout shown to students is
+# rendered from the parsed JSON (quiz_utils.render_questions).
+SINGLE_TYPE_FORMAT_TEMPLATE = PromptTemplate.from_template("""
+**题型格式要求（{question_type_specific_name}）：**
+{format_requirements}
 """)
 
 # --- Specific Formatting Requirements for Each Question Type ---
@@ -44,95 +52,41 @@ SINGLE_TYPE_PROMPT_TEMPLATE = PromptTemplate.from_template("""
 QUESTION_TYPE_CONFIG = {
     "选择题": {
         "question_type_specific_name": "选择题",
-        "format_requirements": "每道选择题包含：题干、4个选项（A、B、C、D）、正确答案和简要解析。\n4. 选项设计要合理，干扰项要有一定迷惑性。\n5. 为便于后续按需展示，请确保每个要素各自独立成行，并以如下关键词开头：‘题干：’、‘A.’、‘B.’、‘C.’、‘D.’、‘正确答案：’、‘解析：’。",
-        "output_format_example": """题目1：
-题干：[具体题目内容]
-A. [选项A]
-B. [选项B]
-C. [选项C]
-D. [选项D]
-正确答案：[正确选项]
-解析：[简要解析说明]
-
-题目2：
-..."""
+        "format_requirements": "- 每道选择题包含：题干、4个选项（A、B、C、D）、正确答案和简要解析。\n- 选项设计要合理，干扰项要有一定迷惑性。"
     },
     "判断题": {
         "question_type_specific_name": "判断题",
-        "format_requirements": "判断题格式：题干 + 正确答案（正确/错误）+ 简要解析。\n为便于后续按需展示，请确保每个要素各自独立成行，并以如下关键词开头：‘题干：’、‘正确答案：’、‘解析：’。",
-        "output_format_example": """题目1：
-题干：[具体题目内容]
-正确答案：[正确/错误]
-解析：[简要解析说明]
-
-题目2：
-..."""
+        "format_requirements": "- 判断题格式：题干 + 正确答案（正确/错误）+ 简要解析。"
     },
     "简答题": {
         "question_type_specific_name": "材料分析/简答题",
-        "format_requirements": "每道材料分析/简答题包含：题干（可提供材料或问题描述）、参考答案、简要解析。\n为便于后续按需展示，请确保每个要素各自独立成行，并以如下关键词开头：‘题干：’、‘参考答案：’、‘解析：’。",
-        "output_format_example": """题目1：
-题干：[具体题目内容]
-参考答案：[答案内容]
-解析：[简要解析说明]
-
-题目2：
-..."""
+        "format_requirements": "- 每道材料分析/简答题包含：题干（可提供材料或问题描述）、参考答案、简要解析。"
     }
 }
 
-# --- Prompt for Mixed Question Types ---
-# This template is used when the user requests multiple types of questions in one go.
-MIXED_TYPE_PROMPT_TEMPLATE = PromptTemplate.from_template("""
-你是一位资深的{subject_name}课程教师，具有丰富的出题经验。请根据以下要求生成高质量的题目。
+# Static: format requirements when several question types are requested at once.
+MIXED_TYPE_FORMAT = """
+**各题型格式要求：**
+- 选择题：题干 + 4个选项（A、B、C、D）+ 正确答案 + 简要解析。
+- 判断题：题干 + 正确答案（正确/错误）+ 简要解析。
+- 材料分析/简答题：题干（可含材料）+ 参考答案 + 简要解析。
+请按题型分类输出。
+"""
 
+# Per request: always the last section of a question prompt.
+QUESTION_REQUEST_TEMPLATE = PromptTemplate.from_template("""
 **任务要求：**
 - 主题：{topic}
-- 题目类型及数量：
 {type_details}
 - 难度等级：{difficulty}
 
 **参考资料：**
 {context}
 
-**出题要求：**
-1. 题目必须严格基于提供的参考资料内容。
-2. {difficulty}难度的题目特点：
-   - 简单：考查基本概念和定义的理解。
-   - 中等：考查概念间的关系和应用。
-   - 困难：考查深层理解、分析和综合运用能力。
-3. 各题型格式要求：
-   - 选择题：题干 + 4个选项（A、B、C、D）+ 正确答案 + 简要解析。
-   - 判断题：题干 + 正确答案（正确/错误）+ 简要解析。
-    - 材料分析/简答题：题干（可含材料）+ 参考答案 + 简要解析。
-   为便于系统在首次展示时隐藏答案与解析，请确保各要素各自独立成行，并以如下关键词开头：
-   ‘题干：’、‘A.’、‘B.’、‘C.’、‘D.’、‘正确答案：’、‘参考答案：’、‘解析：’。
-4. 语言表达要准确、严谨。
-
-**原始用户需求：** 
+**原始用户需求：**
 {user_input}
 
-**输出格式示例：**
-选择题1：
-题干：[具体题目内容]
-A. [选项A]
-B. [选项B]
-C. [选项C]
-D. [选项D]
-正确答案：[正确选项]
-解析：[简要解析说明]
-
-判断题1：
-题干：[具体题目内容]
-正确答案：[正确/错误]
-解析：[简要解析说明]
-
-简答题1：
-题干：[具体题目内容]
-参考答案：[答案内容]
-解析：[简要解析说明]
-
-请按照题型分类并保持题号连续。
+请严格按照上述要求生成题目。
 """)
 
 # --- Addendum for "Hard" Difficulty ---
@@ -146,4 +100,371 @@ DIFFICULTY_ADDENDUM_HARD = """
 - 判断题：可设置常见谬误或易混淆表述，引导学生进行严谨辨析。
 - 简答/材料分析题：要求多角度论证，联系现实并提出评价与思考。
 - 解析部分需展示推理链条或思考步骤，而不仅给出结论。
-""" 
\ No newline at end of file
+""" 
+# --- Per-Batch Request for Fan-out Generation ---
+# When a large or mixed quiz is split into several parallel single-type calls,
+# each call receives this text in place of the original user request so the
+# model does not try to produce the whole paper.
+FANOUT_BATCH_REQUEST_TEMPLATE = (
+    "请围绕“{topic}”生成{num_questions}道{difficulty}难度的{question_type}。"
+    "本套题共分{total_batches}批并行生成，这是第{batch_index}批，"
+    "请尽量考查与其他批次不同的知识点，避免重复。"
+)
+
+# --- Structured (JSON) Output Addendum ---
+# Appended to every question-generation prompt. The agent validates the JSON
+# once and renders both the question-only and the full (answers + explanations)
+# views from it, instead of guessing answer boundaries in free text.
+STRUCTURED_OUTPUT_ADDENDUM = """
+**输出格式：**
+请只输出一个 ```json 代码块，内容为 JSON 数组，每个元素表示一道题，字段如下：
+- "type"：题型，取值为 "选择题"、"判断题" 或 "简答题"
+- "stem"：题干（材料分析题可将材料写入题干）
+- "options"：选项文本数组，选择题恰好 4 项且不带 "A." 等前缀，其他题型为空数组 []
+- "answer"：选择题为正确选项字母（如 "B"），判断题为 "正确" 或 "错误"，简答题为参考答案
+- "explanation"：简要解析
+除该 JSON 代码块外不要输出任何其他文字。
+"""
+
+# --- Targeted Repair of Generated Questions ---
+# When local validation finds malformed items (wrong option count, missing
+# answer) or fewer questions than requested, only those items are sent back
+# with their problems, instead of regenerating the whole quiz.
+QUIZ_REPAIR_INSTRUCTIONS_TEMPLATE = PromptTemplate.from_template("""
+你是一位{subject_name}课程教师。下面是已生成试卷中格式有误的题目及其问题，请逐题修正所列问题，尽量保留原题考查的内容；如果要求补充新题，请围绕给定主题（及参考资料）出题，并与已有题目不同。
+
+**各题型要求：**
+- 选择题：恰好 4 个选项，"answer" 为正确选项字母（A/B/C/D）
+- 判断题："options" 为空数组，"answer" 为 "正确" 或 "错误"
+- 简答题："options" 为空数组，"answer" 为参考答案
+
+请只输出一个 ```json 代码块，内容为 JSON 数组：先按原顺序给出修正后的题目，再给出补充的新题；每个元素包含 "type"、"stem"、"options"、"answer"、"explanation" 字段。
+""")
+
+QUIZ_REPAIR_REQUEST_TEMPLATE = PromptTemplate.from_template("""
+- 主题：{topic}
+- 难度等级：{difficulty}
+
+{items}
+""")
+
+# --- Per-Paper Variant Request for Batch Generation ---
+# Used when a teacher asks for several copies of the same paper, so that each
+# copy is steered towards different questions.
+BATCH_PAPER_VARIANT_TEMPLATE = (
+    "{user_input}（这是同一需求下共{total_papers}套试卷中的第{paper_no}套，"
+    "请与其他试卷考查不同的知识点或采用不同的设问角度，避免题目雷同。）"
+)
+
+# Batch: replacements for questions that duplicate another paper's questions.
+BATCH_REPLACEMENT_REQUEST_TEMPLATE = (
+    "请围绕“{topic}”另出{num_questions}道{difficulty}难度的{question_type}，"
+    "用于替换试卷中与其他试卷雷同的题目，考查的知识点与设问角度不要与下列题干相同：\n{stems}"
+)
+
+# User request for quizzes pre-generated in the background (see quiz_pool);
+# stands in for the short student requests that map to the same pool key.
+POOL_REQUEST_TEMPLATE = "请出{num_questions}道关于“{topic}”的{difficulty}难度{question_type}。"
+
+# --- Knowledge Graph Prompts ---
+KG_SYSTEM_PROMPT = "你是一位精通知识图谱构建的学者。"
+
+# Static per subject; the topic and references follow in KG_REQUEST_TEMPLATE.
+KG_INSTRUCTIONS_TEMPLATE = PromptTemplate.from_template("""
+你是一位{subject_name}知识图谱专家。请利用本提示末尾提供的"参考资料"，围绕末尾给出的"知识点"构建一个 Mermaid mindmap（思维导图）格式的知识图谱，突出关键概念及其主要关系，并保持简洁易读。
+
+输出要求：
+1. mindmap 总节点不超过 15 个，层级不超过 3 级，保证图谱信息清晰、结构美观，便于学生学习和整理思路。
+2. 先输出 Mermaid 源代码，必须使用如下代码块格式（根节点文字为知识点名称）：
+```mermaid
+mindmap
+  root((知识点))
+    概念1
+      子概念A
+    概念2
+```
+3. Mermaid 代码块结束后，换行再输出一段不超过 100 字的中文总结，对图谱内容进行简洁概括。
+4. 除以上内容外，不要输出其他文字。
+""")
+
+KG_REQUEST_TEMPLATE = PromptTemplate.from_template("""
+知识点：{topic}
+
+参考资料：
+{context}
+""")
+
+# Appended to the request when the previous mindmap could not be repaired locally.
+KG_RETRY_NOTE_TEMPLATE = "上一次输出无法作为 Mermaid mindmap 使用（{problems}），请严格按照上述输出要求重新生成。"
+
+# --- Socratic Dialogue Prompts ---
+# Static per subject.
+DIALOGUE_RULES_TEMPLATE = PromptTemplate.from_template("""
+你是一个资深的{subject_name}教师，现在你正在扮演一位人物，与学生进行苏格拉底式对话（所扮演的人物和对话主题见下文）。
+你的目标是：
+1. 模仿所扮演人物的说话语气、风格和常用词汇。
+2. 保持苏格拉底式对话的核心：不直接给出答案，而是通过一系列启发性的问题引导学生思考。
+3. 问题应基于当前对话内容和参考资料，聚焦并促进思考。
+4. 如果学生回答偏离主题，尝试巧妙引导回主题。
+5. 当你认为学生对某个概念已经有了足够深入的思考时，可适当总结或提出更高层次的问题。
+6. 不要分点回答，回答不超过300字
+""")
+
+# Fixed for the whole session; the conversation history follows as messages.
+DIALOGUE_PERSONA_TEMPLATE = PromptTemplate.from_template("""
+本次对话中你扮演 {simulated_character}，对话主题是 {current_topic}。
+
+参考资料：
+{references}
+""")
+
+# Session-scoped too: a caption stays in the dialogue until another image is sent.
+DIALOGUE_IMAGE_TEMPLATE = PromptTemplate.from_template("""
+学生在对话中分享了一张图片，以下是图片内容（请结合它展开讨论）：
+{image_context}
+""")
+
+# --- Image Caption Prompt ---
+# Sent to the vision model once per image (see image_caption); the caption,
+# not the image, then feeds retrieval and the text model.
+IMAGE_CAPTION_PROMPT = """
+请仔细观察这张图片，提取其中与{subject_name}学习相关的信息，只输出一个 JSON 对象：
+{{
+    "text": "图片中出现的文字（按阅读顺序，没有则为空字符串）",
+    "concepts": ["图片涉及的理论概念或知识点，最多5个"],
+    "description": "用不超过150字客观描述图片内容（图表结构、人物、场景等）"
+}}
+学生随图片提出的问题：{question}
+"""
+
+
+# =============================================================================
+# Prompt Assembly
+# =============================================================================
+# A prompt is a list of named segments, each tagged with how often it changes:
+#   static  – identical for every request of the same subject / question type;
+#   session – fixed for one dialogue session (persona, topic);
+#   request – differs per request (topic, counts, retrieved context, user text).
+# Builders emit segments in that order so the longest possible prefix is shared
+# between requests, render static segments once (LRU-cached) and report an
+# estimated token count per segment.
+
+SCOPE_STATIC = "static"
+SCOPE_SESSION = "session"
+SCOPE_REQUEST = "request"
+
+_CJK_RE = re.compile(r"[\u3000-\u303f\u3400-\u4dbf\u4e00-\u9fff\uff00-\uffef]")
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough Qwen token estimate: ~1.5 CJK characters or ~4 other characters per token."""
+    cjk = len(_CJK_RE.findall(text))
+    return math.ceil(cjk / 1.5) + math.ceil((len(text) - cjk) / 4)
+
+
+@dataclass(frozen=True)
+class PromptSegment:
+    name: str
+    text: str
+    scope: str = SCOPE_STATIC
+
+
+@dataclass
+class AssembledPrompt:
+    """System and user prompt built from ordered :class:`PromptSegment` lists."""
+
+    kind: str
+    system: List[PromptSegment] = field(default_factory=list)
+    user: List[PromptSegment] = field(default_factory=list)
+
+    @staticmethod
+    def _join(segments: Iterable[PromptSegment]) -> str:
+        return "\n\n".join(seg.text for seg in segments if seg.text)
+
+    @property
+    def system_text(self) -> str:
+        return self._join(self.system)
+
+    @property
+    def user_text(self) -> str:
+        return self._join(self.user)
+
+    def to_messages(self) -> List[BaseMessage]:
+        messages: List[BaseMessage] = []
+        if self.system:
+            messages.append(SystemMessage(content=self.system_text))
+        if self.user:
+            messages.append(HumanMessage(content=self.user_text))
+        return messages
+
+    def token_counts(self) -> Dict[str, int]:
+        """Estimated tokens per segment, plus ``cacheable_prefix`` and ``total``.
+
+        ``cacheable_prefix`` covers the leading static/session segments, i.e.
+        the part a provider-side prefix cache can reuse.
+        """
+        counts: Dict[str, int] = {}
+        prefix, in_prefix = 0, True
+        for seg in self.system + self.user:
+            tokens = estimate_tokens(seg.text)
+            counts[seg.name] = counts.get(seg.name, 0) + tokens
+            in_prefix = in_prefix and seg.scope != SCOPE_REQUEST
+            if in_prefix:
+                prefix += tokens
+        counts["cacheable_prefix"] = prefix
+        counts["total"] = sum(v for k, v in counts.items() if k != "cacheable_prefix")
+        return counts
+
+
+_STATIC_TEMPLATES = {
+    "question_instructions": QUESTION_INSTRUCTIONS_TEMPLATE,
+    "single_type_format": SINGLE_TYPE_FORMAT_TEMPLATE,
+    "mixed_type_format": MIXED_TYPE_FORMAT,
+    "structured_output": STRUCTURED_OUTPUT_ADDENDUM,
+    "difficulty_hard": DIFFICULTY_ADDENDUM_HARD,
+    "quiz_repair_instructions": QUIZ_REPAIR_INSTRUCTIONS_TEMPLATE,
+    "kg_instructions": KG_INSTRUCTIONS_TEMPLATE,
+    "dialogue_rules": DIALOGUE_RULES_TEMPLATE,
+}
+
+
+@lru_cache(maxsize=256)
+def static_section(name: str, **params: str) -> PromptSegment:
+    """Renders (once) the static section ``name`` with ``params``."""
+    template = _STATIC_TEMPLATES[name]
+    text = template.format(**params) if isinstance(template, PromptTemplate) else template
+    return PromptSegment(name, text.strip(), SCOPE_STATIC)
+
+
+def build_question_prompt(
+    subject_name: str,
+    question_type_counts: Dict[str, int],
+    topic: str,
+    difficulty: str,
+    context: str,
+    user_input: str,
+) -> AssembledPrompt:
+    """Question-generation prompt; a single entry in ``question_type_counts`` means one type."""
+    if len(question_type_counts) == 1:
+        q_type, num = next(iter(question_type_counts.items()))
+        config = QUESTION_TYPE_CONFIG.get(q_type, QUESTION_TYPE_CONFIG["选择题"])
+        format_section = static_section("single_type_format", **config)
+        type_details = f"- 题目数量：{num}道\n- 题目类型：{config['question_type_specific_name']}"
+    else:
+        format_section = static_section("mixed_type_format")
+        type_details = "- 题目类型及数量：\n" + "\n".join(
+            f"  - {qt}：{cnt}道" for qt, cnt in question_type_counts.items()
+        )
+
+    user = [
+        static_section("question_instructions", subject_name=subject_name),
+        format_section,
+        static_section("structured_output"),
+    ]
+    if difficulty == "困难":
+        user.append(static_section("difficulty_hard"))
+    request = QUESTION_REQUEST_TEMPLATE.format(
+        topic=topic, type_details=type_details, difficulty=difficulty, context=context, user_input=user_input
+    )
+    user.append(PromptSegment("request", request.strip(), SCOPE_REQUEST))
+    system = [PromptSegment("system", f"你是一位专业的{subject_name}课程教师，擅长出题和教学。")]
+    return AssembledPrompt("question", system, user)
+
+
+def build_quiz_repair_prompt(
+    subject_name: str,
+    topic: str,
+    difficulty: str,
+    broken: Sequence[Tuple[Dict, Sequence[str]]],
+    missing: Dict[str, int],
+    context: str = "",
+) -> AssembledPrompt:
+    """Prompt that fixes only ``broken`` ``(question_dict, problems)`` items and adds ``missing`` ones."""
+    parts: List[str] = []
+    if broken:
+        parts.append("**需要修正的题目：**")
+        for i, (question, problems) in enumerate(broken, 1):
+            parts.append(f"{i}. 问题：{'；'.join(problems)}\n{json.dumps(question, ensure_ascii=False)}")
+    if missing:
+        parts.append("**需要补充的新题：**" + "，".join(f"{qt}{count}道" for qt, count in missing.items()))
+        if context:
+            parts.append(f"**参考资料：**\n{context}")
+    request = QUIZ_REPAIR_REQUEST_TEMPLATE.format(topic=topic, difficulty=difficulty, items="\n\n".join(parts))
+    return AssembledPrompt(
+        "quiz_repair",
+        system=[PromptSegment("system", f"你是一位专业的{subject_name}课程教师，擅长出题和教学。")],
+        user=[
+            static_section("quiz_repair_instructions", subject_name=subject_name),
+            PromptSegment("request", request.strip(), SCOPE_REQUEST),
+        ],
+    )
+
+
+def build_kg_prompt(subject_name: str, topic: str, context: str, retry_problems: Sequence[str] = ()) -> AssembledPrompt:
+    """Knowledge-graph (Mermaid mindmap) prompt; ``retry_problems`` explains why a previous reply was rejected."""
+    request = KG_REQUEST_TEMPLATE.format(topic=topic, context=context)
+    if retry_problems:
+        request = request.rstrip() + "\n\n" + KG_RETRY_NOTE_TEMPLATE.format(problems="；".join(retry_problems))
+    return AssembledPrompt(
+        "knowledge_graph",
+        system=[PromptSegment("system", KG_SYSTEM_PROMPT)],
+        user=[
+            static_section("kg_instructions", subject_name=subject_name),
+            PromptSegment("request", request.strip(), SCOPE_REQUEST),
+        ],
+    )
+
+
+def build_dialogue_system_prompt(
+    subject_name: str, simulated_character: str, current_topic: str, references: str, image_context: str = ""
+) -> AssembledPrompt:
+    """System prompt of a Socratic dialogue turn; the history is appended by the caller."""
+    persona = DIALOGUE_PERSONA_TEMPLATE.format(
+        simulated_character=simulated_character,
+        current_topic=current_topic,
+        references=references,
+    )
+    system = [
+        static_section("dialogue_rules", subject_name=subject_name),
+        PromptSegment("persona", persona.strip(), SCOPE_SESSION),
+    ]
+    if image_context:
+        image = DIALOGUE_IMAGE_TEMPLATE.format(image_context=image_context)
+        system.append(PromptSegment("image", image.strip(), SCOPE_SESSION))
+    return AssembledPrompt("dialogue", system=system)
+
+
+class PromptTokenStats:
+    """Running per-kind averages of estimated prompt tokens per segment."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._totals: Dict[str, Dict[str, int]] = {}
+        self._counts: Dict[str, int] = {}
+
+    def record(self, prompt: AssembledPrompt, extra_tokens: Optional[Dict[str, int]] = None) -> Dict[str, int]:
+        """Adds ``prompt`` (plus e.g. history tokens) and returns its counts."""
+        counts = prompt.token_counts()
+        for name, tokens in (extra_tokens or {}).items():
+            counts[name] = counts.get(name, 0) + tokens
+            counts["total"] += tokens
+        with self._lock:
+            totals = self._totals.setdefault(prompt.kind, {})
+            for name, tokens in counts.items():
+                totals[name] = totals.get(name, 0) + tokens
+            self._counts[prompt.kind] = self._counts.get(prompt.kind, 0) + 1
+        return counts
+
+    def metrics(self) -> Dict[str, Dict]:
+        with self._lock:
+            return {
+                kind: {
+                    "prompts": self._counts[kind],
+                    "avg_tokens": {name: round(total / self._counts[kind], 1) for name, total in totals.items()},
+                }
+                for kind, totals in self._totals.items()
+            }
+
+
+PROMPT_TOKEN_STATS = PromptTokenStats()
+
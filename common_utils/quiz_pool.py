@@ -0,0 +1,339 @@
+"""
+Background pre-generation of quizzes for the most requested combinations.
+
+Most quiz requests name one of a subject's common topics, one difficulty and
+one question type, with a handful of common sizes ("5道简单的选择题"). A
+:class:`QuizPool` counts how often each ``(topic, difficulty, type, count)``
+is requested (exponentially decayed, so the pool follows what the class is
+studying right now), and a background thread keeps a few validated quizzes
+ready for the hottest combinations. It only generates while no foreground
+request is running and while the hourly token budget allows.
+
+A pooled quiz is handed out once and then removed, so every student still
+gets a quiz no one else has seen; pooled quizzes also expire after a TTL.
+
+Environment variables (read by :meth:`QuizPool.from_env`):
+    QUIZ_POOL_SIZE: Total quizzes kept ready (``0`` disables the pool; default 20).
+    QUIZ_POOL_TOKENS_PER_HOUR: Estimated tokens pre-generation may spend per hour.
+    QUIZ_POOL_IDLE_SECONDS: Quiet time after the last request before refilling.
+    QUIZ_POOL_TTL: Seconds a pooled quiz stays servable.
+
+Demand counts, ready quizzes and the token budget are per process: with
+``WEB_CONCURRENCY`` pre-forked workers each worker counts only the requests
+it served, and pre-generation may spend up to ``WEB_CONCURRENCY`` times
+``QUIZ_POOL_TOKENS_PER_HOUR`` in total. Size the budget per worker.
+"""
+import math
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Callable, Deque, Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+from .quiz_utils import QuizRecord
+
+DEFAULT_POOL_SIZE = 20
+DEFAULT_TOKENS_PER_HOUR = 200_000
+DEFAULT_TTL_SECONDS = 6 * 60 * 60
+
+
+class PoolKey(NamedTuple):
+    topic: str
+    difficulty: str
+    question_type: str
+    num_questions: int
+
+
+# ---------------------------------------------------------------------------
+# Token metering
+# ---------------------------------------------------------------------------
+
+class TokenMeter:
+    """Token counter shared by the threads that work on one metered call."""
+
+    def __init__(self):
+        self.tokens = 0
+        self._lock = threading.Lock()
+
+    def add(self, tokens: int) -> None:
+        with self._lock:
+            self.tokens += tokens
+
+
+_meter = threading.local()
+
+
+def current_meter() -> Optional[TokenMeter]:
+    """The meter active in this thread, to be handed to helper threads via :func:`use_meter`."""
+    return getattr(_meter, "current", None)
+
+
+@contextmanager
+def use_meter(meter: Optional[TokenMeter]) -> Iterator[None]:
+    """Charges tokens spent in this thread to ``meter`` (e.g. in a fan-out worker thread)."""
+    previous = current_meter()
+    _meter.current = meter
+    try:
+        yield
+    finally:
+        _meter.current = previous
+
+
+def charge_tokens(tokens: int) -> None:
+    """Adds ``tokens`` to the current thread's meter (no-op outside :func:`metered`)."""
+    meter = current_meter()
+    if meter is not None:
+        meter.add(tokens)
+
+
+@contextmanager
+def metered() -> Iterator[List[int]]:
+    """Counts the tokens charged by LLM calls made in this thread, and in helper
+    threads that enter the same meter with :func:`use_meter`; yields a one-item list."""
+    meter = TokenMeter()
+    spent = [0]
+    try:
+        with use_meter(meter):
+            yield spent
+    finally:
+        spent[0] = meter.tokens
+
+
+# ---------------------------------------------------------------------------
+# Pool
+# ---------------------------------------------------------------------------
+
+class QuizPool:
+    """Keeps pre-generated quizzes for the hottest request combinations.
+
+    Args:
+        generate: Produces one validated quiz for a key, or ``None`` if the
+            output did not validate. Runs in the background thread.
+        name: Label used in logs and ``/metrics``.
+        max_quizzes: Total quizzes kept ready across all keys.
+        max_per_key: Upper bound for a single key.
+        min_demand: Requests for a key within ``half_life`` before it is
+            pooled (counted without decay, so two requests meet ``2.0``).
+        half_life: Seconds after which a past request counts half.
+        ttl_seconds: Seconds a pooled quiz stays servable.
+        idle_seconds: Quiet time after the last foreground request before
+            the worker generates.
+        tokens_per_hour: Estimated token budget of pre-generation.
+        failure_backoff: Seconds a key is skipped after a failed or invalid
+            generation; doubles with each consecutive failure (up to 16×).
+    """
+
+    def __init__(
+        self,
+        generate: Callable[[PoolKey], Optional[QuizRecord]],
+        name: str = "",
+        max_quizzes: int = DEFAULT_POOL_SIZE,
+        max_per_key: int = 5,
+        min_demand: float = 2.0,
+        half_life: float = 30 * 60,
+        ttl_seconds: float = DEFAULT_TTL_SECONDS,
+        idle_seconds: float = 5.0,
+        tokens_per_hour: int = DEFAULT_TOKENS_PER_HOUR,
+        failure_backoff: float = 30.0,
+    ):
+        self.generate = generate
+        self.name = name
+        self.max_quizzes = max_quizzes
+        self.max_per_key = max_per_key
+        self.min_demand = min_demand
+        self.half_life = half_life
+        self.ttl_seconds = ttl_seconds
+        self.idle_seconds = idle_seconds
+        self.tokens_per_hour = tokens_per_hour
+        self.failure_backoff = failure_backoff
+
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._demand: Dict[PoolKey, Tuple[float, float]] = {}  # key -> (decayed count, updated at)
+        # 最近几次请求的时间：是否入池按半衰期内的请求次数判断（衰减后的计数只用于排序），
+        # 否则两次请求衰减后总略小于 2，永远达不到默认阈值
+        self._recent: Dict[PoolKey, Deque[float]] = {}
+        self._recent_len = max(1, math.ceil(min_demand - 1e-6))
+        self._ready: Dict[PoolKey, Deque[Tuple[float, QuizRecord]]] = {}
+        self._spent: Deque[Tuple[float, int]] = deque()  # (time, tokens) within the last hour
+        self._failures: Dict[PoolKey, Tuple[int, float]] = {}  # key -> (consecutive failures, retry after)
+        self._active = 0
+        self._last_active = 0.0
+        self._worker: Optional[threading.Thread] = None
+        self._worker_pid: Optional[int] = None
+        self._counts = {"hits": 0, "misses": 0, "generated": 0, "invalid": 0, "errors": 0, "expired": 0}
+        _POOLS[name or str(id(self))] = self
+
+    @classmethod
+    def from_env(cls, generate: Callable[[PoolKey], Optional[QuizRecord]], name: str = "") -> Optional["QuizPool"]:
+        """A pool configured by ``QUIZ_POOL_*`` variables, or ``None`` if disabled."""
+        size = int(os.environ.get("QUIZ_POOL_SIZE", DEFAULT_POOL_SIZE))
+        if size <= 0:
+            return None
+        return cls(
+            generate,
+            name=name,
+            max_quizzes=size,
+            tokens_per_hour=int(os.environ.get("QUIZ_POOL_TOKENS_PER_HOUR", DEFAULT_TOKENS_PER_HOUR)),
+            idle_seconds=float(os.environ.get("QUIZ_POOL_IDLE_SECONDS", 5.0)),
+            ttl_seconds=float(os.environ.get("QUIZ_POOL_TTL", DEFAULT_TTL_SECONDS)),
+        )
+
+    # ------------------------------------------------------------------
+    # Foreground
+    # ------------------------------------------------------------------
+
+    def _decayed(self, key: PoolKey, now: float) -> float:
+        count, updated_at = self._demand.get(key, (0.0, now))
+        return count * 0.5 ** ((now - updated_at) / self.half_life)
+
+    def _qualifies(self, key: PoolKey, now: float) -> bool:
+        """Whether ``key`` got ``min_demand`` requests within the last ``half_life``."""
+        recent = [t for t in self._recent.get(key, ()) if now - t <= self.half_life]
+        return len(recent) >= self.min_demand - 1e-6
+
+    def take(self, key: PoolKey) -> Optional[QuizRecord]:
+        """Records a request for ``key`` and pops a ready quiz for it, if any."""
+        self._ensure_worker()
+        now = time.monotonic()
+        record = None
+        with self._lock:
+            self._demand[key] = (self._decayed(key, now) + 1.0, now)
+            self._recent.setdefault(key, deque(maxlen=self._recent_len)).append(now)
+            queue = self._ready.get(key)
+            while queue:
+                created_at, candidate = queue.popleft()
+                if now - created_at <= self.ttl_seconds:
+                    record = candidate
+                    break
+                self._counts["expired"] += 1
+            self._counts["hits" if record else "misses"] += 1
+        self._wake.set()
+        return record
+
+    @contextmanager
+    def foreground(self) -> Iterator[None]:
+        """Marks a user request in progress; the worker waits until none are running."""
+        with self._lock:
+            self._active += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._active -= 1
+                self._last_active = time.monotonic()
+
+    # ------------------------------------------------------------------
+    # Background refill
+    # ------------------------------------------------------------------
+
+    def targets(self) -> Dict[PoolKey, int]:
+        """Quizzes to keep per key: ``max_quizzes`` split by demand over the hottest keys."""
+        now = time.monotonic()
+        with self._lock:
+            demand = {key: self._decayed(key, now) for key in self._demand if self._qualifies(key, now)}
+        hot = sorted(((d, key) for key, d in demand.items()), reverse=True)
+        hot = hot[:self.max_quizzes]
+        total = sum(d for d, _ in hot)
+        return {key: min(self.max_per_key, max(1, math.floor(self.max_quizzes * d / total))) for d, key in hot}
+
+    def _next_key(self) -> Optional[PoolKey]:
+        now = time.monotonic()
+        targets = self.targets()
+        with self._lock:
+            for key, queue in self._ready.items():
+                while queue and now - queue[0][0] > self.ttl_seconds:
+                    queue.popleft()
+                    self._counts["expired"] += 1
+            ready = sum(len(q) for q in self._ready.values())
+            if ready >= self.max_quizzes:
+                return None
+            deficits = [
+                (target - len(self._ready.get(key, ())), key) for key, target in targets.items()
+                if now >= self._failures.get(key, (0, 0.0))[1]
+            ]
+        deficits = [(deficit, key) for deficit, key in deficits if deficit > 0]
+        return max(deficits)[1] if deficits else None
+
+    def _tokens_last_hour(self, now: float) -> int:
+        while self._spent and now - self._spent[0][0] > 3600:
+            self._spent.popleft()
+        return sum(tokens for _, tokens in self._spent)
+
+    def _may_generate(self) -> bool:
+        now = time.monotonic()
+        with self._lock:
+            idle = self._active == 0 and now - self._last_active >= self.idle_seconds
+            return idle and self._tokens_last_hour(now) < self.tokens_per_hour
+
+    def refill_once(self) -> bool:
+        """Generates one quiz for the key with the largest deficit.
+
+        Returns ``False`` if nothing was due or the attempt failed; a failed
+        (or invalid) key is then skipped for a growing backoff, so an upstream
+        outage does not turn into back-to-back calls.
+        """
+        key = self._next_key()
+        if key is None:
+            return False
+        record, error = None, None
+        with metered() as spent:
+            try:
+                record = self.generate(key)
+            except Exception as e:
+                error = e
+        now = time.monotonic()
+        with self._lock:
+            # 失败的调用同样计入预算（至少包含已发送提示词的估算 token）
+            self._spent.append((now, spent[0]))
+            if record is not None:
+                self._ready.setdefault(key, deque()).append((now, record))
+                self._counts["generated"] += 1
+                self._failures.pop(key, None)
+                return True
+            self._counts["errors" if error is not None else "invalid"] += 1
+            failures = self._failures.get(key, (0, 0.0))[0] + 1
+            delay = self.failure_backoff * 2 ** min(failures - 1, 4)
+            self._failures[key] = (failures, now + delay)
+        reason = f"failed: {error}" if error is not None else "did not validate"
+        print(f"[{self.name}] Quiz pre-generation for {key} {reason}; retrying the key in {delay:.0f}s.")
+        return False
+
+    def _run(self) -> None:
+        while True:
+            self._wake.wait(timeout=max(1.0, self.idle_seconds))
+            self._wake.clear()
+            while self._may_generate() and self.refill_once():
+                pass
+
+    def _ensure_worker(self) -> None:
+        # 后台线程不会跨越 fork()：每个 worker 进程在首次请求时各自启动
+        if self._worker is not None and self._worker_pid == os.getpid():
+            return
+        with self._lock:
+            if self._worker is None or self._worker_pid != os.getpid():
+                self._worker = threading.Thread(target=self._run, name=f"quiz-pool-{self.name}", daemon=True)
+                self._worker_pid = os.getpid()
+                self._worker.start()
+
+    def metrics(self) -> Dict:
+        targets = self.targets()
+        now = time.monotonic()
+        with self._lock:
+            result: Dict = dict(self._counts)
+            served = result["hits"] + result["misses"]
+            result["hit_rate"] = round(result["hits"] / served, 3) if served else 0.0
+            result["tokens_last_hour"] = self._tokens_last_hour(now)
+            result["ready"] = {
+                "/".join(map(str, key)): len(self._ready.get(key, ())) for key in targets
+            }
+        return result
+
+
+_POOLS: Dict[str, QuizPool] = {}
+
+
+def pool_metrics() -> Dict[str, Dict]:
+    """Metrics of every quiz pool created in this process."""
+    return {name: pool.metrics() for name, pool in list(_POOLS.items())}
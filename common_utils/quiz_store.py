@@ -0,0 +1,168 @@
+"""
+Per-session storage for generated quizzes.
+
+The question agent hides answers when a quiz is first served and returns the
+full version when the same user later asks for "答案/解析". Keeping that quiz
+on the (process-wide) agent instance mixes users up, so quizzes are stored
+here keyed by the session ID issued by ``/chat``.
+
+Two backends are provided:
+
+* :class:`MemoryQuizStore` – bounded LRU with TTL eviction, per process.
+  Only suitable for a single-process server (``python app.py``): with
+  several workers, or an async job finishing in another worker, the request
+  asking for the answers may not see the quiz.
+* :class:`SqliteQuizStore` – disk-backed, shared by every worker on the host
+  and surviving restarts.
+
+:func:`create_quiz_store` picks one from environment variables.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+from .quiz_utils import QuizRecord
+
+DEFAULT_TTL_SECONDS = 2 * 60 * 60
+DEFAULT_MAX_ENTRIES = 10000
+
+
+class QuizStore:
+    """Interface of a session-keyed quiz store."""
+
+    def get(self, session_id: str) -> Optional[QuizRecord]:
+        raise NotImplementedError
+
+    def put(self, session_id: str, record: QuizRecord) -> None:
+        raise NotImplementedError
+
+    def delete(self, session_id: str) -> None:
+        raise NotImplementedError
+
+
+class MemoryQuizStore(QuizStore):
+    """In-process LRU store with a per-entry time-to-live.
+
+    Both lookups and inserts are O(1); the least recently used entry is
+    evicted once ``max_entries`` is exceeded, and expired entries are dropped
+    lazily when they are read.
+    """
+
+    def __init__(self, max_entries: int = DEFAULT_MAX_ENTRIES, ttl_seconds: float = DEFAULT_TTL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[str, Tuple[float, QuizRecord]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, session_id: str) -> Optional[QuizRecord]:
+        with self._lock:
+            entry = self._entries.get(session_id)
+            if entry is None:
+                return None
+            stored_at, record = entry
+            if time.monotonic() - stored_at > self.ttl_seconds:
+                del self._entries[session_id]
+                return None
+            self._entries.move_to_end(session_id)
+            return record
+
+    def put(self, session_id: str, record: QuizRecord) -> None:
+        with self._lock:
+            self._entries[session_id] = (time.monotonic(), record)
+            self._entries.move_to_end(session_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, session_id: str) -> None:
+        with self._lock:
+            self._entries.pop(session_id, None)
+
+
+class SqliteQuizStore(QuizStore):
+    """SQLite-backed store shared across worker processes.
+
+    Expired rows are ignored on read and purged periodically on write.
+    """
+
+    _PURGE_EVERY = 200
+
+    def __init__(self, path: str, ttl_seconds: float = DEFAULT_TTL_SECONDS):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._writes = 0
+        self._conn: Optional[sqlite3.Connection] = None
+        self._conn_pid: Optional[int] = None
+
+    def _connection(self) -> sqlite3.Connection:
+        """Returns this process's connection (callers must hold ``_lock``).
+
+        The store may be created in a pre-fork master; SQLite connections must
+        not cross ``fork()``, so each process opens its own lazily.
+        """
+        if self._conn is None or self._conn_pid != os.getpid():
+            conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+            with conn:
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS quizzes ("
+                    " session_id TEXT PRIMARY KEY,"
+                    " payload TEXT NOT NULL,"
+                    " updated_at REAL NOT NULL)"
+                )
+            self._conn, self._conn_pid = conn, os.getpid()
+        return self._conn
+
+    def get(self, session_id: str) -> Optional[QuizRecord]:
+        with self._lock:
+            row = self._connection().execute(
+                "SELECT payload, updated_at FROM quizzes WHERE session_id = ?", (session_id,)
+            ).fetchone()
+        if row is None or time.time() - row[1] > self.ttl_seconds:
+            return None
+        return QuizRecord.from_dict(json.loads(row[0]))
+
+    def put(self, session_id: str, record: QuizRecord) -> None:
+        payload = json.dumps(record.to_dict(), ensure_ascii=False)
+        now = time.time()
+        with self._lock:
+            conn = self._connection()
+            with conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO quizzes (session_id, payload, updated_at) VALUES (?, ?, ?)",
+                    (session_id, payload, now),
+                )
+                self._writes += 1
+                if self._writes % self._PURGE_EVERY == 0:
+                    conn.execute("DELETE FROM quizzes WHERE updated_at < ?", (now - self.ttl_seconds,))
+
+    def delete(self, session_id: str) -> None:
+        with self._lock:
+            conn = self._connection()
+            with conn:
+                conn.execute("DELETE FROM quizzes WHERE session_id = ?", (session_id,))
+
+
+def create_quiz_store() -> QuizStore:
+    """Creates the quiz store configured by environment variables.
+
+    - ``QUIZ_STORE``: ``memory`` (default, single process only) or
+      ``sqlite``; ``gunicorn.conf.py`` defaults to ``sqlite``.
+    - ``QUIZ_STORE_PATH``: database file for the SQLite backend.
+    - ``QUIZ_STORE_TTL``: seconds a quiz stays retrievable.
+    - ``QUIZ_STORE_MAX_ENTRIES``: capacity of the in-memory backend.
+    """
+    ttl = float(os.environ.get("QUIZ_STORE_TTL", DEFAULT_TTL_SECONDS))
+    if os.environ.get("QUIZ_STORE", "memory").lower() == "sqlite":
+        path = os.environ.get("QUIZ_STORE_PATH", "quiz_store.sqlite3")
+        print(f"[QuizStore] Using SQLite quiz store at '{path}'.")
+        return SqliteQuizStore(path, ttl_seconds=ttl)
+    max_entries = int(os.environ.get("QUIZ_STORE_MAX_ENTRIES", DEFAULT_MAX_ENTRIES))
+    return MemoryQuizStore(max_entries=max_entries, ttl_seconds=ttl)
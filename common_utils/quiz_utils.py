@@ -0,0 +1,544 @@
+"""
+Helpers for working with generated quizzes.
+
+Question generators are asked to return a JSON array of questions
+(``stem``/``options``/``answer``/``explanation``). :func:`parse_structured_questions`
+validates that output once into :class:`Question` objects, and
+:class:`QuizRecord` caches both text renderings (with and without answers) so
+that serving the answers later is a lookup rather than a re-scan of the text.
+
+:func:`validate_quiz` checks the parsed questions against the per-type
+structure of ``QUESTION_TYPE_CONFIG`` (option count, answer form) and the
+requested counts, so the agent can regenerate only the broken items.
+
+For outputs that are not valid JSON (older prompts, vision model replies) the
+legacy text helpers remain: questions are blocks that start with a title line
+such as ``题目1：`` or ``选择题2：``, and :func:`strip_explanations` removes
+answer/explanation lines.
+"""
+import json
+import re
+import threading
+import time
+import unicodedata
+import uuid
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from .image_caption import ImageCaption
+
+# Title line of a question block, tolerant of markdown decoration such as
+# "**题目1：**" or "### 选择题 2:". Group 1 is the label, group 2 the number.
+QUESTION_TITLE_RE = re.compile(
+    r"^\s*[#*]*\s*(题目|选择题|判断题|简答题)\s*(\d+)\s*[:：]?\s*\**\s*"
+)
+
+
+def split_question_blocks(text: str) -> Tuple[str, List[str]]:
+    """Splits quiz text into a preamble and a list of question bodies.
+
+    The title line of each block is removed; any text that follows the title on
+    the same line is kept as the first line of the body.
+
+    Returns:
+        ``(preamble, bodies)`` where *preamble* is whatever precedes the first
+        question (often empty) and *bodies* holds one string per question.
+    """
+    preamble: List[str] = []
+    bodies: List[List[str]] = []
+    for line in text.strip().splitlines():
+        match = QUESTION_TITLE_RE.match(line)
+        if match:
+            rest = line[match.end():].strip()
+            bodies.append([rest] if rest else [])
+        elif bodies:
+            bodies[-1].append(line)
+        else:
+            preamble.append(line)
+    return "\n".join(preamble).strip(), ["\n".join(b).strip() for b in bodies]
+
+
+def merge_question_batches(batches: Sequence[Tuple[str, str]], mixed: bool) -> str:
+    """Merges several generated batches into one consistently numbered quiz.
+
+    Args:
+        batches: ``(question_type, generated_text)`` pairs in display order.
+        mixed: When ``True`` questions are titled per type with independent
+            counters (``选择题1：``, ``判断题1：`` ...); otherwise a single
+            ``题目N：`` sequence is used, as in :func:`render_questions`.
+    """
+    counters = {}
+    parts: List[str] = []
+    for q_type, text in batches:
+        _, bodies = split_question_blocks(text)
+        if not bodies:
+            # Unrecognised layout: keep the raw text rather than dropping it.
+            if text.strip():
+                parts.append(text.strip())
+            continue
+        label = q_type if mixed else "题目"
+        for body in bodies:
+            counters[label] = counters.get(label, 0) + 1
+            parts.append(f"{label}{counters[label]}：\n{body}".rstrip())
+    return "\n\n".join(parts)
+
+
+# ---------------------------------------------------------------------------
+# Structured questions
+# ---------------------------------------------------------------------------
+
+OPTION_LABELS = ("A", "B", "C", "D", "E", "F")
+_JSON_BLOCK_RE = re.compile(r"```(?:json)?\s*(.*?)```", re.DOTALL | re.IGNORECASE)
+_OPTION_PREFIX_RE = re.compile(r"^\s*[A-FＡ-Ｆ]\s*[\.．、:：)）]\s*")
+_ANSWER_LABEL_BY_TYPE = {"简答题": "参考答案"}
+
+
+@dataclass
+class Question:
+    """One generated question."""
+
+    type: str
+    stem: str
+    options: List[str] = field(default_factory=list)
+    answer: str = ""
+    explanation: str = ""
+
+    def to_dict(self) -> dict:
+        return {
+            "type": self.type,
+            "stem": self.stem,
+            "options": list(self.options),
+            "answer": self.answer,
+            "explanation": self.explanation,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "Question":
+        return cls(
+            type=data.get("type", ""),
+            stem=data.get("stem", ""),
+            options=list(data.get("options") or []),
+            answer=data.get("answer", ""),
+            explanation=data.get("explanation", ""),
+        )
+
+
+def _coerce_text(value) -> str:
+    if value is None:
+        return ""
+    if isinstance(value, bool):
+        return "正确" if value else "错误"
+    if isinstance(value, (list, tuple)):
+        return "".join(_coerce_text(v) for v in value)
+    return str(value).strip()
+
+
+def _extract_json_payload(text: str) -> Optional[str]:
+    match = _JSON_BLOCK_RE.search(text)
+    if match:
+        return match.group(1).strip()
+    start, end = text.find("["), text.rfind("]")
+    if start != -1 and end > start:
+        return text[start:end + 1]
+    return None
+
+
+def parse_structured_questions(text: str, default_type: Optional[str] = None) -> Optional[List[Question]]:
+    """Parses and validates the JSON question array emitted by the generator.
+
+    Args:
+        text: Raw LLM output, optionally wrapping the JSON in a code fence.
+        default_type: Question type assigned to items without a ``type`` field
+            (used for single-type requests).
+
+    Returns:
+        The validated questions, or ``None`` if the output is not a usable
+        JSON question list (callers then fall back to the text helpers).
+    """
+    payload = _extract_json_payload(text)
+    if payload is None:
+        return None
+    try:
+        data = json.loads(payload)
+    except ValueError:
+        return None
+    if isinstance(data, dict):
+        data = data.get("questions")
+    if not isinstance(data, list) or not data:
+        return None
+
+    questions: List[Question] = []
+    for item in data:
+        if not isinstance(item, dict):
+            return None
+        stem = _coerce_text(item.get("stem"))
+        if not stem:
+            return None
+        raw_options = item.get("options") or []
+        if isinstance(raw_options, dict):
+            raw_options = [raw_options[k] for k in sorted(raw_options)]
+        if not isinstance(raw_options, list):
+            return None
+        options = [_OPTION_PREFIX_RE.sub("", _coerce_text(o)) for o in raw_options]
+        questions.append(Question(
+            type=_coerce_text(item.get("type")) or (default_type or ""),
+            stem=stem,
+            options=[o for o in options if o],
+            answer=_coerce_text(item.get("answer")),
+            explanation=_coerce_text(item.get("explanation")),
+        ))
+    return questions
+
+
+def render_questions(questions: Sequence[Question], mixed: bool, include_answers: bool = True) -> str:
+    """Renders questions in the text layout understood by the web front end."""
+    counters = {}
+    blocks: List[str] = []
+    for q in questions:
+        label = q.type if (mixed and q.type) else "题目"
+        counters[label] = counters.get(label, 0) + 1
+        lines = [f"{label}{counters[label]}：", f"题干：{q.stem}"]
+        lines.extend(f"{OPTION_LABELS[i]}. {opt}" for i, opt in enumerate(q.options[:len(OPTION_LABELS)]))
+        if include_answers:
+            if q.answer:
+                lines.append(f"{_ANSWER_LABEL_BY_TYPE.get(q.type, '正确答案')}：{q.answer}")
+            if q.explanation:
+                lines.append(f"解析：{q.explanation}")
+        blocks.append("\n".join(lines))
+    return "\n\n".join(blocks)
+
+
+_NON_WORD_RE = re.compile(r"[\W_]+")
+
+
+def _stem_shingles(stem: str) -> frozenset:
+    """Character bigrams of a stem with whitespace and punctuation removed."""
+    normalized = _NON_WORD_RE.sub("", stem.lower())
+    if len(normalized) < 2:
+        return frozenset([normalized])
+    return frozenset(normalized[i:i + 2] for i in range(len(normalized) - 1))
+
+
+class QuestionDeduplicator:
+    """Thread-safe filter that rejects questions similar to ones already accepted.
+
+    Similarity is the Jaccard index of the stems' character bigrams, which is
+    robust to small wording and punctuation changes in Chinese text.
+    """
+
+    def __init__(self, threshold: float = 0.8):
+        self.threshold = threshold
+        self._accepted: List[frozenset] = []
+        self._lock = threading.Lock()
+
+    def _is_duplicate(self, shingles: frozenset) -> bool:
+        for other in self._accepted:
+            union = len(shingles | other)
+            if union and len(shingles & other) / union >= self.threshold:
+                return True
+        return False
+
+    def filter(self, questions: Sequence[Question]) -> Tuple[List[Question], List[Question]]:
+        """Accepts non-duplicate questions, returning ``(kept, removed)``."""
+        kept: List[Question] = []
+        removed: List[Question] = []
+        with self._lock:
+            for q in questions:
+                shingles = _stem_shingles(q.stem)
+                if self._is_duplicate(shingles):
+                    removed.append(q)
+                else:
+                    self._accepted.append(shingles)
+                    kept.append(q)
+        return kept, removed
+
+
+# ---------------------------------------------------------------------------
+# Validation
+# ---------------------------------------------------------------------------
+
+@dataclass(frozen=True)
+class QuestionRule:
+    """Structure required of one question type.
+
+    Attributes:
+        num_options: Exact number of options, or ``None`` if options are not
+            checked.
+        answers: Allowed answer prefixes, or ``None`` if any non-empty answer
+            is accepted.
+    """
+
+    num_options: Optional[int] = None
+    answers: Optional[Tuple[str, ...]] = None
+
+
+# 与 prompts.QUESTION_TYPE_CONFIG / STRUCTURED_OUTPUT_ADDENDUM 中各题型的格式要求一致
+QUESTION_RULES: Dict[str, QuestionRule] = {
+    "选择题": QuestionRule(num_options=4, answers=OPTION_LABELS[:4]),
+    "判断题": QuestionRule(answers=("正确", "错误", "对", "错")),
+    "简答题": QuestionRule(),
+}
+
+
+def question_issues(question: Question, q_type: Optional[str] = None) -> List[str]:
+    """Problems that make ``question`` unusable as a ``q_type`` question (empty if none)."""
+    rule = QUESTION_RULES.get(q_type or question.type, QuestionRule())
+    issues: List[str] = []
+    if not question.stem.strip():
+        issues.append("缺少题干")
+    if rule.num_options is not None and len(question.options) != rule.num_options:
+        issues.append(f"选项为{len(question.options)}个，应恰好为{rule.num_options}个")
+    answer = unicodedata.normalize("NFKC", question.answer).strip().lstrip("（(【[").upper()
+    if not answer:
+        issues.append("缺少答案")
+    elif rule.answers is not None and not answer.startswith(rule.answers):
+        issues.append(f"答案“{question.answer}”无效，应为{'/'.join(rule.answers)}之一")
+    return issues
+
+
+@dataclass
+class QuizValidation:
+    """Result of :func:`validate_quiz`.
+
+    Attributes:
+        questions: Questions kept, in generation order, with surplus items of
+            each type and items of unrequested types dropped.
+        broken: Index into ``questions`` -> problems of that question.
+        missing: Question type -> number of questions still to generate.
+    """
+
+    questions: List[Question]
+    broken: Dict[int, List[str]] = field(default_factory=dict)
+    missing: Dict[str, int] = field(default_factory=dict)
+
+    @property
+    def ok(self) -> bool:
+        return not self.broken and not self.missing
+
+
+def validate_quiz(questions: Sequence[Question], expected_counts: Dict[str, int]) -> QuizValidation:
+    """Checks ``questions`` against the requested ``{question_type: count}``.
+
+    Questions whose type was not requested are dropped (in a single-type
+    request an untyped question counts as the requested type). When a type has
+    more questions than requested, valid ones are kept first.
+    """
+    single_type = next(iter(expected_counts)) if len(expected_counts) == 1 else None
+    by_type: Dict[str, List[Tuple[int, Question, List[str]]]] = {}
+    for index, q in enumerate(questions):
+        if q.type not in expected_counts:
+            if single_type is None or q.type in QUESTION_RULES:
+                continue
+            q.type = single_type
+        by_type.setdefault(q.type, []).append((index, q, question_issues(q)))
+
+    chosen: List[Tuple[int, Question, List[str]]] = []
+    missing: Dict[str, int] = {}
+    for q_type, count in expected_counts.items():
+        items = sorted(by_type.get(q_type, []), key=lambda item: bool(item[2]))[:count]
+        chosen.extend(items)
+        if len(items) < count:
+            missing[q_type] = count - len(items)
+    chosen.sort(key=lambda item: item[0])
+
+    return QuizValidation(
+        questions=[q for _, q, _ in chosen],
+        broken={i: issues for i, (_, _, issues) in enumerate(chosen) if issues},
+        missing=missing,
+    )
+
+
+def splice_repairs(validation: QuizValidation, repaired: Sequence[Question]) -> Tuple[List[Question], int, int]:
+    """Puts regenerated questions back into a validated quiz.
+
+    ``repaired`` holds the fixed versions of ``validation.broken`` in index
+    order, followed by new questions for ``validation.missing``. A fixed item
+    replaces the original only if it passes validation; new items are added
+    after the last question of their type.
+
+    Returns:
+        ``(questions, fixed, added)``.
+    """
+    questions = list(validation.questions)
+    broken = sorted(validation.broken)
+    fixed = 0
+    for index, candidate in zip(broken, repaired):
+        candidate.type = questions[index].type
+        if not question_issues(candidate):
+            questions[index] = candidate
+            fixed += 1
+
+    missing = dict(validation.missing)
+    single_missing = next(iter(missing)) if len(missing) == 1 else None
+    added = 0
+    for candidate in repaired[len(broken):]:
+        if candidate.type not in missing and single_missing and candidate.type not in QUESTION_RULES:
+            candidate.type = single_missing
+        if not missing.get(candidate.type) or question_issues(candidate):
+            continue
+        missing[candidate.type] -= 1
+        position = max((i + 1 for i, q in enumerate(questions) if q.type == candidate.type), default=len(questions))
+        questions.insert(position, candidate)
+        added += 1
+    return questions, fixed, added
+
+
+class QuizValidationStats:
+    """Counters for ``/metrics``: how often quizzes needed repairs and what they cost."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts = {
+            "quizzes": 0, "valid_first_pass": 0, "repair_calls": 0,
+            "items_broken": 0, "items_missing": 0, "items_fixed": 0, "items_added": 0, "unresolved": 0,
+        }
+        self._validations = 0
+        self._validate_seconds = 0.0
+
+    def timed_validate(self, questions: Sequence[Question], expected_counts: Dict[str, int]) -> QuizValidation:
+        start = time.perf_counter()
+        validation = validate_quiz(questions, expected_counts)
+        with self._lock:
+            self._validations += 1
+            self._validate_seconds += time.perf_counter() - start
+        return validation
+
+    def record(self, first: QuizValidation, final: QuizValidation, repair_calls: int, fixed: int, added: int) -> None:
+        with self._lock:
+            counts = self._counts
+            counts["quizzes"] += 1
+            counts["valid_first_pass"] += first.ok
+            counts["repair_calls"] += repair_calls
+            counts["items_broken"] += len(first.broken)
+            counts["items_missing"] += sum(first.missing.values())
+            counts["items_fixed"] += fixed
+            counts["items_added"] += added
+            counts["unresolved"] += len(final.broken) + sum(final.missing.values())
+
+    def metrics(self) -> Dict:
+        with self._lock:
+            result = dict(self._counts)
+            result["avg_validate_us"] = (
+                round(self._validate_seconds / self._validations * 1e6, 1) if self._validations else 0.0
+            )
+        return result
+
+
+QUIZ_VALIDATION_STATS = QuizValidationStats()
+
+
+# ---------------------------------------------------------------------------
+# Legacy text stripping
+# ---------------------------------------------------------------------------
+
+# 起始信号（命中后进入剥离块）
+_STRIP_START_RES = [
+    re.compile(p, re.IGNORECASE) for p in (
+        r"^\s*(?:正确?答案|参考答案|标准答案|答案解析|解析|解答|讲解|评分标准|思路|分析|参考思路|答案是|答案为|Answer|Explanation)\s*[:：】\])]?.*$",
+        r"^\s*[（(【\[]?(?:答|解)\s*[：:]\s*.*$",
+        r"^\s*[【\[]?(?:答案|解析|参考答案)[】\]]\s*.*$",
+    )
+]
+# 内嵌写法（行中出现“答案/解析”也视为需要移除整行）
+_STRIP_INLINE_RE = re.compile(
+    r"(正确?答案|参考答案|标准答案|答案解析|解析|解答|答案是|答案为|Answer|Explanation)\s*[:：]?\s*",
+    re.IGNORECASE,
+)
+# 结束信号：出现下一题或新的题型小节标题，结束剥离
+_STRIP_BOUNDARY_RES = [
+    re.compile(p) for p in (
+        r"^\s*(?:题目|选择题|判断题|简答题)\s*\d+",
+        r"^\s*(?:选择题|判断题|简答题)\s*[：:]\s*$",
+        r"^\s*\d+\s*[、\.\)．]",  # 1.  1)  1．  1、
+    )
+]
+_EXCESS_BLANK_LINES_RE = re.compile(r"\n{3,}")
+
+
+def strip_explanations(text: str) -> str:
+    """移除答案与解析，只保留题干及选项/题号。
+
+    用于无法解析为结构化题目的输出（如多模态模型的回复）。规则：
+    - 识别丰富的“答案/解析”起始样式（如：正确答案、参考答案、标准答案、答案是/为、答：、解：、【答案】等）。
+    - 支持“解析：”换行后的多行内容整段剥离，直到检测到下一题/新段落标题为止。
+    - 处理同一行内含有“答案：B”之类的内嵌写法（整行移除）。
+    """
+    filtered: List[str] = []
+    in_strip_block = False
+
+    for line in text.splitlines():
+        if in_strip_block:
+            # 检测是否到达下一题/小节，否则仍在“解析/答案”块内，整行丢弃
+            if any(r.match(line) for r in _STRIP_BOUNDARY_RES):
+                in_strip_block = False
+                filtered.append(line)
+        elif any(r.match(line) for r in _STRIP_START_RES) or _STRIP_INLINE_RE.search(line):
+            # 进入剥离块，不输出该行
+            in_strip_block = True
+        else:
+            filtered.append(line)
+
+    # 去除末尾多余空行
+    result = "\n".join(filtered)
+    return _EXCESS_BLANK_LINES_RE.sub("\n\n", result).strip("\n")
+
+
+# ---------------------------------------------------------------------------
+# Quiz records
+# ---------------------------------------------------------------------------
+
+@dataclass
+class QuizRecord:
+    """A generated quiz with both renderings computed once.
+
+    Attributes:
+        quiz_id: Unique ID of the generation request.
+        full_text: Questions with answers and explanations.
+        question_only_text: Questions only, shown when the quiz is first served.
+        questions: Structured questions, empty when the output was free text.
+        image_caption: Caption of the image the session last uploaded, kept
+            so later text-only requests in the session still see it.
+    """
+
+    full_text: str
+    question_only_text: str
+    questions: List[Question] = field(default_factory=list)
+    quiz_id: str = field(default_factory=lambda: uuid.uuid4().hex)
+    image_caption: Optional[ImageCaption] = None
+
+    @classmethod
+    def from_questions(cls, questions: Sequence[Question], mixed: bool) -> "QuizRecord":
+        return cls(
+            full_text=render_questions(questions, mixed, include_answers=True),
+            question_only_text=render_questions(questions, mixed, include_answers=False),
+            questions=list(questions),
+        )
+
+    @classmethod
+    def from_text(cls, text: str) -> "QuizRecord":
+        return cls(full_text=text, question_only_text=strip_explanations(text))
+
+    def to_dict(self) -> dict:
+        return {
+            "quiz_id": self.quiz_id,
+            "full_text": self.full_text,
+            "question_only_text": self.question_only_text,
+            "questions": [q.to_dict() for q in self.questions],
+            "image_caption": self.image_caption._asdict() if self.image_caption else None,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "QuizRecord":
+        return cls(
+            full_text=data["full_text"],
+            question_only_text=data["question_only_text"],
+            questions=[Question.from_dict(q) for q in data.get("questions", [])],
+            quiz_id=data.get("quiz_id") or uuid.uuid4().hex,
+            image_caption=_caption_from_dict(data.get("image_caption")),
+        )
+
+
+def _caption_from_dict(data: Optional[dict]) -> Optional[ImageCaption]:
+    if not data:
+        return None
+    return ImageCaption(data.get("text", ""), tuple(data.get("concepts") or ()), data.get("description", ""))
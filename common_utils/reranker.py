@@ -0,0 +1,215 @@
+"""
+Retrieve-wide-then-rerank stage for the agents' knowledge-base lookups.
+
+FAISS returns the top-k chunks by embedding distance only. :class:`Reranker`
+fetches a wider candidate set (``candidate_k``, default 50) in the same FAISS
+call and re-scores it on CPU before keeping the best ``k``:
+
+* default scorer – min-max normalised embedding similarity (the FAISS
+  distances, already computed) blended with character-bigram overlap between
+  the topic and the chunk;
+* optional cross-encoder – set ``RERANK_CROSS_ENCODER`` to a
+  ``sentence-transformers`` CrossEncoder model name (e.g.
+  ``BAAI/bge-reranker-base``); falls back to the default scorer when the
+  package or model is unavailable.
+
+Candidates are scored in batches, best-first by embedding similarity, until
+the latency budget is spent; the rest keep their FAISS order after the scored
+ones. Only the query-chunk part of a score (bigram overlap or cross-encoder
+score) is cached, per (scorer, focus, chunk); the embedding similarity is
+normalised over each call's own candidate set, so it is blended in afresh
+every time. Agents search FAISS with different expansions of the same focus
+(subject name, persona, image concepts), and a cached blend would carry one
+candidate window's normalisation into another.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from langchain_community.vectorstores.utils import DistanceStrategy
+from langchain_core.documents import Document
+
+from .context_packer import char_bigrams
+
+
+class Reranker:
+    """Reranks a wide FAISS candidate set down to the best ``k`` chunks.
+
+    Args:
+        candidate_k: Number of FAISS candidates fetched per query.
+        latency_budget_ms: Soft cap on scoring time per query.
+        batch_size: Candidates scored per batch (cross-encoder batch size).
+        embedding_weight: Weight of the embedding similarity in the default
+            scorer; the lexical score gets ``1 - embedding_weight``.
+        cross_encoder: Optional CrossEncoder model name.
+        cache_size: Maximum cached (focus, chunk) scores.
+    """
+
+    def __init__(
+        self,
+        candidate_k: int = 50,
+        latency_budget_ms: float = 50.0,
+        batch_size: int = 16,
+        embedding_weight: float = 0.5,
+        cross_encoder: Optional[str] = None,
+        cache_size: int = 20000,
+    ):
+        self.candidate_k = candidate_k
+        self.latency_budget = latency_budget_ms / 1000.0
+        self.batch_size = max(1, batch_size)
+        self.embedding_weight = embedding_weight
+        self.cache_size = cache_size
+        self._cache: "OrderedDict[Tuple[str, str, str], float]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._model = self._load_cross_encoder(cross_encoder) if cross_encoder else None
+        self.scorer_name = f"cross-encoder:{cross_encoder}" if self._model is not None else "lexical+embedding"
+        self._stats = {"queries": 0, "scored": 0, "cache_hits": 0, "over_budget": 0, "total_ms": 0.0}
+
+    @staticmethod
+    def _load_cross_encoder(model_name: str):
+        try:
+            from sentence_transformers import CrossEncoder
+        except ImportError:
+            print(f"[Reranker] sentence-transformers 未安装，无法加载 {model_name}，使用词法 + 向量打分。")
+            return None
+        try:
+            return CrossEncoder(model_name, device="cpu")
+        except Exception as e:
+            print(f"[Reranker] 加载交叉编码器 {model_name} 失败: {e}，使用词法 + 向量打分。")
+            return None
+
+    @classmethod
+    def from_env(cls) -> "Reranker":
+        """Reads ``RERANK_CANDIDATES``, ``RERANK_LATENCY_MS`` and ``RERANK_CROSS_ENCODER``."""
+        return cls(
+            candidate_k=int(os.environ.get("RERANK_CANDIDATES", 50)),
+            latency_budget_ms=float(os.environ.get("RERANK_LATENCY_MS", 50)),
+            cross_encoder=os.environ.get("RERANK_CROSS_ENCODER") or None,
+        )
+
+    # ------------------------------------------------------------------
+    # Score cache
+    # ------------------------------------------------------------------
+
+    def _cached(self, key: Tuple[str, str, str]) -> Optional[float]:
+        with self._lock:
+            score = self._cache.get(key)
+            if score is not None:
+                self._cache.move_to_end(key)
+            return score
+
+    def _store(self, key: Tuple[str, str, str], score: float) -> None:
+        with self._lock:
+            self._cache[key] = score
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    # ------------------------------------------------------------------
+    # Scoring
+    # ------------------------------------------------------------------
+
+    def _score_batch(self, query: str, docs: Sequence[Document]) -> List[float]:
+        """Query-chunk scores, independent of the candidate set (cacheable)."""
+        if self._model is not None:
+            pairs = [(query, doc.page_content) for doc in docs]
+            return [float(s) for s in self._model.predict(pairs, batch_size=self.batch_size)]
+        query_grams = char_bigrams(query)
+        if not query_grams:
+            return [0.0] * len(docs)
+        return [len(char_bigrams(doc.page_content) & query_grams) / len(query_grams) for doc in docs]
+
+    def _final_score(self, score: float, similarity: float) -> float:
+        """Blends a cached lexical score with this call's normalised embedding similarity."""
+        if self._model is not None:
+            return score
+        return self.embedding_weight * similarity + (1 - self.embedding_weight) * score
+
+    def rerank(self, query: str, candidates: Sequence[Tuple[Document, float]], k: int) -> List[Document]:
+        """Reorders ``(document, distance)`` candidates (smaller = closer) and returns the best ``k``.
+
+        ``query`` should be the focused topic text (not padded with the subject
+        name), since every chunk in the knowledge base matches the subject.
+        """
+        start = time.perf_counter()
+        unique: Dict[str, Tuple[Document, float]] = {}
+        for doc, distance in candidates:
+            unique.setdefault(doc.id or doc.page_content, (doc, distance))
+        ordered = sorted(unique.items(), key=lambda item: item[1][1])  # FAISS L2: smaller is closer
+        if len(ordered) <= k:
+            return [doc for _, (doc, _) in ordered]
+
+        distances = [d for _, (_, d) in ordered]
+        lo, hi = min(distances), max(distances)
+        similarity = {key: 1.0 - (d - lo) / (hi - lo) if hi > lo else 1.0 for key, (_, d) in ordered}
+
+        scored: Dict[str, float] = {}
+        hits = 0
+        pending = []
+        for key, (doc, _) in ordered:
+            cached = self._cached((self.scorer_name, query, key))
+            if cached is None:
+                pending.append((key, doc))
+            else:
+                scored[key] = cached
+                hits += 1
+
+        over_budget = False
+        for i in range(0, len(pending), self.batch_size):
+            if time.perf_counter() - start > self.latency_budget:
+                over_budget = True
+                break
+            batch = pending[i:i + self.batch_size]
+            scores = self._score_batch(query, [doc for _, doc in batch])
+            for (key, _), score in zip(batch, scores):
+                scored[key] = score
+                self._store((self.scorer_name, query, key), score)
+
+        final = {key: self._final_score(score, similarity[key]) for key, score in scored.items()}
+        ranked = sorted(final, key=lambda key: -final[key])
+        ranked += [key for key, _ in ordered if key not in scored]
+        elapsed = time.perf_counter() - start
+        with self._lock:
+            self._stats["queries"] += 1
+            self._stats["scored"] += len(scored) - hits
+            self._stats["cache_hits"] += hits
+            self._stats["over_budget"] += int(over_budget)
+            self._stats["total_ms"] += elapsed * 1000
+        return [unique[key][0] for key in ranked[:k]]
+
+    def search(self, vectorstore, query: str, k: int, focus: Optional[str] = None) -> List[Document]:
+        """FAISS search for ``candidate_k`` candidates of ``query``, reranked against ``focus``."""
+        fetch = max(k, self.candidate_k)
+        candidates = vectorstore.similarity_search_with_score(query, k=fetch)
+        if getattr(vectorstore, "distance_strategy", None) == DistanceStrategy.MAX_INNER_PRODUCT:
+            candidates = [(doc, -score) for doc, score in candidates]
+        return self.rerank(focus or query, candidates, k)
+
+    def metrics(self) -> Dict[str, float]:
+        with self._lock:
+            stats = dict(self._stats)
+        queries = stats.pop("queries")
+        total_ms = stats.pop("total_ms")
+        return {
+            "scorer": self.scorer_name,
+            "queries": queries,
+            "avg_ms": round(total_ms / queries, 3) if queries else 0.0,
+            "cache_entries": len(self._cache),
+            **stats,
+        }
+
+
+_DEFAULT_RERANKER: Optional[Reranker] = None
+_DEFAULT_LOCK = threading.Lock()
+
+
+def get_reranker() -> Reranker:
+    """Process-wide reranker (configured from the environment) shared by all agents."""
+    global _DEFAULT_RERANKER
+    if _DEFAULT_RERANKER is None:
+        with _DEFAULT_LOCK:
+            if _DEFAULT_RERANKER is None:
+                _DEFAULT_RERANKER = Reranker.from_env()
+    return _DEFAULT_RERANKER
@@ -0,0 +1,356 @@
+"""
+Multi-subject retrieval service shared by all agents.
+
+Each subject (马原, 毛概, 习概, ...) has its own FAISS folder. Instead of every
+agent loading its own copy, agents register their ``vectorstore_path`` with a
+:class:`RetrievalService` under a namespace (the folder name by default) and
+search through it:
+
+* indexes are loaded lazily on the first search of their namespace and
+  unloaded least-recently-used first once the estimated footprint exceeds
+  ``RETRIEVAL_MEMORY_MB``;
+* chunk IDs are namespaced (``"database_agent_mayuan:17"``), so results,
+  caches and deduplication never mix subjects;
+* wide-candidate reranking runs next to the index, so only the final ``k``
+  chunks leave the service.
+
+By default the service lives in the web process (and is shared copy-on-write
+by pre-forked workers). With ``RETRIEVAL_SERVICE_ADDR`` set, agents instead
+talk to one standalone server over a local socket, so adding subjects does
+not grow every web worker::
+
+    python -m common_utils.retrieval_service --listen unix:/tmp/retrieval.sock database_agent_mayuan
+    RETRIEVAL_SERVICE_ADDR=unix:/tmp/retrieval.sock gunicorn -c gunicorn.conf.py app:app
+"""
+import argparse
+import json
+import os
+import socket
+import socketserver
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+from langchain_core.documents import Document
+
+from .chunk_store import CHUNK_STORE_FILE, CompactDocstore
+from .reranker import get_reranker
+from .singleflight import SingleFlight
+from .vector_utils import load_embeddings, load_vectorstore
+
+
+class RetrievalError(RuntimeError):
+    """Raised when a namespace is unknown or the retrieval server reports an error."""
+
+
+def _estimate_nbytes(vectorstore) -> int:
+    """Approximate resident size of a loaded store: raw vectors plus packed chunk texts."""
+    index = vectorstore.index
+    size = index.ntotal * index.d * 4
+    docstore = vectorstore.docstore
+    if isinstance(docstore, CompactDocstore):
+        size += docstore.nbytes
+    return size
+
+
+class _Subject:
+    __slots__ = ("namespace", "path", "embedding_model", "vectorstore", "nbytes", "searches", "loads")
+
+    def __init__(self, namespace: str, path: str, embedding_model: str):
+        self.namespace = namespace
+        self.path = path
+        self.embedding_model = embedding_model
+        self.vectorstore = None
+        self.nbytes = 0
+        self.searches = 0
+        self.loads = 0
+
+
+class RetrievalService:
+    """Hosts several subject indexes in one process with lazy loading and LRU unloading.
+
+    Args:
+        memory_cap_mb: Soft cap on the estimated footprint of loaded indexes;
+            ``None`` or ``0`` means unlimited. The most recently used index
+            is never unloaded, even when it alone exceeds the cap.
+    """
+
+    def __init__(self, memory_cap_mb: Optional[float] = None):
+        self.memory_cap = int(memory_cap_mb * 1024 * 1024) if memory_cap_mb else None
+        self._subjects: Dict[str, _Subject] = {}
+        self._loaded: "OrderedDict[str, _Subject]" = OrderedDict()
+        self._embeddings: Dict[str, Any] = {}
+        self._lock = threading.Lock()
+        self._loads = SingleFlight("检索服务加载")
+        self.evictions = 0
+
+    @classmethod
+    def from_env(cls) -> "RetrievalService":
+        """Reads ``RETRIEVAL_MEMORY_MB``."""
+        return cls(memory_cap_mb=float(os.environ.get("RETRIEVAL_MEMORY_MB", 0)))
+
+    def register(self, path: str, namespace: Optional[str] = None, embedding_model: str = "text-embedding-v2") -> str:
+        """Makes the vector store at ``path`` searchable as ``namespace`` (loaded on first use)."""
+        path = os.path.abspath(path)
+        if not any(os.path.exists(os.path.join(path, name)) for name in (CHUNK_STORE_FILE, "index.faiss")):
+            raise FileNotFoundError(f"No vector store found in {path}")
+        namespace = namespace or os.path.basename(os.path.normpath(path))
+        with self._lock:
+            existing = self._subjects.get(namespace)
+            if existing is not None:
+                if existing.path != path:
+                    raise RetrievalError(f"Namespace '{namespace}' is already registered for {existing.path}")
+                return namespace
+            self._subjects[namespace] = _Subject(namespace, path, embedding_model)
+        return namespace
+
+    def _embeddings_for(self, model: str):
+        with self._lock:
+            embeddings = self._embeddings.get(model)
+            if embeddings is None:
+                embeddings = self._embeddings[model] = load_embeddings(model)
+            return embeddings
+
+    def _load(self, subject: _Subject):
+        print(f"[RetrievalService] Loading '{subject.namespace}' from {subject.path} ...")
+        vectorstore = load_vectorstore(subject.path, self._embeddings_for(subject.embedding_model), shared=False)
+        if isinstance(vectorstore.docstore, CompactDocstore):
+            vectorstore.docstore.namespace = subject.namespace
+        with self._lock:
+            subject.vectorstore = vectorstore
+            subject.nbytes = _estimate_nbytes(vectorstore)
+            subject.loads += 1
+            self._loaded[subject.namespace] = subject
+            self._evict_locked(keep=subject.namespace)
+        return vectorstore
+
+    def _evict_locked(self, keep: str) -> None:
+        if not self.memory_cap:
+            return
+        while sum(s.nbytes for s in self._loaded.values()) > self.memory_cap:
+            victim = next((ns for ns in self._loaded if ns != keep), None)
+            if victim is None:
+                return
+            subject = self._loaded.pop(victim)
+            # 正在进行的检索仍持有引用，结束后由引用计数释放
+            subject.vectorstore = None
+            subject.nbytes = 0
+            self.evictions += 1
+            print(f"[RetrievalService] Unloaded '{victim}' (memory cap {self.memory_cap // (1024 * 1024)} MB).")
+
+    def _acquire(self, namespace: str, search: bool = False):
+        with self._lock:
+            subject = self._subjects.get(namespace)
+            if subject is None:
+                raise RetrievalError(f"Unknown retrieval namespace '{namespace}'")
+            subject.searches += int(search)
+            vectorstore = subject.vectorstore
+            if vectorstore is not None:
+                self._loaded.move_to_end(namespace)
+                return vectorstore
+        return self._loads.do(namespace, self._load, subject)
+
+    def search(self, namespace: str, query: str, k: int, focus: Optional[str] = None) -> List[Document]:
+        """The best ``k`` chunks of ``namespace`` for ``query``, reranked against ``focus``."""
+        return get_reranker().search(self._acquire(namespace, search=True), query, k, focus=focus)
+
+    def preload(self, namespaces: Optional[List[str]] = None) -> None:
+        """Loads ``namespaces`` (default: all registered) now, e.g. in a pre-fork master."""
+        with self._lock:
+            targets = list(namespaces or self._subjects)
+        for namespace in targets:
+            self._acquire(namespace)
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "memory_cap_mb": self.memory_cap // (1024 * 1024) if self.memory_cap else None,
+                "loaded_mb": round(sum(s.nbytes for s in self._loaded.values()) / (1024 * 1024), 2),
+                "evictions": self.evictions,
+                "namespaces": {
+                    ns: {
+                        "loaded": s.vectorstore is not None,
+                        "mb": round(s.nbytes / (1024 * 1024), 2),
+                        "searches": s.searches,
+                        "loads": s.loads,
+                    }
+                    for ns, s in self._subjects.items()
+                },
+            }
+
+
+# ----------------------------------------------------------------------
+# Local socket server / client（每行一个 JSON 请求 / 响应）
+# ----------------------------------------------------------------------
+
+def _parse_address(address: str) -> Tuple[int, Union[str, Tuple[str, int]]]:
+    if address.startswith("unix:"):
+        return socket.AF_UNIX, address[len("unix:"):]
+    if address.startswith("/"):
+        return socket.AF_UNIX, address
+    host, _, port = address.rpartition(":")
+    return socket.AF_INET, (host or "127.0.0.1", int(port))
+
+
+def _doc_to_json(doc: Document) -> Dict[str, Any]:
+    return {"id": doc.id, "text": doc.page_content, "metadata": doc.metadata}
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        service: RetrievalService = self.server.service
+        for line in self.rfile:
+            try:
+                request = json.loads(line)
+                op = request.pop("op")
+                if op == "search":
+                    result = [_doc_to_json(doc) for doc in service.search(**request)]
+                elif op == "register":
+                    result = service.register(**request)
+                elif op == "preload":
+                    result = service.preload(**request)
+                elif op == "metrics":
+                    result = service.metrics()
+                else:
+                    raise RetrievalError(f"Unknown op '{op}'")
+                response = {"result": result}
+            except Exception as e:
+                response = {"error": f"{type(e).__name__}: {e}"}
+            self.wfile.write(json.dumps(response, ensure_ascii=False).encode("utf-8") + b"\n")
+            self.wfile.flush()
+
+
+if hasattr(socketserver, "UnixStreamServer"):  # Windows 上只能使用 TCP 地址
+    class _UnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+        daemon_threads = True
+
+
+class _TCPServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+def serve(service: RetrievalService, address: str) -> socketserver.BaseServer:
+    """Creates a threaded server for ``service`` on ``address`` (call ``serve_forever`` on it)."""
+    family, bind = _parse_address(address)
+    if family == socket.AF_UNIX:
+        if os.path.exists(bind):
+            os.unlink(bind)
+        server = _UnixServer(bind, _RequestHandler)
+    else:
+        server = _TCPServer(bind, _RequestHandler)
+    server.service = service
+    return server
+
+
+class RetrievalClient:
+    """Same API as :class:`RetrievalService`, forwarded to a retrieval server.
+
+    Each thread keeps its own connection; a broken connection is reopened
+    once per call.
+    """
+
+    def __init__(self, address: str, timeout: float = 30.0):
+        self.address = address
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            family, target = _parse_address(self.address)
+            sock = socket.socket(family, socket.SOCK_STREAM)
+            sock.settimeout(self.timeout)
+            sock.connect(target)
+            conn = self._local.conn = (sock, sock.makefile("rwb"))
+        return conn
+
+    def _close(self) -> None:
+        conn = getattr(self._local, "conn", None)
+        self._local.conn = None
+        if conn is not None:
+            conn[1].close()
+            conn[0].close()
+
+    def _call(self, op: str, **params) -> Any:
+        payload = json.dumps({"op": op, **params}, ensure_ascii=False).encode("utf-8") + b"\n"
+        for attempt in range(2):
+            try:
+                _, stream = self._connection()
+                stream.write(payload)
+                stream.flush()
+                line = stream.readline()
+                if not line:
+                    raise ConnectionError("retrieval server closed the connection")
+                break
+            except OSError:
+                self._close()
+                if attempt:
+                    raise
+        response = json.loads(line)
+        if "error" in response:
+            raise RetrievalError(response["error"])
+        return response["result"]
+
+    def register(self, path: str, namespace: Optional[str] = None, embedding_model: str = "text-embedding-v2") -> str:
+        return self._call("register", path=os.path.abspath(path), namespace=namespace, embedding_model=embedding_model)
+
+    def search(self, namespace: str, query: str, k: int, focus: Optional[str] = None) -> List[Document]:
+        docs = self._call("search", namespace=namespace, query=query, k=k, focus=focus)
+        return [Document(id=d["id"], page_content=d["text"], metadata=d["metadata"]) for d in docs]
+
+    def preload(self, namespaces: Optional[List[str]] = None) -> None:
+        self._call("preload", namespaces=namespaces)
+
+    def metrics(self) -> Dict[str, Any]:
+        return {"server": self.address, **self._call("metrics")}
+
+
+_RETRIEVER: Optional[Union[RetrievalService, RetrievalClient]] = None
+_RETRIEVER_LOCK = threading.Lock()
+
+
+def get_retriever() -> Union[RetrievalService, RetrievalClient]:
+    """Process-wide retrieval backend: a client if ``RETRIEVAL_SERVICE_ADDR`` is set, else an in-process service."""
+    global _RETRIEVER
+    if _RETRIEVER is None:
+        with _RETRIEVER_LOCK:
+            if _RETRIEVER is None:
+                address = os.environ.get("RETRIEVAL_SERVICE_ADDR")
+                _RETRIEVER = RetrievalClient(address) if address else RetrievalService.from_env()
+    return _RETRIEVER
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="多学科共享检索服务")
+    parser.add_argument("paths", nargs="+", help="向量库目录，可写成 命名空间=目录")
+    parser.add_argument("--listen", default="unix:/tmp/retrieval.sock", help="unix:/路径 或 主机:端口")
+    parser.add_argument("--memory-mb", type=float, default=float(os.environ.get("RETRIEVAL_MEMORY_MB", 0)),
+                        help="已加载索引的内存上限（MB），0 表示不限")
+    parser.add_argument("--preload", action="store_true", help="启动时加载全部索引")
+    args = parser.parse_args(argv)
+
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    service = RetrievalService(memory_cap_mb=args.memory_mb)
+    for entry in args.paths:
+        namespace, _, path = entry.rpartition("=")
+        print(f"Registered '{service.register(path, namespace or None)}' -> {os.path.abspath(path)}")
+    if args.preload:
+        start = time.perf_counter()
+        service.preload()
+        print(f"Preloaded in {time.perf_counter() - start:.2f}s")
+    server = serve(service, args.listen)
+    print(f"Retrieval service listening on {args.listen}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""
+Request coalescing ("single-flight") for identical concurrent calls.
+
+When a class asks for the same mind map at once, dozens of identical chat and
+embedding requests arrive within seconds. :class:`SingleFlight` lets the first
+caller for a key run the upstream call while concurrent callers with the same
+key wait for it and share its result (or its exception). Nothing is cached:
+once the call finishes the key is released, so later requests go upstream
+again.
+"""
+import hashlib
+import json
+import threading
+from typing import Any, Callable, Dict, Hashable, Optional
+
+# name -> instance, for /metrics
+_REGISTRY: Dict[str, "SingleFlight"] = {}
+_REGISTRY_LOCK = threading.Lock()
+
+
+class _Flight:
+    __slots__ = ("done", "result", "error", "waiters")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """Coalesces concurrent calls that share a key into one execution."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self._lock = threading.Lock()
+        self._flights: Dict[Hashable, _Flight] = {}
+        self.calls = 0
+        self.coalesced = 0
+        with _REGISTRY_LOCK:
+            _REGISTRY[name] = self
+
+    def do(self, key: Hashable, fn: Callable[..., Any], /, *args, **kwargs) -> Any:
+        """Runs ``fn(*args, **kwargs)`` unless a call for ``key`` is already in flight.
+
+        Followers block until the leader finishes and then return its result
+        or re-raise its exception.
+        """
+        with self._lock:
+            self.calls += 1
+            flight = self._flights.get(key)
+            if flight is not None:
+                flight.waiters += 1
+                self.coalesced += 1
+                leader = False
+            else:
+                flight = self._flights[key] = _Flight()
+                leader = True
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+        try:
+            flight.result = fn(*args, **kwargs)
+            return flight.result
+        except BaseException as exc:
+            flight.error = exc
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+
+    def metrics(self) -> Dict[str, int]:
+        with self._lock:
+            return {"calls": self.calls, "coalesced": self.coalesced, "in_flight": len(self._flights)}
+
+
+def request_key(*parts: Any) -> str:
+    """Stable hash of JSON-serialisable request parts (model, messages, ...)."""
+    payload = json.dumps(parts, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def singleflight_metrics() -> Dict[str, Dict[str, int]]:
+    """Call / coalesced counts of every named single-flight group."""
+    with _REGISTRY_LOCK:
+        groups = list(_REGISTRY.values())
+    return {group.name: group.metrics() for group in groups}
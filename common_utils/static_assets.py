@@ -0,0 +1,52 @@
+"""
+Fingerprinted URLs for static assets.
+
+Templates link static files through ``static_url(name)``, which appends a
+content hash (``/static/script.js?v=3f2a9c01b7``). A request carrying the
+current hash can be cached by browsers and proxies for a year, because any
+change to the file changes its URL; pages on slow school networks then load
+scripts and styles from cache instead of revalidating each of them.
+"""
+import hashlib
+import os
+import threading
+from typing import Dict, Optional, Tuple
+
+LONG_CACHE = "public, max-age=31536000, immutable"
+
+
+class AssetFingerprints:
+    """Content hashes of the files under ``static_folder``, recomputed when a file's mtime changes."""
+
+    def __init__(self, static_folder: str, url_path: str = "/static"):
+        self.static_folder = static_folder
+        self.url_path = url_path.rstrip("/")
+        self._hashes: Dict[str, Tuple[float, str]] = {}
+        self._lock = threading.Lock()
+
+    def version(self, filename: str) -> Optional[str]:
+        """First 10 hex digits of the file's SHA-256, or ``None`` if it does not exist."""
+        path = os.path.join(self.static_folder, filename)
+        try:
+            mtime = os.path.getmtime(path)
+        except OSError:
+            return None
+        with self._lock:
+            cached = self._hashes.get(filename)
+        if cached and cached[0] == mtime:
+            return cached[1]
+        with open(path, "rb") as f:
+            digest = hashlib.sha256(f.read()).hexdigest()[:10]
+        with self._lock:
+            self._hashes[filename] = (mtime, digest)
+        return digest
+
+    def url(self, filename: str) -> str:
+        """URL of ``filename`` with its fingerprint (plain URL for missing files)."""
+        version = self.version(filename)
+        base = f"{self.url_path}/{filename}"
+        return f"{base}?v={version}" if version else base
+
+    def is_current(self, filename: str, version: Optional[str]) -> bool:
+        """Whether ``version`` is the fingerprint of the file's current content."""
+        return bool(version) and version == self.version(filename)
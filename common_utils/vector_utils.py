@@ -1,29 +1,71 @@
-from typing import Optional
+import os
+import threading
+from typing import Dict, Optional, Tuple
 
 from langchain_community.vectorstores import FAISS
 from langchain_dashscope.embeddings import DashScopeEmbeddings
 
+from .chunk_store import CompactDocstore, RowIdMapping, has_chunk_store, load_chunk_store
+from .llm_wrapper import ThrottledDashScopeEmbeddings
 
-def load_embeddings(model: str = "text-embedding-v2") -> DashScopeEmbeddings:
-    """Initialize and return a DashScopeEmbeddings instance."""
-    return DashScopeEmbeddings(model=model)
+# 进程级向量库缓存：同一路径 + 同一 embedding 模型只加载一次，
+# 出题 / 知识图谱 / 对话三个 Agent 共享同一份 FAISS 索引与文档存储。
+_VECTORSTORE_CACHE: Dict[Tuple[str, str], FAISS] = {}
+_VECTORSTORE_LOCK = threading.Lock()
+
+
+def load_embeddings(model: str = "text-embedding-v2") -> ThrottledDashScopeEmbeddings:
+    """Initialize and return a (rate-limited) DashScopeEmbeddings instance."""
+    return ThrottledDashScopeEmbeddings(model=model)
 
 
 def load_vectorstore(
     path: str = "database_agent_mayuan",
     embeddings: Optional[DashScopeEmbeddings] = None,
     allow_dangerous_deserialization: bool = True,
+    shared: bool = True,
+    compact: bool = True,
 ):
     """Load a FAISS vectorstore from ``path`` with provided ``embeddings``.
 
     If *embeddings* is ``None`` a new embedding model will be created with the
     default parameters.
+
+    With ``shared=True`` (the default) the store is cached per process so that
+    every agent pointing at the same path reuses one index; loading it once in
+    a pre-fork master lets all workers share it copy-on-write. ``compact=True``
+    replaces LangChain's per-chunk ``Document`` objects with a
+    :class:`~common_utils.chunk_store.CompactDocstore`: read directly from
+    ``chunks.bin`` when the folder has one (no unpickling), otherwise
+    converted in memory from ``index.faiss`` / ``index.pkl``.
     """
     if embeddings is None:
         embeddings = load_embeddings()
 
-    return FAISS.load_local(
-        path,
-        embeddings,
-        allow_dangerous_deserialization=allow_dangerous_deserialization,
-    ) 
\ No newline at end of file
+    key = (os.path.abspath(path), getattr(embeddings, "model", ""))
+    if shared:
+        cached = _VECTORSTORE_CACHE.get(key)
+        if cached is not None:
+            return cached
+
+    with _VECTORSTORE_LOCK:
+        if shared and key in _VECTORSTORE_CACHE:
+            return _VECTORSTORE_CACHE[key]
+
+        if compact and has_chunk_store(path):
+            vectorstore = load_chunk_store(path, embeddings)
+        else:
+            vectorstore = FAISS.load_local(
+                path,
+                embeddings,
+                allow_dangerous_deserialization=allow_dangerous_deserialization,
+            )
+            if compact:
+                rows = range(vectorstore.index.ntotal)
+                vectorstore.docstore = CompactDocstore.from_docstore(
+                    vectorstore.docstore, [vectorstore.index_to_docstore_id[row] for row in rows]
+                )
+                vectorstore.index_to_docstore_id = RowIdMapping(len(rows))
+        if shared:
+            _VECTORSTORE_CACHE[key] = vectorstore
+        return vectorstore
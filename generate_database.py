@@ -2,7 +2,8 @@ import os
 from langchain_community.document_loaders import PyPDFDirectoryLoader
 from langchain_community.vectorstores import FAISS
 from langchain_text_splitters import RecursiveCharacterTextSplitter
-from langchain_dashscope.embeddings import DashScopeEmbeddings
+from common_utils.chunk_store import dedupe_documents, save_chunk_store
+from common_utils.llm_wrapper import ThrottledDashScopeEmbeddings
 
 os.environ["DASHSCOPE_API_KEY"] = "sk-xxx"
 
@@ -22,9 +23,15 @@ text_splitter = RecursiveCharacterTextSplitter(
 split_docs = text_splitter.split_documents(documents)
 print(f"文档被分割成 {len(split_docs)} 个小块。")
 
+# 去除近似重复的块（主要是只含上一块重叠部分的短尾块、以及重复出现的段落），也省去它们的 embedding 调用
+unique_docs = dedupe_documents(split_docs)
+print(f"去除 {len(split_docs) - len(unique_docs)} 个近似重复的块，剩余 {len(unique_docs)} 个。")
+split_docs = unique_docs
+
 #文本的embedding操作
 print("正在初始化文本嵌入模型...")
-embeddings = DashScopeEmbeddings(model="text-embedding-v2")
+# 通过共享的限流器调用 embedding 接口，批量请求不会触发服务端限流
+embeddings = ThrottledDashScopeEmbeddings(model="text-embedding-v2")
 
 #数据库的创建
 print("正在创建并保存向量数据库 (采用分批处理模式)...")
@@ -53,4 +60,6 @@ for i in range(batch_size, len(split_docs), batch_size):
 
 #数据库的储存
 vectorstore.save_local("database_agent_mayuan")
+# 紧凑格式：int32 ID 即 FAISS 行号，文本存放在单一 UTF-8 缓冲区中，加载时直接 mmap
+save_chunk_store(vectorstore, "database_agent_mayuan")
 print("知识库构建完成，并已保存到本地 'database_agent_mayuan' 文件夹。")
\ No newline at end of file
@@ -0,0 +1,36 @@
+"""
+gunicorn 配置：pre-fork 预加载模式。
+
+    gunicorn -c gunicorn.conf.py app:app
+
+master 进程导入 app.py 时会加载全部 Agent（FAISS 索引、文档存储、LangGraph 图），
+随后 fork 出的 worker 以写时复制方式共享这些对象，8 个 worker 的总内存接近 1 个。
+"""
+import gc
+import os
+
+# 必须在 app.py 被导入前设置，app.py 据此在 master 中执行 preload_for_fork()
+os.environ.setdefault("PREFORK_PRELOAD", "1")
+# 出题与索要答案的请求（以及异步任务）可能落在不同 worker 上，进程内的题目存储
+# 彼此不可见，多 worker 部署默认改用 SQLite 共享存储
+os.environ.setdefault("QUIZ_STORE", "sqlite")
+
+bind = os.environ.get("BIND", "0.0.0.0:5001")
+workers = int(os.environ.get("WEB_CONCURRENCY", "8"))
+# Agent 可重入（每次调用的上下文各自独立），每个 worker 用多个线程处理请求
+threads = int(os.environ.get("WEB_THREADS", "4"))
+preload_app = True
+timeout = int(os.environ.get("WEB_TIMEOUT", "120"))
+
+
+def post_fork(server, worker):
+    # master 在加载期间关闭了 gc 并冻结了已有对象，worker 中重新开启 gc
+    gc.enable()
+
+
+def post_worker_init(worker):
+    # 异步任务的工作线程不能跨越 fork()，在每个 worker 进程中各自启动，
+    # 这样重启前排队的任务无需等到第一个请求就会继续执行
+    import app
+
+    app.job_queue.start()
@@ -2,8 +2,14 @@
 马克思主义基本原理智能出题 Agent
 """
 import os
+from dataclasses import replace
 from typing import Optional
 from common_utils.base_agent import BaseAgent
+from common_utils.image_caption import ImageCaption
+from common_utils.input_parser import is_answer_request, is_quiz_request
+from common_utils.lazy_loader import LazyAgent
+from common_utils.quiz_store import QuizStore, create_quiz_store
+from common_utils.quiz_utils import QuizRecord
 from common_utils.multimodal_agent import MayuanMultimodalAgent
 
 class MayuanQuestionAgent(BaseAgent):
@@ -11,8 +17,16 @@ class MayuanQuestionAgent(BaseAgent):
     专门用于“马克思主义基本原理”课程的智能出题 Agent。
     它继承自 BaseAgent，并提供了该课程特有的配置。
     """
-    def __init__(self):
-        """初始化马原 Agent 的特定配置"""
+    # 命令行等未提供会话 ID 的调用共用此键
+    DEFAULT_SESSION_ID = "default"
+
+    def __init__(self, quiz_store: Optional[QuizStore] = None):
+        """初始化马原 Agent 的特定配置
+
+        Args:
+            quiz_store: 按会话保存已生成题目的存储，默认按环境变量创建
+                （见 common_utils.quiz_store.create_quiz_store）。
+        """
         
         # 定义马原课程的常见主题，用于更精确地解析用户输入
         common_topics = [
@@ -31,141 +45,116 @@ class MayuanQuestionAgent(BaseAgent):
             vectorstore_path="database_agent_mayuan"
         )
         
-        # 初始化多模态Agent用于图片分析
-        try:
-            self.multimodal_agent = MayuanMultimodalAgent()
-            print("[马原Agent] 多模态功能初始化成功")
-        except Exception as e:
-            print(f"[马原Agent] 多模态功能初始化失败: {e}")
-            self.multimodal_agent = None
+        # 多模态Agent用于图片分析，首次收到图片时才初始化（懒加载）
+        self._multimodal_loader = LazyAgent("[马原Agent] 多模态功能", MayuanMultimodalAgent)
 
         # --------------------------------------------------
-        # 状态缓存：保存最近一次生成的题目（含答案解析）
-        # 以及对应的仅题干版本，便于后续按需提供解析
+        # 题目存储：按会话 ID 保存每位用户最近一次生成的题目记录，
+        # 记录中同时缓存了完整版本（含答案解析）与仅题干版本，
+        # 便于该用户后续按需获取解析，且不同用户之间互不干扰
         # --------------------------------------------------
-        self._last_full_output: str = ""
-        self._last_question_only_output: str = ""
+        self.quiz_store: QuizStore = quiz_store or create_quiz_store()
     
+    @property
+    def multimodal_agent(self) -> Optional[MayuanMultimodalAgent]:
+        """多模态Agent，初始化失败时为 None。"""
+        return self._multimodal_loader.get()
+
     # --------------------------------------------------
     # 公共接口
     # --------------------------------------------------
-    def process_request(self, user_input: str) -> str:
-        """重写父类方法，以支持“按需提供解析”的逻辑"""
-        # 如果用户明确索要解析/答案，则直接返回上一次的完整内容
-        if any(kw in user_input for kw in ["解析", "答案", "讲解", "答案解析", "参考答案"]):
-            if self._last_full_output:
-                return self._last_full_output
-            # 若没有缓存，则提示用户先生成题目
-            return "当前没有可供解析的题目，请先提出出题需求。"
-
-        # 否则视为新的出题需求，调用父类生成题目
-        full_output = super().process_request(user_input)
-
-        # 生成后保存完整内容
-        self._last_full_output = full_output
-        # 同时生成“去除正确答案/解析”的版本
-        self._last_question_only_output = self._strip_explanations(full_output)
-        return self._last_question_only_output
+    def _answers_for(self, session_id: Optional[str]) -> str:
+        """返回该会话最近一次题目的完整内容（含答案与解析）。"""
+        record = self.quiz_store.get(session_id or self.DEFAULT_SESSION_ID)
+        if record:
+            return record.full_text
+        # 若没有缓存，则提示用户先生成题目
+        return "当前没有可供解析的题目，请先提出出题需求。"
+
+    def _session_caption(self, session_id: Optional[str]) -> Optional[ImageCaption]:
+        """该会话最近一次上传图片的描述（随题目记录保存）。"""
+        record = self.quiz_store.get(session_id or self.DEFAULT_SESSION_ID)
+        return record.image_caption if record else None
+
+    def _store_record(self, session_id: Optional[str], record: QuizRecord, caption: Optional[ImageCaption]) -> None:
+        """保存题目记录，并带上该会话的图片描述，供之后的纯文字轮次继续使用。"""
+        if caption is not None and record.image_caption != caption:
+            record = replace(record, image_caption=caption)
+        self.quiz_store.put(session_id or self.DEFAULT_SESSION_ID, record)
+
+    def process_request(self, user_input: str, session_id: Optional[str] = None) -> str:
+        """重写父类方法，以支持“按需提供解析”的逻辑
+
+        Args:
+            user_input: 用户输入。
+            session_id: 会话 ID，用于区分不同用户的题目；为空时使用默认会话。
+        """
+        # 如果用户明确索要解析/答案，则直接返回该会话上一次的完整内容
+        if is_answer_request(user_input):
+            return self._answers_for(session_id)
+
+        # 否则视为新的出题需求：热门需求直接取预生成题库中的一份，其余运行工作流生成；
+        # 会话中之前上传过图片时（如“再出5道”），沿用该图片的描述出题
+        caption = self._session_caption(session_id)
+        record, error = self._quiz_for(user_input, image_caption=caption)
+        if error:
+            return error
+
+        # 结构化题目只需校验解析一次，两种展示版本在记录中一并缓存
+        self._store_record(session_id, record, caption)
+        return record.question_only_text
 
     # --------------------------------------------------
     # 多模态接口保持不变，内部仍会回退到 process_request
     # --------------------------------------------------
-    def process_multimodal_request(self, text_input: str, image_path: Optional[str] = None) -> str:
+    def process_multimodal_request(
+        self,
+        text_input: str,
+        image_path: Optional[str] = None,
+        session_id: Optional[str] = None,
+    ) -> str:
         """
         处理多模态请求（支持图片+文本输入）
         """
         # 若未提供图片或多模态未初始化，则退回文本出题流程（保留按需解析逻辑）
         if not image_path or not self.multimodal_agent:
-            return self.process_request(text_input)
+            return self.process_request(text_input, session_id=session_id)
 
-        # 如果用户这次是来“索要解析/答案”，优先返回缓存的完整内容
-        if any(kw in text_input for kw in ["解析", "答案", "讲解", "答案解析", "参考答案"]):
-            return self._last_full_output or "当前没有可供解析的题目，请先提出出题需求。"
+        # 如果用户这次是来“索要解析/答案”，优先返回该会话缓存的完整内容
+        if is_answer_request(text_input):
+            return self._answers_for(session_id)
+
+        # 视觉模型只描述图片（同一张图片只描述一次），描述随会话保存，之后的纯文字轮次继续使用
+        caption = None
+        try:
+            caption = self.multimodal_agent.describe_image(image_path, text_input)
+        except Exception as e:
+            print(f"[马原Agent] 图片描述失败，改用多模态模型直接回复: {e}")
+
+        # 出题请求：题目由正常的检索 + 文本模型流程生成
+        if is_quiz_request(text_input) and caption is not None:
+            record, error = self._quiz_for(text_input, image_caption=caption)
+            if error:
+                return error
+            self._store_record(session_id, record, caption)
+            return record.question_only_text
 
         try:
             # 走多模态模型生成完整内容
             full_output = self.multimodal_agent.process_multimodal_request(text_input, image_path)
-            # 将完整内容纳入缓存
-            self._last_full_output = full_output
+            # 将完整内容纳入缓存（多模态回复为自由文本，按规则剥离答案）
+            record = QuizRecord.from_text(full_output)
+            self._store_record(session_id, record, caption)
 
             # 如果本次请求属于出题场景（包含常见出题关键词），则先隐藏答案/解析
-            if any(kw in text_input for kw in ["出题", "生成题目", "题目", "选择题", "判断题", "简答题", "试题", "练习"]):
-                self._last_question_only_output = self._strip_explanations(full_output)
-                return self._last_question_only_output
+            if is_quiz_request(text_input):
+                return record.question_only_text
 
             # 否则按多模态原样返回
             return full_output
         except Exception as e:
             print(f"[马原Agent] 多模态处理失败，回退到文本模式: {e}")
-            return self.process_request(text_input)
-
-    # --------------------------------------------------
-    # 私有工具方法
-    # --------------------------------------------------
-    def _strip_explanations(self, text: str) -> str:
-        """移除答案与解析，只保留题干及选项/题号。
-
-        规则改进：
-        - 识别更丰富的“答案/解析”起始样式（如：正确答案、参考答案、标准答案、答案是/为、答：、解：、【答案】等）。
-        - 支持“解析：”换行后的多行内容整段剥离，直到检测到下一题/新段落标题为止。
-        - 处理同一行内含有“答案：B”之类的内嵌写法（整行移除）。
-        """
-        import re
-
-        lines = text.splitlines()
-        filtered: list[str] = []
-
-        # 起始信号（命中后进入剥离块）
-        start_patterns = [
-            r"^\s*(?:正确?答案|参考答案|标准答案|答案解析|解析|解答|讲解|评分标准|思路|分析|参考思路|答案是|答案为|Answer|Explanation)\s*[:：】\])]?.*$",
-            r"^\s*[（(【\[]?(?:答|解)\s*[：:]\s*.*$",
-            r"^\s*[【\[]?(?:答案|解析|参考答案)[】\]]\s*.*$",
-        ]
-
-        # 内嵌写法（行中出现“答案/解析”也视为需要移除整行）
-        inline_patterns = [
-            r"(正确?答案|参考答案|标准答案|答案解析|解析|解答|答案是|答案为|Answer|Explanation)\s*[:：]?\s*",
-        ]
-
-        # 结束信号：出现下一题或新的题型小节标题，结束剥离
-        boundary_patterns = [
-            r"^\s*(?:题目|选择题|判断题|简答题)\s*\d+",
-            r"^\s*(?:选择题|判断题|简答题)\s*[：:]\s*$",
-            r"^\s*\d+\s*[、\.\)．]",  # 1.  1)  1．  1、
-        ]
-
-        start_regexes = [re.compile(p, re.IGNORECASE) for p in start_patterns]
-        inline_regexes = [re.compile(p, re.IGNORECASE) for p in inline_patterns]
-        boundary_regexes = [re.compile(p) for p in boundary_patterns]
-
-        in_strip_block = False
-
-        def is_start(line: str) -> bool:
-            return any(r.match(line) for r in start_regexes) or any(r.search(line) for r in inline_regexes)
-
-        def is_boundary(line: str) -> bool:
-            return any(r.match(line) for r in boundary_regexes)
-
-        for line in lines:
-            if in_strip_block:
-                # 检测是否到达下一题/小节
-                if is_boundary(line):
-                    in_strip_block = False
-                    filtered.append(line)
-                else:
-                    # 仍在“解析/答案”块内，整行丢弃
-                    continue
-            else:
-                if is_start(line):
-                    # 进入剥离块，不输出该行
-                    in_strip_block = True
-                    continue
-                filtered.append(line)
-
-        # 去除末尾多余空行
-        result = "\n".join(filtered)
-        result = re.sub(r"\n{3,}", "\n\n", result).strip("\n")
-        return result
+            return self.process_request(text_input, session_id=session_id)
 
 
 def main():
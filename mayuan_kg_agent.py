@@ -1,7 +1,8 @@
 """
 马克思主义基本原理知识图谱 Agent
 """
-from common_utils.base_kg_agent import BaseKnowledgeGraphAgent
+from common_utils.base_kg_agent import OUTPUT_MERMAID, BaseKnowledgeGraphAgent
+from common_utils.input_parser import extract_kg_topic
 
 
 class MayuanKnowledgeGraphAgent(BaseKnowledgeGraphAgent):
@@ -16,6 +17,31 @@ class MayuanKnowledgeGraphAgent(BaseKnowledgeGraphAgent):
         )
 
 
+# ---------- Knowledge-Graph Agent 包装 ----------
+# 为了与 QuestionAgent 保持统一的调用接口，
+# 这里包装一个 process_request 方法，对用户输入做简单的主题抽取后
+# 调用 MayuanKnowledgeGraphAgent.build_knowledge_graph 生成 Mermaid 图。
+
+
+class MayuanKGAgent(MayuanKnowledgeGraphAgent):
+    """Knowledge-Graph Agent 的薄包装，提供统一的 process_request 接口。"""
+
+    def _extract_topic(self, user_input: str) -> str:
+        """从用户输入中提取知识图谱主题。
+
+        策略：
+        1. 去除常见触发关键词（知识图谱/思维导图/mindmap 等，见
+           common_utils.input_parser.KG_STRIP_KEYWORDS，一次扫描完成）。
+        2. 删除标点与前后空白。
+        3. 若为空则回退使用完整输入。
+        """
+        return extract_kg_topic(user_input)
+
+    def process_request(self, user_input: str, output_format: str = OUTPUT_MERMAID) -> str:
+        topic = self._extract_topic(user_input)
+        return self.build_knowledge_graph(topic, output_format)
+
+
 if __name__ == "__main__":
     print("=" * 60)
     print("   马克思主义基本原理知识图谱 Agent")
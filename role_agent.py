@@ -5,6 +5,7 @@ import uuid
 
 # Import the new base class
 from common_utils.base_dialogue_agent import BaseDialogueAgent, DialogueGraphState
+from common_utils.lazy_loader import LazyAgent
 from common_utils.multimodal_agent import SocratesMultimodalAgent
 
 #  API Key Setup (与之前相同) 
@@ -36,13 +37,13 @@ class SocratesAgent(BaseDialogueAgent):
             temperature=0.8
         )
         
-        # 初始化多模态Agent用于图片分析
-        try:
-            self.multimodal_agent = SocratesMultimodalAgent()
-            print("[苏格拉底Agent] 多模态功能初始化成功")
-        except Exception as e:
-            print(f"[苏格拉底Agent] 多模态功能初始化失败: {e}")
-            self.multimodal_agent = None
+        # 多模态Agent用于图片分析，首次收到图片时才初始化（懒加载）
+        self._multimodal_loader = LazyAgent("[苏格拉底Agent] 多模态功能", SocratesMultimodalAgent)
+
+    @property
+    def multimodal_agent(self) -> Optional[SocratesMultimodalAgent]:
+        """多模态Agent，初始化失败时为 None。"""
+        return self._multimodal_loader.get()
     
     def process_multimodal_dialogue(
         self, 
@@ -64,59 +65,17 @@ class SocratesAgent(BaseDialogueAgent):
         # 如果没有图片或多模态Agent不可用，使用普通对话处理
         if not image_path or not self.multimodal_agent:
             return self.process_dialogue(user_input, current_state)
-        
+
+        # 视觉模型只把图片描述为结构化文字（同一张图片只描述一次）；描述随会话状态保存，
+        # 本轮及后续轮次都走正常的检索 + 文本模型对话流程，不再调用视觉模型
         try:
-            # 更新多模态Agent的对话上下文
-            if current_state:
-                character = current_state.get("simulated_character", "马克思")
-                topic = current_state.get("current_topic", "马克思主义理论")
-                self.multimodal_agent.update_dialogue_context(character, topic)
-            
-            # 使用多模态Agent处理图片+文本
-            response = self.multimodal_agent.process_multimodal_request(user_input, image_path)
-            
-            # 如果是新对话，需要初始化状态
-            if not current_state:
-                # 从响应中推断角色和主题（简化处理）
-                character = "马克思"  # 默认角色
-                topic = "马克思主义理论"  # 默认主题
-                
-                new_state = {
-                    "simulated_character": character,
-                    "current_topic": topic,
-                    "turn_count": 1,
-                    "conversation_history": [
-                        {"role": "user", "content": user_input},
-                        {"role": "assistant", "content": response}
-                    ],
-                    "last_image_path": image_path if image_path else None  # 添加图像上下文
-                }
-                
-                return {
-                    "status": "success",
-                    "response": response,
-                    "state": new_state
-                }
-            else:
-                # 更新现有状态
-                current_state["turn_count"] = current_state.get("turn_count", 0) + 1
-                current_state["conversation_history"] = current_state.get("conversation_history", [])
-                current_state["conversation_history"].extend([
-                    {"role": "user", "content": user_input},
-                    {"role": "assistant", "content": response}
-                ])
-                
-                current_state["last_image_path"] = image_path if image_path else current_state.get("last_image_path")
-                
-                return {
-                    "status": "success",
-                    "response": response,
-                    "state": current_state
-                }
-                
+            caption = self.multimodal_agent.describe_image(image_path, user_input)
         except Exception as e:
-            print(f"[苏格拉底Agent] 多模态处理失败，回退到文本模式: {e}")
+            print(f"[苏格拉底Agent] 图片描述失败，回退到文本模式: {e}")
+            caption = None
+        if caption is None:
             return self.process_dialogue(user_input, current_state)
+        return self.process_dialogue(user_input, current_state, image_caption=caption)
 
 def main():
     """主程序入口 - 提供命令行交互界面"""
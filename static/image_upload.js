@@ -0,0 +1,83 @@
+// 图片上传前在浏览器中缩放并重新编码
+// 服务端只会把最长边不超过 /config 中 max_dim 的图片发给视觉模型，因此上传前先缩放到该尺寸、
+// 编码为 WebP（浏览器不支持时用 JPEG），手机照片的上传体积通常缩小一个数量级。
+(() => {
+    const DEFAULT_CONFIG = { max_dim: 1024, formats: ['image/webp', 'image/jpeg'], quality: 0.85, max_bytes: 5 * 1024 * 1024 };
+    let configPromise = null;
+
+    const loadConfig = () => {
+        if (!configPromise) {
+            configPromise = fetch('/config')
+                .then((res) => (res.ok ? res.json() : {}))
+                .then((data) => Object.assign({}, DEFAULT_CONFIG, data.image || {}))
+                .catch(() => DEFAULT_CONFIG);
+        }
+        return configPromise;
+    };
+
+    const readAsDataURL = (blob) => new Promise((resolve, reject) => {
+        const reader = new FileReader();
+        reader.onload = (e) => resolve(e.target.result);
+        reader.onerror = () => reject(reader.error);
+        reader.readAsDataURL(blob);
+    });
+
+    const decode = async (file) => {
+        if (window.createImageBitmap) {
+            try {
+                // 按 EXIF 方向摆正手机照片
+                return await createImageBitmap(file, { imageOrientation: 'from-image' });
+            } catch (err) {
+                // 部分浏览器不支持该选项，退回 <img> 解码
+            }
+        }
+        const url = URL.createObjectURL(file);
+        try {
+            const img = new Image();
+            img.src = url;
+            await img.decode();
+            return img;
+        } finally {
+            URL.revokeObjectURL(url);
+        }
+    };
+
+    const encode = (canvas, type, quality) => new Promise((resolve) => {
+        canvas.toBlob((blob) => resolve(blob && blob.type === type ? blob : null), type, quality);
+    });
+
+    // 返回可直接放进请求 JSON 的 data URL；超出服务端大小限制时抛出 Error（message 可直接展示）
+    window.prepareImageUpload = async (file) => {
+        const config = await loadConfig();
+        let image;
+        try {
+            image = await decode(file);
+        } catch (err) {
+            // 浏览器无法解码（如部分 BMP），原样上传，由服务端校验
+            if (file.size > config.max_bytes) throw new Error('图片文件过大，请选择更小的图片！');
+            return readAsDataURL(file);
+        }
+        const width = image.width;
+        const height = image.height;
+        const scale = Math.min(1, config.max_dim / Math.max(width, height));
+
+        const canvas = document.createElement('canvas');
+        canvas.width = Math.max(1, Math.round(width * scale));
+        canvas.height = Math.max(1, Math.round(height * scale));
+        const ctx = canvas.getContext('2d');
+        ctx.fillStyle = '#fff'; // 透明背景在 JPEG 中显示为白色
+        ctx.fillRect(0, 0, canvas.width, canvas.height);
+        ctx.drawImage(image, 0, 0, canvas.width, canvas.height);
+        if (image.close) image.close();
+
+        let blob = null;
+        for (const type of config.formats) {
+            blob = await encode(canvas, type, config.quality);
+            if (blob) break;
+        }
+        // 已经足够小的原图比重新编码的结果更小时，直接上传原图
+        if (!blob || (scale === 1 && file.size <= blob.size)) blob = file;
+        if (blob.size > config.max_bytes) throw new Error('图片文件过大，请选择更小的图片！');
+        return readAsDataURL(blob);
+    };
+})();
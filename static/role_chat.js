@@ -0,0 +1,335 @@
+class HistoricalDialogueApp {
+    constructor() {
+        this.sessionId = null;
+        this.isDialogueActive = false;
+        this.initializeElements();
+        this.bindEvents();
+    }
+
+    initializeElements() {
+        this.chatMessages = document.getElementById('chatMessages');
+        this.messageInput = document.getElementById('messageInput');
+        this.sendButton = document.getElementById('sendButton');
+        this.loading = document.getElementById('loading');
+        this.statusBar = document.getElementById('statusBar');
+        this.currentCharacter = document.getElementById('currentCharacter');
+        this.currentTopic = document.getElementById('currentTopic');
+        this.turnCount = document.getElementById('turnCount');
+        this.newDialogueBtn = document.getElementById('newDialogueBtn');
+        this.endDialogueBtn = document.getElementById('endDialogueBtn');
+        this.loadingText = document.getElementById('loadingText');
+
+        // 多模态功能元素
+        this.imageButton = document.getElementById('imageButton');
+        this.imageInput = document.getElementById('imageInput');
+        this.imagePreview = document.getElementById('imagePreview');
+        this.previewImg = document.getElementById('previewImg');
+        this.removeImage = document.getElementById('removeImage');
+
+        // 图片相关变量
+        this.selectedImageData = null;
+    }
+
+    bindEvents() {
+        this.sendButton.addEventListener('click', () => this.handleSendMessage());
+        this.messageInput.addEventListener('keypress', (e) => {
+            if (e.key === 'Enter' && !e.shiftKey) {
+                e.preventDefault();
+                this.handleSendMessage();
+            }
+        });
+        this.newDialogueBtn.addEventListener('click', () => this.startNewDialogue());
+        this.endDialogueBtn.addEventListener('click', () => this.endDialogue());
+
+        // 图片相关事件监听器
+        this.imageButton.addEventListener('click', () => this.imageInput.click());
+        this.imageInput.addEventListener('change', (e) => this.handleImageSelection(e));
+        this.removeImage.addEventListener('click', () => this.clearSelectedImage());
+
+        // 拖拽上传支持
+        document.addEventListener('dragover', (e) => e.preventDefault());
+        document.addEventListener('drop', (e) => {
+            e.preventDefault();
+            const files = e.dataTransfer.files;
+            if (files.length > 0) {
+                this.handleImageFile(files[0]);
+            }
+        });
+    }
+
+    // 图片处理方法
+    clearSelectedImage() {
+        this.selectedImageData = null;
+        this.imagePreview.style.display = 'none';
+        this.previewImg.src = '';
+        this.imageInput.value = '';
+    }
+
+    handleImageSelection(event) {
+        const file = event.target.files[0];
+        if (file) {
+            this.handleImageFile(file);
+        }
+    }
+
+    handleImageFile(file) {
+        // 检查文件类型
+        if (!file.type.startsWith('image/')) {
+            alert('请选择图片文件！');
+            return;
+        }
+
+        // 上传前缩放到服务端使用的尺寸并重新编码（见 image_upload.js）
+        prepareImageUpload(file).then((dataUrl) => {
+            this.selectedImageData = dataUrl;
+            this.previewImg.src = this.selectedImageData;
+            this.imagePreview.style.display = 'block';
+        }).catch((err) => {
+            alert(err.message || '图片处理失败，请换一张图片！');
+        });
+    }
+
+    async handleSendMessage() {
+        const message = this.messageInput.value.trim();
+        if (!message && !this.selectedImageData) {
+            alert("请输入文本或选择图片！");
+            return;
+        }
+
+        this.addUserMessage(message, this.selectedImageData);
+        this.messageInput.value = '';
+        const imageData = this.selectedImageData; // 保存图片数据
+        this.clearSelectedImage(); // 清除图片预览
+        this.showLoading(true);
+        this.sendButton.disabled = true;
+
+        try {
+            if (!this.isDialogueActive) {
+                await this.startDialogue(message, imageData);
+            } else {
+                await this.continueDialogue(message, imageData);
+            }
+        } catch (error) {
+            this.addErrorMessage(`对话出现错误：${error.message}`);
+        } finally {
+            this.showLoading(false);
+            this.sendButton.disabled = false;
+        }
+    }
+
+    async startDialogue(message, imageData = null) {
+        const requestData = { message };
+        if (imageData) {
+            requestData.image = imageData;
+        }
+
+        const response = await fetch('/start_dialogue', {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify(requestData)
+        });
+
+        if (!response.ok) {
+            const error = await response.json();
+            throw new Error(error.error || '启动对话失败');
+        }
+
+        const data = await response.json();
+        this.sessionId = data.session_id;
+        this.isDialogueActive = true;
+
+        this.updateStatus(data.character, data.topic, data.turn_count);
+        this.addAIMessage(data.response, data.character);
+        this.updateUIForActiveDialogue();
+    }
+
+    async continueDialogue(message, imageData = null) {
+        const requestData = { 
+            session_id: this.sessionId,
+            message 
+        };
+        if (imageData) {
+            requestData.image = imageData;
+        }
+
+        const response = await fetch('/continue_dialogue', {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify(requestData)
+        });
+
+        if (!response.ok) {
+            const error = await response.json();
+            throw new Error(error.error || '继续对话失败');
+        }
+
+        const data = await response.json();
+        this.updateStatus(data.character, data.topic, data.turn_count);
+        this.addAIMessage(data.response, data.character);
+    }
+
+    updateStatus(character, topic, turnCount) {
+        this.currentCharacter.textContent = character;
+        this.currentTopic.textContent = topic;
+        this.turnCount.textContent = turnCount;
+        this.statusBar.classList.add('active');
+    }
+
+    updateUIForActiveDialogue() {
+        this.sendButton.innerHTML = '💬 继续对话';
+        this.messageInput.placeholder = '请分享您的思考或提出新的问题...';
+        this.newDialogueBtn.style.display = 'inline-block';
+        this.endDialogueBtn.style.display = 'inline-block';
+    }
+
+    addUserMessage(message, imageData = null) {
+        const messageDiv = document.createElement('div');
+        messageDiv.className = 'message';
+
+        let messageContent = '';
+
+        // 如果有图片，先显示图片
+        if (imageData) {
+            messageContent += `
+                <img src="${imageData}" 
+                     style="max-width: 200px; max-height: 150px; border-radius: 10px; margin-bottom: 10px; display: block;" 
+                     alt="用户上传的图片">
+            `;
+        }
+
+        // 添加文本内容
+        if (message) {
+            messageContent += this.formatMessage(message);
+        }
+
+        messageDiv.innerHTML = `
+            <div class="message-bubble user-message">
+                ${messageContent}
+            </div>
+        `;
+        this.chatMessages.appendChild(messageDiv);
+        this.scrollToBottom();
+    }
+
+    addAIMessage(message, character) {
+        const messageDiv = document.createElement('div');
+        messageDiv.className = 'message';
+
+        const characterEmoji = this.getCharacterEmoji(character);
+        messageDiv.innerHTML = `
+            <div class="message-bubble ai-message" style="--character-name: '${characterEmoji} ${character}';">
+                ${this.formatMessage(message)}
+            </div>
+        `;
+
+        // 更新CSS自定义属性来显示角色名
+        const aiMessage = messageDiv.querySelector('.ai-message');
+        aiMessage.style.setProperty('--character-name', `'${characterEmoji} ${character}'`);
+
+        this.chatMessages.appendChild(messageDiv);
+        this.scrollToBottom();
+    }
+
+    addErrorMessage(message) {
+        const messageDiv = document.createElement('div');
+        messageDiv.className = 'message';
+        messageDiv.innerHTML = `
+            <div class="message-bubble ai-message" style="background: linear-gradient(135deg, #8b0000 0%, #a52a2a 100%);">
+                ❌ ${this.formatMessage(message)}
+            </div>
+        `;
+        this.chatMessages.appendChild(messageDiv);
+        this.scrollToBottom();
+    }
+
+    getCharacterEmoji(character) {
+        const emojiMap = {
+            '马克思': '🧔',
+            '恩格斯': '👨‍🎓',
+            '列宁': '👨‍💼',
+            '毛泽东': '👨‍🏫'
+        };
+        return emojiMap[character] || '🎭';
+    }
+
+    formatMessage(message) {
+        return message.replace(/\n/g, '<br>');
+    }
+
+    showLoading(show) {
+        if (show) {
+            const loadingTexts = [
+                '思想家正在深思中...',
+                '正在整理哲学思路...',
+                '准备苏格拉底式提问...',
+                '查阅理论典籍中...'
+            ];
+            this.loadingText.textContent = loadingTexts[Math.floor(Math.random() * loadingTexts.length)];
+        }
+        this.loading.style.display = show ? 'block' : 'none';
+    }
+
+    scrollToBottom() {
+        setTimeout(() => {
+            this.chatMessages.scrollTop = this.chatMessages.scrollHeight;
+        }, 100);
+    }
+
+    async startNewDialogue() {
+        await this.endDialogue();
+        this.clearChat();
+        this.resetUI();
+        this.clearSelectedImage(); // 清除选中的图片
+    }
+
+    async endDialogue() {
+        if (this.sessionId) {
+            try {
+                await fetch('/end_dialogue', {
+                    method: 'POST',
+                    headers: { 'Content-Type': 'application/json' },
+                    body: JSON.stringify({ session_id: this.sessionId })
+                });
+            } catch (error) {
+                console.error('结束对话请求失败:', error);
+            }
+        }
+
+        this.sessionId = null;
+        this.isDialogueActive = false;
+        this.addAIMessage('感谢您的参与！希望这次思想之旅对您有所启发。期待下次再会！', '系统');
+    }
+
+    clearChat() {
+        this.chatMessages.innerHTML = `
+            <div class="welcome-message">
+                <div class="emoji">📖✨🎭</div>
+                <p>开始新的思想之旅！</p>
+                <p>请描述您想探讨的新话题和希望对话的历史人物。</p>
+                <div class="emoji">💭🌟📚</div>
+            </div>
+        `;
+    }
+
+    resetUI() {
+        this.statusBar.classList.remove('active');
+        this.sendButton.innerHTML = '📝 开始对话';
+        this.messageInput.placeholder = '例如：我想和马克思探讨一下唯物辩证法，或者让恩格斯谈谈历史唯物主义...';
+        this.newDialogueBtn.style.display = 'inline-block';
+        this.endDialogueBtn.style.display = 'none';
+    }
+}
+
+// 添加CSS规则来显示角色名
+const style = document.createElement('style');
+style.textContent = `
+    .ai-message::before {
+        content: var(--character-name, '🎭 AI');
+    }
+`;
+document.head.appendChild(style);
+
+// 初始化应用
+document.addEventListener('DOMContentLoaded', () => {
+    new HistoricalDialogueApp();
+});
@@ -15,22 +15,66 @@ document.addEventListener("DOMContentLoaded", () => {
     
     // 图片相关变量
     let selectedImageData = null;
+    // 会话 ID：由服务端在首次回复时签发，用于之后索要本人题目的答案解析
+    let chatSessionId = null;
+
+    // Mermaid 与 mindmap 插件体积较大，而大多数请求是出题，
+    // 因此只在回复中首次出现 ```mermaid 代码块时才加载（之后复用同一个 Promise）。
+    // 锁定版本，避免 mermaid 与 mindmap 插件版本不一致导致渲染失败。
+    const MERMAID_SCRIPTS = [
+        "https://cdn.jsdelivr.net/npm/mermaid@10.9.0/dist/mermaid.min.js",
+        "https://cdn.jsdelivr.net/npm/@mermaid-js/mermaid-mindmap@10.9.0/dist/mermaid-mindmap.min.js",
+    ];
+    let mermaidPromise = null;
+
+    const loadScript = (src) => new Promise((resolve, reject) => {
+        const script = document.createElement("script");
+        script.src = src;
+        script.onload = resolve;
+        script.onerror = () => reject(new Error(`无法加载 ${src}`));
+        document.head.appendChild(script);
+    });
 
-    // 初始化 mermaid，并确保 mindmap 插件已注册
-    // 某些版本的 mermaid-mindmap 插件在加载时已自动注册，
-    // 如果我们再次手动调用 registerExternalDiagrams 会抛出异常，
-    // 进而导致后续 mermaid.render 无法执行。
-    // 因此，这里增加存在性检查并使用 try-catch 进行防御，
-    // 确保即便注册失败也不会影响主逻辑。
-    try {
-        if (window.mermaidMindmap && typeof mermaid.registerExternalDiagrams === 'function') {
-            mermaid.registerExternalDiagrams([window.mermaidMindmap]);
+    const loadMermaid = () => {
+        if (!mermaidPromise) {
+            mermaidPromise = MERMAID_SCRIPTS.reduce((chain, src) => chain.then(() => loadScript(src)), Promise.resolve())
+                .then(() => {
+                    // 某些版本的 mermaid-mindmap 插件在加载时已自动注册（也可能挂载为 window.mindmap），
+                    // 重复调用 registerExternalDiagrams 会抛出异常，这里忽略该异常
+                    const mindmapPlugin = window.mermaidMindmap || window.mindmap;
+                    if (mindmapPlugin && typeof mermaid.registerExternalDiagrams === "function") {
+                        try {
+                            mermaid.registerExternalDiagrams([mindmapPlugin]);
+                        } catch (e) {
+                            console.warn("Mermaid mindmap plugin registration skipped:", e);
+                        }
+                    }
+                    mermaid.initialize({ startOnLoad: false, theme: "neutral", securityLevel: "loose" });
+                    return window.mermaid;
+                })
+                .catch((err) => {
+                    mermaidPromise = null; // 允许下次重试
+                    throw err;
+                });
         }
-    } catch (e) {
-        console.warn('Mermaid mindmap plugin registration skipped:', e);
-    }
+        return mermaidPromise;
+    };
 
-    mermaid.initialize({ startOnLoad: false, theme: 'neutral', securityLevel: 'loose' });
+    // 轻量渲染服务端返回的紧凑 JSON 树（{"t": 文字, "c": [子节点]}），无需加载 Mermaid
+    const renderMindmapTree = (node, isRoot = true) => {
+        const item = document.createElement(isRoot ? "div" : "li");
+        item.className = isRoot ? "mindmap-tree" : "mindmap-node";
+        const label = document.createElement("span");
+        label.className = isRoot ? "mindmap-label mindmap-root" : "mindmap-label";
+        label.textContent = node.t;
+        item.appendChild(label);
+        if (node.c && node.c.length) {
+            const list = document.createElement("ul");
+            node.c.forEach((child) => list.appendChild(renderMindmapTree(child, false)));
+            item.appendChild(list);
+        }
+        return item;
+    };
 
     // 保存初始欢迎信息，用于重置对话
     const initialChatHTML = chatBox.innerHTML;
@@ -38,6 +82,7 @@ document.addEventListener("DOMContentLoaded", () => {
     const resetChat = () => {
         chatBox.innerHTML = initialChatHTML;
         userInput.value = "";
+        chatSessionId = null;
         // 清除图片
         clearSelectedImage();
         // 聊天模式没有真实的会话后端状态，这里仅统一按钮表现
@@ -61,19 +106,14 @@ document.addEventListener("DOMContentLoaded", () => {
             return;
         }
         
-        // 检查文件大小（16MB限制）
-        if (file.size > 16 * 1024 * 1024) {
-            alert('图片文件过大，请选择小于16MB的图片！');
-            return;
-        }
-        
-        const reader = new FileReader();
-        reader.onload = (e) => {
-            selectedImageData = e.target.result;
+        // 上传前缩放到服务端使用的尺寸并重新编码（见 image_upload.js）
+        prepareImageUpload(file).then((dataUrl) => {
+            selectedImageData = dataUrl;
             previewImg.src = selectedImageData;
             imagePreview.style.display = 'block';
-        };
-        reader.readAsDataURL(file);
+        }).catch((err) => {
+            alert(err.message || '图片处理失败，请换一张图片！');
+        });
     };
 
     const showLoading = (show) => {
@@ -94,8 +134,12 @@ document.addEventListener("DOMContentLoaded", () => {
         // 显示用户消息（包括图片）
         appendMessage(query, "user", selectedImageData);
         
-        // 准备发送的数据
-        const requestData = { message: query };
+        // 准备发送的数据；以异步任务提交，生成较慢时也不会因代理超时而中断
+        // 知识图谱以紧凑 JSON 树返回，由 renderMindmapTree 渲染
+        const requestData = { message: query, async: true, mindmap_format: "tree" };
+        if (chatSessionId) {
+            requestData.session_id = chatSessionId;
+        }
         if (selectedImageData) {
             requestData.image = selectedImageData;
         }
@@ -118,7 +162,13 @@ document.addEventListener("DOMContentLoaded", () => {
                 throw new Error(`HTTP error! status: ${response.status}`);
             }
 
-            const data = await response.json();
+            let data = await response.json();
+            if (data.job_id) {
+                data = await waitForJob(data.status_url);
+            }
+            if (data.session_id) {
+                chatSessionId = data.session_id;
+            }
             appendMessage(data.response, "bot");
 
         } catch (error) {
@@ -129,6 +179,39 @@ document.addEventListener("DOMContentLoaded", () => {
         }
     };
 
+    // 轮询任务状态直到完成：间隔从 0.5 秒逐步放宽到 2 秒，网络抖动时重试
+    const waitForJob = async (statusUrl) => {
+        let delay = 500;
+        let failures = 0;
+        while (true) {
+            await new Promise((resolve) => setTimeout(resolve, delay));
+            delay = Math.min(delay * 1.5, 2000);
+            let job;
+            try {
+                const res = await fetch(statusUrl, { cache: "no-store" });
+                if (res.status === 404) {
+                    throw new Error("任务不存在或已过期");
+                }
+                if (!res.ok) {
+                    throw new Error(`HTTP error! status: ${res.status}`);
+                }
+                job = await res.json();
+                failures = 0;
+            } catch (error) {
+                if (++failures >= 5 || error.message === "任务不存在或已过期") {
+                    throw error;
+                }
+                continue;
+            }
+            if (job.status === "done") {
+                return job;
+            }
+            if (job.status === "error") {
+                throw new Error(job.error || "任务执行失败");
+            }
+        }
+    };
+
     const appendMessage = (content, type, imageData = null) => {
         const messageWrapper = document.createElement("div");
         messageWrapper.className = "message";
@@ -148,21 +231,42 @@ document.addEventListener("DOMContentLoaded", () => {
             messageBubble.appendChild(imageElement);
         }
 
-        // ---------- Mermaid 渲染处理 ----------
-        // 简化版：只查找 ```mermaid ... ``` 代码块
+        // ---------- 知识图谱渲染处理 ----------
+        // 优先识别紧凑 JSON 树（```mindmap-json），其次是 ```mermaid 代码块
+        const treeMatch = type === 'bot' ? content.match(/```mindmap-json([\s\S]*?)```/i) : null;
+        let tree = null;
+        if (treeMatch) {
+            try {
+                tree = JSON.parse(treeMatch[1]);
+            } catch (e) {
+                console.error('Mindmap tree parse error:', e);
+            }
+        }
         const mermaidBlockRegex = /```mermaid([\s\S]*?)```/i;
-        const match = content.match(mermaidBlockRegex);
+        const match = tree ? null : content.match(mermaidBlockRegex);
 
-        if (type === 'bot' && match) {
-            const mermaidSource = match[1].trim();
-            const summaryText = content.replace(match[0], '').trim();
+        if (type === 'bot' && (tree || match)) {
+            const summaryText = content.replace((tree ? treeMatch : match)[0], '').trim();
 
-            // 创建容器：图 + 总结
-            const graphDiv = document.createElement('div');
-            graphDiv.className = 'mermaid';
-            // 将源码直接放入 mermaid 容器，后续由 mermaid.init 解析
-            graphDiv.textContent = mermaidSource;
-            messageBubble.appendChild(graphDiv);
+            if (tree) {
+                messageBubble.appendChild(renderMindmapTree(tree));
+            } else {
+                const mermaidSource = match[1].trim();
+                // 加载 Mermaid 期间先以源码占位，加载失败时保留源码文本
+                const graphDiv = document.createElement('div');
+                graphDiv.className = 'mermaid';
+                graphDiv.textContent = mermaidSource;
+                messageBubble.appendChild(graphDiv);
+                loadMermaid()
+                    .then((mermaid) => mermaid.init(undefined, graphDiv))
+                    .catch((e) => {
+                        console.error('Mermaid render error:', e);
+                        graphDiv.innerHTML = '';
+                        const pre = document.createElement('pre');
+                        pre.textContent = mermaidSource;
+                        graphDiv.appendChild(pre);
+                    });
+            }
 
             if (summaryText) {
                 const summaryDiv = document.createElement('div');
@@ -171,27 +275,6 @@ document.addEventListener("DOMContentLoaded", () => {
                 messageBubble.appendChild(summaryDiv);
             }
 
-            // 异步渲染，确保元素已插入 DOM
-            setTimeout(() => {
-                try {
-                    // 一些 CDN 版本的 mindmap 插件会自动注册，也可能挂载为 window.mindmap
-                    if (typeof mermaid.registerExternalDiagrams === 'function') {
-                        const mindmapPlugin = window.mermaidMindmap || window.mindmap;
-                        if (mindmapPlugin) {
-                            // registerExternalDiagrams 会抛出错误若重复注册，故 catch 内自行忽略
-                            try {
-                                mermaid.registerExternalDiagrams([mindmapPlugin]);
-                            } catch (_) {}
-                        }
-                    }
-                    mermaid.init(undefined, graphDiv);
-                } catch (e) {
-                    console.error('Mermaid render error:', e);
-                    // 渲染失败时，将源码当作文本展示
-                    graphDiv.innerHTML = `<pre><code>${mermaidSource}</code></pre>`;
-                }
-            }, 100);
-
         } else if (type === 'bot') {
             // 尝试将出题文本解析为结构化的题卡
             const maybeQuiz = tryParseQuiz(content);
@@ -0,0 +1,56 @@
+"""
+并发重入测试：用桩 DashScope 服务同时进行若干场对话和若干名学生的出题 / 索要答案，
+断言各请求之间没有串话（规模较小的 benchmarks/stress_reentrancy.py）。
+
+    python -m pytest -q tests/test_reentrancy.py
+"""
+import importlib
+import os
+import sys
+from types import SimpleNamespace
+
+import pytest
+
+BENCHMARKS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmarks")
+
+
+@pytest.fixture(scope="module")
+def stress(tmp_path_factory):
+    """指向桩服务的 app 模块与压力测试脚本；结束后恢复环境变量、sys.path 与 DashScope 配置。"""
+    with pytest.MonkeyPatch.context() as mp:
+        mp.syspath_prepend(BENCHMARKS)
+        stress_reentrancy = importlib.import_module("stress_reentrancy")
+        stub = importlib.import_module("stub_dashscope_server")
+
+        import dashscope
+
+        server, url = stub.start_stub_server(
+            stub.StubConfig(latency=0.0), responder=stress_reentrancy.make_responder(0.02)
+        )
+        # 与 point_dashscope_at 相同的设置，但经由 monkeypatch 以便测试结束后恢复
+        mp.setattr(dashscope, "base_http_api_url", url)
+        mp.setattr(dashscope, "api_key", dashscope.api_key or "sk-stub")
+        if not os.environ.get("DASHSCOPE_API_KEY"):
+            mp.setenv("DASHSCOPE_API_KEY", "sk-stub")
+        mp.setenv("QUIZ_POOL_SIZE", "0")
+        mp.setenv("JOB_QUEUE_PATH", str(tmp_path_factory.mktemp("jobs") / "test_jobs.sqlite3"))
+        # 按上面的环境重新导入 app；已导入的 app 在结束后恢复
+        mp.delitem(sys.modules, "app", raising=False)
+        app = importlib.import_module("app")
+        try:
+            yield app, stress_reentrancy
+        finally:
+            server.shutdown()
+            server.server_close()
+            # 之后导入 app 的测试重新按当时的环境构造，而不是沿用指向桩服务的 Agent
+            for name in ("app", "stress_reentrancy", "stub_dashscope_server"):
+                sys.modules.pop(name, None)
+
+
+@pytest.mark.parametrize("threads", [1, 8])
+def test_no_cross_talk(stress, threads):
+    app, stress_reentrancy = stress
+    args = SimpleNamespace(sessions=4, turns=3, students=4)
+    problems, requests, _ = stress_reentrancy.run_all(app, args, threads, stress_reentrancy._image_data_url())
+    assert requests == 4 * 4 + 4 * 2
+    assert problems == []